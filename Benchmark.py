@@ -0,0 +1,389 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Benchmark
+#   Version:    1.00
+#
+#   Description:
+#   The Benchmark library measures the latency of the capture hot path by running the real camera module code against the
+#   Fake_GStreamer stand-in for gst-launch-1.0. It measures the time spent starting a capture, the time from a trigger to the
+#   first frame, the skew between the start of cam_0 and cam_1, the gap in the video at a clip rotation, the time taken to
+#   stop a pipeline and the time taken to start and stop a pool of cameras, reports their percentiles and compares them against
+#   a stored baseline so that regressions are caught on any Linux machine.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in placing benchmark output
+import sys
+import json             #Used in storing baselines
+import argparse         #Used in parsing command line arguments
+import shutil           #Used in removing benchmark output
+import tempfile         #Used in creating benchmark output
+import time
+
+import Fake_GStreamer
+from Fake_GStreamer import read_Frames, STARTUP_DELAY_VARIABLE, DEFAULT_STARTUP_DELAY
+from Pipeline_Engine import Subprocess_Engine
+from CSI_Module import CSI_Camera_Module
+from Nano_Camera_Trap import CSI_Module
+from Camera_Pool import Camera_Pool
+from Sensor_Modes import Sensor_Mode_Cache
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Number of times each scenario is run
+DEFAULT_RUNS = 10
+
+#Capture settings of every scenario
+BENCHMARK_RESOLUTION = (1280, 720)
+BENCHMARK_FRAMERATE = 30
+
+#Length in seconds of each segment, kept short so that rotations happen within a run
+BENCHMARK_SEGMENT_DURATION = 0.2
+
+#Time in seconds each capture records for
+BENCHMARK_RECORD_TIME = 0.5
+
+#Number of cameras started and stopped together by the camera pool scenario
+BENCHMARK_POOL_SIZE = 4
+
+#Percentiles reported for each metric
+PERCENTILES = (50, 90, 99)
+
+#Percentiles compared against the baseline
+COMPARED_PERCENTILES = (50, 90)
+
+#Relative increase over the baseline allowed before a metric counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+#Absolute increase in seconds always allowed, so that sub-millisecond metrics do not fail on scheduling noise
+DEFAULT_SLACK = 0.005
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Benchmark_Results:
+    """
+    Class that collects the samples of each metric and summarises them.
+
+    @param samples              The samples of each metric in seconds
+    @type samples               {str:[float]}
+    """
+
+    def __init__(self):
+        """
+        Benchmark_Results Constructor.
+        """
+
+        self.samples = {}
+
+    def add(self, metric, value):
+        """
+        Add a sample to a metric. Unknown values are ignored.
+        """
+
+        if value == None:
+            return
+        self.samples.setdefault(metric, []).append(value)
+
+    def summary(self):
+        """
+        Summarise each metric.
+
+        @return summary:            The sample count, percentiles and maximum of each metric, in seconds
+        @rtype summary:             {str:{str:float}}
+        """
+
+        summary = {}
+        for metric, values in sorted(self.samples.items()):
+            summary[metric] = {"count": len(values), "max": max(values)}
+            for percent in PERCENTILES:
+                summary[metric]["p%d" %(percent)] = percentile(values, percent)
+        return summary
+
+    def report(self):
+        """
+        Print a table of each metric's percentiles in milliseconds.
+        """
+
+        columns = ["p%d" %(percent) for percent in PERCENTILES] + ["max"]
+        print("%-28s %6s" %("metric", "count") + "".join(" %9s" %(column) for column in columns))
+
+        for metric, values in self.summary().items():
+            print("%-28s %6d" %(metric, values["count"]) + "".join(" %9.2f" %(values[column] * 1e3) for column in columns))
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def percentile(values, percent):
+    """
+    Get a percentile of a set of samples, interpolating between the nearest samples.
+
+    @param values:              The samples
+    @type values:               [float]
+
+    @param percent:             The percentile, from 0 to 100
+    @type percent:              float
+    """
+
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def compare(summary, baseline, tolerance = DEFAULT_TOLERANCE, slack = DEFAULT_SLACK):
+    """
+    Compare a summary against a baseline summary.
+
+    @param tolerance:           The relative increase allowed over the baseline
+    @type tolerance:            float
+
+    @param slack:               The absolute increase in seconds always allowed
+    @type slack:                float
+
+    @return regressions:        (metric, percentile, baseline, current) of each percentile that has regressed
+    @rtype regressions:         [(str,str,float,float)]
+    """
+
+    regressions = []
+    for metric, values in summary.items():
+        if metric not in baseline:
+            continue
+
+        for percent in COMPARED_PERCENTILES:
+            key = "p%d" %(percent)
+            allowed = baseline[metric][key] * (1 + tolerance) + slack
+            if values[key] > allowed:
+                regressions.append((metric, key, baseline[metric][key], values[key]))
+
+    return regressions
+
+def benchmark_Camera_Module(results, directory, engine, mode_cache, runs):
+    """
+    Benchmark a single CSI_Camera_Module recording to one file.
+    """
+
+    cam = CSI_Camera_Module(0, engine, mode_cache = mode_cache)
+
+    for run in range(runs):
+        filename = os.path.join(directory, "module_%d" %(run))
+
+        trigger = time.monotonic()
+        cam.start_Video_Capture(filename, BENCHMARK_RESOLUTION[0], BENCHMARK_RESOLUTION[1], BENCHMARK_FRAMERATE)
+        results.add("module.start_call", time.monotonic() - trigger)
+
+        time.sleep(BENCHMARK_RECORD_TIME)
+        cam.terminate_Process()
+        results.add("module.stop_latency", cam.pipeline.stop_latency)
+
+        frames = read_Frames(filename + ".mp4")
+        if len(frames) > 0:
+            results.add("module.first_frame", frames[0][1] - trigger)
+
+def benchmark_CSI_Module(results, directory, engine, mode_cache, runs):
+    """
+    Benchmark a pair of segmented CSI_Module cameras started one after the other, with a clip rotation part way through.
+    """
+
+    clips = {}
+    cams = [CSI_Module(id, "cam_%d" %(id), quiet = True, segment_duration = BENCHMARK_SEGMENT_DURATION,
+                       spool_dir = os.path.join(directory, "spool"), engine = engine, mode_cache = mode_cache,
+                       clip_callback = lambda clip: clips.__setitem__(clip.name, clip))
+            for id in (0, 1)]
+
+    def clip_Frames(name):
+        clip = clips.get(name)
+        if clip == None:
+            return []
+        return [frame for path in clip.segments for frame in read_Frames(path)]
+
+    for run in range(runs):
+        names = [os.path.join(directory, "trap_%d_%s" %(run, cam.name)) for cam in cams]
+        rotated = [name + "_rotated" for name in names]
+
+        triggers = []
+        for cam, name in zip(cams, names):
+            trigger = time.monotonic()
+            cam.start_Video_Capture(name, BENCHMARK_RESOLUTION, BENCHMARK_FRAMERATE)
+            results.add("trap.start_call", time.monotonic() - trigger)
+            triggers.append(trigger)
+
+        time.sleep(BENCHMARK_RECORD_TIME)
+        for cam, name in zip(cams, rotated):
+            cam.start_Video_Capture(name, BENCHMARK_RESOLUTION, BENCHMARK_FRAMERATE)
+
+        time.sleep(BENCHMARK_RECORD_TIME)
+        for cam in cams:
+            cam.stop_Video_Capture()
+            results.add("trap.stop_latency", cam.pipeline.stop_latency)
+
+        first_frames = []
+        for trigger, name, rotated_name in zip(triggers, names, rotated):
+            frames = clip_Frames(name)
+            rotated_frames = clip_Frames(rotated_name)
+
+            if len(frames) > 0:
+                first_frames.append(frames[0][1])
+                results.add("trap.first_frame", frames[0][1] - trigger)
+            if len(frames) > 0 and len(rotated_frames) > 0:
+                results.add("trap.rotation_gap", rotated_frames[0][1] - frames[-1][1])
+
+        if len(first_frames) == 2:
+            results.add("trap.start_skew", abs(first_frames[1] - first_frames[0]))
+
+def benchmark_Camera_Pool(results, directory, engine, mode_cache, runs):
+    """
+    Benchmark starting and stopping a pool of cameras, each in its own pipeline.
+    """
+
+    pool = Camera_Pool([CSI_Module(id, "pool_%d" %(id), quiet = True, segment_duration = BENCHMARK_SEGMENT_DURATION,
+                                   spool_dir = os.path.join(directory, "spool"), engine = engine, mode_cache = mode_cache)
+                        for id in range(BENCHMARK_POOL_SIZE)])
+
+    try:
+        for run in range(runs):
+            result = pool.start_Video_Capture(os.path.join(directory, "pool_%d" %(run)), BENCHMARK_RESOLUTION,
+                                              BENCHMARK_FRAMERATE)
+            results.add("pool.start", result.duration)
+
+            time.sleep(BENCHMARK_RECORD_TIME)
+
+            result = pool.stop_Video_Capture()
+            results.add("pool.stop", result.duration)
+    finally:
+        pool.close()
+
+def run_Benchmarks(runs = DEFAULT_RUNS, startup_delay = DEFAULT_STARTUP_DELAY):
+    """
+    Run every scenario against the gst-launch-1.0 stand-in.
+
+    @param runs:                The number of times each scenario is run
+    @type runs:                 int
+
+    @param startup_delay:       The simulated camera start-up delay in seconds
+    @type startup_delay:        float
+
+    @return results:            The samples of each metric
+    @rtype results:             Benchmark_Results
+    """
+
+    directory = tempfile.mkdtemp(prefix="nano-benchmark-")
+    path = os.environ.get("PATH", "")
+    delay = os.environ.get(STARTUP_DELAY_VARIABLE)
+
+    try:
+        bin_dir = os.path.join(directory, "bin")
+        os.makedirs(bin_dir)
+        Fake_GStreamer.install(bin_dir)
+        os.environ[STARTUP_DELAY_VARIABLE] = str(startup_delay)
+
+        #The in-process engine would not run the stand-in
+        engine = Subprocess_Engine()
+        results = Benchmark_Results()
+
+        #Probe the stand-in's sensor modes up front, so that no capture is timed with a probe
+        mode_cache = Sensor_Mode_Cache(os.path.join(directory, "sensor_modes.json"))
+        for sensor_id in range(BENCHMARK_POOL_SIZE):
+            mode_cache.get(sensor_id)
+
+        benchmark_Camera_Module(results, directory, engine, mode_cache, runs)
+        benchmark_CSI_Module(results, directory, engine, mode_cache, runs)
+        benchmark_Camera_Pool(results, directory, engine, mode_cache, runs)
+
+        return results
+
+    finally:
+        os.environ["PATH"] = path
+        if delay == None:
+            os.environ.pop(STARTUP_DELAY_VARIABLE, None)
+        else:
+            os.environ[STARTUP_DELAY_VARIABLE] = delay
+        shutil.rmtree(directory)
+
+def main(arguments):
+    """
+    Run the benchmarks from the command line.
+
+    @return status:             0 if no metric has regressed against the baseline, 1 otherwise
+    @rtype status:              int
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmark the capture hot path against a gst-launch-1.0 stand-in")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="number of runs of each scenario")
+    parser.add_argument("--startup-delay", type=float, default=DEFAULT_STARTUP_DELAY,
+                        help="simulated camera start-up delay in seconds")
+    parser.add_argument("--baseline", help="baseline JSON file to compare against")
+    parser.add_argument("--save-baseline", help="write the results to a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative increase over the baseline allowed")
+    options = parser.parse_args(arguments)
+
+    results = run_Benchmarks(options.runs, options.startup_delay)
+    results.report()
+    summary = results.summary()
+
+    if options.save_baseline != None:
+        with open(options.save_baseline, "w") as baseline_file:
+            json.dump({"startup_delay": options.startup_delay, "metrics": summary}, baseline_file, indent=2, sort_keys=True)
+        print("Baseline written to %s" %(options.save_baseline))
+
+    if options.baseline == None:
+        return 0
+
+    with open(options.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    if baseline.get("startup_delay") != options.startup_delay:
+        print("Warning: the baseline was recorded with a start-up delay of %s s" %(baseline.get("startup_delay")))
+
+    regressions = compare(summary, baseline["metrics"], options.tolerance)
+    for metric, key, before, after in regressions:
+        print("REGRESSION %s %s: %.2f ms -> %.2f ms" %(metric, key, before * 1e3, after * 1e3))
+
+    if len(regressions) > 0:
+        return 1
+
+    print("No regressions against %s" %(options.baseline))
+    return 0
+
+def test():
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 50) == 3.0
+    assert percentile([1.0, 2.0], 90) == 1.9
+    assert percentile([7.0], 99) == 7.0
+
+    baseline = {"first_frame": {"p50": 0.100, "p90": 0.120}}
+    assert compare({"first_frame": {"p50": 0.110, "p90": 0.130}}, baseline) == []
+    assert compare({"first_frame": {"p50": 0.200, "p90": 0.130}}, baseline) == [("first_frame", "p50", 0.100, 0.200)]
+
+    path = os.environ.get("PATH")
+    delay = os.environ.get(STARTUP_DELAY_VARIABLE)
+    results = run_Benchmarks(runs = 2, startup_delay = 0.05)
+    results.report()
+    assert os.environ.get("PATH") == path and os.environ.get(STARTUP_DELAY_VARIABLE) == delay
+
+    summary = results.summary()
+    for metric in ("module.first_frame", "trap.first_frame", "trap.start_skew", "trap.rotation_gap", "trap.stop_latency"):
+        assert metric in summary
+
+    #Each capture waits for the simulated start-up, and a rotation keeps the pipeline running
+    assert summary["trap.first_frame"]["p50"] >= 0.05
+    assert summary["trap.rotation_gap"]["max"] < 4.0 / BENCHMARK_FRAMERATE
+
+    print("Benchmark tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    sys.exit(main(sys.argv[1:]))
@@ -23,6 +23,14 @@ import subprocess
 import signal
 import time
 
+from Pipeline_Engine import get_Engine
+from Still_Capture import Still_Capture, DEFAULT_STILL_FRAMERATE
+from Pipeline_Metrics import Pipeline_Metrics
+from Capture_Scheduler import get_Scheduler, Capture_Handle, Capture_Info, Timed_Capture
+from Sensor_Modes import get_Sensor_Mode_Cache
+from Video_Container import DEFAULT_CONTAINER, DEFAULT_FRAGMENT_DURATION, extension, stop_Timeout
+from Pipeline_Builder import Pipeline_Builder, DEFAULT_ENCODER_PROFILE, encoder_Name
+
 #-----------------------------------------------------------------------------------------------------------
 #   Command Line Argument Parser
 #-----------------------------------------------------------------------------------------------------------
@@ -33,8 +41,20 @@ import time
 #   Constants
 #-----------------------------------------------------------------------------------------------------------
 
-#TODO: Add constants
-
+#Image resolutions selected by the nvgstcapture-1.0 --image-res scale
+IMAGE_RESOLUTIONS = {
+    2:  (640, 480),
+    3:  (1280, 720),
+    4:  (1920, 1080),
+    5:  (2104, 1560),
+    6:  (2592, 1944),
+    7:  (2616, 1472),
+    8:  (3840, 2160),
+    9:  (3896, 2192),
+    10: (4208, 3120),
+    11: (5632, 3168),
+    12: (5632, 4224),
+}
 
 
 #-----------------------------------------------------------------------------------------------------------
@@ -52,32 +72,82 @@ class CSI_Camera:
     @param log_file:        The text file to which the output of the process is dumped
     @type log_file:         str
 
-    @param process:         The currently active subprocess. Will be overridden in the case where a new
-                            subprocess is initiated
-    @type process:          Popen
+    @param process:         The currently active pipeline. Will be overridden in the case where a new
+                            pipeline is initiated
+    @type process:          Pipeline
+
+    @param engine:          The engine that runs the pipelines
+    @type engine:           Gst_Engine or Subprocess_Engine
+
+    @param still:           The still image pipeline. Holds the camera while running, so it is stopped before a
+                            video is recorded
+    @type still:            Still_Capture
+
+    @param metrics:         The measurements of the current pipeline
+    @type metrics:          Pipeline_Metrics
+
+    @param scheduler:       The timer that ends timed captures and takes scheduled photos
+    @type scheduler:        Capture_Scheduler
+
+    @param container:       The container videos are recorded in, CONTAINER_MP4, CONTAINER_FRAGMENTED_MP4 or
+                            CONTAINER_MATROSKA
+    @type container:        str
+
+    @param fragment_duration: The length in seconds of each fragment of a fragmented container
+    @type fragment_duration: float
+
+    @param mode_cache:      The probed sensor modes that captures are resolved against
+    @type mode_cache:       Sensor_Mode_Cache
+
+    @param encoder:         The settings of the video encoder
+    @type encoder:          Encoder_Profile
     """
 
-    def __init__(self, id, log_file):
+    def __init__(self, id, log_file, engine = None, scheduler = None, container = DEFAULT_CONTAINER,
+                 fragment_duration = DEFAULT_FRAGMENT_DURATION, mode_cache = None, encoder = None):
         """
         CSI_Camera Constructor. 
         """
 
         self.process = None
+        self.still = None
         self.id = id
         self.log_file = log_file
+        self.container = container
+        self.fragment_duration = fragment_duration
+        self.metrics = Pipeline_Metrics("camera_%d" %(id))
+
+        if encoder == None:
+            encoder = DEFAULT_ENCODER_PROFILE
+        self.encoder = encoder
+
+        if engine == None:
+            engine = get_Engine()
+        self.engine = engine
 
-    def start_Process(self, command, shell = True):
+        if scheduler == None:
+            scheduler = get_Scheduler()
+        self.scheduler = scheduler
+
+        if mode_cache == None:
+            mode_cache = get_Sensor_Mode_Cache()
+        self.mode_cache = mode_cache
+
+    def start_Process(self, description, framerate = None):
         """
-        Set the process command and begin the subprocess. Overide the previous process
+        Set the pipeline description and begin the pipeline. Overide the previous pipeline
         """
 
         self.terminate_Process()
-        self.process = subprocess.Popen(command, shell=shell, stdout=self.log_file)
+        self.stop_Still_Capture()
+        self.process = self.engine.launch(description, "camera_%d" %(self.id), self.metrics.handle_Message,
+                                          log_file=self.log_file)
+        self.metrics.start(self.process, framerate)
 
 
     def terminate_Process(self):
         """
-        Terminate the current process. Does nothing if process is not running
+        Terminate the current pipeline and wait for it to finish. Does nothing if pipeline is not running
         """
 
         if self.process == None:
@@ -85,68 +155,193 @@ class CSI_Camera:
         if self.is_Process_Running() == False:
             return
 
-        #Get the process ID
-        process_id = os.getpgid(self.process.pid)
-
-        #Terminate process
-        os.killpg(process_id, signal.SIGINT)
+        #Send EOS, forcing the pipeline down if it does not finish in time
+        self.process.stop(stop_Timeout(self.container))
 
     def is_Process_Running(self):
         """
         Return True if process is ongoing.
         """
 
-        if self.process.poll() == None:
-            return True
-        else:
-            return False
-    
-    def video_Capture(self, filename, res_width, res_height, framerate, duration):
+        return self.process.is_Running()
+
+    def video_Pipeline(self, filename, res_width, res_height, framerate):
         """
-        Record a fixed duration MP4 format video.
+        Get the GStreamer pipeline description that records a video in the camera's container.
+
+        @param filename:        The name of the output file, without extension
+        @type filename:         str
+
+        @return pipeline:       The pipeline description
+        @rtype pipeline:        str
         """
 
-        #Generate process command
+        builder = Pipeline_Builder(self.engine)
 
-        #Select camera source
-        command = "gst-launch-1.0 nvarguscamerasrc sensor-id=%d ! " %(self.id) 
-        
-        #Set resolution and framerate
-        command += "'video/x-raw(memory:NVMM),width=%d,height=%d,framerate=%d/1,format=NV12' ! " %(res_width,res_height,framerate)
+        #Select camera source in the cheapest native mode, scaled to the resolution in hardware
+        builder.source(self.mode_cache.resolve(self.id, (res_width, res_height), framerate))
 
-        #Convert raw input to MP4 format
-        command += "nvv4l2h264enc ! h264parse ! mp4mux ! "
+        #Encode the raw input and convert it to the container format, measuring each encoded frame
+        builder.encode(self.encoder, "camera_%d" %(self.id)).meter("camera_%d" %(self.id))
+        builder.mux(self.container, self.fragment_duration)
 
         #Record video in specified output file
-        command += "filesink location=%s.mp4 -e" %(filename)
+        builder.file_Sink("%s%s" %(filename, extension(self.container)))
 
-        self.start_Process(command)
-        time.sleep(duration)
-        self.terminate_Process()
+        return builder.build()
+
+    def set_Bitrate(self, bitrate):
+        """
+        Change the bitrate of the camera's video, e.g. to save storage. The running recording is changed where the
+        engine allows it, otherwise the change takes effect from the next recording.
+
+        @param bitrate:         The bitrate in bits per second
+        @type bitrate:          int
+
+        @return live:           True if the running recording was changed
+        @rtype live:            bool
+        """
+
+        self.encoder = self.encoder.with_Bitrate(bitrate)
+
+        if self.process == None or self.process.supports_Control == False or self.is_Process_Running() == False:
+            return False
+
+        self.process.set_Property(encoder_Name("camera_%d" %(self.id)), "bitrate",
+                                  self.encoder.bitrate_Property(self.encoder.is_Software(self.engine)))
+        return True
+    
+    def video_Capture(self, filename, res_width, res_height, framerate, duration, callback = None):
+        """
+        Record a fixed duration video in the camera's container. Returns as soon as the pipeline has been launched, and the shared
+        scheduler ends the recording once the duration has passed.
+
+        @param callback:        Function called with the Capture_Info of the video once it has been written
+        @type callback:         function
+
+        @return handle:         The recording, which can be extended, stopped early or waited on
+        @rtype handle:          Timed_Capture
+        """
+
+        self.start_Process(self.video_Pipeline(filename, res_width, res_height, framerate), framerate)
+
+        handle = Timed_Capture(self.process, filename + extension(self.container), duration, self.scheduler,
+                               frames=lambda: self.metrics.frame_count, stop_timeout=stop_Timeout(self.container))
+        if callback != None:
+            handle.add_Done_Callback(callback)
+        return handle
 
     def continuous_Video_Capture(self, filename, res_width, res_height, framerate):
         """
         The same, but requires explicit call to stop recording.
         """
 
-        #Generate process command
+        self.start_Process(self.video_Pipeline(filename, res_width, res_height, framerate), framerate)
 
-        #Select camera source
-        command = "gst-launch-1.0 nvarguscamerasrc sensor-id=%d ! " %(self.id) 
-        
-        #Set resolution and framerate
-        command += "'video/x-raw(memory:NVMM),width=%d,height=%d,framerate=%d/1,format=NV12' ! " %(res_width,res_height,framerate)
+    def start_Still_Capture(self, res_width, res_height, framerate = DEFAULT_STILL_FRAMERATE):
+        """
+        Start the still image pipeline, restarting it if the resolution or framerate has changed.
+        """
 
-        #Convert raw input to MP4 format
-        command += "nvv4l2h264enc ! h264parse ! mp4mux ! "
+        still = self.still
+        if still != None and still.is_Running() == True:
+            if (still.width, still.height, still.framerate) == (res_width, res_height, framerate):
+                return
+            self.stop_Still_Capture()
 
-        #Record video in specified output file
-        command += "filesink location=%s.mp4 -e" %(filename)
+        self.terminate_Process()
+
+        self.still = Still_Capture(self.id, res_width, res_height, framerate, engine=self.engine, mode_cache=self.mode_cache)
+        self.still.start()
+
+    def stop_Still_Capture(self):
+        """
+        Stop the still image pipeline and write any queued images. Does nothing if it is not running.
+        """
+
+        if self.still == None:
+            return
+
+        self.still.stop()
+        self.still.writer.close()
+        self.still = None
+
+    def Image_Capture(self, filename, res_width, res_height):
+        """
+        Take a JPEG photo. The still pipeline is left running so that the next photo is taken without delay.
+
+        @return path:           The path of the output JPEG file
+        @rtype path:            str
+        """
+
+        self.start_Still_Capture(res_width, res_height)
+        return self.still.capture_To_File(filename)
+
+    def schedule_Image_Capture(self, delay, filename, res_width, res_height, callback = None):
+        """
+        Take a JPEG photo after a delay without waiting for it. The photo is taken on the shared scheduler, which starts
+        the still pipeline if it is not running, and written with the still pipeline's writer.
+
+        @param delay:           The time in seconds until the photo is taken
+        @type delay:            float
+
+        @param callback:        Function called with the Capture_Info of the photo once it has been taken
+        @type callback:         function
+
+        @return handle:         The photo, which can be cancelled until it is taken or waited on
+        @rtype handle:          Capture_Handle
+        """
+
+        path = "%s.jpg" %(filename)
+        handle = Capture_Handle(path)
+        if callback != None:
+            handle.add_Done_Callback(callback)
+
+        def take():
+            with handle.lock:
+                handle.timer = None
+            start = time.monotonic()
+
+            #Stopping a recording would hold the scheduler, so a photo is not taken while one is running
+            if self.process != None and self.is_Process_Running() == True:
+                handle.complete(Capture_Info(path, start_time=start, error="the camera is recording a video"))
+                return
 
-        self.start_Process(command)
+            try:
+                self.start_Still_Capture(res_width, res_height)
+            except Exception as error:
+                handle.complete(Capture_Info(path, start_time=start, error=str(error)))
+                return
 
-    def Image_Capture(self):
-        pass
+            still = self.still
+
+            def write(data):
+                if data == None:
+                    handle.complete(Capture_Info(path, start_time=start, error="the still pipeline has stopped"))
+                    return
+
+                still.writer.write(path, data)
+                handle.complete(Capture_Info(path, len(data), start, time.monotonic(), 1))
+
+            still.request_Frame(write)
+
+        handle.timer = self.scheduler.call_Later(delay, take)
+        return handle
+
+    def Burst_Capture(self, filename, res_width, res_height, count, interval = 0.0):
+        """
+        Take a number of JPEG photos at a set interval, written as filename_000.jpg onwards.
+
+        @return result:         The paths of the photos and the achieved rate
+        @rtype result:          Burst_Result
+        """
+
+        framerate = DEFAULT_STILL_FRAMERATE
+        if interval > 0:
+            framerate = max(framerate, int(round(1.0 / interval)))
+
+        self.start_Still_Capture(res_width, res_height, framerate)
+        return self.still.burst(filename, count, interval)
 
 
 
@@ -158,21 +353,60 @@ class CSI_Camera_Module:
     @param sensor_id:       CSI Port ID of the camera device
     @type sensor_id:        int
 
-    @param process:         The currently active subprocess. Starting a new subprocess will override the 
-                            current process
-    @type process:          Popen
+    @param still:           The still image pipeline, kept running between frame captures
+    @type still:            Still_Capture
+
+    @param pipeline:        The currently active video pipeline
+    @type pipeline:         Pipeline
+
+    @param engine:          The engine that runs the pipelines
+    @type engine:           Gst_Engine or Subprocess_Engine
+
+    @param metrics:         The measurements of the current video pipeline
+    @type metrics:          Pipeline_Metrics
+
+    @param container:       The container videos are recorded in, CONTAINER_MP4, CONTAINER_FRAGMENTED_MP4 or
+                            CONTAINER_MATROSKA
+    @type container:        str
+
+    @param fragment_duration: The length in seconds of each fragment of a fragmented container
+    @type fragment_duration: float
+
+    @param mode_cache:      The probed sensor modes that captures are resolved against
+    @type mode_cache:       Sensor_Mode_Cache
+
+    @param encoder:         The settings of the video encoder
+    @type encoder:          Encoder_Profile
     """
 
-    def __init__(self, sensor_id):
+    def __init__(self, sensor_id, engine = None, container = DEFAULT_CONTAINER, fragment_duration = DEFAULT_FRAGMENT_DURATION,
+                 mode_cache = None, encoder = None):
         """
         CSI_Camera_Module Constructor.
         """
         self.sensor_id = sensor_id
-        self.process = None
+        self.container = container
+        self.fragment_duration = fragment_duration
+        self.still = None
+        self.pipeline = None
+        self.metrics = Pipeline_Metrics("camera_module_%d" %(sensor_id))
+
+        if encoder == None:
+            encoder = DEFAULT_ENCODER_PROFILE
+        self.encoder = encoder
+
+        if engine == None:
+            engine = get_Engine()
+        self.engine = engine
+
+        if mode_cache == None:
+            mode_cache = get_Sensor_Mode_Cache()
+        self.mode_cache = mode_cache
 
     def start_Frame_Capture(self, filename, res):
         """
-        Start a subprocess that captures a single frame and outputs a JPEG file.
+        Capture a single frame and output a JPEG file. The still pipeline is started on the first capture and
+        kept running, so later captures only wait for the next frame.
 
         @param filename:        The name of the output JPEG file
         @type filename:         str
@@ -180,22 +414,68 @@ class CSI_Camera_Module:
         @param res:             Resolution of the image (Scale goes from 2-12)         
         @type res:              int
 
-        @param flip:            Indicates whether the orientation of the camera should be inverted
-        @type flip:             bool
+        @return path:           The path of the output JPEG file
+        @rtype path:            str
         """
 
-        process_command = "nvgstcapture-1.0 --sensor-id=%d --image-res=%d --automate --capture-auto --start-time=1 --file-name=%s" %(self.sensor_id, res, filename)
+        self.start_Still_Pipeline(res)
+        return self.still.capture_To_File(filename)
+
+    def start_Burst_Capture(self, filename, res, count, interval = 0.0):
+        """
+        Capture a number of frames at a set interval and output them as numbered JPEG files.
 
-        #Start the subprocess
-        self.process = subprocess.Popen(process_command, shell=True)
+        @param filename:        The name of the output JPEG files
+        @type filename:         str
+
+        @param res:             Resolution of the images (Scale goes from 2-12)
+        @type res:              int
+
+        @param count:           The number of frames to capture
+        @type count:            int
+
+        @param interval:        The time in seconds between frames. 0 captures consecutive frames
+        @type interval:         float
+
+        @return result:         The paths of the images and the achieved rate
+        @rtype result:          Burst_Result
+        """
+
+        self.start_Still_Pipeline(res)
+        return self.still.burst(filename, count, interval)
+
+    def start_Still_Pipeline(self, res):
+        """
+        Start the still image pipeline at the given resolution scale, restarting it if the scale has changed.
+        """
+
+        width, height = IMAGE_RESOLUTIONS[res]
+
+        if self.still != None and self.still.is_Running() == True:
+            if (self.still.width, self.still.height) == (width, height):
+                return
+            self.still.stop()
+
+        #The camera can only be held by one pipeline
+        if self.pipeline != None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+        #Keep the writer so that images queued at the previous resolution are still written
+        writer = None
+        if self.still != None:
+            writer = self.still.writer
+
+        self.still = Still_Capture(self.sensor_id, width, height, engine=self.engine, writer=writer, mode_cache=self.mode_cache)
+        self.still.start()
 
 
 
     def start_Video_Capture(self, filename, width, height, framerate):
         """
-        Start a subprocess that captures a video and outputs a MP4 file.
+        Start a pipeline that captures a video and outputs a file in the module's container.
 
-        @param filename:        The name of the output MP4 file
+        @param filename:        The name of the output file, without extension
         @type filename:         str
 
         @param width:           The resolution width of the output video
@@ -209,17 +489,56 @@ class CSI_Camera_Module:
 
         """
 
-        process_command = "gst-launch-1.0 nvarguscamerasrc sensor-id=%d ! 'video/x-raw(memory:NVMM),width=%d,height=%d,framerate=%d/1,format=NV12' ! nvv4l2h264enc ! h264parse ! mp4mux ! filesink location=%s.mp4 -e" %(self.sensor_id, width, height, framerate, filename)
+        if self.still != None:
+            self.still.stop()
+
+        #Start the pipeline
+        self.pipeline = self.engine.launch(self.video_Pipeline(filename, width, height, framerate),
+                                           "camera_module_%d" %(self.sensor_id), self.metrics.handle_Message)
+        self.metrics.start(self.pipeline, framerate)
 
-        #Start the subprocess
-        self.process = subprocess.Popen(process_command, shell=True)
+    def video_Pipeline(self, filename, width, height, framerate):
+        """
+        Get the GStreamer pipeline description that captures a video and outputs a file in the module's container.
+
+        @return pipeline:       The pipeline description
+        @rtype pipeline:        str
+        """
+
+        builder = Pipeline_Builder(self.engine)
+        builder.source(self.mode_cache.resolve(self.sensor_id, (width, height), framerate))
+        builder.encode(self.encoder, self.metrics.name).meter(self.metrics.name)
+        builder.mux(self.container, self.fragment_duration).file_Sink("%s%s" %(filename, extension(self.container)))
+
+        return builder.build()
+
+    def set_Bitrate(self, bitrate):
+        """
+        Change the bitrate of the module's video. See CSI_Camera.set_Bitrate.
+
+        @return live:           True if the running video was changed
+        @rtype live:            bool
+        """
+
+        self.encoder = self.encoder.with_Bitrate(bitrate)
+
+        if self.pipeline == None or self.pipeline.supports_Control == False or self.pipeline.is_Running() == False:
+            return False
+
+        self.pipeline.set_Property(encoder_Name(self.metrics.name), "bitrate",
+                                   self.encoder.bitrate_Property(self.encoder.is_Software(self.engine)))
+        return True
 
     def terminate_Process(self):
         """
-        Terminate the ongoing subprocess
+        Terminate the ongoing still and video pipelines
         """
-        
-        os.killpg(os.getpgid(self.process.pid), signal.SIGINT)
+
+        if self.still != None:
+            self.still.stop()
+
+        if self.pipeline != None:
+            self.pipeline.stop(stop_Timeout(self.container))
 
 
 
@@ -241,8 +560,10 @@ def test():
 
     time.sleep(10)
 
-    cam1.terminate_Process()
-    cam2.terminate_Process()
+    #Stop both pipelines in parallel
+    threads = [cam.pipeline.stop_Async() for cam in (cam1, cam2)]
+    for thread in threads:
+        thread.join()
 
 
 #-----------------------------------------------------------------------------------------------------------
@@ -0,0 +1,406 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Camera_Pool
+#   Version:    1.00
+#
+#   Description:
+#   The Camera_Pool library runs an operation on any number of camera modules at once. Each camera's call runs on its own
+#   worker thread, so starting or stopping N cameras takes as long as the slowest camera rather than the sum of all of them,
+#   and the outcome of every camera is collected so that one failing or slow camera neither stops nor delays the others.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in discovering sensors
+import re               #Used in discovering sensors
+import shutil           #Used in removing test output
+import tempfile         #Used in creating test output
+import threading        #Used in testing hung cameras
+import concurrent.futures                           #Used in running camera operations in parallel
+import time
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Directory holding the sysfs entry of each video device node
+VIDEO_DEVICE_DIR = "/sys/class/video4linux"
+
+#Matches the name of a video device node, capturing its index
+VIDEO_DEVICE_PATTERN = re.compile(r'^video(\d+)$')
+
+#Start of the name of a CSI sensor's video device on the Jetson, e.g. "vi-output, imx219 9-0010". USB cameras and other
+#video devices are named by their own drivers
+CSI_DEVICE_NAME_PREFIX = "vi-output"
+
+#Sensors assumed when none are discovered, e.g. on a development machine
+DEFAULT_SENSOR_IDS = (0, 1)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Camera_Result:
+    """
+    Class representing the outcome of an operation on a single camera.
+
+    @param camera               The camera module
+    @type camera                CSI_Module
+
+    @param value                The value returned by the operation, None if it failed
+    @type value                 object
+
+    @param error                The exception raised by the operation, None if it succeeded
+    @type error                 Exception
+
+    @param duration             The time in seconds the operation took, None if it had not finished by the timeout
+    @type duration              float
+    """
+
+    def __init__(self, camera, value = None, error = None, duration = None):
+        """
+        Camera_Result Constructor.
+        """
+
+        self.camera = camera
+        self.value = value
+        self.error = error
+        self.duration = duration
+
+    def is_Ok(self):
+        """
+        Return True if the operation succeeded.
+        """
+
+        return self.error == None
+
+
+
+class Pool_Result:
+    """
+    Class representing the outcome of an operation across a camera pool.
+
+    @param operation            The name of the operation
+    @type operation             str
+
+    @param results              The result of each camera, in pool order
+    @type results               [Camera_Result]
+
+    @param duration             The wall-clock time in seconds the operation took across the pool
+    @type duration              float
+    """
+
+    def __init__(self, operation, results, duration):
+        """
+        Pool_Result Constructor.
+        """
+
+        self.operation = operation
+        self.results = results
+        self.duration = duration
+
+    def succeeded(self):
+        """
+        Get the cameras on which the operation succeeded.
+
+        @return cameras:            The camera modules
+        @rtype cameras:             [CSI_Module]
+        """
+
+        return [result.camera for result in self.results if result.is_Ok() == True]
+
+    def failed(self):
+        """
+        Get the results of the cameras on which the operation failed or timed out.
+
+        @return results:            The failed results
+        @rtype results:             [Camera_Result]
+        """
+
+        return [result for result in self.results if result.is_Ok() == False]
+
+    def values(self):
+        """
+        Get the value returned for each camera, keyed by camera name. Failed cameras are left out.
+        """
+
+        return {result.camera.name: result.value for result in self.results if result.is_Ok() == True}
+
+    def report(self):
+        """
+        Print a warning for each camera on which the operation failed.
+
+        @return ok:                 True if the operation succeeded on every camera
+        @rtype ok:                  bool
+        """
+
+        for result in self.failed():
+            print("Warning: %s failed on %s: %s" %(self.operation, result.camera.name, result.error))
+
+        return len(self.failed()) == 0
+
+
+
+class Camera_Pool:
+    """
+    Class that runs operations on a set of camera modules in parallel. The pool keeps one worker thread per camera, so
+    every camera's call starts at once, and a camera whose call hangs only holds up its own later calls.
+
+    @param cameras              The camera modules, in order
+    @type cameras               [CSI_Module]
+    """
+
+    def __init__(self, cameras):
+        """
+        Camera_Pool Constructor.
+
+        @param cameras:             The camera modules. Each must have a unique name
+        @type cameras:              [CSI_Module]
+        """
+
+        self.cameras = list(cameras)
+        self.executors = {}
+        for camera in self.cameras:
+            self.executors[camera.name] = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                                thread_name_prefix="camera-%s" %(camera.name))
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def __iter__(self):
+        return iter(self.cameras)
+
+    def get(self, name):
+        """
+        Get a camera module by name.
+
+        @return camera:             The camera module, None if there is none by that name
+        @rtype camera:              CSI_Module
+        """
+
+        for camera in self.cameras:
+            if camera.name == name:
+                return camera
+        return None
+
+    def map(self, operation, function, cameras = None, timeout = None):
+        """
+        Call a function with each camera in parallel and wait for every call to finish.
+
+        @param operation:           The name of the operation, used in reporting failures
+        @type operation:            str
+
+        @param function:            Function called with a camera module
+        @type function:             function
+
+        @param cameras:             The cameras to call it with. Defaults to the whole pool
+        @type cameras:              [CSI_Module]
+
+        @param timeout:             The time in seconds to wait for the calls. A call still running after the timeout is
+                                    reported as failed and left to finish in the background, ahead of that camera's later
+                                    calls. None waits for every call
+        @type timeout:              float
+
+        @return result:             The outcome on each camera
+        @rtype result:              Pool_Result
+        """
+
+        if cameras == None:
+            cameras = self.cameras
+
+        start = time.monotonic()
+
+        def call(camera):
+            call_start = time.monotonic()
+            value = function(camera)
+            return value, time.monotonic() - call_start
+
+        futures = [self.executors[camera.name].submit(call, camera) for camera in cameras]
+        concurrent.futures.wait(futures, timeout)
+
+        results = []
+        for camera, future in zip(cameras, futures):
+            if future.done() == False:
+                results.append(Camera_Result(camera, error = TimeoutError("still running after %.1f s" %(timeout))))
+            elif future.exception() != None:
+                results.append(Camera_Result(camera, error = future.exception()))
+            else:
+                value, duration = future.result()
+                results.append(Camera_Result(camera, value, duration = duration))
+
+        return Pool_Result(operation, results, time.monotonic() - start)
+
+    def start_Video_Capture(self, filename, resolution, framerate, cameras = None):
+        """
+        Start recording on each camera in its own pipeline.
+
+        @param filename:            The name of the recording. Each camera's clip is named <filename>_<camera name>
+        @type filename:             str
+        """
+
+        return self.map("start", lambda camera: camera.start_Video_Capture("%s_%s" %(filename, camera.name), resolution,
+                                                                             framerate), cameras)
+
+    def rotate_Video_Capture(self, filename, cameras = None):
+        """
+        Switch each camera to a new recording at its next segment boundary.
+        """
+
+        return self.map("rotate", lambda camera: camera.rotate_Video_Capture("%s_%s" %(filename, camera.name)), cameras)
+
+    def stop_Video_Capture(self, cameras = None, timeout = None):
+        """
+        Stop recording on each camera.
+
+        @param timeout:             The time in seconds to wait for the cameras, after which the slow ones are reported
+                                    and left to stop in the background. None waits for every camera
+        @type timeout:              float
+        """
+
+        return self.map("stop", lambda camera: camera.stop_Video_Capture(), cameras, timeout)
+
+    def start_Pre_Roll(self, resolution, framerate, duration, max_bytes, cameras = None):
+        """
+        Start buffering pre-roll video on each camera.
+        """
+
+        return self.map("start pre-roll", lambda camera: camera.start_Pre_Roll(resolution, framerate, duration, max_bytes),
+                        cameras)
+
+    def stop_Pre_Roll(self, cameras = None):
+        """
+        Stop buffering pre-roll video on each camera.
+        """
+
+        return self.map("stop pre-roll", lambda camera: camera.stop_Pre_Roll(), cameras)
+
+    def trigger_Video_Capture(self, filename, expected_duration = None, cameras = None, trigger_time = None):
+        """
+        Start writing a clip from each camera's pre-roll ring.
+        """
+
+        return self.map("trigger", lambda camera: camera.trigger_Video_Capture("%s_%s" %(filename, camera.name),
+                                                                                 expected_duration, trigger_time), cameras)
+
+    def close(self):
+        """
+        Shut down the worker threads once their calls have finished.
+        """
+
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def discover_Sensors(directory = VIDEO_DEVICE_DIR):
+    """
+    Find the connected CSI sensors from the names of the video devices, skipping USB cameras and other devices that
+    nvarguscamerasrc cannot open. Argus numbers the CSI sensors from 0 in the order of their device nodes, so a sensor's ID
+    is its position among them rather than the index of its node.
+
+    @param directory:           The directory holding the sysfs entry of each device node
+    @type directory:            str
+
+    @return sensor_ids:         The sensor ID of each CSI sensor, in order. Empty if none are found
+    @rtype sensor_ids:          [int]
+    """
+
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    indexes = []
+    for name in names:
+        match = VIDEO_DEVICE_PATTERN.match(name)
+        if match == None:
+            continue
+
+        try:
+            with open(os.path.join(directory, name, "name")) as device_name:
+                if device_name.read().startswith(CSI_DEVICE_NAME_PREFIX) == False:
+                    continue
+        except OSError:
+            continue
+
+        indexes.append(int(match.group(1)))
+
+    return list(range(len(indexes)))
+
+def test():
+    class Slow_Camera:
+        def __init__(self, name, delay, fail = False):
+            self.name = name
+            self.delay = delay
+            self.fail = fail
+            self.hang = None
+
+        def start_Video_Capture(self, filename, resolution, framerate):
+            time.sleep(self.delay)
+            if self.fail == True:
+                raise RuntimeError("sensor not responding")
+            return filename
+
+        def stop_Video_Capture(self):
+            time.sleep(self.delay)
+
+        def rotate_Video_Capture(self, filename):
+            if self.hang != None:
+                self.hang.wait()
+            time.sleep(self.delay)
+
+    #Six cameras start in the time of one
+    cameras = [Slow_Camera("cam_%d" %(index), 0.2) for index in range(6)]
+    pool = Camera_Pool(cameras)
+
+    result = pool.start_Video_Capture("clip", (1280, 720), 30)
+    assert result.duration < 0.35 and result.report() == True
+    assert result.values()["cam_5"] == "clip_cam_5"
+
+    #A failing camera and a stuck camera are reported without holding up the others
+    cameras[1].fail = True
+    cameras[2].delay = 2.0
+    result = pool.map("start", lambda camera: camera.start_Video_Capture("clip", (1280, 720), 30), timeout = 0.5)
+    assert 0.5 <= result.duration < 0.65
+    assert [failure.camera.name for failure in result.failed()] == ["cam_1", "cam_2"]
+    assert len(result.succeeded()) == 4
+
+    #A camera that hangs across calls keeps only its own calls waiting
+    cameras[2].delay = 0.2
+    cameras[2].hang = threading.Event()
+    for call in range(2):
+        result = pool.map("rotate", lambda camera: camera.rotate_Video_Capture("clip"), timeout = 0.3)
+        assert [failure.camera.name for failure in result.failed()] == ["cam_2"]
+        assert len(result.succeeded()) == 5 and result.duration < 0.4
+
+    cameras[2].hang.set()
+    pool.close()
+
+    directory = tempfile.mkdtemp()
+    try:
+        for name, device_name in (("video0", "vi-output, imx219 9-0010"), ("video1", "USB Camera"), ("video2", None),
+                                  ("video3", "vi-output, imx219 10-0010"), ("media0", "vi-output, imx219 9-0010")):
+            os.makedirs(os.path.join(directory, name))
+            if device_name != None:
+                with open(os.path.join(directory, name, "name"), "w") as name_file:
+                    name_file.write(device_name + "\n")
+        assert discover_Sensors(directory) == [0, 1]
+        assert discover_Sensors(os.path.join(directory, "missing")) == []
+    finally:
+        shutil.rmtree(directory)
+
+    print("Camera_Pool tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
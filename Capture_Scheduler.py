@@ -0,0 +1,566 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Capture_Scheduler
+#   Version:    1.00
+#
+#   Description:
+#   The Capture_Scheduler library runs timed captures without blocking their callers. A single timer thread shared by every
+#   camera ends each timed recording when it is due, and each capture is handed back as a handle that can be extended,
+#   stopped early, waited on or awaited, and that calls its completion callbacks with the metadata of the output file. A
+#   scheduled capture costs a heap entry rather than a thread.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in measuring output files
+import asyncio          #Used in awaiting captures
+import heapq            #Used in ordering scheduled calls
+import itertools        #Used in ordering scheduled calls
+import threading        #Used in running the timer thread
+import time
+
+from Process_Supervisor import DEFAULT_EOS_TIMEOUT
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Scheduled_Call:
+    """
+    Class representing a function waiting to be called by the scheduler.
+
+    @param deadline             The time.monotonic() time at which the function is called
+    @type deadline              float
+
+    @param function             The function, called with no arguments on the timer thread
+    @type function              function
+    """
+
+    def __init__(self, deadline, function):
+        """
+        Scheduled_Call Constructor.
+        """
+
+        self.deadline = deadline
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Stop the function from being called. Does nothing if it already has been.
+        """
+
+        self.cancelled = True
+
+
+
+class Capture_Scheduler:
+    """
+    Class that calls functions at set times on a single timer thread. The thread is started by the first scheduled call.
+    Scheduled functions must return quickly, since every other call waits behind them.
+    """
+
+    def __init__(self, name = "capture-scheduler"):
+        """
+        Capture_Scheduler Constructor.
+
+        @param name:                The name of the timer thread
+        @type name:                 str
+        """
+
+        self.name = name
+        self.condition = threading.Condition()
+        self.heap = []
+        self.order = itertools.count()
+        self.running = False
+        self.thread = None
+
+    def call_At(self, deadline, function):
+        """
+        Call a function at a set time.
+
+        @param deadline:            The time.monotonic() time at which to call it
+        @type deadline:             float
+
+        @return call:               The scheduled call, which can be cancelled
+        @rtype call:                Scheduled_Call
+        """
+
+        call = Scheduled_Call(deadline, function)
+
+        with self.condition:
+            heapq.heappush(self.heap, (deadline, next(self.order), call))
+
+            if self.running == False:
+                self.running = True
+                self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self.thread.start()
+
+            #Wake the timer thread only if the new call is due before the one it is waiting for
+            if self.heap[0][2] is call:
+                self.condition.notify()
+
+        return call
+
+    def call_Later(self, delay, function):
+        """
+        Call a function after a delay in seconds.
+
+        @return call:               The scheduled call, which can be cancelled
+        @rtype call:                Scheduled_Call
+        """
+
+        return self.call_At(time.monotonic() + delay, function)
+
+    def pending(self):
+        """
+        Get the number of calls waiting to be made.
+        """
+
+        with self.condition:
+            return len([entry for entry in self.heap if entry[2].cancelled == False])
+
+    def run(self):
+        """
+        Make each call when it is due. Runs on the timer thread.
+        """
+
+        while True:
+            with self.condition:
+                while self.running == True:
+                    if len(self.heap) == 0:
+                        self.condition.wait()
+                        continue
+
+                    delay = self.heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.condition.wait(delay)
+
+                if self.running == False:
+                    return
+
+                deadline, order, call = heapq.heappop(self.heap)
+
+            if call.cancelled == True:
+                continue
+
+            try:
+                call.function()
+            except Exception as error:
+                print("Warning: scheduled call failed: %s" %(error))
+
+    def stop(self):
+        """
+        Stop the timer thread, dropping the calls that have not been made.
+        """
+
+        with self.condition:
+            self.running = False
+            self.heap = []
+            self.condition.notify_all()
+
+        if self.thread != None and self.thread != threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+
+
+class Capture_Info:
+    """
+    Class holding the metadata of a finished capture.
+
+    @param path                 The output file
+    @type path                  str
+
+    @param size                 The size of the output file in bytes, None if it was not written
+    @type size                  int
+
+    @param start_time           The time.monotonic() time at which the capture started
+    @type start_time            float
+
+    @param stop_time            The time.monotonic() time at which the capture finished
+    @type stop_time             float
+
+    @param frames               The number of frames captured, None if they were not counted
+    @type frames                int
+
+    @param error                The reason the capture failed, None if it succeeded
+    @type error                 str
+    """
+
+    def __init__(self, path, size = None, start_time = None, stop_time = None, frames = None, error = None):
+        """
+        Capture_Info Constructor.
+        """
+
+        self.path = path
+        self.size = size
+        self.start_time = start_time
+        self.stop_time = stop_time
+        self.frames = frames
+        self.error = error
+
+    def duration(self):
+        """
+        Get the length of the capture in seconds, None if it never started.
+        """
+
+        if self.start_time == None or self.stop_time == None:
+            return None
+        return self.stop_time - self.start_time
+
+
+
+class Capture_Handle:
+    """
+    Class representing a capture that finishes in the background. Its result is the Capture_Info of the output file.
+
+    @param path                 The output file
+    @type path                  str
+
+    @param info                 The metadata of the finished capture, None until it has finished
+    @type info                  Capture_Info
+
+    @param timer                The scheduled call that takes the capture, None once it has been made
+    @type timer                 Scheduled_Call
+    """
+
+    def __init__(self, path):
+        """
+        Capture_Handle Constructor.
+        """
+
+        self.path = path
+        self.info = None
+        self.timer = None
+
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.finishing = False
+        self.callbacks = []
+
+    def done(self):
+        """
+        Return True once the capture has finished.
+        """
+
+        return self.finished.is_set()
+
+    def complete(self, info):
+        """
+        Finish the capture and run its completion callbacks. Only the first call has any effect.
+
+        @param info:                The metadata of the capture
+        @type info:                 Capture_Info
+        """
+
+        with self.lock:
+            if self.finishing == True:
+                return
+            self.finishing = True
+            self.info = info
+
+            callbacks = self.callbacks
+            self.callbacks = []
+
+        for callback in callbacks:
+            try:
+                callback(info)
+            except Exception as error:
+                print("Warning: capture callback failed for %s: %s" %(self.path, error))
+
+        self.finished.set()
+
+    def add_Done_Callback(self, callback):
+        """
+        Call a function with the Capture_Info once the capture has finished. Called immediately if it already has, and
+        otherwise on the thread that finishes the capture, so it must return quickly.
+        """
+
+        with self.lock:
+            if self.finishing == False:
+                self.callbacks.append(callback)
+                return
+
+        callback(self.info)
+
+    def wait(self, timeout = None):
+        """
+        Wait for the capture to finish.
+
+        @return finished:           True if the capture finished before the timeout
+        @rtype finished:            bool
+        """
+
+        return self.finished.wait(timeout)
+
+    def result(self, timeout = None):
+        """
+        Wait for the capture to finish and get its metadata.
+
+        @return info:               The metadata of the capture
+        @rtype info:                Capture_Info
+        """
+
+        if self.wait(timeout) == False:
+            raise TimeoutError("%s has not finished after %.1f s" %(self.path, timeout))
+        return self.info
+
+    def __await__(self):
+        """
+        Wait for the capture to finish from a coroutine, without blocking the event loop.
+        """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(info):
+            if future.done() == False:
+                future.set_result(info)
+
+        self.add_Done_Callback(lambda info: loop.call_soon_threadsafe(resolve, info))
+        return (yield from future.__await__())
+
+    def stop(self):
+        """
+        Cancel the capture if it has not been taken yet.
+
+        @return handle:             This handle
+        @rtype handle:              Capture_Handle
+        """
+
+        with self.lock:
+            timer = self.timer
+
+        if timer != None:
+            timer.cancel()
+            self.complete(Capture_Info(self.path, error = "cancelled"))
+
+        return self
+
+
+
+class Timed_Capture(Capture_Handle):
+    """
+    Class representing a recording that the scheduler ends after a set duration. Ending sends EOS without waiting, and the
+    handle finishes when the pipeline does, so no thread is held while the recording runs or finishes. A pipeline that has
+    not finished by the stop timeout is forced down.
+
+    @param pipeline             The recording pipeline
+    @type pipeline              Pipeline
+
+    @param end_time             The time.monotonic() time at which the recording is ended
+    @type end_time              float
+    """
+
+    def __init__(self, pipeline, path, duration, scheduler = None, frames = None, stop_timeout = DEFAULT_EOS_TIMEOUT):
+        """
+        Timed_Capture Constructor.
+
+        @param pipeline:            The recording pipeline, already launched
+        @type pipeline:             Pipeline
+
+        @param path:                The output file
+        @type path:                 str
+
+        @param duration:            The length of the recording in seconds, from the pipeline's launch
+        @type duration:             float
+
+        @param scheduler:           The scheduler that ends the recording. Defaults to the shared scheduler
+        @type scheduler:            Capture_Scheduler
+
+        @param frames:              Function returning the number of frames recorded. None if they are not counted
+        @type frames:               function
+
+        @param stop_timeout:        The time in seconds the pipeline is given to finish after EOS
+        @type stop_timeout:         float
+        """
+
+        Capture_Handle.__init__(self, path)
+
+        if scheduler == None:
+            scheduler = get_Scheduler()
+
+        self.pipeline = pipeline
+        self.scheduler = scheduler
+        self.frames = frames
+        self.stop_timeout = stop_timeout
+        self.end_time = pipeline.start_time + duration
+        self.stopping = False
+
+        self.timer = scheduler.call_At(self.end_time, self.expire)
+        pipeline.add_Finish_Callback(self.finish)
+
+    def remaining(self):
+        """
+        Get the time in seconds until the recording is ended.
+        """
+
+        return max(0, self.end_time - time.monotonic())
+
+    def extend(self, seconds):
+        """
+        Lengthen the recording.
+
+        @param seconds:             The time in seconds added to the recording
+        @type seconds:              float
+
+        @return extended:           True if the recording was extended, False if it is already ending
+        @rtype extended:            bool
+        """
+
+        with self.lock:
+            if self.stopping == True or self.finishing == True:
+                return False
+
+            self.end_time += seconds
+            self.timer.cancel()
+            self.timer = self.scheduler.call_At(self.end_time, self.expire)
+
+        return True
+
+    def expire(self):
+        """
+        End the recording once it is due. Runs on the timer thread.
+        """
+
+        #The recording may have been extended after this call was taken off the heap
+        if time.monotonic() < self.end_time:
+            return
+
+        self.stop()
+
+    def stop(self):
+        """
+        End the recording now without waiting for it to finish. Wait on the handle to wait for the output file.
+
+        @return handle:             This handle
+        @rtype handle:              Timed_Capture
+        """
+
+        with self.lock:
+            if self.stopping == True or self.finishing == True:
+                return self
+            self.stopping = True
+            self.timer.cancel()
+
+            #Scheduled before EOS is sent so that a pipeline finishing at once cancels it
+            self.timer = self.scheduler.call_Later(self.stop_timeout, self.force)
+
+        self.pipeline.send_EOS()
+        return self
+
+    def force(self):
+        """
+        Force down a pipeline that has not finished after EOS. Only a stuck pipeline is given a thread of its own.
+        """
+
+        if self.pipeline.is_Running() == True:
+            print("Warning: %s did not finish after EOS, forcing it down" %(self.pipeline.name))
+            self.pipeline.stop_Async(0)
+
+    def finish(self, pipeline):
+        """
+        Complete the handle with the output file's metadata. Called once the pipeline has finished.
+        """
+
+        self.timer.cancel()
+
+        size = None
+        if os.path.exists(self.path) == True:
+            size = os.path.getsize(self.path)
+
+        frames = None
+        if self.frames != None:
+            frames = self.frames()
+
+        self.complete(Capture_Info(self.path, size, pipeline.start_time, time.monotonic(), frames, pipeline.error))
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Scheduler shared by every camera module
+scheduler = Capture_Scheduler()
+
+def get_Scheduler():
+    """
+    Get the scheduler shared by every camera module.
+
+    @return scheduler:          The shared scheduler
+    @rtype scheduler:           Capture_Scheduler
+    """
+
+    return scheduler
+
+def test():
+    class Fake_Pipeline:
+        def __init__(self):
+            self.name = "fake"
+            self.start_time = time.monotonic()
+            self.stop_time = None
+            self.error = None
+            self.callbacks = []
+
+        def add_Finish_Callback(self, callback):
+            self.callbacks.append(callback)
+
+        def is_Running(self):
+            return self.stop_time == None
+
+        def send_EOS(self):
+            self.stop_time = time.monotonic()
+            for callback in self.callbacks:
+                callback(self)
+
+    test_scheduler = Capture_Scheduler("test-scheduler")
+
+    #Thousands of captures cost a single thread
+    threads = threading.active_count()
+    handles = [Timed_Capture(Fake_Pipeline(), "/nonexistent_%d.mp4" %(index), 0.2, test_scheduler) for index in range(2000)]
+    assert threading.active_count() == threads + 1
+    assert all(handle.done() == False for handle in handles)
+    assert all(handle.wait(2.0) == True for handle in handles)
+    assert max(handle.info.duration() for handle in handles) < 0.5
+
+    #A recording is extended, reports its metadata to its callback and can be awaited
+    completed = []
+    pipeline = Fake_Pipeline()
+    handle = Timed_Capture(pipeline, "/nonexistent.mp4", 0.1, test_scheduler, frames = lambda: 42)
+    handle.add_Done_Callback(completed.append)
+    assert handle.extend(0.2) == True
+
+    info = asyncio.run(asyncio.wait_for(handle, 2.0))
+    assert 0.29 < info.duration() < 0.45
+    assert completed == [info] and info.frames == 42 and info.size == None
+    assert handle.extend(1.0) == False
+
+    #A recording stopped early finishes at once
+    handle = Timed_Capture(Fake_Pipeline(), "/nonexistent.mp4", 60, test_scheduler).stop()
+    assert handle.result(0.1).duration() < 0.1
+    assert test_scheduler.pending() == 0
+
+    #A scheduled still is cancelled before it is taken
+    taken = []
+    handle = Capture_Handle("/nonexistent.jpg")
+    handle.timer = test_scheduler.call_Later(0.1, lambda: taken.append(True))
+    assert handle.stop().result(0).error == "cancelled"
+    time.sleep(0.2)
+    assert taken == []
+
+    test_scheduler.stop()
+
+    print("Capture_Scheduler tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,388 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Fake_GStreamer
+#   Version:    1.00
+#
+#   Description:
+#   The Fake_GStreamer library is a stand-in for gst-launch-1.0 that lets the capture code paths run on any Linux machine. It
+#   parses the sinks of the pipeline description, waits a simulated camera start-up delay and then writes one timestamped line
+#   per frame into each filesink and splitmuxsink location, rotating splitmuxsink segments and printing their messages the way
+#   gst-launch-1.0 -m does. Identities with silent=false print each frame as gst-launch-1.0 -v does. SIGINT finishes the open
+#   segments and prints EOS, as gst-launch-1.0 -e does. A pipeline reading from a filesrc, such as a remux, copies the file
+#   into its sinks and exits at the end of the file, a line per frame at the framerate if it encodes. A camera source with
+#   num-buffers, such as a sensor mode probe, prints the sensor modes of an IMX219 and exits after that many frames.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in placing the stand-in on PATH
+import re               #Used in parsing caps
+import signal           #Used in receiving EOS
+import stat             #Used in skipping named pipes
+import sys
+import time
+
+from Sensor_Modes import IMX219_PROBE_OUTPUT
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Environment variable holding the simulated camera start-up delay in seconds
+STARTUP_DELAY_VARIABLE = "FAKE_GST_STARTUP_DELAY"
+
+#Simulated time in seconds between the process starting and the first frame, roughly an argus session start-up
+DEFAULT_STARTUP_DELAY = 0.1
+
+#Framerate used when the pipeline description has no framerate caps
+DEFAULT_FRAMERATE = 30
+
+#Elements that make a pipeline reading a file run at the framerate rather than copy it at once, as a transcode does
+ENCODERS = ("nvv4l2h264enc", "nvv4l2h265enc", "jpegenc")
+
+#Size in bytes of each frame reported by an identity, a 4 Mbit/s stream at 30 frames per second
+FRAME_BYTES = 16666
+
+#Name of the executable replaced by the stand-in
+GST_LAUNCH = "gst-launch-1.0"
+
+#Matches the framerate field of a caps string
+FRAMERATE_PATTERN = re.compile(r'framerate=(?:\(fraction\))?(\d+)/(\d+)')
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Fake_Sink:
+    """
+    Class representing a filesink or splitmuxsink of the faked pipeline. Each frame is written as a line holding the
+    frame number and the time.monotonic_ns() time at which it was written.
+
+    @param name                 The name of the sink element
+    @type name                  str
+
+    @param location             The output path, a printf style pattern for a splitmuxsink
+    @type location              str
+
+    @param max_size_time        The segment length in nanoseconds, None for a filesink
+    @type max_size_time         int
+    """
+
+    def __init__(self, name, location, max_size_time = None):
+        """
+        Fake_Sink Constructor.
+        """
+
+        self.name = name
+        self.location = location
+        self.max_size_time = max_size_time
+        self.file = None
+        self.path = None
+        self.index = 0
+        self.segment_start = 0
+
+    def open(self, running_time):
+        """
+        Open the next output file.
+        """
+
+        if self.max_size_time == None:
+            self.path = self.location
+        else:
+            self.path = self.location %(self.index)
+            self.index += 1
+
+        self.file = open(self.path, "w")
+        self.segment_start = running_time
+        self.post("splitmuxsink-fragment-opened", running_time)
+
+    def close(self, running_time):
+        """
+        Close the current output file.
+        """
+
+        self.file.close()
+        self.file = None
+        self.post("splitmuxsink-fragment-closed", running_time)
+
+    def write_Frame(self, index, running_time):
+        """
+        Write a frame, first starting a new segment if the current one is full.
+        """
+
+        if self.max_size_time != None and running_time - self.segment_start >= self.max_size_time:
+            self.close(running_time)
+            self.open(running_time)
+
+        self.file.write("%d %d\n" %(index, time.monotonic_ns()))
+        self.file.flush()
+
+    def post(self, message, running_time):
+        """
+        Print a splitmuxsink message in the gst-launch-1.0 -m format.
+        """
+
+        if self.max_size_time == None:
+            return
+
+        post_Message(self.name, "%s, location=(string)%s, running-time=(guint64)%d" %(message, self.path, running_time))
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Number of messages printed by the stand-in
+message_count = 0
+
+def post_Message(element, structure):
+    """
+    Print an element message in the gst-launch-1.0 -m format.
+    """
+
+    global message_count
+
+    message_count += 1
+    print('Got message #%d from element "%s" (element): %s;' %(message_count, element, structure), flush=True)
+
+def format_Time(nanoseconds):
+    """
+    Format a time in nanoseconds as GStreamer prints it, e.g. 0:00:01.033333333.
+    """
+
+    seconds, fraction = divmod(nanoseconds, 1000000000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d.%09d" %(hours, minutes, seconds, fraction)
+
+def print_Handoff(identity, pts, duration):
+    """
+    Print the last-message notification of a silent=false identity in the gst-launch-1.0 -v format.
+    """
+
+    print("/GstPipeline:pipeline0/GstIdentity:%s: last-message = chain   ******* (%s:sink) (%d bytes, dts: none, pts: %s, "
+          "duration: %s, offset: -1, offset_end: -1, flags: 00004000 tag-memory , meta: none) 0x7f0000000000"
+          %(identity, identity, FRAME_BYTES, format_Time(pts), format_Time(duration)), flush=True)
+
+def parse_Description(arguments):
+    """
+    Find the sinks and framerate of a pipeline description.
+
+    @param arguments:           The gst-launch-1.0 arguments, options first
+    @type arguments:            [str]
+
+    @return description:        (sinks, names of the identities that print each frame, framerate) of the pipeline
+    @rtype description:         ([Fake_Sink],[str],float)
+    """
+
+    elements = []
+    framerate = None
+
+    for token in arguments:
+        if token.startswith("-") == True or token == "!":
+            continue
+
+        match = FRAMERATE_PATTERN.search(token)
+        if match != None:
+            if framerate == None:
+                framerate = int(match.group(1)) / float(match.group(2))
+            continue
+
+        if "=" in token and len(elements) > 0:
+            key, value = token.split("=", 1)
+            elements[-1][1][key] = value
+        else:
+            elements.append((token, {}))
+
+    sinks = []
+    identities = []
+    counts = {}
+    for element, properties in elements:
+        #Unnamed elements are named like gst-launch-1.0 names them, e.g. filesink0
+        counts[element] = counts.get(element, -1) + 1
+        name = properties.get("name", "%s%d" %(element, counts[element]))
+
+        if element == "splitmuxsink":
+            sinks.append(Fake_Sink(name, properties["location"], int(properties.get("max-size-time", 0)) or None))
+
+        elif element == "filesink":
+            location = properties["location"]
+
+            #Named pipes are data sinks read by the caller, which sees them close when the process exits
+            if os.path.exists(location) == True and stat.S_ISFIFO(os.stat(location).st_mode) == True:
+                continue
+            sinks.append(Fake_Sink(name, location))
+
+        elif element == "identity" and properties.get("silent") == "false":
+            identities.append(name)
+
+    return sinks, identities, framerate or DEFAULT_FRAMERATE
+
+def source_Location(arguments):
+    """
+    Find the file read by the filesrc of a pipeline description.
+
+    @return location:           The location of the filesrc, None if the pipeline has none
+    @rtype location:            str
+    """
+
+    for index, token in enumerate(arguments):
+        if token == "filesrc":
+            for argument in arguments[index + 1:]:
+                if argument.startswith("location=") == True:
+                    return argument.split("=", 1)[1]
+                if argument == "!":
+                    break
+    return None
+
+def buffer_Limit(arguments):
+    """
+    Find the number of frames a pipeline description's camera source is limited to.
+
+    @return limit:              The num-buffers of the nvarguscamerasrc, None if it runs until stopped
+    @rtype limit:               int
+    """
+
+    for index, token in enumerate(arguments):
+        if token == "nvarguscamerasrc":
+            for argument in arguments[index + 1:]:
+                if argument.startswith("num-buffers=") == True:
+                    return int(argument.split("=", 1)[1])
+                if argument == "!":
+                    break
+    return None
+
+def fake_Gst_Launch(arguments):
+    """
+    Run the gst-launch-1.0 stand-in until SIGINT.
+
+    @param arguments:           The gst-launch-1.0 arguments
+    @type arguments:            [str]
+
+    @return status:             The exit status
+    @rtype status:              int
+    """
+
+    stopping = []
+    signal.signal(signal.SIGINT, lambda *args: stopping.append(True))
+
+    sinks, identities, framerate = parse_Description(arguments)
+    interval = 1.0 / framerate
+
+    if "-v" not in arguments:
+        identities = []
+
+    #A file source runs to the end of the file without waiting for a camera
+    source = source_Location(arguments)
+    if source != None:
+        with open(source) as source_file:
+            lines = source_file.readlines()
+        if any(encoder in arguments for encoder in ENCODERS) == False:
+            lines = ["".join(lines)]
+
+        for sink in sinks:
+            sink.open(0)
+        for line in lines:
+            if len(stopping) > 0:
+                break
+            for sink in sinks:
+                sink.file.write(line)
+                sink.file.flush()
+            if len(lines) > 1:
+                time.sleep(interval)
+        for sink in sinks:
+            sink.close(0)
+
+        print('Got EOS from element "pipeline0".', flush=True)
+        return 0
+
+    time.sleep(float(os.environ.get(STARTUP_DELAY_VARIABLE, DEFAULT_STARTUP_DELAY)))
+
+    #Argus lists the sensor modes as the session starts
+    limit = buffer_Limit(arguments)
+    if limit != None:
+        print(IMX219_PROBE_OUTPUT, end="", flush=True)
+
+    for sink in sinks:
+        sink.open(0)
+
+    start = time.monotonic()
+    index = 0
+    while len(stopping) == 0 and (limit == None or index < limit):
+        pts = int(index * interval * 1e9)
+        for identity in identities:
+            print_Handoff(identity, pts, int(interval * 1e9))
+        for sink in sinks:
+            sink.write_Frame(index, pts)
+        index += 1
+
+        time.sleep(max(0, start + index * interval - time.monotonic()))
+
+    for sink in sinks:
+        sink.close(int(index * interval * 1e9))
+
+    print('Got EOS from element "pipeline0".', flush=True)
+    return 0
+
+def install(directory):
+    """
+    Write a gst-launch-1.0 executable that runs the stand-in into a directory and put the directory first on PATH, so
+    that pipelines started by this process and its children use the stand-in.
+
+    @param directory:           The directory to install into
+    @type directory:            str
+    """
+
+    path = os.path.join(directory, GST_LAUNCH)
+    with open(path, "w") as script:
+        script.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n' %(sys.executable, os.path.abspath(__file__), GST_LAUNCH))
+    os.chmod(path, 0o755)
+
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+
+def read_Frames(path):
+    """
+    Read the frames written by the stand-in to an output file.
+
+    @return frames:             (frame number, time.monotonic() time) of each frame
+    @rtype frames:              [(int,float)]
+    """
+
+    frames = []
+    with open(path) as output:
+        for line in output:
+            index, timestamp = line.split()
+            frames.append((int(index), int(timestamp) / 1e9))
+    return frames
+
+def test():
+    arguments = ["-e", "-m", "nvarguscamerasrc", "sensor-id=0", "!",
+                 "video/x-raw(memory:NVMM),width=1280,height=720,framerate=60/1,format=NV12", "!",
+                 "identity", "name=meter_cam_0", "silent=false", "!",
+                 "splitmuxsink", "name=splitmux_cam_0", "max-size-time=1000000000", "location=/tmp/cam_0_%05d.mp4",
+                 "nvarguscamerasrc", "sensor-id=1", "!", "filesink", "location=/tmp/cam_1.mp4"]
+    sinks, identities, framerate = parse_Description(arguments)
+
+    assert framerate == 60 and identities == ["meter_cam_0"]
+    assert format_Time(3723033333333) == "1:02:03.033333333"
+    assert source_Location(["filesrc", "location=/tmp/in.mkv", "!", "matroskademux"]) == "/tmp/in.mkv"
+    assert buffer_Limit(arguments) == None
+    assert buffer_Limit(["nvarguscamerasrc", "sensor-id=0", "num-buffers=1", "!", "fakesink"]) == 1
+    assert [(sink.name, sink.location, sink.max_size_time) for sink in sinks] == \
+        [("splitmux_cam_0", "/tmp/cam_0_%05d.mp4", 1000000000), ("filesink0", "/tmp/cam_1.mp4", None)]
+
+    print("Fake_GStreamer tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == GST_LAUNCH:
+        sys.exit(fake_Gst_Launch(sys.argv[2:]))
+
+    test()
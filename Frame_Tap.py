@@ -0,0 +1,451 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Frame_Tap
+#   Version:    1.00
+#
+#   Description:
+#   The Frame_Tap library publishes a camera's live raw frames to other local processes, such as an on-device classifier or
+#   a preview tool, while the camera keeps recording. Frames are written into a ring of slots in a named shared memory
+#   segment, each slot holding a header with the frame's sequence number, timestamp and size. Readers attach to the segment
+#   by name and only ever read from it, so any number of them can come and go without the camera noticing, and a reader
+#   that falls behind skips to the newest frame instead of holding up the encoder.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in attaching to shared memory
+import sys              #Used in testing readers in other processes
+import mmap             #Used in attaching to shared memory
+import struct           #Used in reading and writing the frame headers
+import subprocess       #Used in testing readers in other processes
+import threading        #Used in serialising publication
+import time
+
+from multiprocessing import shared_memory
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Prefix of the name of each camera's shared memory segment
+TAP_PREFIX = "nano_tap_"
+
+#Directory in which Linux keeps named shared memory segments
+SHM_DIR = "/dev/shm"
+
+#Identifies a frame tap segment and the version of its layout
+TAP_MAGIC = b"NANOTAP1"
+
+#Number of frames held in the ring. A reader has this many frame intervals to copy a frame before it is overwritten
+DEFAULT_TAP_SLOTS = 4
+
+#Resolution and pixel format of the published frames
+DEFAULT_TAP_RESOLUTION = (640, 360)
+DEFAULT_TAP_FORMAT = "I420"
+
+#Bytes per pixel of each supported raw format
+TAP_FORMATS = {
+    "GRAY8":    1.0,
+    "I420":     1.5,
+    "NV12":     1.5,
+    "RGBA":     4.0,
+    "BGRx":     4.0,
+}
+
+#Segment header: magic, number of slots, largest frame in bytes, width, height and format. The sequence number of the last
+#published frame follows at LATEST_OFFSET
+SEGMENT_HEADER = struct.Struct("<8sIIII8s")
+LATEST = struct.Struct("<Q")
+LATEST_OFFSET = 48
+SEGMENT_HEADER_SIZE = 64
+
+#Slot header: sequence number, time.monotonic() time of publication and size in bytes of the frame that follows. A
+#sequence number of 0 marks a slot that is being written
+SLOT_HEADER = struct.Struct("<QdI")
+SLOT_HEADER_SIZE = 32
+
+#Time in seconds between checks for a new frame while a reader waits
+POLL_INTERVAL = 0.002
+
+#Number of times a reader retries a frame that was overwritten while it was being read
+READ_RETRIES = 3
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Tap_Frame:
+    """
+    Class representing a frame read from a frame tap.
+
+    @param sequence             The sequence number of the frame, counting from 1 for the first frame published
+    @type sequence              int
+
+    @param timestamp            The time.monotonic() time at which the frame was published
+    @type timestamp             float
+
+    @param data                 The raw frame
+    @type data                  bytes
+
+    @param width                The width of the frame in pixels
+    @type width                 int
+
+    @param height               The height of the frame in pixels
+    @type height                int
+
+    @param format               The raw pixel format of the frame, e.g. I420
+    @type format                str
+    """
+
+    def __init__(self, sequence, timestamp, data, width, height, format):
+        """
+        Tap_Frame Constructor.
+        """
+
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.data = data
+        self.width = width
+        self.height = height
+        self.format = format
+
+
+
+class Frame_Tap:
+    """
+    Class that publishes a camera's frames into a shared memory ring. Publishing copies the frame into the next slot and
+    never waits on readers.
+
+    @param name                 The name of the shared memory segment
+    @type name                  str
+
+    @param width                The width of the frames in pixels
+    @type width                 int
+
+    @param height               The height of the frames in pixels
+    @type height                int
+
+    @param format               The raw pixel format of the frames
+    @type format                str
+
+    @param slots                The number of frames held in the ring
+    @type slots                 int
+
+    @param frame_size           The size of each frame in bytes
+    @type frame_size            int
+
+    @param sequence             The sequence number of the last published frame, 0 before the first
+    @type sequence              int
+    """
+
+    def __init__(self, name, width, height, format = DEFAULT_TAP_FORMAT, slots = DEFAULT_TAP_SLOTS):
+        """
+        Frame_Tap Constructor. A segment left behind by a process that did not close its tap is replaced.
+        """
+
+        self.name = name
+        self.width = width
+        self.height = height
+        self.format = format
+        self.slots = slots
+        self.frame_size = frame_Size(format, width, height)
+        self.stride = SLOT_HEADER_SIZE + (self.frame_size + 63) // 64 * 64
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+        size = SEGMENT_HEADER_SIZE + slots * self.stride
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+
+        SEGMENT_HEADER.pack_into(self.memory.buf, 0, TAP_MAGIC, slots, self.frame_size, width, height, format.encode())
+        LATEST.pack_into(self.memory.buf, LATEST_OFFSET, 0)
+
+    def publish(self, data, timestamp = None):
+        """
+        Write a frame into the next slot of the ring, overwriting the oldest frame.
+
+        @param data:                The raw frame
+        @type data:                 bytes
+
+        @param timestamp:           The time.monotonic() time of the frame. Defaults to now
+        @type timestamp:            float
+        """
+
+        if len(data) > self.frame_size:
+            raise ValueError("%s: a %d byte frame does not fit in %d byte slots" %(self.name, len(data), self.frame_size))
+
+        if timestamp == None:
+            timestamp = time.monotonic()
+
+        with self.lock:
+            sequence = self.sequence + 1
+            offset = SEGMENT_HEADER_SIZE + (sequence % self.slots) * self.stride
+            buffer = self.memory.buf
+
+            #Readers seeing a sequence number of 0 or a different one know the slot has changed under them
+            SLOT_HEADER.pack_into(buffer, offset, 0, timestamp, len(data))
+            buffer[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + len(data)] = data
+            SLOT_HEADER.pack_into(buffer, offset, sequence, timestamp, len(data))
+            LATEST.pack_into(buffer, LATEST_OFFSET, sequence)
+
+            self.sequence = sequence
+
+    def close(self):
+        """
+        Remove the segment. Attached readers keep their mapping but see no new frames.
+        """
+
+        self.memory.close()
+        try:
+            self.memory.unlink()
+        except FileNotFoundError:
+            pass
+
+
+
+class Tap_Reader:
+    """
+    Class that reads the newest frames of a frame tap published by another process. Attaching and detaching does not
+    affect the publisher or other readers.
+
+    @param name                 The name of the shared memory segment
+    @type name                  str
+
+    @param width                The width of the frames in pixels
+    @type width                 int
+
+    @param height               The height of the frames in pixels
+    @type height                int
+
+    @param format               The raw pixel format of the frames
+    @type format                str
+
+    @param last                 The sequence number of the last frame read. Starts at the frame published last before
+                                the reader attached
+    @type last                  int
+
+    @param dropped              The number of frames published since attaching that the reader skipped
+    @type dropped               int
+    """
+
+    def __init__(self, name):
+        """
+        Tap_Reader Constructor.
+
+        @param name:                The name of the shared memory segment, see tap_Name
+        @type name:                 str
+        """
+
+        self.name = name
+        self.memory = attach_Segment(name)
+
+        magic, self.slots, self.frame_size, self.width, self.height, format = SEGMENT_HEADER.unpack_from(self.memory, 0)
+        if magic != TAP_MAGIC:
+            self.memory.close()
+            raise ValueError("%s is not a frame tap" %(name))
+
+        self.format = format.rstrip(b"\x00").decode()
+        self.stride = SLOT_HEADER_SIZE + (self.frame_size + 63) // 64 * 64
+        self.last = self.latest()
+        self.dropped = 0
+
+    def latest(self):
+        """
+        Get the sequence number of the last published frame.
+        """
+
+        return LATEST.unpack_from(self.memory, LATEST_OFFSET)[0]
+
+    def read(self):
+        """
+        Read the newest frame, if one has been published since the last read. Frames published in between are skipped.
+
+        @return frame:              The newest frame, None if there is no new frame
+        @rtype frame:               Tap_Frame
+        """
+
+        buffer = self.memory
+
+        for attempt in range(READ_RETRIES):
+            sequence = self.latest()
+            if sequence == self.last:
+                return None
+
+            offset = SEGMENT_HEADER_SIZE + (sequence % self.slots) * self.stride
+            slot_sequence, timestamp, size = SLOT_HEADER.unpack_from(buffer, offset)
+            if slot_sequence != sequence:
+                continue
+
+            data = bytes(buffer[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + size])
+
+            #The publisher went round the ring while the frame was being copied
+            if SLOT_HEADER.unpack_from(buffer, offset)[0] != sequence:
+                continue
+
+            self.dropped += max(0, sequence - self.last - 1)
+            self.last = sequence
+            return Tap_Frame(sequence, timestamp, data, self.width, self.height, self.format)
+
+        return None
+
+    def wait(self, timeout = None):
+        """
+        Wait for a new frame.
+
+        @param timeout:             The time in seconds to wait. None waits until a frame is published
+        @type timeout:              float
+
+        @return frame:              The newest frame, None if none was published before the timeout
+        @rtype frame:               Tap_Frame
+        """
+
+        deadline = None
+        if timeout != None:
+            deadline = time.monotonic() + timeout
+
+        while True:
+            frame = self.read()
+            if frame != None:
+                return frame
+            if deadline != None and time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def close(self):
+        """
+        Detach from the segment.
+        """
+
+        self.memory.close()
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def tap_Name(camera):
+    """
+    Get the name of the shared memory segment of a camera's frame tap.
+
+    @param camera:              The name of the camera, e.g. cam_0
+    @type camera:               str
+    """
+
+    return TAP_PREFIX + camera
+
+def frame_Size(format, width, height):
+    """
+    Get the size in bytes of a raw frame.
+
+    @raise ValueError:          If the format is not supported
+    """
+
+    if format not in TAP_FORMATS:
+        raise ValueError("unsupported frame tap format %s, use one of %s" %(format, ", ".join(sorted(TAP_FORMATS))))
+
+    return int(width * height * TAP_FORMATS[format])
+
+def attach_Segment(name):
+    """
+    Map an existing shared memory segment read-only. SharedMemory is not used to attach, as it registers the segment
+    with the resource tracker, which would remove it under the publisher when the reader exits.
+
+    @return memory:             The mapped segment
+    @rtype memory:              mmap
+
+    @raise FileNotFoundError:   If no tap of that name is published
+    """
+
+    with open(os.path.join(SHM_DIR, name), "rb") as segment:
+        return mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+
+def read_Frames(name, count):
+    """
+    Read frames from a tap and print the sequence number and first byte of each, for testing from another process.
+    """
+
+    reader = Tap_Reader(name)
+    print("attached", flush=True)
+    for index in range(count):
+        frame = reader.wait(5.0)
+        if frame == None:
+            break
+        print(frame.sequence, frame.data[0], flush=True)
+    reader.close()
+
+def test():
+    name = tap_Name("test_%d" %(time.monotonic_ns() % 1000000))
+    tap = Frame_Tap(name, 64, 48, "GRAY8", slots = 4)
+    try:
+        def frame(index):
+            return bytes([index % 256]) * tap.frame_size
+
+        reader = Tap_Reader(name)
+        assert (reader.width, reader.height, reader.format, reader.frame_size) == (64, 48, "GRAY8", 3072)
+        assert reader.read() == None
+
+        tap.publish(frame(1))
+        received = reader.read()
+        assert received.sequence == 1 and received.data == frame(1) and reader.read() == None
+
+        #A slow reader skips to the newest frame
+        for index in range(2, 11):
+            tap.publish(frame(index))
+        received = reader.read()
+        assert received.sequence == 10 and received.data == frame(10) and reader.dropped == 8
+
+        #Readers in other processes attach and detach while frames are published
+        script = "import Frame_Tap; Frame_Tap.read_Frames(%r, 5)" %(name)
+        process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, universal_newlines=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert process.stdout.readline() == "attached\n"
+        for index in range(11, 41):
+            tap.publish(frame(index))
+            time.sleep(0.01)
+        lines = process.communicate(timeout = 5)[0].split()
+        sequences = [(int(sequence), int(first)) for sequence, first in zip(lines[0::2], lines[1::2])]
+
+        assert len(sequences) == 5 and all(sequence == first for sequence, first in sequences)
+        assert [sequence for sequence, first in sequences] == sorted(sequence for sequence, first in sequences)
+
+        #The segment outlives the reader process
+        tap.publish(frame(41))
+        assert reader.read().sequence == 41
+
+        try:
+            tap.publish(b"\x00" * (tap.frame_size + 1))
+            assert False
+        except ValueError:
+            pass
+
+        #Publishing is a single copy, far faster than the camera's frame interval
+        large = Frame_Tap(name + "_large", 640, 360, "I420")
+        start = time.monotonic()
+        for index in range(100):
+            large.publish(b"\x80" * large.frame_size)
+        elapsed = (time.monotonic() - start) / 100
+        large.close()
+        assert elapsed < 0.005
+        print("Published a 640x360 I420 frame in %.3f ms" %(elapsed * 1e3))
+
+        reader.close()
+    finally:
+        tap.close()
+
+    print("Frame_Tap tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,341 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Motion_Detector
+#   Version:    1.00
+#
+#   Description:
+#   The Motion_Detector library scores the visual activity in a low resolution greyscale copy of a camera's stream. Each frame
+#   is compared with the previous frame and with a background averaged over a sliding window of frames, so that the camera
+#   trap can confirm that a PIS (Passive Infrared Sensor) trigger was caused by something moving in view rather than by a
+#   change in heat or light.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Resolution of the greyscale frames analysed
+DEFAULT_ANALYSIS_RESOLUTION = (160, 120)
+
+#Number of frames averaged into the background model
+DEFAULT_BACKGROUND_WINDOW = 30
+
+#Number of frames that must be in the background before frames are scored
+DEFAULT_WARMUP_FRAMES = 5
+
+#Change in grey level beyond which a pixel is considered changed
+DEFAULT_PIXEL_THRESHOLD = 20
+
+#Fraction of moving pixels at or above which a frame counts as active
+DEFAULT_ACTIVITY_SCORE = 0.005
+
+#Time in seconds a camera is still considered active after its last active frame
+DEFAULT_MOTION_HOLD = 0.5
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Motion_Detector:
+    """
+    Class that scores the activity of each frame of a greyscale stream. A pixel is moving if it differs both from the
+    previous frame and from the background, after the median difference of the frame has been removed so that global
+    changes in brightness are ignored. The score of a frame is the fraction of its pixels that are moving.
+
+    @param width                The width of the analysed frames
+    @type width                 int
+
+    @param height               The height of the analysed frames
+    @type height                int
+
+    @param window               The number of frames averaged into the background
+    @type window                int
+
+    @param pixel_threshold      The change in grey level beyond which a pixel is considered changed
+    @type pixel_threshold       int
+
+    @param warmup               The number of frames that must be in the background before frames are scored
+    @type warmup                int
+    """
+
+    def __init__(self, width, height, window = DEFAULT_BACKGROUND_WINDOW, pixel_threshold = DEFAULT_PIXEL_THRESHOLD,
+                 warmup = DEFAULT_WARMUP_FRAMES):
+        """
+        Motion_Detector Constructor.
+        """
+
+        if np == None:
+            raise ImportError("NumPy is required for motion analysis")
+
+        self.width = width
+        self.height = height
+        self.window = window
+        self.pixel_threshold = pixel_threshold
+        self.warmup = min(warmup, window)
+        self.frame_size = width * height
+
+        #Sliding window of frames and their running sum
+        self.frames = np.zeros((window, height, width), np.uint8)
+        self.total = np.zeros((height, width), np.uint32)
+        self.index = 0
+        self.count = 0
+        self.previous = None
+
+    def reset(self):
+        """
+        Forget the background, e.g. after the camera has been restarted.
+        """
+
+        self.total[:] = 0
+        self.index = 0
+        self.count = 0
+        self.previous = None
+
+    def score(self, frame):
+        """
+        Score a frame and add it to the background.
+
+        @param frame:               A GRAY8 frame of width x height pixels
+        @type frame:                bytes or ndarray
+
+        @return score:              The fraction of pixels that are moving, None while the background is warming up
+        @rtype score:               float
+        """
+
+        if isinstance(frame, np.ndarray) == False:
+            frame = np.frombuffer(frame, np.uint8, self.frame_size)
+        frame = frame.reshape(self.height, self.width)
+
+        current = frame.astype(np.int16)
+        score = None
+
+        if self.count >= self.warmup:
+            background = (self.total // self.count).astype(np.int16)
+
+            background_difference = current - background
+            background_difference -= np.int16(np.median(background_difference))
+
+            frame_difference = current - self.previous
+            frame_difference -= np.int16(np.median(frame_difference))
+
+            moving = (np.abs(background_difference) > self.pixel_threshold) & (np.abs(frame_difference) > self.pixel_threshold)
+            score = np.count_nonzero(moving) / float(self.frame_size)
+
+        #Replace the oldest frame of the window
+        if self.count == self.window:
+            self.total -= self.frames[self.index]
+        else:
+            self.count += 1
+        self.frames[self.index] = frame
+        self.total += frame
+        self.index = (self.index + 1) % self.window
+
+        self.previous = current
+        return score
+
+
+
+class Frame_Reader:
+    """
+    Class that splits a raw video byte stream, delivered in arbitrary sized chunks, into frames of a fixed size.
+
+    @param frame_size           The number of bytes in each frame
+    @type frame_size            int
+    """
+
+    def __init__(self, frame_size):
+        """
+        Frame_Reader Constructor.
+        """
+
+        self.frame_size = frame_size
+        self.buffer = bytearray()
+
+    def push(self, data):
+        """
+        Add bytes from the stream and return the frames they complete.
+
+        @return frames:             The completed frames in order
+        @rtype frames:              [bytes]
+        """
+
+        self.buffer += data
+
+        count = len(self.buffer) // self.frame_size
+        frames = [bytes(self.buffer[index * self.frame_size:(index + 1) * self.frame_size]) for index in range(count)]
+        del self.buffer[:count * self.frame_size]
+
+        return frames
+
+
+
+class Motion_Confirmation:
+    """
+    Class that combines the activity scores of several cameras into one confirmation state: True while any camera has seen
+    an active frame within the hold time, False otherwise, and None until any camera has been scored.
+
+    @param score_threshold      The score at or above which a frame counts as active
+    @type score_threshold       float
+
+    @param hold                 The time in seconds a camera stays active after its last active frame
+    @type hold                  float
+
+    @param state                The current confirmation state
+    @type state                 bool
+    """
+
+    def __init__(self, score_threshold = DEFAULT_ACTIVITY_SCORE, hold = DEFAULT_MOTION_HOLD):
+        """
+        Motion_Confirmation Constructor.
+        """
+
+        self.score_threshold = score_threshold
+        self.hold = hold
+        self.reset()
+
+    def reset(self):
+        """
+        Forget every camera's activity, returning the state to unknown.
+        """
+
+        self.last_motion = {}
+        self.scored = set()
+        self.state = None
+
+    def update(self, source, score, t):
+        """
+        Add a camera's score for a frame.
+
+        @param source:              The name of the camera
+        @type source:               str
+
+        @param score:               The activity score of the frame
+        @type score:                float
+
+        @param t:                   The time of the frame
+        @type t:                    float
+
+        @return changed:            True if the confirmation state has changed
+        @rtype changed:             bool
+        """
+
+        self.scored.add(source)
+        if score >= self.score_threshold:
+            self.last_motion[source] = t
+
+        state = any(t - last <= self.hold for last in self.last_motion.values())
+        if state == self.state:
+            return False
+
+        self.state = state
+        return True
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def synthetic_Frames(count, width, height, square = None, brightness_step = 0, seed = 0):
+    """
+    Generate noisy greyscale frames for exercising the detector without a camera.
+
+    @param count:               The number of frames
+    @type count:                int
+
+    @param square:              The side of a bright square that moves across the frame each frame, None for no square
+    @type square:               int
+
+    @param brightness_step:     The change in overall brightness per frame, e.g. the sun coming out
+    @type brightness_step:      int
+
+    @return frames:             The frames
+    @rtype frames:              [ndarray]
+    """
+
+    generator = np.random.default_rng(seed)
+    scene = generator.integers(60, 120, (height, width)).astype(np.int16)
+
+    frames = []
+    for index in range(count):
+        frame = scene + generator.integers(-4, 5, (height, width)) + brightness_step * index
+
+        if square != None:
+            x = (index * square // 2) % (width - square)
+            frame[height // 3:height // 3 + square, x:x + square] = 220
+
+        frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+
+    return frames
+
+def benchmark(width, height, count = 300):
+    """
+    Measure the rate at which frames are scored.
+
+    @return rate:               Frames scored per second
+    @rtype rate:                float
+    """
+
+    frames = [frame.tobytes() for frame in synthetic_Frames(60, width, height, square = 24)]
+    detector = Motion_Detector(width, height)
+
+    start = time.perf_counter()
+    for index in range(count):
+        detector.score(frames[index % len(frames)])
+    return count / (time.perf_counter() - start)
+
+def test():
+    if np == None:
+        print("NumPy is not installed, skipping")
+        return
+
+    width, height = DEFAULT_ANALYSIS_RESOLUTION
+
+    def scores(frames):
+        detector = Motion_Detector(width, height)
+        scored = [detector.score(frame) for frame in frames]
+        assert scored[:DEFAULT_WARMUP_FRAMES] == [None] * DEFAULT_WARMUP_FRAMES
+        return scored[DEFAULT_BACKGROUND_WINDOW:]
+
+    #A moving animal is active, sensor noise and a change in light are not
+    assert min(scores(synthetic_Frames(90, width, height, square = 24))) >= DEFAULT_ACTIVITY_SCORE
+    assert max(scores(synthetic_Frames(90, width, height))) < DEFAULT_ACTIVITY_SCORE
+    assert max(scores(synthetic_Frames(90, width, height, brightness_step = 2))) < DEFAULT_ACTIVITY_SCORE
+
+    #Frames split across chunks
+    frames = synthetic_Frames(3, width, height)
+    stream = b"".join(frame.tobytes() for frame in frames)
+    reader = Frame_Reader(width * height)
+    parsed = reader.push(stream[:10000]) + reader.push(stream[10000:])
+    assert parsed == [frame.tobytes() for frame in frames]
+
+    confirmation = Motion_Confirmation(hold = 0.5)
+    assert confirmation.update("cam_0", 0.0, 0.0) == True and confirmation.state == False
+    assert confirmation.update("cam_1", 0.1, 0.1) == True and confirmation.state == True
+    assert confirmation.update("cam_0", 0.0, 0.5) == False
+    assert confirmation.update("cam_0", 0.0, 0.7) == True and confirmation.state == False
+
+    for resolution in ((width, height), (320, 240)):
+        print("%dx%d: %.0f frames per second" %(resolution[0], resolution[1], benchmark(*resolution)))
+
+    assert benchmark(width, height) > 30
+    print("Motion_Detector tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -6,8 +6,8 @@
 #
 #   Description:
 #   The Nano_Camera_Trap library runs a program that utilizes hardware modules attached to a Nvidia Jetson Nano SBC to act as an
-#   animal camera trap. A PIS (Pssive Infrared Sensor) is used to detect movement within the dual camera's field-of-view and the 
-#   cameras record this action in a series of MP4 format video files.
+#   animal camera trap. A PIS (Pssive Infrared Sensor) is used to detect movement within the cameras' field-of-view and the 
+#   cameras record this action in a series of MP4 or Matroska format video files.
 #      
 #------------------------------------------------------------------------------------------------------------------------------------
 
@@ -20,11 +20,62 @@ import sys              #Used in error handling
 import subprocess       #Used in camera recording(threading)
 import signal           #Used in camera recording(threading)
 import time
+import shutil           #Used in moving completed video segments
+import threading        #Used in sharing clip bookkeeping between threads
+import select           #Used in waiting for sensor edges
+import queue            #Used in feeding triggered clips to their writers
+import asyncio          #Used in delivering sensor edges to coroutines
+import concurrent.futures   #Used in starting and stopping recordings off the event loop
+
+from Process_Supervisor import DEFAULT_EOS_TIMEOUT
+from Pipeline_Engine import get_Engine, DATA_SINK_NAME
+from PIS_Backend import GPIO_Chardev_Backend, PIS_Event, RISING, FALLING
+from Trap_Controller import Trap_Controller, Recording_Policy, MOTION, CONFIRMATION, STARTED
+from Pre_Roll_Buffer import H264_Parser, Pre_Roll_Buffer, DEFAULT_PRE_ROLL_DURATION, DEFAULT_PRE_ROLL_BYTES
+from Staging_Area import Staging_Area, DEFAULT_STAGING_BYTES
+from Storage_Manager import Storage_Manager, OLDEST_FIRST, STORAGE_LOW, STORAGE_CRITICAL, STORAGE_FULL, downgrade_Caps
+from Motion_Detector import Motion_Detector, Frame_Reader, Motion_Confirmation, DEFAULT_ANALYSIS_RESOLUTION, \
+    DEFAULT_ACTIVITY_SCORE
+from Pipeline_Metrics import Pipeline_Metrics, Metrics_Exporter
+from Camera_Pool import Camera_Pool, discover_Sensors, DEFAULT_SENSOR_IDS
+from Warm_Standby import Standby_Stats
+from Sensor_Modes import get_Sensor_Mode_Cache
+from Frame_Tap import Frame_Tap, tap_Name, DEFAULT_TAP_FORMAT
+from Post_Processing import Post_Processor, DEFAULT_POST_WORKERS, DERIVED_DIR
+from Recording_Catalog import Recording_Catalog, Catalog_Entry, CATALOG_NAME, TRIGGER_PIS, RECORDING_TIME_FORMAT, \
+    RECORDING_FILE_PATTERN, entry_From_File
+from Pipeline_Builder import Pipeline_Builder, DEFAULT_ENCODER_PROFILE, CODEC_H264, encoder_Name
+from Video_Container import Remuxer, Container_Error, DEFAULT_CONTAINER, DEFAULT_FRAGMENT_DURATION, extension, \
+    stop_Timeout, recover, is_Fragmented
 
 #------------------------------------------------------------------------------------------------------------------------------------
 #   Constants & Global Variables
 #------------------------------------------------------------------------------------------------------------------------------------
 
+#Length in seconds of each splitmuxsink segment. Where the engine cannot split on request, clip rotation requests take
+#effect at the next segment boundary, so a shorter segment is given where rotation must react quickly
+DEFAULT_SEGMENT_DURATION = 60.0
+
+#Time in seconds a recording of the trap may run past its maximum duration while it is being stopped
+SEGMENT_STOP_MARGIN = 5.0
+
+#Directory in which in-progress segments are written before being moved to their clip
+DEFAULT_SPOOL_DIR = ".spool"
+
+#Retention score of a recording without motion scores, ranked as if its motion had just reached the activity threshold
+UNSCORED_RECORDING_SCORE = DEFAULT_ACTIVITY_SCORE
+
+#Fraction of the encoder's bitrate recorded at while dir is low on space
+LOW_SPACE_BITRATE_FACTOR = 0.5
+
+#GPIO character device line of the sensor output (Jetson Nano header pin 7)
+DEFAULT_PIS_CHIP = "/dev/gpiochip0"
+DEFAULT_PIS_LINE = 216
+
+#Sensor debounce and hold-off periods in seconds
+DEFAULT_PIS_DEBOUNCE = 0.01
+DEFAULT_PIS_HOLDOFF = 1.0
+
 
 #------------------------------------------------------------------------------------------------------------------------------------
 #   Error Definitions
@@ -50,11 +101,8 @@ class Nano_Camera_Trap:
     """
     Class representing the whole camera trap setup.
 
-    @param cam_0:               First CSI Camera
-    @type cam_0:                CSI_Module
-
-    @param cam_1:               Second CSI Camera
-    @type cam_1:                CSI_Module
+    @param cameras:             The CSI cameras, named cam_<sensor id>
+    @type cameras:              Camera_Pool
 
     @param pis:                 Passive Infrared Sensor
     @type pis:                  PIS_Module
@@ -80,10 +128,74 @@ class Nano_Camera_Trap:
 
     @param sleep_duration:      The enforced period of inactivity after a successful recording session in seconds
     @type sleep_duration:       float
+
+    @param pre_roll_duration:   The length of video in seconds captured before each trigger. 0 disables pre-roll
+    @type pre_roll_duration:    float
+
+    @param pre_roll_bytes:      The maximum number of bytes of pre-roll video held in memory per camera
+    @type pre_roll_bytes:       int
+
+    @param staging:             The RAM-backed area in which recordings are held until the active threshold is met
+    @type staging:              Staging_Area
+
+    @param motion:              The cameras' confirmation of the sensor's activity. None if the cameras are not analysed
+    @type motion:               Motion_Confirmation
+
+    @param storage:             The manager of the free space and retention of dir
+    @type storage:              Storage_Manager
+
+    @param catalog:             The SQLite catalog of the kept recordings
+    @type catalog:              Recording_Catalog
+
+    @param exporter:            The writer and server of both cameras' pipeline metrics. None if metrics are not exported
+    @type exporter:             Metrics_Exporter
+
+    @param container:           The container the cameras record in
+    @type container:            str
+
+    @param remuxer:             The background remux of kept recordings to faststart MP4. None if they are kept as recorded
+    @type remuxer:              Remuxer
+
+    @param standby:             The policy that keeps the cameras warm after a recording. None keeps them off between
+                                recordings, or on around the clock with pre-roll
+    @type standby:              Standby_Policy
+
+    @param post_processor:      The background jobs that derive thumbnails, previews and merges from kept recordings.
+                                None if nothing is derived
+    @type post_processor:       Post_Processor
+
+    @param post_jobs:           The jobs run on each kept recording
+    @type post_jobs:            (str)
+
+    @param encoder:             The settings of the cameras' video encoder
+    @type encoder:              Encoder_Profile
+
+    @param bitrate:             The bitrate in bits per second the cameras record at while dir has space
+    @type bitrate:              int
+
+    @param bitrate_factor:      The fraction of bitrate recorded at, lowered while dir is low on space
+    @type bitrate_factor:       float
+
+    @param standby_stats:       The measured trigger latency and warm time of the standby. None without a standby policy
+    @type standby_stats:        Standby_Stats
+
+    @param start_offsets:       The time in seconds by which each camera started recording after the first camera in the
+                                last shared capture, keyed by camera name
+    @type start_offsets:        {str:float}
+
+    @param stop_skews:          The time in seconds by which each camera stopped recording after the first camera in the
+                                last shared capture, keyed by camera name
+    @type stop_skews:           {str:float}
     """
 
 
-    def __init__(self, dir, resolution, framerate, rec_min_duration, rec_max_duration, active_threshold, sleep_duration):
+    def __init__(self, dir, resolution, framerate, rec_min_duration, rec_max_duration, active_threshold, sleep_duration,
+                 pre_roll_duration = 0, pre_roll_bytes = DEFAULT_PRE_ROLL_BYTES, pis_backend = None, staging_dir = None,
+                 staging_bytes = DEFAULT_STAGING_BYTES, motion_confirmation = False, retention = OLDEST_FIRST,
+                 metrics_path = None, metrics_port = None, sensor_ids = None, container = DEFAULT_CONTAINER,
+                 fragment_duration = DEFAULT_FRAGMENT_DURATION, remux = False, standby = None, catalog_path = None,
+                 mode_cache = None, tap_resolution = None, tap_format = DEFAULT_TAP_FORMAT, post_jobs = None,
+                 post_workers = DEFAULT_POST_WORKERS, encoder = None):
         """
         Nano_Camera_Trap Constructor.
         
@@ -108,20 +220,190 @@ class Nano_Camera_Trap:
 
         @param sleep_duration:      The enforced period of inactivity after a successful recording session in seconds
         @type sleep_duration:       float
+
+        @param pre_roll_duration:   The length of video in seconds captured before each trigger. 0 disables pre-roll
+        @type pre_roll_duration:    float
+
+        @param pre_roll_bytes:      The maximum number of bytes of pre-roll video held in memory per camera
+        @type pre_roll_bytes:       int
+
+        @param pis_backend:         The GPIO edge source of the PIS. Defaults to the sensor pin's character device line
+        @type pis_backend:          GPIO_Chardev_Backend, GPIO_Sysfs_Backend or Fake_GPIO_Backend
+
+        @param staging_dir:         The RAM-backed directory in which recordings are staged, unless the container is
+                                    fragmented. Defaults to /dev/shm
+        @type staging_dir:          str
+
+        @param staging_bytes:       The maximum number of bytes staged in RAM before recordings spill to dir
+        @type staging_bytes:        int
+
+        @param motion_confirmation: Analyse a low resolution copy of each camera's video, so that activity only counts
+                                    towards active_threshold while the cameras see motion. Requires NumPy
+        @type motion_confirmation:  bool
+
+        @param retention:           The order in which kept recordings are deleted when dir runs low on space,
+                                    OLDEST_FIRST or LOWEST_SCORE_FIRST. The score of a recording is the peak motion
+                                    score of its cameras, or its length if the cameras were not scored
+        @type retention:            str
+
+        @param metrics_path:        The JSON file to which both cameras' pipeline metrics are written periodically
+        @type metrics_path:         str
+
+        @param metrics_port:        The loopback port on which the pipeline metrics are served as Prometheus text
+        @type metrics_port:         int
+
+        @param sensor_ids:          The CSI port of each camera. Defaults to the sensors with a video device node, or
+                                    ports 0 and 1 if none are found
+        @type sensor_ids:           [int]
+
+        @param container:           The container the cameras record in, CONTAINER_MP4, CONTAINER_FRAGMENTED_MP4 or
+                                    CONTAINER_MATROSKA. The fragmented containers stop without waiting on EOS and only
+                                    lose their last fragment if the trap is interrupted. To survive a power loss they are
+                                    staged in dir rather than in RAM, so discarded recordings still cost SD card writes
+        @type container:            str
+
+        @param fragment_duration:   The length in seconds of each fragment of a fragmented container
+        @type fragment_duration:    float
+
+        @param remux:               Remux each kept recording into a standard faststart MP4 in the background
+        @type remux:                bool
+
+        @param standby:             Keep the cameras warm after each recording for the idle window chosen by this policy,
+                                    encoding into the pre-roll ring with their output held back, and turn them off once it
+                                    passes without a trigger. Every recording is then triggered from the ring
+        @type standby:              Standby_Policy
+
+        @param catalog_path:        The SQLite catalog of the kept recordings. Defaults to CATALOG_NAME in dir. A new
+                                    catalog is built from the recordings already in dir
+        @type catalog_path:         str
+
+        @param mode_cache:          The probed sensor modes of the cameras. Defaults to the shared cache. The resolution
+                                    and framerate are checked against every camera's modes here, so that a capture no
+                                    sensor mode can satisfy fails before the trap starts
+        @type mode_cache:           Sensor_Mode_Cache
+
+        @param tap_resolution:      Publish each camera's live frames at this resolution as (width,height) of pixels to
+                                    other local processes, in the shared memory frame tap named tap_Name(<camera name>).
+                                    None publishes no frames
+        @type tap_resolution:       (int,int)
+
+        @param tap_format:          The raw pixel format of the published frames
+        @type tap_format:           str
+
+        @param post_jobs:           The jobs run on each kept recording in the background, any of JOB_THUMBNAIL,
+                                    JOB_PREVIEW and JOB_MERGE, written to DERIVED_DIR in dir. No job is started while a
+                                    camera is recording. None derives nothing
+        @type post_jobs:            (str)
+
+        @param post_workers:        The number of worker processes that run the jobs
+        @type post_workers:         int
+
+        @param encoder:             The settings of the cameras' video encoder. Defaults to DEFAULT_ENCODER_PROFILE. The
+                                    bitrate is lowered by LOW_SPACE_BITRATE_FACTOR while dir is low on space. Pre-roll,
+                                    standby, remux and post_jobs need an H.264 encoder
+        @type encoder:              Encoder_Profile
         """
         
         try:
-            self.cam_0 = CSI_Module(0, "cam_0")
-            self.cam_1 = CSI_Module(1, "cam_1")
-            self.pis = PIS_Module()
+            if sensor_ids == None:
+                sensor_ids = discover_Sensors() or DEFAULT_SENSOR_IDS
+
+            if catalog_path == None:
+                catalog_path = os.path.join(dir, CATALOG_NAME)
+            self.catalog = Recording_Catalog(catalog_path)
+            if self.catalog.count() == 0 and os.path.isdir(dir) == True:
+                self.catalog.rebuild(dir)
+
+            if encoder == None:
+                encoder = DEFAULT_ENCODER_PROFILE
+            if encoder.codec != CODEC_H264 and (pre_roll_duration > 0 or standby != None or remux == True or post_jobs != None):
+                raise ValueError("Pre-roll, standby, remux and post-processing need an H.264 encoder, not %s" %(encoder.codec))
+            self.encoder = encoder
+            self.bitrate = encoder.bitrate
+            self.bitrate_factor = 1.0
+
+            self.staging = Staging_Area(dir, staging_dir, staging_bytes)
+            self.storage = Storage_Manager(dir, len(sensor_ids) * encoder.bitrate / 8, retention,
+                                           delete_callback = self.recording_Deleted, existing = self.catalog.recordings(),
+                                           default_score = UNSCORED_RECORDING_SCORE)
+
+            self.motion = None
+            motion_callback = None
+            if motion_confirmation == True:
+                self.motion = Motion_Confirmation()
+                motion_callback = self.motion_Scored
+
+            #The cameras are stopped at the end of each recording, so each recording is kept as one segment per camera
+            self.cameras = Camera_Pool([CSI_Module(id, "cam_%d" %(id), clip_callback = self.clip_Completed,
+                                                   segment_duration = rec_max_duration + SEGMENT_STOP_MARGIN,
+                                                   staging = self.staging, motion_callback = motion_callback,
+                                                   container = container, fragment_duration = fragment_duration,
+                                                   mode_cache = mode_cache, tap_resolution = tap_resolution,
+                                                   tap_format = tap_format, encoder = encoder)
+                                        for id in sensor_ids])
+            for cam in self.cameras:
+                cam.capture_Mode(resolution, framerate)
+            self.pis = PIS_Module(backend = pis_backend)
+
+            self.standby = standby
+            self.standby_stats = None
+            extra_metrics = {}
+            if standby != None:
+                self.standby_stats = Standby_Stats()
+                extra_metrics["standby"] = self.standby_stats.summary
+
+            self.remuxer = None
+            if remux == True:
+                self.remuxer = Remuxer()
+
+            self.post_processor = None
+            self.post_jobs = post_jobs
+            if post_jobs != None:
+                self.post_processor = Post_Processor(os.path.join(dir, DERIVED_DIR), post_workers, self.is_Recording,
+                                                     engine_name = get_Engine().name)
+                extra_metrics["post_processing"] = self.post_processor.summary
+
+            self.exporter = None
+            if metrics_path != None or metrics_port != None:
+                self.exporter = Metrics_Exporter([cam.metrics for cam in self.cameras], metrics_path, metrics_port,
+                                                 extra = extra_metrics)
 
             self.dir = dir
+            self.container = container
             self.resolution = resolution
             self.framerate = framerate
             self.rec_min_duration = rec_min_duration
             self.rec_max_duration = rec_max_duration
             self.active_threshold = active_threshold
             self.sleep_duration = sleep_duration
+            self.pre_roll_duration = pre_roll_duration
+            self.pre_roll_bytes = pre_roll_bytes
+
+            #Shared capture pipeline and the alignment of its last recording
+            self.shared_pipeline = None
+            self.start_offsets = {}
+            self.stop_skews = {}
+
+            #Recording policy controller, the thread that starts and stops recordings in order, and the clips of the
+            #current recording
+            self.controller = None
+            self.recorder = None
+            self.clips_lock = threading.Lock()
+            self.recording_clips = []
+
+            #Cameras and times of the current recording, and the peak activity score of each camera over it
+            self.recording_cams = []
+            self.recording_name = None
+            self.recording_start = None
+            self.recording_stop = None
+            self.recording_wall_start = None
+            self.recording_wall_stop = None
+            self.recording_warm = False
+            self.recording_scores = {}
+
+            #Warm standby state. Each trigger starts a new generation, cancelling the power-off of the last one
+            self.warm = False
+            self.standby_generation = 0
 
         except ModuleNotFoundError as err:
             print("Error: %s Module Not Found. Ensure Connections Are Secure." %err.module)
@@ -132,191 +414,1923 @@ class Nano_Camera_Trap:
 
     def start(self):
         """
-        Start the camera trap.
+        Start the camera trap. Runs until interrupted.
         """
-        pass       
 
-    def start_Dual_Video_Capture(self):
-        pass
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            pass
 
-    def stop_Dual_Video_Capture(self):
-        pass
-    
+    async def run(self, clock = None):
+        """
+        Run the recording policy on the event loop, reacting to sensor edges and pipeline completion.
 
+        @param clock:               The clock the controller runs on. Defaults to the monotonic clock
+        @type clock:                Monotonic_Clock or Virtual_Clock
+        """
 
-class CSI_Module:
-    """
-    Class representing a CSI camera module.
+        policy = Recording_Policy(self.rec_min_duration, self.rec_max_duration, self.active_threshold, self.sleep_duration)
+        self.controller = Trap_Controller(policy, self, clock)
+        self.recorder = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="recorder")
 
-    @param id                   The CSI port number of the camera module
-    @type id                    int
+        os.makedirs(self.dir, exist_ok=True)
+        self.recover_Interrupted()
+        self.storage.start()
+        if self.exporter != None:
+            self.exporter.start()
+        if self.standby == None:
+            self.start_Pre_Roll()
+        self.pis.start()
 
-    @param name                 The plaintext name given to the camera module
-    @type name                  str
+        try:
+            await self.controller.run([self.forward_PIS_Events()])
+
+        finally:
+            self.pis.stop()
+            self.recorder.shutdown()
+            self.stop_Shared_Video_Capture()
+            self.stop_Pre_Roll()
+            if self.standby_stats != None and self.warm == True:
+                self.standby_stats.powered_Off(self.controller.clock.time())
+            if self.remuxer != None:
+                self.remuxer.flush()
+            if self.post_processor != None:
+                self.post_processor.close()
+            self.storage.stop()
+            if self.exporter != None:
+                self.exporter.stop()
+            for cam in self.cameras:
+                if cam.frame_tap != None:
+                    cam.frame_tap.close()
+
+    def recover_Interrupted(self):
+        """
+        Keep the segments an interrupted run left in the cameras' spool directories and the clips it left staged, before
+        the cameras overwrite them.
+        """
 
-    @param quiet                Enables the camera module's subprocess to print output to the command line
-    @type quiet                 bool
-    """
+        paths = []
+        for cam in self.cameras:
+            paths += cam.recover_Spool(self.dir)
+        paths += self.staging.recover_Staged(self.dir)
 
-    def __init__(self, id, name, quiet = False):
+        #The files of each recording are kept and deleted together
+        recordings = {}
+        for path in paths:
+            match = RECORDING_FILE_PATTERN.match(os.path.basename(path))
+            recordings.setdefault(match.group(1) if match != None else path, []).append(path)
+
+        for recording in recordings.values():
+            self.storage.add_Recording(recording, 0)
+            self.catalog.add([entry_From_File(path) for path in recording])
+
+    async def forward_PIS_Events(self):
+        """
+        Pass the sensor edges to the controller as activity changes.
         """
-        CSI_Module Constructor.
 
-        @param id                   The CSI port number of the camera module
-        @type id                    int
+        async for event in self.pis.events():
+            self.controller.post(MOTION, event.level == RISING, event.timestamp)
 
-        @param name                 The plaintext name given to the camera module
-        @type name                  str
+    def start_Recording(self, t):
+        """
+        Start a recording on every camera in the background. Called by the controller, which is told through STARTED
+        whether any camera started.
 
-        @param quiet                Enables the camera module's subprocess to print output to the command line
-        @type quiet                 bool
+        Old recordings are deleted in the background if the recording could take dir below its low space mark. While
+        space is critical, a pre-roll recording is made on the first camera only and other recordings at half resolution
+        and framerate. Nothing is recorded once dir is full. With a standby policy, cameras that are off are started
+        before the clip is triggered.
+        """
 
-        @param running              Displays True whenever the process is running (i.e. video recording)
-        @type                       bool
+        filename = time.strftime("%Y%m%d_%H%M%S")
+
+        with self.clips_lock:
+            self.recording_clips = []
+            self.recording_scores = {}
+
+        self.recording_name = filename
+        self.recording_start = t
+        self.recording_wall_start = time.time()
+        self.recording_cams = []
+
+        if self.standby != None:
+            self.standby.record_Trigger(t)
+            self.standby_generation += 1
+            self.recording_warm = self.warm
+            self.standby_stats.triggered(t, self.warm)
+
+        self.controller.loop.run_in_executor(self.recorder, self.begin_Recording, filename, t)
+
+    def begin_Recording(self, filename, t):
+        """
+        Start the cameras of a recording and post whether any started to the controller. Runs on the recorder thread.
         """
 
         try:
-            self.id = id
-            self.name = name
-            self.quiet = quiet
+            started = self.start_Cameras(filename, t)
+        except Exception as error:
+            print("Warning: recording %s could not be started: %s" %(filename, error))
+            started = False
 
-            #Empty process & Process flag
-            self.pro = None
-            self.running = False
+        self.controller.post(STARTED, started, t)
 
-            if self.is_Module_Valid() == False:
-                raise ModuleNotFoundError(self.name)
+    def start_Cameras(self, filename, t):
+        """
+        Start the cameras of a recording. Runs on the recorder thread.
 
-        except os.error as error_type:
-            raise error_type
+        @return started:            True if any camera is recording
+        @rtype started:             bool
+        """
 
-    def is_Module_Valid(self):
+        level = self.storage.prepare_Recording(self.pre_roll_duration + self.rec_max_duration)
+        if level == STORAGE_FULL:
+            print("Warning: %s is full, recording skipped" %(self.dir))
+            return False
+
+        #Stretch the remaining space with a lower bitrate until old recordings have been deleted
+        if level == STORAGE_LOW or level == STORAGE_CRITICAL:
+            self.bitrate_factor = LOW_SPACE_BITRATE_FACTOR
+        else:
+            self.bitrate_factor = 1.0
+        self.apply_Bitrate()
+
+        #Without pre-roll the cameras only see the scene once recording has started
+        if self.motion != None and self.pre_roll_duration <= 0:
+            self.motion.reset()
+            self.controller.post(CONFIRMATION, None, t)
+
+        if self.standby != None:
+            self.wake_Cameras()
+
+        if self.pre_roll_duration > 0 or self.standby != None:
+            cams = list(self.cameras)
+            if level == STORAGE_CRITICAL:
+                cams = cams[:1]
+
+            result = self.cameras.trigger_Video_Capture(os.path.join(self.dir, filename),
+                                                        self.pre_roll_duration + self.rec_max_duration, cams, t)
+            result.report()
+            self.recording_cams = result.succeeded()
+        else:
+            self.recording_cams = list(self.cameras)
+            if level == STORAGE_CRITICAL:
+                self.start_Shared_Video_Capture(filename, *downgrade_Caps(self.resolution, self.framerate))
+            else:
+                self.start_Shared_Video_Capture(filename)
+
+        return len(self.recording_cams) > 0
+
+    def set_Bitrate(self, bitrate):
         """
-        Used to determine whether the CSI module is functioning.
+        Change the bitrate of every camera, e.g. to save storage on quiet scenes. Running pipelines are changed where the
+        engine allows it, otherwise the change takes effect from the next recording. While dir is low on space the cameras
+        record at LOW_SPACE_BITRATE_FACTOR of it.
 
-        @return valid:              Value is True if module is working
-        @rtype valid:               bool
+        @param bitrate:             The bitrate in bits per second
+        @type bitrate:              int
         """
-        #TODO: Implement this
-        return True
 
-    def start_Video_Capture(self, filename, resolution, framerate):
+        self.bitrate = bitrate
+        self.apply_Bitrate()
+
+    def apply_Bitrate(self):
         """
-        Start recording an MP4 video.
+        Set the bitrate of every camera whose encoder is not already at the trap's bitrate, scaled for the space left.
         """
-        #TODO: Make this neater. Implement quiet mode.
 
-        #Shut down process if it is still running
-        if self.running == True:
-            self.stop_Video_Capture()
-            self.running = False
-            time.sleep(1)
+        bitrate = int(self.bitrate * self.bitrate_factor)
+        for cam in self.cameras:
+            if cam.encoder.bitrate != bitrate:
+                cam.set_Bitrate(bitrate)
 
-        #Generate process command
-        command = ""
+    def stop_Recording(self, t, done):
+        """
+        Stop the recording on every camera in the background and call done once every clip is complete. Called by the
+        controller. The recorder thread stops the recording once it has finished starting it.
+        """
 
-        #Select camera source
-        command += "gst-launch-1.0 nvarguscamerasrc sensor-id=%d ! " %(self.id) 
-        
-        #Set resolution and framerate
-        command += "'video/x-raw(memory:NVMM),width=%d,height=%d,framerate=%d/1,format=NV12' ! " %(resolution[0],resolution[1],framerate)
+        self.recording_stop = t
+        self.recording_wall_stop = time.time()
 
-        #Convert raw input to MP4 format
-        command += "nvv4l2h264enc ! h264parse ! mp4mux ! "
+        if self.standby != None:
+            self.schedule_Standby_End(t)
 
-        #Record video in specified output file
-        command += "filesink location=%s.mp4 -e" %(filename)
+        def stop():
+            if self.pre_roll_duration > 0 or self.standby != None:
+                self.cameras.stop_Video_Capture(self.recording_cams).report()
+            else:
+                self.stop_Shared_Video_Capture()
 
-        #Start process
-        self.running = True
-        self.pro = subprocess.Popen(command, shell=True)
-    
+            if self.standby_stats != None:
+                for cam in self.recording_cams:
+                    if cam.trigger_latency != None:
+                        self.standby_stats.recorded(cam.trigger_latency, self.recording_warm)
+            done()
+
+        self.controller.loop.run_in_executor(self.recorder, stop)
 
-    def stop_Video_Capture(self):
+    def wake_Cameras(self):
         """
-        Stop recording the MP4 video
+        Make sure the cameras are warm for a trigger, starting them if the standby has turned them off. Runs on the
+        recorder thread, after start_Recording has counted the trigger on the event loop and after any power-off of the
+        last idle window has finished.
         """
-        #TODO: Make this neater. Implement None state functionality
 
+        if self.warm == True:
+            return
 
-        name = "gst-launch-1.0 nvarguscamerasrc sensor-id=%d" %(self.id)
-        
-        #Get the process ID
-        pid = get_pid(name)
+        self.cameras.start_Pre_Roll(self.resolution, self.framerate, self.pre_roll_duration, self.pre_roll_bytes).report()
+        self.warm = True
 
-        #Terminate process
-        kill_pid(pid)
+    def schedule_Standby_End(self, t):
+        """
+        Keep the cameras warm for the idle window after a recording stopping at time t, then turn them off unless another
+        trigger has arrived.
+        """
 
-        self.running = False
+        generation = self.standby_generation
+        self.standby_stats.idle(t)
+        self.controller.clock.call_At(t + self.standby.idle_Window(t), self.end_Standby, generation)
 
-    
-    
+    def end_Standby(self, generation):
+        """
+        Turn the cameras off once an idle window has passed. Runs on the controller's clock. The cameras are stopped on
+        the recorder thread, so a trigger arriving meanwhile starts them again once they are off without holding up the
+        event loop.
+        """
 
-class PIS_Module:
+        if generation != self.standby_generation or self.warm == False:
+            return
+
+        self.warm = False
+        self.standby_stats.powered_Off(self.controller.clock.time())
+
+        self.controller.loop.run_in_executor(self.recorder, self.stop_Pre_Roll)
+
+    def commit_Recording(self, t):
+        """
+        Keep the clips of the last recording, promoting them from staging to persistent storage. Called by the
+        controller.
+        """
+
+        with self.clips_lock:
+            clips = self.recording_clips
+            self.recording_clips = []
+
+        paths = []
+        for clip in clips:
+            clip.segments = self.staging.promote(clip.segments)
+            paths += clip.segments
+
+        if len(paths) == 0:
+            return
+
+        duration = self.recording_stop - self.recording_start
+        entries = self.catalog_Entries(clips)
+
+        with self.clips_lock:
+            score = max(self.recording_scores.values(), default = UNSCORED_RECORDING_SCORE)
+
+        def kept(outputs):
+            self.storage.add_Recording(outputs, duration, score = score)
+            for entry, output in zip(entries, outputs):
+                entry.path = output
+            self.catalog.add(entries)
+            if self.post_processor != None:
+                self.post_processor.submit_Recording(outputs, self.post_jobs)
+
+        if self.remuxer != None:
+            self.remuxer.submit(paths, kept)
+        else:
+            kept(paths)
+
+    def catalog_Entries(self, clips):
+        """
+        Get the catalog entries of the promoted clips of the last recording, in the order of their segments. Each clip
+        begins its pre-roll before the trigger, and its segments are taken to share its length evenly.
+
+        @return entries:            The entries of every clip's segments
+        @rtype entries:             [Catalog_Entry]
+        """
+
+        with self.clips_lock:
+            scores = dict(self.recording_scores)
+
+        entries = []
+        for clip in clips:
+            if len(clip.segments) == 0:
+                continue
+
+            start = self.recording_wall_start - clip.pre_roll_duration
+            length = clip.duration()
+            if length <= 0:
+                length = self.recording_wall_stop - self.recording_wall_start + clip.pre_roll_duration
+            length /= len(clip.segments)
+
+            for index, path in enumerate(clip.segments):
+                entries.append(Catalog_Entry(path, self.recording_name, clip.camera, index, start + index * length,
+                                             start + (index + 1) * length, trigger = TRIGGER_PIS,
+                                             score = scores.get(clip.camera)))
+
+        return entries
+
+    def recording_Deleted(self, paths):
+        """
+        Forget the files of a recording deleted by retention, and delete the files derived from them. Called on the
+        retention thread.
+        """
+
+        self.catalog.remove(paths)
+        if self.post_processor != None:
+            self.post_processor.remove_Derived(paths)
+
+    def is_Recording(self):
+        """
+        Return True while any camera is recording.
+        """
+
+        return any(cam.running == True for cam in self.cameras)
+
+    def discard_Recording(self, t):
+        """
+        Delete the clips of the last recording from staging. Called by the controller.
+        """
+
+        with self.clips_lock:
+            clips = self.recording_clips
+            self.recording_clips = []
+
+        for clip in clips:
+            self.staging.drop(clip.segments)
+
+    def motion_Scored(self, cam, score, timestamp):
+        """
+        Pass a change in the cameras' confirmation of activity to the controller. Called for every analysed frame.
+        """
+
+        with self.clips_lock:
+            self.recording_scores[cam.name] = max(score, self.recording_scores.get(cam.name, score))
+
+        if self.motion.update(cam.name, score, timestamp) == True and self.controller != None:
+            self.controller.post(CONFIRMATION, self.motion.state, timestamp)
+
+    def clip_Completed(self, clip):
+        """
+        Collect the clips of the current recording as the cameras complete them.
+        """
+
+        with self.clips_lock:
+            self.recording_clips.append(clip)
+
+    def start_Pre_Roll(self):
+        """
+        Start buffering pre-roll video on every camera. Does nothing if pre-roll is disabled.
+        """
+
+        if self.pre_roll_duration <= 0:
+            return
+
+        self.cameras.start_Pre_Roll(self.resolution, self.framerate, self.pre_roll_duration, self.pre_roll_bytes).report()
+
+    def stop_Pre_Roll(self):
+        """
+        Stop buffering pre-roll video on every camera.
+        """
+
+        self.cameras.stop_Pre_Roll().report()
+
+    def start_Shared_Video_Capture(self, filename, resolution = None, framerate = None):
+        """
+        Start recording on every camera from a single pipeline. The sensors share the pipeline clock and start together,
+        and each clip's start_time records its camera's start on that clock. A single process is launched however many
+        cameras there are.
+
+        @param filename:            The name of the recording. Each camera's clip is named <filename>_<camera name>
+        @type filename:             str
+
+        @param resolution:          The resolution of the video as (width,height) of pixels. Defaults to the trap's
+        @type resolution:           (int,int)
+
+        @param framerate:           The framerate of the video. Defaults to the trap's
+        @type framerate:            int
+        """
+
+        cams = list(self.cameras)
+
+        if resolution == None:
+            resolution = self.resolution
+        if framerate == None:
+            framerate = self.framerate
+
+        if self.shared_pipeline != None:
+            self.stop_Shared_Video_Capture()
+
+        running = [cam for cam in cams if cam.running == True]
+        if len(running) > 0:
+            self.cameras.stop_Video_Capture(running).report()
+
+        caps = (tuple(resolution), framerate)
+        for cam in cams:
+            cam.prepare_Capture("%s_%s" %(os.path.join(self.dir, filename), cam.name), caps)
+
+        #Generate pipeline description with one branch per camera
+        description = " ".join(cam.video_Pipeline(resolution, framerate) for cam in cams)
+
+        data_callbacks = {}
+        for cam in cams:
+            data_callbacks.update(cam.analysis_Callbacks())
+            data_callbacks.update(cam.tap_Callbacks())
+
+        pipeline = cams[0].engine.launch(description, "shared", self.dispatch_Shared_Message, data_callbacks,
+                                         quiet = all(cam.quiet for cam in cams))
+        pipeline.add_Finish_Callback(self.finish_Shared_Clips)
+
+        for cam in cams:
+            cam.pipeline = pipeline
+            cam.metrics.start(pipeline, framerate, shared = True)
+
+        self.shared_pipeline = pipeline
+
+    def dispatch_Shared_Message(self, element, name, fields):
+        """
+        Pass a message of the shared capture pipeline to every camera.
+        """
+
+        for cam in self.cameras:
+            cam.handle_Message(element, name, fields)
+
+    def finish_Shared_Clips(self, pipeline):
+        """
+        Complete every camera's clips once the shared capture pipeline has finished.
+        """
+
+        for cam in self.cameras:
+            cam.finish_Clips()
+
+    def rotate_Shared_Video_Capture(self, filename):
+        """
+        Switch every camera to a new recording at its next segment boundary without restarting the pipeline.
+
+        @param filename:            The name of the new recording
+        @type filename:             str
+        """
+
+        self.cameras.rotate_Video_Capture(os.path.join(self.dir, filename)).report()
+
+    def stop_Shared_Video_Capture(self, timeout = None):
+        """
+        Stop recording on every camera. A single EOS reaches every branch of the shared pipeline at once.
+
+        @param timeout:             The time in seconds given for EOS to finish before the pipeline is killed. Defaults
+                                    to the stop timeout of the container
+        @type timeout:              float
+
+        @return skew:               (start_offsets, stop_skews) of each camera relative to the first camera in seconds,
+                                    None where unknown. None if no shared capture was running
+        @rtype skew:                ({str:float},{str:float})
+        """
+
+        if self.shared_pipeline == None:
+            return None
+
+        if timeout == None:
+            timeout = stop_Timeout(self.container)
+
+        self.shared_pipeline.stop(timeout)
+        self.shared_pipeline = None
+
+        cams = list(self.cameras)
+        for cam in cams:
+            cam.running = False
+
+        self.start_offsets = {cam.name: running_Time_Difference(cams[0].first_running_time, cam.first_running_time)
+                              for cam in cams[1:]}
+        self.stop_skews = {cam.name: running_Time_Difference(cams[0].last_running_time, cam.last_running_time)
+                           for cam in cams[1:]}
+
+        return self.start_offsets, self.stop_skews
+
+    def start_Dual_Video_Capture(self, filename, resolution = None, framerate = None):
+        """
+        Start recording on every camera from a single pipeline. Kept for callers of the two camera trap, see
+        start_Shared_Video_Capture.
+        """
+
+        self.start_Shared_Video_Capture(filename, resolution, framerate)
+
+    def rotate_Dual_Video_Capture(self, filename):
+        """
+        Switch every camera to a new recording. Kept for callers of the two camera trap, see rotate_Shared_Video_Capture.
+        """
+
+        self.rotate_Shared_Video_Capture(filename)
+
+    def stop_Dual_Video_Capture(self, timeout = None):
+        """
+        Stop recording on every camera. Kept for callers of the two camera trap, see stop_Shared_Video_Capture.
+
+        @return skew:               (start_offset, stop_skew) of the second camera relative to the first in seconds, None
+                                    if unknown. None if no shared capture was running
+        @rtype skew:                (float,float)
+        """
+
+        skew = self.stop_Shared_Video_Capture(timeout)
+        if skew == None:
+            return None
+
+        cams = list(self.cameras)
+        if len(cams) < 2:
+            return None, None
+
+        start_offsets, stop_skews = skew
+        return start_offsets.get(cams[1].name), stop_skews.get(cams[1].name)
+
+
+
+class CSI_Module:
     """
-    Class representing a PIS Sensor module.
+    Class representing a CSI camera module.
+
+    @param id                   The CSI port number of the camera module
+    @type id                    int
 
     @param name                 The plaintext name given to the camera module
     @type name                  str
 
     @param quiet                Enables the camera module's subprocess to print output to the command line
     @type quiet                 bool
-    """
 
-    def __init__(self):
-        """
-        PIS_Module Constructor.
+    @param segment_duration     The length in seconds of each recorded segment
+    @type segment_duration      float
 
-        @param name                 The plaintext name given to the camera module
-        @type name                  str
+    @param max_duration         The maximum length in seconds of a clip before it is rotated automatically. None disables
+                                automatic rotation
+    @type max_duration          float
 
-        @param quiet                Enables the camera module's subprocess to print output to the command line
-        @type quiet                 bool
-        """
+    @param spool_dir            The directory into which in-progress segments are written
+    @type spool_dir             str
 
-        pass
+    @param clip_callback        Function called with the finished Video_Clip whenever a clip is completed
+    @type clip_callback         function
 
-    pass
+    @param engine               The engine that runs the camera module's pipelines
+    @type engine                Gst_Engine or Subprocess_Engine
 
-#------------------------------------------------------------------------------------------------------------------------------------
-#   Global Funtion Definitions
-#------------------------------------------------------------------------------------------------------------------------------------
+    @param staging              The area in which finished segments are held until promoted. None writes them in place
+    @type staging               Staging_Area
 
-def get_pid(name):
-    command = "pgrep -f '^%s'" %name
-    pro = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = pro.communicate()
+    @param motion_callback      Function called with (camera module, score, time) for each analysed frame. None disables
+                                the analysis branch
+    @type motion_callback       function
 
-    return int(out)
+    @param analysis_resolution  The resolution of the greyscale frames analysed as (width,height) of pixels
+    @type analysis_resolution   (int,int)
 
-def kill_pid(pid):
-    command = "kill -2 %d" %pid
-    pro = subprocess.Popen(command, shell=True)
+    @param metrics              The measurements of the camera's current pipeline
+    @type metrics               Pipeline_Metrics
 
-def system_Check():
-    pass
+    @param container            The container the camera records in
+    @type container             str
 
-def test():
-    cam_1 = CSI_Module(0, "cam_1")
-    cam_2 = CSI_Module(1, "cam_2")
+    @param fragment_duration    The length in seconds of each fragment of a fragmented container
+    @type fragment_duration     float
+
+    @param mode_cache           The probed sensor modes that captures are resolved against
+    @type mode_cache            Sensor_Mode_Cache
 
-    cam_1.start_Video_Capture("bin/vid_test_1", (1280, 720), 30)
-    cam_2.start_Video_Capture("bin/vid_test_2", (1280, 720), 30)
+    @param frame_tap            The shared memory ring through which the live frames are published to other local
+                                processes. None if the frames are not published
+    @type frame_tap             Frame_Tap
 
-    print("Started recording vid 1 & 2")
+    @param encoder              The settings of the camera's video encoder
+    @type encoder               Encoder_Profile
+    """
+
+    def __init__(self, id, name, quiet = False, segment_duration = DEFAULT_SEGMENT_DURATION, max_duration = None,
+                 spool_dir = None, clip_callback = None, engine = None, staging = None, motion_callback = None,
+                 analysis_resolution = DEFAULT_ANALYSIS_RESOLUTION, container = DEFAULT_CONTAINER,
+                 fragment_duration = DEFAULT_FRAGMENT_DURATION, mode_cache = None, tap_resolution = None,
+                 tap_format = DEFAULT_TAP_FORMAT, encoder = None):
+        """
+        CSI_Module Constructor.
+
+        @param id                   The CSI port number of the camera module
+        @type id                    int
+
+        @param name                 The plaintext name given to the camera module
+        @type name                  str
+
+        @param quiet                Enables the camera module's subprocess to print output to the command line
+        @type quiet                 bool
+
+        @param running              Displays True whenever the process is running (i.e. video recording)
+        @type                       bool
+
+        @param segment_duration     The length in seconds of each recorded segment
+        @type segment_duration      float
+
+        @param max_duration         The maximum length in seconds of a clip before it is rotated automatically
+        @type max_duration          float
+
+        @param spool_dir            The directory into which in-progress segments are written
+        @type spool_dir             str
+
+        @param clip_callback        Function called with the finished Video_Clip whenever a clip is completed
+        @type clip_callback         function
+
+        @param engine               The engine that runs the camera module's pipelines. Defaults to the shared one
+        @type engine                Gst_Engine or Subprocess_Engine
+
+        @param staging              The area in which finished segments are held until promoted. Its RAM directory
+                                    also holds the in-progress segments unless spool_dir is given
+        @type staging               Staging_Area
+
+        @param motion_callback      Function called with (camera module, score, time) for each analysed frame
+        @type motion_callback       function
+
+        @param analysis_resolution  The resolution of the greyscale frames analysed as (width,height) of pixels
+        @type analysis_resolution   (int,int)
+
+        @param container            The container the camera records in, CONTAINER_MP4, CONTAINER_FRAGMENTED_MP4 or
+                                    CONTAINER_MATROSKA
+        @type container             str
+
+        @param fragment_duration    The length in seconds of each fragment of a fragmented container
+        @type fragment_duration     float
+
+        @param mode_cache           The probed sensor modes that captures are resolved against. Defaults to the shared cache
+        @type mode_cache            Sensor_Mode_Cache
+
+        @param tap_resolution       The resolution as (width,height) of pixels at which the live frames are published in
+                                    the frame tap named tap_Name(name). None publishes no frames
+        @type tap_resolution        (int,int)
+
+        @param tap_format           The raw pixel format of the published frames
+        @type tap_format            str
+
+        @param encoder              The settings of the camera's video encoder. Defaults to DEFAULT_ENCODER_PROFILE. The
+                                    pre-roll ring only parses H.264
+        @type encoder               Encoder_Profile
+        """
+
+        try:
+            self.id = id
+            self.name = name
+            self.quiet = quiet
+            self.segment_duration = segment_duration
+            self.max_duration = max_duration
+            self.clip_callback = clip_callback
+            self.staging = staging
+            self.motion_callback = motion_callback
+            self.analysis_resolution = analysis_resolution
+            self.container = container
+            self.fragment_duration = fragment_duration
+            self.extension = extension(container)
+
+            #A crash-safe recording is only recoverable after a power loss if it is written to persistent storage, so its
+            #segments and clips bypass the RAM staging
+            self.persistent = is_Fragmented(container)
+
+            if mode_cache == None:
+                mode_cache = get_Sensor_Mode_Cache()
+            self.mode_cache = mode_cache
+
+            if encoder == None:
+                encoder = DEFAULT_ENCODER_PROFILE
+            self.encoder = encoder
+
+            if spool_dir == None and staging != None:
+                spool_dir = staging.spool_Dir(name, self.persistent)
+            elif spool_dir == None:
+                spool_dir = os.path.join(DEFAULT_SPOOL_DIR, name)
+            self.spool_dir = spool_dir
+
+            if engine == None:
+                engine = get_Engine()
+            self.engine = engine
+
+            #Empty pipeline & Process flag
+            self.pipeline = None
+            self.running = False
+            self.caps = None
+
+            #Clip bookkeeping, shared between the caller and the pipeline's message thread
+            self.lock = threading.Lock()
+            self.clip = None
+            self.pending_clip = None
+            self.open_segments = {}
+
+            #Running times of the first segment start and last segment end of the current pipeline
+            self.first_running_time = None
+            self.last_running_time = None
+
+            #Pre-roll pipeline, buffer and the writer pipeline of the triggered clip
+            self.pre_roll_pipeline = None
+            self.pre_roll = None
+            self.writer = None
+            self.writer_feed = None
+            self.writer_clip = None
+            self.writer_location = None
+            self.writer_frame_count = 0
+            self.writer_started = False
+            self.trigger_time = None
+            self.trigger_latency = None
+
+            #Motion analysis of the low resolution branch
+            self.motion_detector = None
+            self.frame_reader = None
+            if motion_callback != None:
+                self.motion_detector = Motion_Detector(*analysis_resolution)
+                self.frame_reader = Frame_Reader(self.motion_detector.frame_size)
+
+            #Frame tap of the raw branch published to other processes
+            self.frame_tap = None
+            self.tap_reader = None
+            if tap_resolution != None:
+                self.frame_tap = Frame_Tap(tap_Name(name), tap_resolution[0], tap_resolution[1], tap_format)
+                self.tap_reader = Frame_Reader(self.frame_tap.frame_size)
+
+            #Bytes of the segments closed so far, for measuring the growth of the output
+            self.closed_bytes = 0
+            self.metrics = Pipeline_Metrics(name, self.written_Bytes)
+
+            if self.is_Module_Valid() == False:
+                raise ModuleNotFoundError(self.name)
+
+        except os.error as error_type:
+            raise error_type
+
+    def is_Module_Valid(self):
+        """
+        Used to determine whether the CSI module is functioning.
+
+        @return valid:              Value is True if module is working
+        @rtype valid:               bool
+        """
+        #TODO: Implement this
+        return True
+
+    def written_Bytes(self):
+        """
+        Get the number of bytes written to this camera's output files so far.
+
+        @return written:            The size of the closed segments plus the current size of the open segments and of
+                                    the triggered clip
+        @rtype written:             int
+        """
+
+        with self.lock:
+            paths = list(self.open_segments.keys())
+            if self.writer_location != None:
+                paths.append(self.writer_location)
+            written = self.closed_bytes
+
+        for path in paths:
+            try:
+                written += os.path.getsize(path)
+            except OSError:
+                pass
+
+        return written
+
+    def segment_Location(self):
+        """
+        Get the splitmuxsink location pattern for this camera's in-progress segments.
+
+        @return location:           printf style location pattern
+        @rtype location:            str
+        """
+
+        return os.path.join(self.spool_dir, "%s_%%05d%s" %(self.name, self.extension))
+
+    def recover_Spool(self, dir):
+        """
+        Move the segments an interrupted run left in the spool directory into dir, each truncated back to its last
+        complete fragment. They are named as the segments of a recording at the time of the first of them, prefixed with
+        recovered_, so that the segments of different runs do not overwrite each other. Segments that cannot be recovered
+        are moved as they are. Must be called before the camera starts recording.
+
+        @param dir:                 The directory into which the segments are moved
+        @type dir:                  str
+
+        @return paths:              The moved segments
+        @rtype paths:               [str]
+        """
+
+        if os.path.isdir(self.spool_dir) == False:
+            return []
+
+        names = [name for name in sorted(os.listdir(self.spool_dir)) if os.path.isfile(os.path.join(self.spool_dir, name))]
+        if len(names) == 0:
+            return []
+
+        first = os.path.join(self.spool_dir, names[0])
+        recording = time.strftime(RECORDING_TIME_FORMAT, time.localtime(os.path.getmtime(first)))
+
+        paths = []
+        for index, name in enumerate(names):
+            path = os.path.join(self.spool_dir, name)
+
+            try:
+                recover(path)
+            except Container_Error as error:
+                print("Warning: %s" %(error))
+            except OSError as error:
+                print("Warning: %s could not be recovered: %s" %(path, error))
+
+            destination = os.path.join(dir, "recovered_%s_%s_%03d%s" %(recording, self.name, index,
+                                                                        os.path.splitext(name)[1]))
+            shutil.move(path, destination)
+            paths.append(destination)
+
+        return paths
+
+    def capture_Mode(self, resolution, framerate):
+        """
+        Resolve a capture against this camera's native sensor modes.
+
+        @return capture:            The native mode and scaling of the capture
+        @rtype capture:             Capture_Mode
+
+        @raise Sensor_Mode_Error:   If no sensor mode can satisfy the capture
+        """
+
+        return self.mode_cache.resolve(self.id, resolution, framerate)
+
+    def camera_Source(self, resolution, framerate):
+        """
+        Start a pipeline from this camera's source, split by a tee when the stream is analysed. The analysis and tap
+        branches are taken from the tee.
+
+        @return builder:            The pipeline, ending in a link to the main branch
+        @rtype builder:             Pipeline_Builder
+        """
+
+        #Select camera source in the cheapest native mode, scaled to the resolution in hardware
+        builder = Pipeline_Builder(self.engine).source(self.capture_Mode(resolution, framerate))
+
+        if self.motion_detector != None or self.frame_tap != None:
+            builder.tee("tee_%s" %(self.name))
+
+        return builder.branch(self.analysis_Branch()).branch(self.tap_Branch())
+
+    def analysis_Branch(self):
+        """
+        Get the GStreamer pipeline description of the low resolution greyscale branch handed to the motion detector. The
+        branch drops frames rather than hold up recording if analysis falls behind.
+
+        @return pipeline:           The pipeline description, empty if the stream is not analysed
+        @rtype pipeline:            str
+        """
+
+        if self.motion_detector == None:
+            return ""
+
+        pipeline = " tee_%s. ! queue leaky=downstream max-size-buffers=1 ! nvvidconv ! " %(self.name)
+        pipeline += "'video/x-raw,format=GRAY8,width=%d,height=%d' ! " %(self.analysis_resolution)
+        pipeline += self.engine.data_Sink("analysis_%s" %(self.name))
+
+        return pipeline
+
+    def analysis_Callbacks(self):
+        """
+        Get the data callbacks of the analysis branch, keyed by data sink name.
+        """
+
+        if self.motion_detector == None:
+            return {}
+
+        self.motion_detector.reset()
+        self.frame_reader = Frame_Reader(self.motion_detector.frame_size)
+        return {"analysis_%s" %(self.name): self.read_Analysis}
+
+    def read_Analysis(self, data):
+        """
+        Score the newest complete frame of the analysis branch and pass the score to the motion callback. Older frames
+        that arrive together are skipped so that analysis never falls behind the camera.
+        """
+
+        frames = self.frame_reader.push(data)
+        if len(frames) == 0:
+            return
+
+        score = self.motion_detector.score(frames[-1])
+        if score == None:
+            return
+
+        self.motion_callback(self, score, time.monotonic())
+
+    def tap_Branch(self):
+        """
+        Get the GStreamer pipeline description of the raw branch published in the frame tap. Like the analysis branch, it
+        drops frames rather than hold up recording.
+
+        @return pipeline:           The pipeline description, empty if no frames are published
+        @rtype pipeline:            str
+        """
+
+        if self.frame_tap == None:
+            return ""
+
+        pipeline = " tee_%s. ! queue leaky=downstream max-size-buffers=1 ! nvvidconv ! " %(self.name)
+        pipeline += "'video/x-raw,format=%s,width=%d,height=%d' ! " %(self.frame_tap.format, self.frame_tap.width,
+                                                                      self.frame_tap.height)
+        pipeline += self.engine.data_Sink("tap_%s" %(self.name))
+
+        return pipeline
+
+    def tap_Callbacks(self):
+        """
+        Get the data callbacks of the frame tap branch, keyed by data sink name.
+        """
+
+        if self.frame_tap == None:
+            return {}
+
+        self.tap_reader = Frame_Reader(self.frame_tap.frame_size)
+        return {"tap_%s" %(self.name): self.read_Tap}
+
+    def read_Tap(self, data):
+        """
+        Publish each complete frame of the frame tap branch. Readers that fall behind skip to the newest frame.
+        """
+
+        for frame in self.tap_reader.push(data):
+            self.frame_tap.publish(frame)
+
+    def video_Pipeline(self, resolution, framerate):
+        """
+        Get the GStreamer pipeline description of this camera's segmented recording branch.
+
+        @param resolution:          The resolution of the video as (width,height) of pixels
+        @type resolution:           (int,int)
+
+        @param framerate:           The framerate of the video
+        @type framerate:            int
+
+        @return pipeline:           The pipeline description
+        @rtype pipeline:            str
+        """
+
+        #Select camera source
+        builder = self.camera_Source(resolution, framerate)
+
+        #Encode raw input, measuring each encoded frame
+        builder.encode(self.encoder, self.name).meter(self.name)
+
+        #Split the stream into segments in the camera's container, forcing a keyframe at each boundary
+        builder.split_Sink("splitmux_%s" %(self.name), self.container, self.fragment_duration, self.segment_duration,
+                           self.segment_Location())
+
+        return builder.build()
+
+    def set_Bitrate(self, bitrate):
+        """
+        Change the bitrate of the camera's video. The running pipeline is changed where the engine allows it, otherwise
+        the change takes effect from the next pipeline.
+
+        @param bitrate:             The bitrate in bits per second
+        @type bitrate:              int
+
+        @return live:               True if the running pipeline was changed
+        @rtype live:                bool
+        """
+
+        self.encoder = self.encoder.with_Bitrate(bitrate)
+
+        pipeline = self.pre_roll_pipeline or self.pipeline
+        if pipeline == None or pipeline.supports_Control == False or pipeline.is_Running() == False:
+            return False
+
+        pipeline.set_Property(encoder_Name(self.name), "bitrate",
+                              self.encoder.bitrate_Property(self.encoder.is_Software(self.engine)))
+        return True
+
+    def start_Video_Capture(self, filename, resolution, framerate):
+        """
+        Start recording a video. If the camera is already recording with the same settings, the current clip
+        is ended at the next segment boundary and recording continues into the new clip without restarting the
+        pipeline. If pre-roll is running, the clip is triggered from the pre-roll ring instead.
+
+        @param filename:            The name of the clip. Segments are written as <filename>_<n> with the container's
+                                    extension
+        @type filename:             str
+
+        @param resolution:          The resolution of the video as (width,height) of pixels
+        @type resolution:           (int,int)
+
+        @param framerate:           The framerate of the video
+        @type framerate:            int
+        """
+
+        caps = (tuple(resolution), framerate)
+
+        #The camera is already encoding into the pre-roll ring
+        if self.pre_roll_pipeline != None:
+            self.trigger_Video_Capture(filename)
+            return
+
+        if self.running == True:
+
+            #Keep the pipeline alive and switch clips at the next segment boundary
+            if self.caps == caps:
+                self.rotate_Video_Capture(filename)
+                return
+
+            #Settings changed, so the pipeline has to be rebuilt
+            self.stop_Video_Capture()
+
+        self.prepare_Capture(filename, caps)
+
+        #Start pipeline
+        data_callbacks = self.analysis_Callbacks()
+        data_callbacks.update(self.tap_Callbacks())
+
+        self.pipeline = self.engine.launch(self.video_Pipeline(resolution, framerate), self.name, self.handle_Message,
+                                           data_callbacks, quiet = self.quiet)
+        self.pipeline.add_Finish_Callback(lambda pipeline: self.finish_Clips())
+        self.metrics.start(self.pipeline, framerate)
+
+    def prepare_Capture(self, filename, caps):
+        """
+        Reset the clip bookkeeping before a recording pipeline that includes this camera is started.
+
+        @param filename:            The name of the first clip
+        @type filename:             str
+
+        @param caps:                The ((width,height), framerate) of the recording
+        @type caps:                 ((int,int),int)
+        """
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        with self.lock:
+            self.clip = None
+            self.pending_clip = Video_Clip(filename, staging = self.staging, extension = self.extension, camera = self.name,
+                                           persistent = self.persistent)
+            self.open_segments = {}
+            self.first_running_time = None
+            self.last_running_time = None
+
+        self.running = True
+        self.caps = caps
+
+    def rotate_Video_Capture(self, filename):
+        """
+        End the current clip and continue recording into a new clip. The split happens immediately where the engine
+        supports action signals, otherwise at the next segment boundary.
+
+        @param filename:            The name of the new clip
+        @type filename:             str
+        """
+
+        with self.lock:
+            self.pending_clip = Video_Clip(filename, staging = self.staging, extension = self.extension, camera = self.name,
+                                           persistent = self.persistent)
+
+        if self.pipeline != None and self.pipeline.supports_Control == True:
+            self.pipeline.emit("splitmux_%s" %(self.name), "split-now")
+
+    def stop_Video_Capture(self, timeout = None):
+        """
+        Stop recording the video. Returns once the pipeline has exited and its last clip has been completed. If the
+        camera is part of a shared capture, the shared pipeline is stopped.
+
+        @param timeout:             The time in seconds given for EOS to finish before the pipeline is killed. Defaults
+                                    to the stop timeout of the container
+        @type timeout:              float
+        """
+
+        if timeout == None:
+            timeout = stop_Timeout(self.container)
+
+        #In pre-roll mode only the triggered clip ends, the camera keeps buffering
+        if self.pre_roll_pipeline != None:
+            writer = self.end_Triggered_Capture()
+            if writer != None:
+                writer.wait()
+            return
+
+        if self.pipeline == None:
+            self.running = False
+            return
+
+        self.pipeline.stop(timeout)
+
+        self.running = False
+
+    def pre_Roll_Pipeline(self, resolution, framerate):
+        """
+        Get the GStreamer pipeline description that hands this camera's encoded H.264 stream to the pre-roll ring.
+
+        @param resolution:          The resolution of the video as (width,height) of pixels
+        @type resolution:           (int,int)
+
+        @param framerate:           The framerate of the video
+        @type framerate:            int
+
+        @return pipeline:           The pipeline description
+        @rtype pipeline:            str
+        """
+
+        if self.encoder.codec != CODEC_H264:
+            raise ValueError("Pre-roll of %s needs an H.264 encoder, not %s" %(self.name, self.encoder.codec))
+
+        #Encode with one second GOPs unless the profile sets its own, and parameter sets repeated on every keyframe
+        encoder = self.encoder
+        if encoder.iframe_interval == None:
+            encoder = encoder.with_Iframe_Interval(framerate)
+
+        #Hand the encoded stream to the camera module
+        return self.camera_Source(resolution, framerate).encode(encoder, self.name, stream = True).data_Sink().build()
+
+    def start_Pre_Roll(self, resolution, framerate, duration = DEFAULT_PRE_ROLL_DURATION, max_bytes = DEFAULT_PRE_ROLL_BYTES):
+        """
+        Start encoding video into an in-memory ring so that the next triggered clip includes the seconds before the
+        trigger.
+
+        @param resolution:          The resolution of the video as (width,height) of pixels
+        @type resolution:           (int,int)
+
+        @param framerate:           The framerate of the video
+        @type framerate:            int
+
+        @param duration:            The length of video in seconds to keep in the ring
+        @type duration:             float
+
+        @param max_bytes:           The maximum number of bytes to keep in the ring
+        @type max_bytes:            int
+        """
+
+        if self.pre_roll_pipeline != None:
+            self.stop_Pre_Roll()
+
+        #The sensor can only be opened by one pipeline
+        elif self.running == True:
+            self.stop_Video_Capture()
+
+        self.pre_roll = Pre_Roll_Buffer(duration, max_bytes, framerate)
+        self.caps = (tuple(resolution), framerate)
+
+        parser = H264_Parser()
+        ring = self.pre_roll
+
+        data_callbacks = self.analysis_Callbacks()
+        data_callbacks.update(self.tap_Callbacks())
+        data_callbacks[DATA_SINK_NAME] = lambda data: self.read_Pre_Roll(data, parser, ring)
+
+        self.pre_roll_pipeline = self.engine.launch(self.pre_Roll_Pipeline(resolution, framerate), self.name,
+                                                    data_callback = data_callbacks, quiet = self.quiet)
+        self.metrics.start(self.pre_roll_pipeline, framerate)
+
+    def stop_Pre_Roll(self, timeout = DEFAULT_EOS_TIMEOUT):
+        """
+        Stop the pre-roll pipeline, ending any triggered clip.
+
+        @param timeout:             The time in seconds given for EOS to finish before the pipeline is killed
+        @type timeout:              float
+        """
+
+        if self.pre_roll_pipeline == None:
+            return
+
+        self.pre_roll_pipeline.stop(timeout)
+        self.pre_roll_pipeline = None
+        self.end_Triggered_Capture()
+
+    def trigger_Video_Capture(self, filename, expected_duration = None, trigger_time = None):
+        """
+        Start writing a clip that begins with the buffered pre-roll video and continues with the live stream. The time
+        from the trigger to the clip's first frame is kept in trigger_latency.
+
+        @param filename:            The name of the clip. The video is written as <filename>_000 with the container's
+                                    extension
+        @type filename:             str
+
+        @param expected_duration:   The longest the clip is expected to run in seconds, used in reserving staging space
+        @type expected_duration:    float
+
+        @param trigger_time:        The time.monotonic() time of the trigger. Defaults to now
+        @type trigger_time:         float
+        """
+
+        if trigger_time == None:
+            trigger_time = time.monotonic()
+
+        if self.pre_roll_pipeline == None:
+            raise RuntimeError("Pre-roll is not running on %s" %(self.name))
+
+        clip = Video_Clip(filename, staging = self.staging, extension = self.extension, camera = self.name,
+                          persistent = self.persistent)
+        location = clip.segment_Path(0)
+
+        #The writer streams into a single file, so staging space for the whole clip is reserved up front
+        if self.staging != None:
+            if expected_duration == None:
+                expected_duration = self.max_duration or self.segment_duration
+            location = self.staging.location(location, int(expected_duration * self.encoder.bitrate / 8), self.persistent)
+
+        directory = os.path.dirname(location)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        #Generate pipeline description. The byte stream carries no timestamps, so the framerate is given in the caps
+        description = Pipeline_Builder(self.engine).data_Source().parse(self.encoder, self.caps[1]) \
+                      .mux(self.container, self.fragment_duration).file_Sink(location).build()
+
+        writer = self.engine.launch(description, "%s-writer" %(self.name), data_input = True, quiet = self.quiet)
+
+        #The writer is fed on its own thread, so that a slow writer never holds the lock the pre-roll stream is read under
+        feed = queue.Queue()
+        threading.Thread(target=self.feed_Writer, args=(writer, feed), name="%s-feed" %(self.name), daemon=True).start()
+
+        with self.lock:
+            self.end_Triggered_Capture(locked = True)
+
+            clip.pre_roll_duration = self.pre_roll.buffered_Duration()
+            clip.start_time = 0
+            self.writer = writer
+            self.writer_feed = feed
+            self.writer_clip = clip
+            self.writer_location = location
+            self.writer_frame_count = 0
+            self.writer_started = False
+            self.trigger_time = trigger_time
+            self.trigger_latency = None
+
+            for unit in self.pre_roll.flush():
+                self.write_Access_Unit(unit)
+
+            self.running = True
+
+    def end_Triggered_Capture(self, locked = False):
+        """
+        Finish the triggered clip, if any, leaving the pre-roll pipeline running.
+
+        @return writer:             The writer pipeline of the clip, which finishes in the background. None if no clip was
+                                    triggered
+        @rtype writer:              Pipeline
+        """
+
+        if locked == False:
+            with self.lock:
+                return self.end_Triggered_Capture(locked = True)
+
+        if self.writer == None:
+            return None
+
+        writer = self.writer
+        clip = self.writer_clip
+        location = self.writer_location
+        clip.end_time = int(self.writer_frame_count * 1e9 / self.caps[1])
+        self.writer = None
+        self.writer_clip = None
+        self.writer_location = None
+
+        #Ending the writer's input, once the queued video has been written, sends EOS through it so that the muxer can
+        #finalise the file. The camera counts as recording until it has
+        writer.add_Finish_Callback(lambda writer: self.finish_Triggered_Clip(clip, location))
+        self.writer_feed.put(None)
+        self.writer_feed = None
+
+        return writer
+
+    def finish_Triggered_Clip(self, clip, location):
+        """
+        Complete a triggered clip once its writer has exited. The camera stops counting as recording unless another
+        clip has been triggered since.
+        """
+
+        if self.staging != None:
+            self.staging.update(location)
+
+        try:
+            size = os.path.getsize(location)
+        except OSError:
+            size = 0
+
+        with self.lock:
+            self.closed_bytes += size
+
+        clip.segments.append(location)
+        clip.closing = True
+        self.finish_Clip(clip)
+
+        with self.lock:
+            if self.writer == None:
+                self.running = False
+
+    def write_Access_Unit(self, unit):
+        """
+        Queue an access unit for the triggered clip's writer. Must be called with the lock held.
+        """
+
+        #The clip has to begin on a keyframe
+        if self.writer_started == False:
+            if unit.keyframe == False:
+                return
+            self.writer_started = True
+            self.trigger_latency = time.monotonic() - self.trigger_time
+
+        self.writer_feed.put(unit.data)
+        self.writer_frame_count += 1
+
+    def feed_Writer(self, writer, feed):
+        """
+        Write the queued video of a triggered clip to its writer until the clip ends, then stop the writer. Runs on a
+        thread of its own for each clip.
+
+        @param writer:              The writer pipeline of the clip
+        @type writer:               Pipeline
+
+        @param feed:                The queued access units, ending in None
+        @type feed:                 Queue
+        """
+
+        while True:
+            data = feed.get()
+            if data == None:
+                break
+            writer.push_Data(data)
+
+        writer.stop(stop_Timeout(self.container))
+
+    def read_Pre_Roll(self, data, parser, ring):
+        """
+        Split encoded data from the pre-roll pipeline into access units, passing each one to the ring or, while a clip
+        is triggered, to the clip's writer.
+
+        @param data:                The next chunk of the encoded stream
+        @type data:                 bytes
+
+        @param parser:              The parser of the pre-roll pipeline's stream
+        @type parser:               H264_Parser
+
+        @param ring:                The ring that buffers the stream between clips
+        @type ring:                 Pre_Roll_Buffer
+        """
+
+        for unit in parser.push(data):
+            self.metrics.on_Frame(len(unit.data))
+
+            with self.lock:
+                if self.writer != None:
+                    self.write_Access_Unit(unit)
+                    continue
+
+            ring.push(unit)
+
+    def handle_Message(self, element, name, fields):
+        """
+        Update the clip bookkeeping from a splitmuxsink element message.
+
+        @param element:             The name of the element which posted the message
+        @type element:              str
+
+        @param name:                The name of the message structure
+        @type name:                 str
+
+        @param fields:              The fields of the message structure
+        @type fields:               dict
+        """
+
+        self.metrics.handle_Message(element, name, fields)
+
+        if element != "splitmux_%s" %(self.name):
+            return
+
+        finished = []
+
+        with self.lock:
+
+            if name == "splitmuxsink-fragment-opened":
+                previous = self.clip
+
+                if self.pending_clip != None:
+                    self.clip = self.pending_clip
+                    self.pending_clip = None
+                elif self.clip.is_Expired(fields["running-time"], self.max_duration):
+                    self.clip = self.clip.rollover()
+
+                if previous != None and previous != self.clip:
+                    previous.closing = True
+                    if previous.open_count == 0:
+                        finished.append(previous)
+
+                self.clip.open_Segment(fields["running-time"])
+                self.open_segments[fields["location"]] = self.clip
+
+                if self.first_running_time == None:
+                    self.first_running_time = fields["running-time"]
+
+            elif name == "splitmuxsink-fragment-closed":
+                clip = self.open_segments.pop(fields["location"], None)
+                if clip == None:
+                    return
+
+                try:
+                    self.closed_bytes += os.path.getsize(fields["location"])
+                except OSError:
+                    pass
+
+                clip.close_Segment(fields["location"], fields["running-time"])
+                self.last_running_time = fields["running-time"]
+                if clip.closing == True and clip.open_count == 0:
+                    finished.append(clip)
+
+        for clip in finished:
+            self.finish_Clip(clip)
+
+    def finish_Clips(self):
+        """
+        Complete every clip still held after the recording pipeline has finished.
+        """
+
+        with self.lock:
+            clips = set(self.open_segments.values())
+            if self.clip != None:
+                clips.add(self.clip)
+
+            self.clip = None
+            self.pending_clip = None
+            self.open_segments = {}
+
+        for clip in clips:
+            clip.closing = True
+            self.finish_Clip(clip)
+
+    def finish_Clip(self, clip):
+        """
+        Mark a clip as complete and pass it to the clip callback.
+
+        @param clip:                The completed clip
+        @type clip:                 Video_Clip
+        """
+
+        clip.complete = True
+
+        if self.clip_callback != None:
+            self.clip_callback(clip)
+
+
+
+class Video_Clip:
+    """
+    Class representing a single logical recording made up of one or more consecutive segment files.
+
+    @param name                 The name of the clip, used as the prefix of each segment file
+    @type name                  str
+
+    @param segments             The paths of the completed segment files in recording order
+    @type segments              [str]
+
+    @param start_time           The pipeline running time in nanoseconds at which the clip begins
+    @type start_time            int
+
+    @param end_time             The pipeline running time in nanoseconds at which the clip ends
+    @type end_time              int
+
+    @param pre_roll_duration    The length in seconds of video recorded before the clip was triggered
+    @type pre_roll_duration     float
+
+    @param staging              The area in which the segments are held until promoted. None moves them to their final
+                                paths directly
+    @type staging               Staging_Area
+
+    @param extension            The extension of the segment files
+    @type extension             str
+
+    @param camera               The name of the camera that recorded the clip
+    @type camera                str
+
+    @param persistent           True if the segments are staged on persistent storage rather than in RAM
+    @type persistent            bool
+    """
+
+    def __init__(self, name, rollover_count = 0, staging = None, extension = ".mp4", camera = None, persistent = False):
+        """
+        Video_Clip Constructor.
+
+        @param name                 The name of the clip
+        @type name                  str
+
+        @param rollover_count       The number of times the clip has been rotated on its maximum duration
+        @type rollover_count        int
+
+        @param staging              The area in which the segments are held until promoted
+        @type staging               Staging_Area
+
+        @param extension            The extension of the segment files
+        @type extension             str
+
+        @param camera               The name of the camera that recorded the clip
+        @type camera                str
+
+        @param persistent           True if the segments are staged on persistent storage rather than in RAM
+        @type persistent            bool
+        """
+
+        self.name = name
+        self.rollover_count = rollover_count
+        self.staging = staging
+        self.extension = extension
+        self.camera = camera
+        self.persistent = persistent
+        self.segments = []
+        self.start_time = None
+        self.end_time = None
+        self.open_count = 0
+        self.closing = False
+        self.complete = False
+        self.pre_roll_duration = 0.0
+
+    def duration(self):
+        """
+        Get the length of the recorded part of the clip.
+
+        @return duration:           Clip length in seconds
+        @rtype duration:            float
+        """
+
+        if self.start_time == None or self.end_time == None:
+            return 0.0
+        return (self.end_time - self.start_time) / 1e9
+
+    def is_Expired(self, running_time, max_duration):
+        """
+        Return True if a segment starting at running_time would take the clip past max_duration.
+        """
+
+        if max_duration == None or self.start_time == None:
+            return False
+        return running_time - self.start_time >= max_duration * 1e9
+
+    def rollover(self):
+        """
+        Get the clip that continues this one once its maximum duration is reached.
+        """
+
+        return Video_Clip(self.name, self.rollover_count + 1, self.staging, self.extension, self.camera, self.persistent)
+
+    def open_Segment(self, running_time):
+        """
+        Register a segment that has started recording into this clip.
+        """
+
+        if self.start_time == None:
+            self.start_time = running_time
+        self.open_count += 1
+
+    def close_Segment(self, location, running_time):
+        """
+        Move a finished segment file to its place in the clip, or into staging until the clip is promoted.
+        """
+
+        destination = self.segment_Path(len(self.segments))
+
+        if self.staging != None:
+            destination = self.staging.stage(location, destination, self.persistent)
+        else:
+            directory = os.path.dirname(destination)
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+            shutil.move(location, destination)
+
+        self.segments.append(destination)
+        self.end_time = running_time
+        self.open_count -= 1
+
+    def segment_Path(self, index):
+        """
+        Get the output path of the segment at position index in this clip.
+        """
+
+        if self.rollover_count == 0:
+            return "%s_%03d%s" %(self.name, index, self.extension)
+        return "%s-%d_%03d%s" %(self.name, self.rollover_count, index, self.extension)
+
+    
+    
+
+class PIS_Module:
+    """
+    Class representing a PIS Sensor module. Edges are waited on with poll() on a background thread, so the sensor uses no
+    CPU while idle. Each accepted edge is passed to the callback and to every async iterator returned by events().
+
+    @param name                 The plaintext name given to the camera module
+    @type name                  str
+
+    @param quiet                Enables the camera module's subprocess to print output to the command line
+    @type quiet                 bool
+
+    @param backend              The GPIO edge source of the sensor output
+    @type backend               GPIO_Chardev_Backend, GPIO_Sysfs_Backend or Fake_GPIO_Backend
+
+    @param debounce             The time in seconds after an accepted edge during which further edges are ignored
+    @type debounce              float
+
+    @param holdoff              The time in seconds after motion ends before new motion is accepted
+    @type holdoff               float
+
+    @param callback             Function called with each accepted PIS_Event, on the sensor thread
+    @type callback              function
+
+    @param level                The debounced level of the sensor output
+    @type level                 int
+    """
+
+    def __init__(self, name = "pis", quiet = False, backend = None, debounce = DEFAULT_PIS_DEBOUNCE,
+                 holdoff = DEFAULT_PIS_HOLDOFF, callback = None):
+        """
+        PIS_Module Constructor.
+
+        @param name                 The plaintext name given to the camera module
+        @type name                  str
+
+        @param quiet                Enables the camera module's subprocess to print output to the command line
+        @type quiet                 bool
+
+        @param backend              The GPIO edge source. Defaults to the character device line of the sensor pin
+        @type backend               GPIO_Chardev_Backend, GPIO_Sysfs_Backend or Fake_GPIO_Backend
+
+        @param debounce             The time in seconds after an accepted edge during which further edges are ignored
+        @type debounce              float
+
+        @param holdoff              The time in seconds after motion ends before new motion is accepted
+        @type holdoff               float
+
+        @param callback             Function called with each accepted PIS_Event, on the sensor thread
+        @type callback              function
+        """
+
+        self.name = name
+        self.quiet = quiet
+        self.debounce = debounce
+        self.holdoff = holdoff
+        self.callback = callback
+
+        if backend == None:
+            backend = GPIO_Chardev_Backend(DEFAULT_PIS_CHIP, DEFAULT_PIS_LINE)
+        self.backend = backend
+
+        #Debounced and raw levels, and the time until which edges are not accepted
+        self.level = FALLING
+        self.raw_level = FALLING
+        self.lockout_until = None
+
+        self.thread = None
+        self.wake_fds = None
+        self.listeners = []
+
+        if self.is_Module_Valid() == False:
+            raise ModuleNotFoundError(self.name)
+
+    def is_Module_Valid(self):
+        """
+        Used to determine whether the sensor is connected.
+
+        @return valid:              Value is True if the sensor's GPIO is present
+        @rtype valid:               bool
+        """
+
+        return self.backend.is_Available()
+
+    def is_Active(self):
+        """
+        Return True while the sensor reports motion.
+        """
+
+        return self.level == RISING
+
+    def start(self):
+        """
+        Start listening for edges.
+        """
+
+        if self.thread != None:
+            return
+
+        self.backend.open()
+        self.wake_fds = os.pipe()
+
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop listening for edges.
+        """
+
+        if self.thread == None:
+            return
+
+        os.write(self.wake_fds[1], b"\x00")
+        self.thread.join()
+        self.thread = None
+
+        for fd in self.wake_fds:
+            os.close(fd)
+        self.wake_fds = None
+        self.backend.close()
+
+    def run(self):
+        """
+        Wait for edges until stopped. Runs on the sensor thread.
+        """
+
+        poller = select.poll()
+        poller.register(self.backend.fileno(), self.backend.poll_Mask())
+        poller.register(self.wake_fds[0], select.POLLIN)
+
+        while True:
+
+            #Block indefinitely unless a lockout has to be resolved
+            timeout = None
+            if self.lockout_until != None:
+                timeout = max(0.0, (self.lockout_until - time.monotonic()) * 1000.0)
+
+            for fd, mask in poller.poll(timeout):
+                if fd == self.wake_fds[0]:
+                    return
+
+                for edge in self.backend.read_Edges():
+                    self.handle_Edge(edge)
+
+            if self.lockout_until != None and time.monotonic() >= self.lockout_until:
+                self.end_Lockout()
+
+    def handle_Edge(self, edge):
+        """
+        Accept an edge unless it falls inside a debounce or hold-off period, or does not change the level.
+
+        @param edge:                The raw edge
+        @type edge:                 PIS_Event
+        """
+
+        self.raw_level = edge.level
+
+        if self.lockout_until != None and edge.timestamp < self.lockout_until:
+            return
+        if edge.level == self.level:
+            return
+
+        self.deliver(edge)
+
+    def end_Lockout(self):
+        """
+        Deliver the level the sensor settled on during a debounce or hold-off period, if it changed.
+        """
+
+        self.lockout_until = None
+
+        if self.raw_level != self.level:
+            self.deliver(PIS_Event(time.monotonic(), self.raw_level))
+
+    def deliver(self, event):
+        """
+        Pass an accepted edge to the callback and the async listeners.
+
+        @param event:               The accepted edge
+        @type event:                PIS_Event
+        """
+
+        self.level = event.level
+
+        lockout = self.debounce
+        if event.level == FALLING:
+            lockout = max(self.debounce, self.holdoff)
+        self.lockout_until = event.timestamp + lockout
+
+        if self.quiet == False:
+            print("%s: %s" %(self.name, event))
+
+        if self.callback != None:
+            self.callback(event)
+
+        for loop, queue in list(self.listeners):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    async def events(self):
+        """
+        Iterate asynchronously over the accepted edges.
+
+        @return events:             Async iterator of PIS_Event
+        @rtype events:              async generator
+        """
+
+        listener = (asyncio.get_running_loop(), asyncio.Queue())
+        self.listeners.append(listener)
+
+        try:
+            while True:
+                yield await listener[1].get()
+        finally:
+            self.listeners.remove(listener)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def running_Time_Difference(reference, other):
+    """
+    Get the difference between two pipeline running times.
+
+    @return difference:         other - reference in seconds, or None if either is unknown
+    @rtype difference:          float
+    """
+
+    if reference == None or other == None:
+        return None
+    return (other - reference) / 1e9
+
+def system_Check():
+    pass
+
+def test():
+    import tempfile
+    import Fake_GStreamer
+    from Pipeline_Engine import Subprocess_Engine
+    from Sensor_Modes import Sensor_Mode_Cache
+
+    #Rotate clips on one long-lived pipeline of the gst-launch-1.0 stand-in
+    path_variable = os.environ.get("PATH")
+    directory = tempfile.mkdtemp()
+    try:
+        bin_dir = os.path.join(directory, "bin")
+        os.makedirs(bin_dir)
+        Fake_GStreamer.install(bin_dir)
+
+        clips = []
+        cam = CSI_Module(0, "cam_0", quiet = True, segment_duration = 0.2, max_duration = 0.5,
+                         spool_dir = os.path.join(directory, "spool"), engine = Subprocess_Engine(),
+                         mode_cache = Sensor_Mode_Cache(os.path.join(directory, "sensor_modes.json")),
+                         clip_callback = clips.append)
+
+        first = os.path.join(directory, "first")
+        second = os.path.join(directory, "second")
+
+        def wait_For_Clips(count):
+            deadline = time.monotonic() + 5.0
+            while len(clips) < count and time.monotonic() < deadline:
+                time.sleep(0.02)
+
+        #The first clip rolls over on its maximum duration, then the rolled over clip is rotated on request
+        cam.start_Video_Capture(first, (1280, 720), 30)
+        pipeline = cam.pipeline
+        wait_For_Clips(1)
+        cam.start_Video_Capture(second, (1280, 720), 30)
+        wait_For_Clips(2)
+        time.sleep(0.3)
+
+        #The same process recorded every clip
+        assert cam.pipeline == pipeline and pipeline.is_Running() == True
+        cam.stop_Video_Capture()
+
+        assert [(clip.name, clip.rollover_count) for clip in clips] == [(first, 0), (first, 1), (second, 0)]
+        assert all(clip.complete == True and len(clip.segments) > 0 for clip in clips)
+
+        #Each clip holds only its own segments, and the segments of the clips in order hold every frame once
+        frames = []
+        for clip in clips:
+            for index, path in enumerate(clip.segments):
+                assert path == clip.segment_Path(index) and os.path.exists(path) == True
+                frames += [frame for frame, _ in Fake_GStreamer.read_Frames(path)]
+        assert len(frames) > 0 and frames == list(range(len(frames)))
+        assert os.listdir(os.path.join(directory, "spool")) == []
+
+    finally:
+        if path_variable == None:
+            os.environ.pop("PATH", None)
+        else:
+            os.environ["PATH"] = path_variable
+        shutil.rmtree(directory)
+
+    print("Rotation tests passed")
+
+    #The rest records on the connected cameras
+    if len(discover_Sensors()) == 0:
+        return
+
+    cams = Camera_Pool([CSI_Module(id, "cam_%d" %(id)) for id in discover_Sensors()])
+
+    cams.start_Video_Capture("bin/vid_test_1", (1280, 720), 30).report()
+
+    print("Started recording vid 1 on %d cameras" %(len(cams)))
 
     time.sleep(10)
 
-    cam_1.start_Video_Capture("bin/vid_test_3", (1280, 720), 30)
-    cam_2.start_Video_Capture("bin/vid_test_4", (1280, 720), 30)
+    cams.start_Video_Capture("bin/vid_test_2", (1280, 720), 30).report()
 
-    print("Started recording vid 3 & 4")
+    print("Started recording vid 2")
 
     time.sleep(10)
 
-    cam_1.stop_Video_Capture()
-    cam_2.stop_Video_Capture()
+    result = cams.stop_Video_Capture()
+    result.report()
 
+    print("Stopped %d cameras in %.2f s" %(len(cams), result.duration))
     print("Finished")
 
 
@@ -0,0 +1,393 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       PIS_Backend
+#   Version:    1.00
+#
+#   Description:
+#   The PIS_Backend library provides the GPIO edge sources used by the PIS (Passive Infrared Sensor) module. Each backend exposes
+#   a file descriptor that becomes readable when an edge occurs, so that the sensor can be waited on with poll() instead of a
+#   polling loop. The Linux GPIO character device, the legacy sysfs interface and a replayable fake are supported.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in reading GPIO file descriptors
+import fcntl            #Used in requesting GPIO line events
+import select           #Used in waiting for sysfs edges
+import struct           #Used in packing GPIO ioctl structures
+import threading        #Used in replaying fake edge timelines
+import time
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Edge levels
+FALLING = 0
+RISING = 1
+
+#GPIO character device ABI (linux/gpio.h, v1)
+GPIO_GET_LINEEVENT_IOCTL = 0xC030B404
+GPIOHANDLE_REQUEST_INPUT = 1 << 0
+GPIOEVENT_REQUEST_BOTH_EDGES = (1 << 0) | (1 << 1)
+GPIOEVENT_EVENT_RISING_EDGE = 0x01
+
+#struct gpioevent_request and struct gpioevent_data
+EVENT_REQUEST_FORMAT = "III32si"
+EVENT_DATA_FORMAT = "QI4x"
+EVENT_DATA_SIZE = struct.calcsize(EVENT_DATA_FORMAT)
+
+#Sysfs GPIO interface
+SYSFS_GPIO_DIR = "/sys/class/gpio"
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class PIS_Event:
+    """
+    Class representing a single edge of the sensor output.
+
+    @param timestamp            The time.monotonic() time of the edge in seconds
+    @type timestamp             float
+
+    @param level                The level of the sensor output after the edge, RISING (motion) or FALLING
+    @type level                 int
+    """
+
+    def __init__(self, timestamp, level):
+        """
+        PIS_Event Constructor.
+        """
+
+        self.timestamp = timestamp
+        self.level = level
+
+    def __repr__(self):
+        return "PIS_Event(%.6f, %s)" %(self.timestamp, "RISING" if self.level == RISING else "FALLING")
+
+
+
+class GPIO_Chardev_Backend:
+    """
+    Edge source using the Linux GPIO character device (/dev/gpiochipN). The kernel queues every edge, so none are lost
+    while the reader is busy.
+
+    @param chip                 The path of the GPIO chip device
+    @type chip                  str
+
+    @param line                 The line offset of the sensor pin on the chip
+    @type line                  int
+    """
+
+    def __init__(self, chip, line):
+        """
+        GPIO_Chardev_Backend Constructor.
+        """
+
+        self.chip = chip
+        self.line = line
+        self.fd = None
+
+    def is_Available(self):
+        """
+        Return True if the GPIO chip exists.
+        """
+
+        return os.path.exists(self.chip)
+
+    def open(self):
+        """
+        Request edge events for the sensor line.
+        """
+
+        request = bytearray(struct.pack(EVENT_REQUEST_FORMAT, self.line, GPIOHANDLE_REQUEST_INPUT,
+                                        GPIOEVENT_REQUEST_BOTH_EDGES, b"PIS_Module", 0))
+
+        chip_fd = os.open(self.chip, os.O_RDONLY)
+        try:
+            fcntl.ioctl(chip_fd, GPIO_GET_LINEEVENT_IOCTL, request)
+        finally:
+            os.close(chip_fd)
+
+        self.fd = struct.unpack(EVENT_REQUEST_FORMAT, request)[4]
+
+    def close(self):
+        """
+        Release the sensor line.
+        """
+
+        if self.fd != None:
+            os.close(self.fd)
+            self.fd = None
+
+    def fileno(self):
+        return self.fd
+
+    def poll_Mask(self):
+        """
+        Get the poll() events that signal a pending edge.
+        """
+
+        return select.POLLIN
+
+    def read_Edges(self):
+        """
+        Read the pending edges. Only called once poll() reports the descriptor ready.
+
+        @return edges:              The pending edges in order
+        @rtype edges:               [PIS_Event]
+        """
+
+        timestamp = time.monotonic()
+        data = os.read(self.fd, EVENT_DATA_SIZE * 16)
+
+        edges = []
+        for offset in range(0, len(data) - EVENT_DATA_SIZE + 1, EVENT_DATA_SIZE):
+            kernel_time, event_id = struct.unpack_from(EVENT_DATA_FORMAT, data, offset)
+            level = RISING if event_id == GPIOEVENT_EVENT_RISING_EDGE else FALLING
+
+            #The kernel timestamp clock differs between kernel versions, so edges are stamped on arrival
+            edges.append(PIS_Event(timestamp, level))
+
+        return edges
+
+
+
+class GPIO_Sysfs_Backend:
+    """
+    Edge source using the legacy sysfs GPIO interface, for kernels without the character device.
+
+    @param gpio                 The global GPIO number of the sensor pin
+    @type gpio                  int
+    """
+
+    def __init__(self, gpio):
+        """
+        GPIO_Sysfs_Backend Constructor.
+        """
+
+        self.gpio = gpio
+        self.path = os.path.join(SYSFS_GPIO_DIR, "gpio%d" %(gpio))
+        self.fd = None
+
+    def is_Available(self):
+        """
+        Return True if the sysfs GPIO interface exists.
+        """
+
+        return os.path.exists(SYSFS_GPIO_DIR)
+
+    def open(self):
+        """
+        Export the pin and enable interrupts on both edges.
+        """
+
+        if os.path.exists(self.path) == False:
+            with open(os.path.join(SYSFS_GPIO_DIR, "export"), "w") as export:
+                export.write(str(self.gpio))
+
+        with open(os.path.join(self.path, "direction"), "w") as direction:
+            direction.write("in")
+        with open(os.path.join(self.path, "edge"), "w") as edge:
+            edge.write("both")
+
+        self.fd = os.open(os.path.join(self.path, "value"), os.O_RDONLY)
+
+        #Clear the initial interrupt
+        self.read_Level()
+
+    def close(self):
+        """
+        Stop listening to the pin.
+        """
+
+        if self.fd != None:
+            os.close(self.fd)
+            self.fd = None
+
+    def fileno(self):
+        return self.fd
+
+    def poll_Mask(self):
+        """
+        Get the poll() events that signal a pending edge.
+        """
+
+        return select.POLLPRI | select.POLLERR
+
+    def read_Level(self):
+        """
+        Read the current level of the pin.
+        """
+
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        return RISING if os.read(self.fd, 2)[:1] == b"1" else FALLING
+
+    def read_Edges(self):
+        """
+        Read the pending edge. sysfs only reports the current level, so bursts of edges are merged.
+
+        @return edges:              The pending edges in order
+        @rtype edges:               [PIS_Event]
+        """
+
+        return [PIS_Event(time.monotonic(), self.read_Level())]
+
+
+
+class Fake_GPIO_Backend:
+    """
+    Edge source that replays a timeline of edges, for running the sensor without hardware. Edges are delivered through
+    a pipe so that the sensor waits on them exactly as it would on a real GPIO.
+
+    @param timeline             The edges to replay as (offset in seconds from open, level) pairs
+    @type timeline              [(float,int)]
+    """
+
+    def __init__(self, timeline):
+        """
+        Fake_GPIO_Backend Constructor.
+        """
+
+        self.timeline = sorted(timeline)
+        self.read_fd = None
+        self.write_fd = None
+        self.pending = []
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.start_time = None
+
+    def is_Available(self):
+        return True
+
+    def open(self):
+        """
+        Start replaying the timeline.
+        """
+
+        self.read_fd, self.write_fd = os.pipe()
+        self.start_time = time.monotonic()
+        self.closed.clear()
+
+        threading.Thread(target=self.replay, daemon=True).start()
+
+    def close(self):
+        """
+        Stop replaying the timeline.
+        """
+
+        self.closed.set()
+        if self.read_fd != None:
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+            self.read_fd = None
+            self.write_fd = None
+
+    def fileno(self):
+        return self.read_fd
+
+    def poll_Mask(self):
+        return select.POLLIN
+
+    def replay(self):
+        """
+        Signal each edge of the timeline at its scheduled time.
+        """
+
+        for offset, level in self.timeline:
+            timestamp = self.start_time + offset
+
+            if self.closed.wait(max(0.0, timestamp - time.monotonic())) == True:
+                return
+
+            with self.lock:
+                self.pending.append(PIS_Event(timestamp, level))
+            try:
+                os.write(self.write_fd, b"\x01")
+            except (OSError, TypeError):
+                return
+
+    def read_Edges(self):
+        """
+        Read the pending edges, stamped with their scheduled times.
+
+        @return edges:              The pending edges in order
+        @rtype edges:               [PIS_Event]
+        """
+
+        os.read(self.read_fd, 4096)
+
+        with self.lock:
+            edges = self.pending
+            self.pending = []
+        return edges
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def test():
+    import asyncio
+
+    from Nano_Camera_Trap import PIS_Module
+
+    #A bouncing rising edge, motion ending, motion resuming inside the hold-off window, and motion ending again
+    timeline = [(0.10, RISING), (0.102, FALLING), (0.104, RISING), (0.30, FALLING), (0.40, RISING), (0.90, FALLING)]
+    debounce = 0.02
+    holdoff = 0.3
+
+    delivered = []
+    def callback(event):
+        delivered.append((event, time.monotonic()))
+
+    backend = Fake_GPIO_Backend(timeline)
+    pis = PIS_Module(quiet = True, backend = backend, debounce = debounce, holdoff = holdoff, callback = callback)
+
+    async def collect(count):
+        events = []
+        async for event in pis.events():
+            events.append(event)
+            if len(events) == count:
+                return events
+
+    async def main():
+        task = asyncio.ensure_future(collect(4))
+        await asyncio.sleep(0)
+        pis.start()
+        try:
+            return await asyncio.wait_for(task, 5.0)
+        finally:
+            pis.stop()
+
+    received = asyncio.run(main())
+
+    #The bounce is rejected and the motion seen during the hold-off window is only delivered once the window ends
+    levels = [event.level for event, t in delivered]
+    offsets = [event.timestamp - backend.start_time for event, t in delivered]
+    assert levels == [RISING, FALLING, RISING, FALLING]
+    assert abs(offsets[0] - 0.10) < 1e-6 and abs(offsets[1] - 0.30) < 1e-6 and abs(offsets[3] - 0.90) < 1e-6
+    assert 0.30 + holdoff <= offsets[2] < 0.30 + holdoff + 0.05
+
+    #The async iterator sees the same edges as the callback
+    assert [event.level for event in received] == levels
+    assert [event.timestamp for event in received] == [event.timestamp for event, t in delivered]
+
+    #Trigger to callback latency
+    latencies = [t - event.timestamp for event, t in delivered]
+    assert max(latencies) < 0.005
+
+    print("Trigger to callback latency: max %.2f ms" %(max(latencies) * 1e3))
+    print("PIS_Backend tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,551 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Pipeline_Builder
+#   Version:    1.00
+#
+#   Description:
+#   The Pipeline_Builder library builds the GStreamer pipeline descriptions of the camera modules from their parts: the
+#   camera source, the encoder, the muxer and the sinks. The encoder is set by an encoder profile, which chooses H.264 or
+#   H.265, the bitrate and its control, the keyframe interval and the speed preset, and falls back to the software x264 or
+#   x265 encoder where the Jetson's hardware encoder is not installed. The encoder is named after its camera, so that its
+#   bitrate can be changed while the pipeline runs.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import copy             #Used in changing the bitrate of a profile
+
+from Pipeline_Engine import get_Engine, DATA_SINK_NAME
+from Video_Container import muxer, splitmux_Muxer
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Codecs
+CODEC_H264 = "h264"
+CODEC_H265 = "h265"
+
+#Bitrate control
+CONTROL_VBR = "vbr"
+CONTROL_CBR = "cbr"
+
+#Speed presets, fastest first. The hardware encoder takes them as preset levels, the software encoders by name
+PRESET_ULTRA_FAST = "ultrafast"
+PRESET_FAST = "fast"
+PRESET_MEDIUM = "medium"
+PRESET_SLOW = "slow"
+
+HARDWARE_PRESET_LEVELS = {
+    PRESET_ULTRA_FAST:  1,
+    PRESET_FAST:        2,
+    PRESET_MEDIUM:      3,
+    PRESET_SLOW:        4,
+}
+
+#Values of the control-rate property of the hardware encoder
+HARDWARE_CONTROL_RATES = {
+    CONTROL_VBR:    0,
+    CONTROL_CBR:    1,
+}
+
+#Encoder, parser and caps of each codec
+HARDWARE_ENCODERS = {
+    CODEC_H264: "nvv4l2h264enc",
+    CODEC_H265: "nvv4l2h265enc",
+}
+
+SOFTWARE_ENCODERS = {
+    CODEC_H264: "x264enc",
+    CODEC_H265: "x265enc",
+}
+
+PARSERS = {
+    CODEC_H264: "h264parse",
+    CODEC_H265: "h265parse",
+}
+
+CODEC_CAPS = {
+    CODEC_H264: "video/x-h264",
+    CODEC_H265: "video/x-h265",
+}
+
+#Bitrate in bits per second of the encoded video (the nvv4l2h264enc default)
+DEFAULT_VIDEO_BITRATE = 4000000
+
+#Prefix of the name of each camera's encoder
+ENCODER_PREFIX = "encoder_"
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Encoder_Profile:
+    """
+    Class representing the settings of a camera's video encoder.
+
+    @param codec                CODEC_H264 or CODEC_H265
+    @type codec                 str
+
+    @param bitrate              The target bitrate in bits per second
+    @type bitrate               int
+
+    @param control_rate         CONTROL_CBR to hold the bitrate constant, CONTROL_VBR to let it follow the scene
+    @type control_rate          str
+
+    @param peak_bitrate         The highest bitrate in bits per second of VBR on the hardware encoder. None for the
+                                encoder's default
+    @type peak_bitrate          int
+
+    @param iframe_interval      The number of frames between keyframes. None for the encoder's default
+    @type iframe_interval       int
+
+    @param preset               The speed preset, one of PRESET_ULTRA_FAST, PRESET_FAST, PRESET_MEDIUM or PRESET_SLOW.
+                                Slower presets give better quality at the same bitrate. None for the encoder's default
+    @type preset                str
+
+    @param software             True to always use the software encoder, False to always use the hardware encoder, None
+                                to use the hardware encoder where it is installed
+    @type software              bool
+    """
+
+    def __init__(self, codec = CODEC_H264, bitrate = DEFAULT_VIDEO_BITRATE, control_rate = CONTROL_CBR, peak_bitrate = None,
+                 iframe_interval = None, preset = None, software = None):
+        """
+        Encoder_Profile Constructor.
+        """
+
+        if codec not in PARSERS:
+            raise ValueError("unknown codec %s" %(codec))
+        if control_rate not in HARDWARE_CONTROL_RATES:
+            raise ValueError("unknown bitrate control %s" %(control_rate))
+        if preset != None and preset not in HARDWARE_PRESET_LEVELS:
+            raise ValueError("unknown preset %s" %(preset))
+
+        self.codec = codec
+        self.bitrate = bitrate
+        self.control_rate = control_rate
+        self.peak_bitrate = peak_bitrate
+        self.iframe_interval = iframe_interval
+        self.preset = preset
+        self.software = software
+
+    def with_Bitrate(self, bitrate):
+        """
+        Get a copy of the profile at another bitrate.
+        """
+
+        profile = copy.copy(self)
+        profile.bitrate = bitrate
+        return profile
+
+    def with_Iframe_Interval(self, iframe_interval):
+        """
+        Get a copy of the profile with another keyframe interval.
+        """
+
+        profile = copy.copy(self)
+        profile.iframe_interval = iframe_interval
+        return profile
+
+    def is_Software(self, engine = None):
+        """
+        Return True if the profile encodes in software with an engine.
+        """
+
+        if self.software != None:
+            return self.software
+        if engine == None:
+            return False
+        return engine.has_Element(HARDWARE_ENCODERS[self.codec]) == False
+
+    def bitrate_Property(self, software, bitrate = None):
+        """
+        Get the value of the encoder's bitrate property, in bits per second for the hardware encoder and kilobits per
+        second for the software encoders.
+
+        @param bitrate:             The bitrate in bits per second. Defaults to the profile's
+        @type bitrate:              int
+        """
+
+        if bitrate == None:
+            bitrate = self.bitrate
+        if software == True:
+            return max(1, bitrate // 1000)
+        return bitrate
+
+    def element(self, name = None, software = False, stream = False):
+        """
+        Get the GStreamer description of the encoder.
+
+        @param name:                The name of the encoder element. None leaves it unnamed
+        @type name:                 str
+
+        @param software:            True for the software encoder
+        @type software:             bool
+
+        @param stream:              True to repeat the parameter sets on every keyframe and mark every access unit, so
+                                    that the raw byte stream can be cut at any keyframe
+        @type stream:               bool
+
+        @return element:            The encoder element and its properties
+        @rtype element:             str
+        """
+
+        properties = []
+        if name != None:
+            properties.append("name=%s" %(name))
+        properties.append("bitrate=%d" %(self.bitrate_Property(software)))
+
+        if software == True:
+            if self.codec == CODEC_H264:
+                properties.append("nal-hrd=%s" %(self.control_rate))
+            if self.iframe_interval != None:
+                properties.append("key-int-max=%d" %(self.iframe_interval))
+            if self.preset != None:
+                properties.append("speed-preset=%s" %(self.preset))
+            if stream == True and self.codec == CODEC_H264:
+                properties.append("byte-stream=true aud=true")
+
+            return " ".join([SOFTWARE_ENCODERS[self.codec]] + properties)
+
+        properties.append("control-rate=%d" %(HARDWARE_CONTROL_RATES[self.control_rate]))
+        if self.control_rate == CONTROL_VBR and self.peak_bitrate != None:
+            properties.append("peak-bitrate=%d" %(self.peak_bitrate))
+        if self.iframe_interval != None:
+            properties.append("iframeinterval=%d" %(self.iframe_interval))
+        if self.preset != None:
+            properties.append("preset-level=%d" %(HARDWARE_PRESET_LEVELS[self.preset]))
+        if stream == True:
+            properties.append("insert-sps-pps=true insert-aud=true")
+
+        return " ".join([HARDWARE_ENCODERS[self.codec]] + properties)
+
+    def parser(self):
+        """
+        Get the parser element of the profile's codec.
+        """
+
+        return PARSERS[self.codec]
+
+    def caps(self):
+        """
+        Get the media type of the profile's codec, e.g. video/x-h264.
+        """
+
+        return CODEC_CAPS[self.codec]
+
+
+
+class Pipeline_Builder:
+    """
+    Class that builds a GStreamer pipeline description as a chain of elements, followed by any branches off the chain's
+    tees. Each method adds to the chain and returns the builder, so that calls can be chained.
+
+    @param engine               The engine the pipeline is built for, which gives the meter and data elements
+    @type engine                Gst_Engine or Subprocess_Engine
+
+    @param elements             The elements of the chain, in order
+    @type elements              [str]
+
+    @param branches             The descriptions of the branches, each starting from a tee of the chain
+    @type branches              [str]
+    """
+
+    def __init__(self, engine = None):
+        """
+        Pipeline_Builder Constructor.
+
+        @param engine:              The engine the pipeline is built for. Defaults to the shared one
+        @type engine:               Gst_Engine or Subprocess_Engine
+        """
+
+        if engine == None:
+            engine = get_Engine()
+        self.engine = engine
+
+        self.elements = []
+        self.branches = []
+        self.nvmm = False
+
+    def add(self, *elements):
+        """
+        Add elements or caps to the chain as they are.
+        """
+
+        self.elements += elements
+        return self
+
+    def source(self, capture):
+        """
+        Add a camera source, capturing in its resolved sensor mode.
+
+        @param capture:             The capture settings of the camera
+        @type capture:              Capture_Mode
+        """
+
+        self.nvmm = True
+        return self.add(*capture.elements())
+
+    def test_Source(self, width, height, framerate, frames = None):
+        """
+        Add a live test pattern in system memory, standing in for a camera where there is none.
+
+        @param frames:              The number of frames after which the source ends. None runs until stopped
+        @type frames:               int
+        """
+
+        source = "videotestsrc is-live=true"
+        if frames != None:
+            source += " num-buffers=%d" %(frames)
+
+        self.nvmm = False
+        return self.add(source, "video/x-raw,width=%d,height=%d,framerate=%d/1,format=I420" %(width, height, framerate))
+
+    def tee(self, name):
+        """
+        Split the chain so that branches can be taken from it. The chain continues through a queue.
+
+        @param name:                The name of the tee, which branches link from as <name>.
+        @type name:                 str
+        """
+
+        return self.add("tee name=%s" %(name), "queue")
+
+    def encode(self, profile, name = None, stream = False):
+        """
+        Encode the raw video of the chain and parse the encoded stream. The software encoder is given the video in system
+        memory.
+
+        @param profile:             The encoder profile
+        @type profile:              Encoder_Profile
+
+        @param name:                The name of the camera, after which the encoder is named. None leaves it unnamed
+        @type name:                 str
+
+        @param stream:              True to output an H.264 byte stream aligned on access units, with parameter sets on
+                                    every keyframe
+        @type stream:               bool
+        """
+
+        software = profile.is_Software(self.engine)
+        if software == True and self.nvmm == True:
+            self.add("nvvidconv", "'video/x-raw,format=I420'")
+            self.nvmm = False
+
+        encoder_name = None
+        if name != None:
+            encoder_name = encoder_Name(name)
+        self.add(profile.element(encoder_name, software, stream))
+
+        if stream == True:
+            return self.add("%s config-interval=-1" %(profile.parser()),
+                            "%s,stream-format=byte-stream,alignment=au" %(profile.caps()))
+
+        return self.add(profile.parser())
+
+    def parse(self, profile, framerate):
+        """
+        Parse a byte stream of the profile's codec handed to the chain. The byte stream carries no timestamps, so the
+        framerate is given in the caps.
+        """
+
+        return self.add("'%s,stream-format=byte-stream,framerate=%d/1'" %(profile.caps(), framerate), profile.parser())
+
+    def meter(self, name):
+        """
+        Measure each buffer passing through the chain. See Subprocess_Engine.meter.
+        """
+
+        return self.add(self.engine.meter(name))
+
+    def mux(self, container, fragment_duration):
+        """
+        Mux the chain into a container.
+        """
+
+        return self.add(muxer(container, fragment_duration))
+
+    def file_Sink(self, location):
+        """
+        End the chain in a file.
+        """
+
+        return self.add("filesink location=%s" %(location))
+
+    def split_Sink(self, name, container, fragment_duration, segment_duration, location):
+        """
+        End the chain in segments of a container, forcing a keyframe at each boundary.
+
+        @param name:                The name of the splitmuxsink
+        @type name:                 str
+
+        @param segment_duration:    The length in seconds of each segment
+        @type segment_duration:     float
+
+        @param location:            The printf style pattern of the segment paths
+        @type location:             str
+        """
+
+        return self.add("splitmuxsink name=%s send-keyframe-requests=true %s max-size-time=%d location=%s"
+                        %(name, splitmux_Muxer(container, fragment_duration), int(segment_duration * 1e9), location))
+
+    def data_Source(self):
+        """
+        Start the chain from the data pushed into the pipeline.
+        """
+
+        return self.add(self.engine.data_Source())
+
+    def data_Sink(self, name = DATA_SINK_NAME):
+        """
+        End the chain in a data sink, handing its buffers to the pipeline's data callback of that name.
+        """
+
+        return self.add(self.engine.data_Sink(name))
+
+    def branch(self, description):
+        """
+        Add a branch taken from a tee of the chain. Empty descriptions are left out.
+
+        @param description:         The branch, starting from <tee name>.
+        @type description:          str
+        """
+
+        if description.strip() != "":
+            self.branches.append(description.strip())
+        return self
+
+    def build(self):
+        """
+        Get the pipeline description.
+
+        @return pipeline:           The pipeline description
+        @rtype pipeline:            str
+        """
+
+        return " ".join([" ! ".join(self.elements)] + self.branches)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def encoder_Name(name):
+    """
+    Get the name of a camera's encoder element.
+    """
+
+    return "%s%s" %(ENCODER_PREFIX, name)
+
+#Named profiles
+ENCODER_PROFILES = {
+    "default":  Encoder_Profile(),
+    "quality":  Encoder_Profile(bitrate = 8000000, control_rate = CONTROL_VBR, peak_bitrate = 12000000, preset = PRESET_SLOW),
+    "storage":  Encoder_Profile(bitrate = 1500000, control_rate = CONTROL_VBR, peak_bitrate = 3000000, iframe_interval = 60),
+    "h265":     Encoder_Profile(codec = CODEC_H265, bitrate = 2000000, control_rate = CONTROL_VBR),
+    "software": Encoder_Profile(software = True, preset = PRESET_ULTRA_FAST),
+}
+
+DEFAULT_ENCODER_PROFILE = ENCODER_PROFILES["default"]
+
+def test():
+    import os
+    import shutil
+    import tempfile
+
+    from Pipeline_Engine import Subprocess_Engine
+    from Sensor_Modes import Sensor_Mode_Cache, parse_Sensor_Modes, IMX219_PROBE_OUTPUT
+    from Video_Container import CONTAINER_MATROSKA
+    from CSI_Module import CSI_Camera, CSI_Camera_Module
+    import Nano_Camera_Trap
+
+    hardware = Encoder_Profile(software = False)
+
+    #Encoder profiles
+    assert hardware.element("encoder_cam_0") == "nvv4l2h264enc name=encoder_cam_0 bitrate=4000000 control-rate=1"
+    assert ENCODER_PROFILES["quality"].element(software = False) == \
+        "nvv4l2h264enc bitrate=8000000 control-rate=0 peak-bitrate=12000000 preset-level=4"
+    assert ENCODER_PROFILES["storage"].element(software = True) == "x264enc bitrate=1500 nal-hrd=vbr key-int-max=60"
+    assert ENCODER_PROFILES["h265"].element() == "nvv4l2h265enc bitrate=2000000 control-rate=0"
+    assert ENCODER_PROFILES["h265"].parser() == "h265parse" and ENCODER_PROFILES["h265"].caps() == "video/x-h265"
+    assert hardware.with_Bitrate(1000000).bitrate_Property(True) == 1000 and hardware.bitrate == DEFAULT_VIDEO_BITRATE
+
+    for arguments in ({"codec": "vp9"}, {"control_rate": "cq"}, {"preset": "placebo"}):
+        try:
+            Encoder_Profile(**arguments)
+            assert False
+        except ValueError:
+            pass
+
+    engine = Subprocess_Engine()
+    engine.elements["nvv4l2h264enc"] = False
+    assert Encoder_Profile().is_Software(engine) == True and hardware.is_Software(engine) == False
+    engine.elements["nvv4l2h265enc"] = True
+    assert ENCODER_PROFILES["h265"].is_Software(engine) == False
+
+    #A software test pipeline
+    description = Pipeline_Builder(engine).test_Source(320, 240, 30, 90).encode(ENCODER_PROFILES["software"]) \
+                  .mux(CONTAINER_MATROSKA, 0.5).file_Sink("test.mkv").build()
+    assert description == "videotestsrc is-live=true num-buffers=90 ! video/x-raw,width=320,height=240,framerate=30/1," \
+        "format=I420 ! x264enc bitrate=4000 nal-hrd=cbr speed-preset=ultrafast ! h264parse ! matroskamux streamable=true " \
+        "max-cluster-duration=500000000 ! filesink location=test.mkv"
+
+    directory = tempfile.mkdtemp()
+    try:
+        mode_cache = Sensor_Mode_Cache(os.path.join(directory, "sensor_modes.json"),
+                                       lambda sensor_id: parse_Sensor_Modes(IMX219_PROBE_OUTPUT))
+        source = "nvarguscamerasrc sensor-id=0 sensor-mode=4 ! " \
+                 "'video/x-raw(memory:NVMM),width=1280,height=720,framerate=30/1,format=NV12' ! "
+
+        #The capture pipelines of each camera module
+        camera = CSI_Camera(0, None, engine, mode_cache = mode_cache, encoder = hardware)
+        assert camera.video_Pipeline("clip", 1280, 720, 30) == source + "nvv4l2h264enc name=encoder_camera_0 " \
+            "bitrate=4000000 control-rate=1 ! h264parse ! identity name=meter_camera_0 silent=false ! mp4mux ! " \
+            "filesink location=clip.mp4"
+
+        module = CSI_Camera_Module(0, engine, mode_cache = mode_cache, encoder = ENCODER_PROFILES["software"])
+        assert module.video_Pipeline("clip", 1280, 720, 30) == source + "nvvidconv ! 'video/x-raw,format=I420' ! " \
+            "x264enc name=encoder_camera_module_0 bitrate=4000 nal-hrd=cbr speed-preset=ultrafast ! h264parse ! " \
+            "identity name=meter_camera_module_0 silent=false ! mp4mux ! filesink location=clip.mp4"
+
+        spool_dir = os.path.join(directory, "spool")
+        trap_camera = Nano_Camera_Trap.CSI_Module(0, "cam_0", spool_dir = spool_dir, engine = engine,
+                                                  mode_cache = mode_cache, encoder = ENCODER_PROFILES["h265"])
+        assert trap_camera.video_Pipeline((1280, 720), 30) == source + "nvv4l2h265enc name=encoder_cam_0 bitrate=2000000 " \
+            "control-rate=0 ! h265parse ! identity name=meter_cam_0 silent=false ! splitmuxsink name=splitmux_cam_0 " \
+            "send-keyframe-requests=true muxer-factory=mp4mux max-size-time=1000000000 location=%s" \
+            %(trap_camera.segment_Location())
+
+        trap_camera = Nano_Camera_Trap.CSI_Module(0, "cam_0", spool_dir = spool_dir, engine = engine,
+                                                  mode_cache = mode_cache, encoder = hardware,
+                                                  motion_callback = lambda camera, score, t: None,
+                                                  analysis_resolution = (160, 90))
+        assert trap_camera.pre_Roll_Pipeline((1280, 720), 30) == source + "tee name=tee_cam_0 ! queue ! nvv4l2h264enc " \
+            "name=encoder_cam_0 bitrate=4000000 control-rate=1 iframeinterval=30 insert-sps-pps=true insert-aud=true ! " \
+            "h264parse config-interval=-1 ! video/x-h264,stream-format=byte-stream,alignment=au ! fdsink fd=1 " \
+            "tee_cam_0. ! queue leaky=downstream max-size-buffers=1 ! nvvidconv ! " \
+            "'video/x-raw,format=GRAY8,width=160,height=90' ! %s" %(engine.data_Sink("analysis_cam_0"))
+
+        assert Pipeline_Builder(engine).data_Source().parse(hardware, 30).mux("mp4", 1.0).file_Sink("clip.mp4").build() == \
+            "fdsrc fd=0 ! 'video/x-h264,stream-format=byte-stream,framerate=30/1' ! h264parse ! mp4mux ! " \
+            "filesink location=clip.mp4"
+
+        #Bitrate changes wait for the next pipeline where the engine cannot change a running one
+        assert trap_camera.set_Bitrate(2000000) == False and trap_camera.encoder.bitrate == 2000000
+        assert "bitrate=2000000" in trap_camera.video_Pipeline((1280, 720), 30)
+    finally:
+        shutil.rmtree(directory)
+
+    print("Pipeline_Builder tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,1170 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Pipeline_Engine
+#   Version:    1.00
+#
+#   Description:
+#   The Pipeline_Engine library runs GStreamer pipeline descriptions for the camera modules. Where PyGObject is available the
+#   pipeline is built in-process, giving access to bus messages, EOS acknowledgement, pausing and property changes on a running
+#   pipeline. Otherwise each pipeline runs in a supervised gst-launch-1.0 subprocess whose printed messages are parsed instead.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in creating named pipes for extra data sinks
+import collections      #Used in holding recent pipeline output
+import re               #Used in parsing gst-launch-1.0 output
+import shlex            #Used in splitting pipeline descriptions
+import shutil           #Used in finding gst-launch-1.0
+import signal           #Used in sending EOS to gst-launch-1.0
+import subprocess       #Used in running gst-launch-1.0
+import tempfile         #Used in placing named pipes for extra data sinks
+import threading        #Used in reading pipeline output and running the GLib main loop
+import time
+
+from Process_Supervisor import get_Supervisor, DEFAULT_EOS_TIMEOUT
+
+try:
+    import gi
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst, GLib
+except (ImportError, ValueError):
+    Gst = None
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Size of the chunks read from a subprocess pipeline's data output
+DATA_READ_SIZE = 64 * 1024
+
+#Matches messages printed by gst-launch-1.0 -m
+MESSAGE_PATTERN = re.compile(r'^Got message #\d+ from element "([^"]+)" \((\w+)\): ([\w-]+)(?:, (.*?))?;?$')
+EOS_PATTERN = re.compile(r'^Got EOS from element')
+ERROR_PATTERN = re.compile(r'^ERROR: from element ([^:]+): (.*)$')
+
+#Matches a single field of a GstStructure, e.g. location=(string)/tmp/cam_0_00000.mp4
+FIELD_PATTERN = re.compile(r'([\w-]+)=\((\w+)\)("(?:[^"\\]|\\.)*"|[^,]*)')
+
+#Matches the last-message notification printed by gst-launch-1.0 -v for each buffer through a silent=false identity
+HANDOFF_PATTERN = re.compile(r'^/\S*/GstIdentity:([^:]+): last-message = chain\s+\*+\s+\(\S+\)\s+\((\d+) bytes, '
+                             r'dts: [^,]*, pts: ([\d:.]+|none)')
+
+#GstStructure field types printed as integers
+INTEGER_TYPES = ("int", "uint", "gint", "guint", "gint64", "guint64", "long", "ulong")
+
+#Names of the elements through which data enters and leaves a pipeline in the in-process engine
+DATA_SINK_NAME = "data_sink"
+DATA_SOURCE_NAME = "data_source"
+
+#Prefix of the names of the identity elements that report each buffer passing through them as a handoff message
+METER_PREFIX = "meter_"
+
+#Number of lines of pipeline output held for inspection
+DEFAULT_OUTPUT_LINES = 256
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Error Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Pipeline_Error(Exception):
+    """
+    Exception raised when a pipeline cannot be started or does not support a requested operation.
+
+    @param pipeline:            The name of the pipeline
+    @type pipeline:             str
+
+    @param message:             Description of the error
+    @type message:              str
+    """
+
+    def __init__(self, pipeline, message):
+        self.pipeline = pipeline
+        self.message = message
+
+    def __str__(self):
+        return "%s: %s" %(self.pipeline, self.message)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Output_Ring:
+    """
+    Class holding the most recent lines of a pipeline's output. Older lines are discarded, so a pipeline that prints
+    continuously never holds more than a fixed amount of memory.
+
+    @param discarded            The number of lines discarded so far
+    @type discarded             int
+    """
+
+    def __init__(self, max_lines = DEFAULT_OUTPUT_LINES):
+        """
+        Output_Ring Constructor.
+        """
+
+        self.lines = collections.deque(maxlen=max_lines)
+        self.lock = threading.Lock()
+        self.discarded = 0
+
+    def append(self, line):
+        """
+        Add a line, discarding the oldest line if the ring is full.
+        """
+
+        with self.lock:
+            if len(self.lines) == self.lines.maxlen:
+                self.discarded += 1
+            self.lines.append(line)
+
+    def recent(self):
+        """
+        Get the held lines, oldest first.
+
+        @return lines:              The held lines
+        @rtype lines:               [str]
+        """
+
+        with self.lock:
+            return list(self.lines)
+
+
+
+class Pipeline:
+    """
+    Class representing a running pipeline. Subclasses implement the backend specific parts.
+
+    @param name                 The plaintext name given to the pipeline
+    @type name                  str
+
+    @param message_callback     Function called with (element, structure name, fields) for each bus message
+    @type message_callback      function
+
+    @param data_callback        Function called with each chunk of bytes produced by the pipeline's data sink
+    @type data_callback         function
+
+    @param data_callbacks       The data callback of each named data sink in the pipeline
+    @type data_callbacks        {str:function}
+
+    @param supports_Control     True if the pipeline's properties can be changed and its signals emitted while running
+    @type supports_Control      bool
+
+    @param error                The first error reported by the pipeline, None if there was none
+    @type error                 str
+
+    @param start_time           The time.monotonic() time at which the pipeline was launched
+    @type start_time            float
+
+    @param stop_latency         The time in seconds between the stop request and the pipeline finishing
+    @type stop_latency          float
+
+    @param output               The most recent lines of the pipeline's output
+    @type output                Output_Ring
+    """
+
+    supports_Control = False
+
+    def __init__(self, name, message_callback = None, data_callback = None):
+        """
+        Pipeline Constructor.
+        """
+
+        self.name = name
+        self.message_callback = message_callback
+
+        #A single callback serves the default data sink
+        if data_callback == None:
+            data_callback = {}
+        elif callable(data_callback) == True:
+            data_callback = {DATA_SINK_NAME: data_callback}
+
+        self.data_callbacks = dict(data_callback)
+        self.data_callback = self.data_callbacks.get(DATA_SINK_NAME)
+        self.error = None
+        self.output = Output_Ring()
+
+        self.start_time = time.monotonic()
+        self.stop_time = None
+        self.stop_latency = None
+
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.finishing = False
+        self.callbacks = []
+
+    def is_Running(self):
+        """
+        Return True until the pipeline has finished.
+        """
+
+        return self.finished.is_set() == False
+
+    def wait(self, timeout = None):
+        """
+        Wait for the pipeline to finish and its finish callbacks to complete.
+
+        @return finished:           True if the pipeline finished before the timeout
+        @rtype finished:            bool
+        """
+
+        return self.finished.wait(timeout)
+
+    def add_Finish_Callback(self, callback):
+        """
+        Call a function with this pipeline once it has finished. Called immediately if it already has.
+        """
+
+        with self.lock:
+            if self.finishing == False:
+                self.callbacks.append(callback)
+                return
+
+        callback(self)
+
+    def finish(self):
+        """
+        Mark the pipeline as finished and run its finish callbacks. Called once by the backend.
+        """
+
+        with self.lock:
+            if self.finishing == True:
+                return
+            self.finishing = True
+
+            if self.stop_time != None:
+                self.stop_latency = time.monotonic() - self.stop_time
+
+            callbacks = self.callbacks
+            self.callbacks = []
+
+        for callback in callbacks:
+            callback(self)
+
+        self.finished.set()
+
+    def dispatch(self, element, name, fields):
+        """
+        Pass a bus message to the message callback.
+        """
+
+        if self.message_callback != None:
+            self.message_callback(element, name, fields)
+
+    def stop_Async(self, timeout = DEFAULT_EOS_TIMEOUT):
+        """
+        Stop the pipeline on a background thread.
+
+        @return thread:             The thread performing the stop
+        @rtype thread:              Thread
+        """
+
+        thread = threading.Thread(target=self.stop, args=(timeout,), daemon=True)
+        thread.start()
+        return thread
+
+    def send_EOS(self):
+        """
+        Ask the pipeline to finish without waiting for it. The pipeline's finish callbacks run once it has.
+        """
+
+        raise NotImplementedError
+
+    def stop(self, timeout = DEFAULT_EOS_TIMEOUT):
+        """
+        Send EOS, wait for it to reach the sinks and shut the pipeline down, forcing it after the timeout.
+        """
+
+        raise NotImplementedError
+
+    def pause(self):
+        raise Pipeline_Error(self.name, "pausing is not supported by this engine")
+
+    def resume(self):
+        raise Pipeline_Error(self.name, "resuming is not supported by this engine")
+
+    def set_Property(self, element, name, value):
+        raise Pipeline_Error(self.name, "property changes are not supported by this engine")
+
+    def emit(self, element, signal, *args):
+        raise Pipeline_Error(self.name, "action signals are not supported by this engine")
+
+    def push_Data(self, data):
+        raise Pipeline_Error(self.name, "the pipeline has no data source")
+
+    def end_Data(self):
+        pass
+
+
+
+class Subprocess_Pipeline(Pipeline):
+    """
+    Pipeline running in a supervised gst-launch-1.0 subprocess. Element, EOS and error messages are parsed from the
+    process output. A pipeline with a default data sink writes its data to stdout instead and prints no messages, and its
+    stderr is read on a separate thread. Other named data sinks write to named pipes, each read on its own thread. Meter
+    identities print each buffer with -v, parsed into handoff messages.
+
+    @param process              The gst-launch-1.0 process
+    @type process               Supervised_Process
+
+    @param fifo_paths           The named pipe of each named data sink other than the default
+    @type fifo_paths            {str:str}
+
+    @param paused               True while the process group is stopped by pause()
+    @type paused                bool
+    """
+
+    def __init__(self, description, name, supervisor, message_callback = None, data_callback = None, data_input = False,
+                 quiet = True, log_file = None, fifo_paths = None):
+        """
+        Subprocess_Pipeline Constructor.
+        """
+
+        Pipeline.__init__(self, name, message_callback, data_callback)
+
+        self.supervisor = supervisor
+        self.quiet = quiet
+        self.log_file = log_file
+        self.data_input = data_input
+        self.paused = False
+
+        if self.data_callback != None:
+            command = ["gst-launch-1.0", "-e", "-q"] + shlex.split(description)
+            output = dict(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            command = ["gst-launch-1.0", "-e", "-m"]
+            if METER_PREFIX in description:
+                command.append("-v")
+            command += shlex.split(description)
+            output = dict(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+        if data_input == True:
+            output["stdin"] = subprocess.PIPE
+            output["bufsize"] = 0
+
+        self.process = supervisor.spawn(command, name, **output)
+
+        self.fifo_paths = fifo_paths or {}
+        self.fifo_readers = []
+        for sink, path in self.fifo_paths.items():
+            reader = threading.Thread(target=self.read_Fifo, args=(path, self.data_callbacks[sink]),
+                                      name="read-%s-%s" %(name, sink), daemon=True)
+            reader.start()
+            self.fifo_readers.append(reader)
+
+        self.error_reader = None
+        if self.data_callback != None:
+            target = self.read_Data
+
+            #stderr is drained into the output ring so that the process never blocks on a full pipe
+            self.error_reader = threading.Thread(target=self.read_Lines, args=(self.process.stderr,),
+                                                 name="read-%s-stderr" %(name), daemon=True)
+            self.error_reader.start()
+        else:
+            target = self.read_Messages
+
+        self.reader = threading.Thread(target=target, name="read-%s" %(name), daemon=True)
+        self.reader.start()
+
+    def read_Lines(self, stream, handler = None):
+        """
+        Read lines from a process output stream until it closes, passing each to the handler and keeping, printing and
+        logging the lines the handler does not consume.
+
+        @param handler:             Function called with each line, returning True if the line is consumed, e.g. a
+                                    per-buffer meter notification that would otherwise flood the output
+        @type handler:              function
+        """
+
+        log = None
+        if self.log_file != None:
+            log = open(self.log_file, "a")
+
+        try:
+            for line in stream:
+                line = line.decode("utf-8", "replace").rstrip()
+
+                if handler != None and handler(line) == True:
+                    continue
+
+                self.output.append(line)
+                if self.quiet == False:
+                    print(line)
+                if log != None:
+                    log.write(line + "\n")
+
+        finally:
+            if log != None:
+                log.close()
+
+    def read_Messages(self):
+        """
+        Read the process output until it exits, dispatching the messages it prints.
+        """
+
+        self.read_Lines(self.process.stdout, self.handle_Line)
+
+        self.process.wait()
+        self.end_Fifos()
+        self.finish()
+
+    def handle_Line(self, line):
+        """
+        Dispatch a single line of gst-launch-1.0 output.
+
+        @return consumed:           True if the line is a meter notification, which is not kept as output
+        @rtype consumed:            bool
+        """
+
+        message = parse_Message(line)
+        if message != None:
+            self.dispatch(*message)
+            return
+
+        handoff = parse_Handoff(line)
+        if handoff != None:
+            self.dispatch(*handoff)
+            return True
+
+        if EOS_PATTERN.match(line):
+            self.dispatch(self.name, "eos", {})
+            return
+
+        match = ERROR_PATTERN.match(line)
+        if match != None:
+            if self.error == None:
+                self.error = match.group(2)
+            self.dispatch(match.group(1), "error", {"message": match.group(2)})
+
+    def read_Data(self):
+        """
+        Read the data written to stdout until the process exits, passing it to the data callback.
+        """
+
+        while True:
+            data = self.process.stdout.read1(DATA_READ_SIZE)
+            if len(data) == 0:
+                break
+            self.data_callback(data)
+
+        self.process.wait()
+        self.error_reader.join()
+        self.end_Fifos()
+        self.finish()
+
+    def read_Fifo(self, path, callback):
+        """
+        Read the data written to a named pipe until the process closes it, passing it to the sink's callback.
+        """
+
+        with open(path, "rb", buffering=0) as fifo:
+            while True:
+                data = fifo.read(DATA_READ_SIZE)
+                if len(data) == 0:
+                    break
+                callback(data)
+
+    def end_Fifos(self):
+        """
+        Wait for the named pipe readers once the process has exited. A reader whose pipe was never opened by the process
+        is released by opening the pipe for writing.
+        """
+
+        for path in self.fifo_paths.values():
+            try:
+                os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+
+        for reader in self.fifo_readers:
+            reader.join(DEFAULT_EOS_TIMEOUT)
+
+    def send_EOS(self):
+        """
+        Ask the process to finish without waiting for it. Pipelines fed through push_Data receive EOS by closing their
+        input.
+        """
+
+        if self.stop_time == None:
+            self.stop_time = time.monotonic()
+
+        #A stopped process would not see EOS until it was continued
+        self.resume()
+
+        if self.data_input == True:
+            self.end_Data()
+        else:
+            self.process.send_Signal(signal.SIGINT)
+
+    def stop(self, timeout = DEFAULT_EOS_TIMEOUT):
+        """
+        Send EOS, wait for the process to exit and for its output to be read, killing it after the timeout.
+        """
+
+        self.send_EOS()
+        self.supervisor.stop(self.process, timeout, eos_signal = None)
+
+        self.reader.join()
+        self.wait()
+
+    def pause(self):
+        """
+        Stop the process group with SIGSTOP, holding the pipeline where it is until resume().
+        """
+
+        self.paused = True
+        self.process.send_Signal(signal.SIGSTOP)
+
+    def resume(self):
+        """
+        Continue a process group stopped by pause().
+        """
+
+        if self.paused == True:
+            self.paused = False
+            self.process.send_Signal(signal.SIGCONT)
+
+    def push_Data(self, data):
+        """
+        Write bytes to the pipeline's data source.
+        """
+
+        if self.data_input == False:
+            Pipeline.push_Data(self, data)
+
+        try:
+            self.process.stdin.write(data)
+        except (OSError, ValueError):
+            pass
+
+    def end_Data(self):
+        """
+        Close the pipeline's data source, sending EOS.
+        """
+
+        if self.data_input == False:
+            return
+
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+
+
+class Subprocess_Engine:
+    """
+    Engine that runs every pipeline in a supervised gst-launch-1.0 subprocess.
+
+    @param supervisor           The supervisor that owns the subprocesses
+    @type supervisor            Process_Supervisor
+    """
+
+    name = "gst-launch"
+
+    def __init__(self, supervisor = None):
+        """
+        Subprocess_Engine Constructor.
+        """
+
+        if supervisor == None:
+            supervisor = get_Supervisor()
+        self.supervisor = supervisor
+        self.elements = {}
+        self.fifo_dir = None
+
+    def has_Element(self, element):
+        """
+        Return True if the named element is installed, asking gst-inspect-1.0 once per element.
+        """
+
+        if element not in self.elements:
+            try:
+                result = subprocess.run(["gst-inspect-1.0", "--exists", element])
+                self.elements[element] = result.returncode == 0
+            except OSError:
+                self.elements[element] = False
+
+        return self.elements[element]
+
+    def data_Sink(self, name = DATA_SINK_NAME):
+        """
+        Get the description of the element through which a pipeline hands data to its data callback. The default sink
+        writes to stdout, other named sinks to a named pipe.
+
+        @param name:                The name of the sink, used as the key of its callback in launch()
+        @type name:                 str
+        """
+
+        if name == DATA_SINK_NAME:
+            return "fdsink fd=1"
+
+        return "filesink location=%s buffer-mode=unbuffered sync=false" %(self.fifo_Path(name))
+
+    def fifo_Path(self, name):
+        """
+        Get the named pipe of a named data sink, creating it on first use.
+        """
+
+        if self.fifo_dir == None:
+            self.fifo_dir = tempfile.mkdtemp(prefix="gst-fifo-")
+
+        path = os.path.join(self.fifo_dir, name)
+        if os.path.exists(path) == False:
+            os.mkfifo(path)
+        return path
+
+    def data_Source(self):
+        """
+        Get the description of the element through which push_Data feeds a pipeline.
+        """
+
+        return "fdsrc fd=0"
+
+    def meter(self, name):
+        """
+        Get the description of an identity that reports every buffer passing through it as a handoff message with the
+        buffer's size and pts. Only pipelines without a default data sink print the reports.
+
+        @param name:                The name of the meter, unique within the pipeline
+        @type name:                 str
+        """
+
+        return "identity name=%s%s silent=false" %(METER_PREFIX, name)
+
+    def launch(self, description, name, message_callback = None, data_callback = None, data_input = False, quiet = True,
+               log_file = None):
+        """
+        Start a pipeline.
+
+        @param description:         The pipeline description in gst-launch-1.0 syntax
+        @type description:          str
+
+        @param name:                The plaintext name given to the pipeline
+        @type name:                 str
+
+        @param message_callback:    Function called with (element, structure name, fields) for each bus message
+        @type message_callback:     function
+
+        @param data_callback:       Function called with the bytes produced by the pipeline's data_Sink(), or a
+                                    dictionary of such functions keyed by data sink name
+        @type data_callback:        function or {str:function}
+
+        @param data_input:          True if the pipeline is fed through push_Data via its data_Source()
+        @type data_input:           bool
+
+        @param quiet:               Suppresses printing the pipeline output to the command line
+        @type quiet:                bool
+
+        @param log_file:            The text file to which the pipeline output is appended
+        @type log_file:             str
+
+        @return pipeline:           The running pipeline
+        @rtype pipeline:            Subprocess_Pipeline
+        """
+
+        fifo_paths = {}
+        if isinstance(data_callback, dict) == True:
+            fifo_paths = {sink: self.fifo_Path(sink) for sink in data_callback if sink != DATA_SINK_NAME}
+
+        return Subprocess_Pipeline(description, name, self.supervisor, message_callback, data_callback, data_input, quiet,
+                                   log_file, fifo_paths)
+
+
+
+class Gst_Pipeline(Pipeline):
+    """
+    Pipeline built in-process with PyGObject. Bus messages are handled on the engine's GLib main loop thread.
+
+    @param pipeline             The GStreamer pipeline
+    @type pipeline              Gst.Pipeline
+    """
+
+    supports_Control = True
+
+    def __init__(self, description, name, message_callback = None, data_callback = None, data_input = False, quiet = True,
+                 log_file = None):
+        """
+        Gst_Pipeline Constructor.
+        """
+
+        Pipeline.__init__(self, name, message_callback, data_callback)
+
+        self.quiet = quiet
+        self.log_file = log_file
+        self.shutting_down = False
+
+        try:
+            self.pipeline = Gst.parse_launchv(shlex.split(description))
+        except GLib.Error as error:
+            raise Pipeline_Error(name, error.message)
+
+        self.pipeline.set_name(name)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        self.watch = bus.connect("message", self.on_Message)
+
+        for sink, callback in self.data_callbacks.items():
+            self.pipeline.get_by_name(sink).connect("new-sample", self.on_Sample, callback)
+
+        for meter in re.findall(r'name=(%s[^\s!]+)' %(METER_PREFIX), description):
+            self.pipeline.get_by_name(meter).connect("handoff", self.on_Handoff)
+
+        self.source = None
+        if data_input == True:
+            self.source = self.pipeline.get_by_name(DATA_SOURCE_NAME)
+
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self.shutdown()
+            raise Pipeline_Error(name, "the pipeline could not be started")
+
+    def log(self, text):
+        """
+        Print and log a line of pipeline output.
+        """
+
+        self.output.append(text)
+
+        if self.quiet == False:
+            print("%s: %s" %(self.name, text))
+        if self.log_file != None:
+            with open(self.log_file, "a") as log:
+                log.write(text + "\n")
+
+    def on_Message(self, bus, message):
+        """
+        Handle a bus message. Runs on the GLib main loop thread.
+        """
+
+        element = message.src.get_name() if message.src != None else self.name
+
+        if message.type == Gst.MessageType.EOS:
+            self.log("EOS")
+            self.dispatch(self.name, "eos", {})
+            self.shutdown()
+
+        elif message.type == Gst.MessageType.ERROR:
+            error, debug = message.parse_error()
+            self.log("ERROR from %s: %s" %(element, error.message))
+            if self.error == None:
+                self.error = error.message
+            self.dispatch(element, "error", {"message": error.message})
+            self.shutdown()
+
+        elif message.type == Gst.MessageType.QOS:
+            live, running_time, stream_time, timestamp, duration = message.parse_qos()
+            stats_format, processed, dropped = message.parse_qos_stats()
+            self.dispatch(element, "qos", {"running-time": running_time, "processed": processed, "dropped": dropped})
+
+        elif message.type == Gst.MessageType.ELEMENT:
+            structure = message.get_structure()
+            if structure == None:
+                return
+
+            fields = {}
+            for index in range(structure.n_fields()):
+                key = structure.nth_field_name(index)
+                fields[key] = structure.get_value(key)
+
+            self.log("%s from %s" %(structure.to_string(), element))
+            self.dispatch(element, structure.get_name(), fields)
+
+    def on_Sample(self, sink, callback):
+        """
+        Pass a buffer from a data sink to its data callback. Runs on the streaming thread.
+        """
+
+        sample = sink.emit("pull-sample")
+        if sample == None:
+            return Gst.FlowReturn.EOS
+
+        buffer = sample.get_buffer()
+        callback(buffer.extract_dup(0, buffer.get_size()))
+        return Gst.FlowReturn.OK
+
+    def on_Handoff(self, identity, buffer):
+        """
+        Pass a buffer through a meter identity to the message callback as a handoff message. Runs on the streaming thread.
+        """
+
+        pts = buffer.pts
+        if pts == Gst.CLOCK_TIME_NONE:
+            pts = None
+
+        self.dispatch(identity.get_name(), "handoff", {"size": buffer.get_size(), "pts": pts})
+
+    def shutdown(self):
+        """
+        Set the pipeline to NULL and finish it. A bus EOS or error and a stop timeout may both call this, only the first
+        shuts the pipeline down.
+        """
+
+        with self.lock:
+            if self.finishing == True or self.shutting_down == True:
+                return
+            self.shutting_down = True
+
+        self.pipeline.set_state(Gst.State.NULL)
+
+        bus = self.pipeline.get_bus()
+        bus.disconnect(self.watch)
+        bus.remove_signal_watch()
+
+        self.finish()
+
+    def send_EOS(self):
+        """
+        Send EOS without waiting for it to reach the sinks.
+        """
+
+        if self.stop_time == None:
+            self.stop_time = time.monotonic()
+
+        if self.source != None:
+            self.end_Data()
+        else:
+            self.pipeline.send_event(Gst.Event.new_eos())
+
+    def stop(self, timeout = DEFAULT_EOS_TIMEOUT):
+        """
+        Send EOS and wait for it to reach the sinks, shutting the pipeline down after the timeout.
+        """
+
+        self.send_EOS()
+
+        if self.finished.wait(timeout) == False:
+            self.shutdown()
+        self.wait()
+
+    def pause(self):
+        self.pipeline.set_state(Gst.State.PAUSED)
+
+    def resume(self):
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def get_Element(self, element):
+        """
+        Get an element of the pipeline by name.
+        """
+
+        found = self.pipeline.get_by_name(element)
+        if found == None:
+            raise Pipeline_Error(self.name, "no element named %s" %(element))
+        return found
+
+    def set_Property(self, element, name, value):
+        """
+        Change a property of an element of the running pipeline.
+        """
+
+        self.get_Element(element).set_property(name, value)
+
+    def get_Property(self, element, name):
+        """
+        Read a property of an element of the running pipeline.
+        """
+
+        return self.get_Element(element).get_property(name)
+
+    def emit(self, element, signal, *args):
+        """
+        Emit an action signal on an element of the running pipeline, e.g. split-now on a splitmuxsink.
+        """
+
+        return self.get_Element(element).emit(signal, *args)
+
+    def push_Data(self, data):
+        """
+        Push bytes into the pipeline's data source.
+        """
+
+        if self.source == None:
+            Pipeline.push_Data(self, data)
+
+        self.source.emit("push-buffer", Gst.Buffer.new_wrapped(data))
+
+    def end_Data(self):
+        """
+        Send EOS from the pipeline's data source.
+        """
+
+        if self.source != None:
+            self.source.emit("end-of-stream")
+
+
+
+class Gst_Engine:
+    """
+    Engine that builds every pipeline in-process with PyGObject. A single GLib main loop thread serves the buses of all
+    pipelines.
+    """
+
+    name = "gst"
+
+    def __init__(self):
+        """
+        Gst_Engine Constructor.
+        """
+
+        if Gst == None:
+            raise Pipeline_Error("gst", "PyGObject GStreamer bindings are not installed")
+
+        Gst.init(None)
+
+        self.loop = GLib.MainLoop()
+        self.thread = threading.Thread(target=self.loop.run, name="glib-main-loop", daemon=True)
+        self.thread.start()
+
+    def has_Element(self, element):
+        """
+        Return True if the named element is installed.
+        """
+
+        return Gst.ElementFactory.find(element) != None
+
+    def data_Sink(self, name = DATA_SINK_NAME):
+        """
+        Get the description of the element through which a pipeline hands data to its data callback.
+
+        @param name:                The name of the sink, used as the key of its callback in launch()
+        @type name:                 str
+        """
+
+        return "appsink name=%s emit-signals=true sync=false" %(name)
+
+    def data_Source(self):
+        """
+        Get the description of the element through which push_Data feeds a pipeline.
+        """
+
+        return "appsrc name=%s is-live=true do-timestamp=false" %(DATA_SOURCE_NAME)
+
+    def meter(self, name):
+        """
+        Get the description of an identity that reports every buffer passing through it as a handoff message. See
+        Subprocess_Engine.meter.
+        """
+
+        return "identity name=%s%s silent=true signal-handoffs=true" %(METER_PREFIX, name)
+
+    def launch(self, description, name, message_callback = None, data_callback = None, data_input = False, quiet = True,
+               log_file = None):
+        """
+        Start a pipeline. See Subprocess_Engine.launch.
+
+        @return pipeline:           The running pipeline
+        @rtype pipeline:            Gst_Pipeline
+        """
+
+        return Gst_Pipeline(description, name, message_callback, data_callback, data_input, quiet, log_file)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Engine shared by every camera module, created on first use
+engine = None
+engine_lock = threading.Lock()
+
+def get_Engine():
+    """
+    Get the engine shared by every camera module: in-process if PyGObject is installed, gst-launch-1.0 otherwise.
+
+    @return engine:             The shared engine
+    @rtype engine:              Gst_Engine or Subprocess_Engine
+    """
+
+    global engine
+
+    with engine_lock:
+        if engine == None:
+            if Gst != None:
+                engine = Gst_Engine()
+            else:
+                engine = Subprocess_Engine()
+
+    return engine
+
+def parse_Message(line):
+    """
+    Parse a message printed by gst-launch-1.0 -m.
+
+    @param line:                A line of gst-launch-1.0 output
+    @type line:                 str
+
+    @return message:            (element, structure name, fields) or None if the line is not a message
+    @rtype message:             (str, str, dict)
+    """
+
+    match = MESSAGE_PATTERN.match(line)
+    if match == None:
+        return None
+
+    element, message_type, name, body = match.groups()
+
+    #QoS messages are printed by structure name
+    if message_type == "qos":
+        name = "qos"
+
+    fields = {}
+    for key, field_type, value in FIELD_PATTERN.findall(body or ""):
+        if value.startswith('"'):
+            value = value[1:-1].replace('\\"', '"')
+        if field_type in INTEGER_TYPES:
+            value = int(value)
+        fields[key] = value
+
+    return element, name, fields
+
+def parse_Handoff(line):
+    """
+    Parse the per-buffer notification printed by gst-launch-1.0 -v for a meter identity.
+
+    @param line:                A line of gst-launch-1.0 output
+    @type line:                 str
+
+    @return message:            (element, "handoff", {"size": bytes, "pts": nanoseconds or None}) or None if the line is
+                                not a meter notification
+    @rtype message:             (str, str, dict)
+    """
+
+    match = HANDOFF_PATTERN.match(line)
+    if match == None or match.group(1).startswith(METER_PREFIX) == False:
+        return None
+
+    element, size, pts = match.groups()
+
+    if pts == "none":
+        pts = None
+    else:
+        hours, minutes, seconds = pts.split(":")
+        whole, fraction = seconds.split(".")
+        pts = ((int(hours) * 60 + int(minutes)) * 60 + int(whole)) * 1000000000 + int(fraction.ljust(9, "0")[:9])
+
+    return element, "handoff", {"size": int(size), "pts": pts}
+
+def test():
+    assert parse_Handoff("/GstPipeline:pipeline0/GstIdentity:meter_cam_0: last-message = chain   ******* (meter_cam_0:sink) "
+                         "(4096 bytes, dts: none, pts: 0:00:01.033333333, duration: 0:00:00.033333333, offset: -1, "
+                         "offset_end: -1, flags: 00004000 tag-memory , meta: none) 0x7f2c0c00a120") == \
+        ("meter_cam_0", "handoff", {"size": 4096, "pts": 1033333333})
+    assert parse_Message('Got message #12 from element "nvv4l2h264enc0" (qos): GstMessageQOS, live=(boolean)true, '
+                         'processed=(guint64)100, dropped=(guint64)3;') == \
+        ("nvv4l2h264enc0", "qos", {"live": "true", "processed": 100, "dropped": 3})
+
+    import Fake_GStreamer
+
+    #The subprocess engine against the gst-launch-1.0 stand-in, which needs no GStreamer
+    directory = tempfile.mkdtemp()
+    path = os.environ.get("PATH")
+    try:
+        bin_dir = os.path.join(directory, "bin")
+        os.makedirs(bin_dir)
+        Fake_GStreamer.install(bin_dir)
+
+        messages = []
+        finished = []
+        location = os.path.join(directory, "test.raw")
+        test_engine = Subprocess_Engine()
+        pipeline = test_engine.launch("videotestsrc is-live=true ! video/x-raw,width=320,height=240,framerate=30/1 ! "
+                                      "%s ! filesink location=%s" %(test_engine.meter("test"), location), "test",
+                                      lambda *message: messages.append(message))
+        pipeline.add_Finish_Callback(finished.append)
+        time.sleep(0.5)
+
+        try:
+            pipeline.set_Property("videotestsrc0", "pattern", 1)
+            assert False
+        except Pipeline_Error:
+            pass
+
+        #No frames are written while the pipeline is paused, and a paused pipeline still stops
+        pipeline.pause()
+        time.sleep(0.1)
+        paused_frames = len(Fake_GStreamer.read_Frames(location))
+        time.sleep(0.3)
+        assert len(Fake_GStreamer.read_Frames(location)) == paused_frames and pipeline.process.stop_time == None
+
+        pipeline.stop()
+        assert pipeline.is_Running() == False and finished == [pipeline] and pipeline.stop_latency != None
+        assert any(name == "eos" for element, name, fields in messages)
+
+        #Every frame written reached the file and was metered
+        frames = Fake_GStreamer.read_Frames(location)
+        handoffs = [fields for element, name, fields in messages if element == "meter_test" and name == "handoff"]
+        assert len(frames) > 0 and [index for index, t in frames] == list(range(len(frames)))
+        assert len(handoffs) == len(frames) and all(fields["size"] > 0 for fields in handoffs)
+
+        print("%s stand-in: stop latency %.1f ms" %(test_engine.name, pipeline.stop_latency * 1e3))
+    finally:
+        if path == None:
+            del os.environ["PATH"]
+        else:
+            os.environ["PATH"] = path
+        shutil.rmtree(directory)
+
+    engines = []
+    if Gst != None:
+        engines.append(get_Engine())
+    if shutil.which("gst-launch-1.0") != None:
+        engines.append(Subprocess_Engine())
+
+    if len(engines) == 0:
+        print("Neither PyGObject nor gst-launch-1.0 is installed, skipping the GStreamer tests")
+        print("Pipeline_Engine tests passed")
+        return
+
+    for test_engine in engines:
+        messages = []
+
+        #A live source that only finishes on EOS
+        pipeline = test_engine.launch("videotestsrc is-live=true ! video/x-raw,width=320,height=240,framerate=30/1 ! "
+                                      "fakesink sync=true", "test", lambda *message: messages.append(message))
+        time.sleep(0.5)
+
+        if pipeline.supports_Control == True:
+            pipeline.pause()
+            assert pipeline.pipeline.get_state(Gst.SECOND)[1] == Gst.State.PAUSED
+            pipeline.resume()
+            assert pipeline.pipeline.get_state(Gst.SECOND)[1] == Gst.State.PLAYING
+            pipeline.set_Property("videotestsrc0", "pattern", 1)
+            assert int(pipeline.get_Property("videotestsrc0", "pattern")) == 1
+
+        pipeline.stop()
+        assert pipeline.is_Running() == False
+        assert any(name == "eos" for element, name, fields in messages)
+
+        #Concurrent shutdowns finish the pipeline once
+        if pipeline.supports_Control == True:
+            finished = []
+            pipeline = test_engine.launch("videotestsrc is-live=true ! fakesink", "race")
+            pipeline.add_Finish_Callback(finished.append)
+            threads = [threading.Thread(target=pipeline.shutdown) for index in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert pipeline.is_Running() == False and finished == [pipeline]
+
+        #Data out of one pipeline and into another
+        chunks = []
+        source = test_engine.launch("videotestsrc num-buffers=10 ! video/x-raw,format=GRAY8,width=64,height=48 ! %s"
+                                    %(test_engine.data_Sink()), "source", data_callback = chunks.append)
+        source.wait(10)
+        assert sum(len(chunk) for chunk in chunks) == 10 * 64 * 48
+
+        print("%s engine: stop latency %.1f ms" %(test_engine.name, pipeline.stop_latency * 1e3))
+
+    print("Pipeline_Engine tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
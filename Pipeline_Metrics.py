@@ -0,0 +1,481 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Pipeline_Metrics
+#   Version:    1.00
+#
+#   Description:
+#   The Pipeline_Metrics library measures whether each camera's pipeline is keeping up. Every encoded frame reported by the
+#   camera's meter is counted towards its delivered framerate and bitrate, gaps in the frame timestamps are counted as dropped
+#   frames and gaps in their arrival as late frames, and the growth of the camera's output files and the start and stop
+#   latencies of its pipelines are recorded. The metrics of every camera are written periodically to a JSON file and served
+#   as Prometheus text on a loopback port.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in writing the metrics file
+import collections      #Used in holding the frames of the measurement window
+import json             #Used in writing the metrics file
+import threading        #Used in writing and serving the metrics in the background
+import time
+import urllib.request   #Used in testing the metrics endpoint
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from Pipeline_Engine import METER_PREFIX
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Length in seconds of the window over which rates are measured
+DEFAULT_METRICS_WINDOW = 5.0
+
+#Time in seconds between writes of the metrics file
+DEFAULT_METRICS_INTERVAL = 5.0
+
+#Address the metrics endpoint listens on
+METRICS_HOST = "127.0.0.1"
+
+#A frame arriving this many frame intervals after the previous one counts as late
+LATE_FRAME_FACTOR = 1.5
+
+#Name, type and description of each exported metric, keyed by its snapshot field
+EXPORTED_METRICS = (
+    ("running",             "camera_running",                       "gauge",    "1 while the camera's pipeline is running"),
+    ("fps",                 "camera_fps",                           "gauge",    "Frames delivered per second over the window"),
+    ("frames",              "camera_frames_total",                  "counter",  "Frames delivered by the current pipeline"),
+    ("dropped_frames",      "camera_dropped_frames_total",          "counter",  "Frames missing from the stream or dropped by QoS"),
+    ("late_frames",         "camera_late_frames_total",             "counter",  "Frames delivered more than 1.5 frame intervals late"),
+    ("bitrate",             "camera_bitrate_bits_per_second",       "gauge",    "Encoded bitrate over the window"),
+    ("file_growth",         "camera_file_growth_bytes_per_second",  "gauge",    "Growth of the output files over the window"),
+    ("start_latency",       "camera_start_latency_seconds",         "gauge",    "Time from pipeline launch to the first frame"),
+    ("stop_latency",        "camera_stop_latency_seconds",          "gauge",    "Time from the stop request to the pipeline finishing"),
+)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Pipeline_Metrics:
+    """
+    Class that measures the pipeline of a single camera.
+
+    @param name                 The name of the camera, and of its meter within the pipeline
+    @type name                  str
+
+    @param written_bytes        Function returning the number of bytes written to the camera's output files so far. None
+                                if the output is not measured
+    @type written_bytes         function
+
+    @param window               The length in seconds of the window over which rates are measured
+    @type window                float
+    """
+
+    def __init__(self, name, written_bytes = None, window = DEFAULT_METRICS_WINDOW):
+        """
+        Pipeline_Metrics Constructor.
+        """
+
+        self.name = name
+        self.meter_name = METER_PREFIX + name
+        self.written_bytes = written_bytes
+        self.window = window
+
+        self.lock = threading.Lock()
+        self.running = False
+        self.shared = False
+        self.interval = None
+        self.start_latency = None
+        self.stop_latency = None
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the counters of the previous pipeline. Must be called with the lock held, or from the constructor.
+        """
+
+        self.frames = collections.deque()
+        self.file_samples = collections.deque()
+        self.frame_count = 0
+        self.byte_count = 0
+        self.dropped_frames = 0
+        self.late_frames = 0
+        self.qos_dropped = {}
+        self.last_pts = None
+        self.last_arrival = None
+        self.start_time = None
+
+    def start(self, pipeline, framerate = None, shared = False):
+        """
+        Start measuring a newly launched pipeline.
+
+        @param pipeline:            The pipeline
+        @type pipeline:             Pipeline
+
+        @param framerate:           The framerate the camera was started at. None disables counting dropped and late
+                                    frames
+        @type framerate:            int
+
+        @param shared:              True if the pipeline also carries other cameras, so that only QoS messages from
+                                    elements named after this camera are counted
+        @type shared:               bool
+        """
+
+        with self.lock:
+            self.reset()
+            self.start_time = pipeline.start_time
+            self.interval = None
+            if framerate != None:
+                self.interval = 1.0 / framerate
+            self.shared = shared
+            self.running = True
+            self.start_latency = None
+
+        pipeline.add_Finish_Callback(self.stopped)
+
+    def stopped(self, pipeline):
+        """
+        Record the end of a pipeline. Called once the pipeline has finished.
+        """
+
+        with self.lock:
+            if pipeline.start_time != self.start_time:
+                return
+
+            self.running = False
+            if pipeline.stop_latency != None:
+                self.stop_latency = pipeline.stop_latency
+
+    def handle_Message(self, element, name, fields):
+        """
+        Count a handoff message from this camera's meter, or a QoS message from its pipeline.
+        """
+
+        if name == "handoff" and element == self.meter_name:
+            self.on_Frame(fields["size"], fields["pts"])
+
+        elif name == "qos" and (self.shared == False or element.endswith("_" + self.name)):
+            with self.lock:
+                self.qos_dropped[element] = fields.get("dropped", 0)
+
+    def on_Frame(self, size, pts = None, arrival = None):
+        """
+        Count a frame delivered by the pipeline.
+
+        @param size:                The size of the encoded frame in bytes
+        @type size:                 int
+
+        @param pts:                 The presentation timestamp of the frame in nanoseconds, None if unknown
+        @type pts:                  int
+
+        @param arrival:             The time.monotonic() time the frame was delivered. Defaults to now
+        @type arrival:              float
+        """
+
+        if arrival == None:
+            arrival = time.monotonic()
+
+        with self.lock:
+            if self.start_time != None and self.start_latency == None:
+                self.start_latency = arrival - self.start_time
+
+            if self.interval != None:
+                if pts != None and self.last_pts != None:
+                    self.dropped_frames += max(0, int(round((pts - self.last_pts) / 1e9 / self.interval)) - 1)
+                if self.last_arrival != None and arrival - self.last_arrival > LATE_FRAME_FACTOR * self.interval:
+                    self.late_frames += 1
+
+            if pts != None:
+                self.last_pts = pts
+            self.last_arrival = arrival
+
+            self.frame_count += 1
+            self.byte_count += size
+            self.frames.append((arrival, size))
+            self.trim(self.frames, arrival)
+
+    def trim(self, samples, now):
+        """
+        Discard the samples older than the window. Must be called with the lock held.
+        """
+
+        while len(samples) > 0 and samples[0][0] < now - self.window:
+            samples.popleft()
+
+    def snapshot(self, now = None):
+        """
+        Get the current metrics of the camera.
+
+        @return metrics:            The metrics, with None for anything not yet measured
+        @rtype metrics:             dict
+        """
+
+        if now == None:
+            now = time.monotonic()
+
+        written = None
+        if self.written_bytes != None:
+            written = self.written_bytes()
+
+        with self.lock:
+            self.trim(self.frames, now)
+
+            fps = None
+            bitrate = None
+            if self.running == True and self.start_time != None:
+                elapsed = min(self.window, now - self.start_time)
+                if elapsed > 0:
+                    fps = len(self.frames) / elapsed
+                    bitrate = sum(size for arrival, size in self.frames) * 8 / elapsed
+
+            file_growth = None
+            if written != None and self.running == True:
+                self.file_samples.append((now, written))
+                self.trim(self.file_samples, now)
+
+                first_time, first_written = self.file_samples[0]
+                if now > first_time:
+                    file_growth = (written - first_written) / (now - first_time)
+
+            return {
+                "camera": self.name,
+                "running": self.running,
+                "fps": fps,
+                "frames": self.frame_count,
+                "dropped_frames": self.dropped_frames + sum(self.qos_dropped.values()),
+                "late_frames": self.late_frames,
+                "bitrate": bitrate,
+                "file_growth": file_growth,
+                "start_latency": self.start_latency,
+                "stop_latency": self.stop_latency,
+            }
+
+
+
+class Metrics_Exporter:
+    """
+    Class that writes the metrics of a set of cameras to a JSON file periodically and serves them as Prometheus text on a
+    loopback port.
+
+    @param sources              The metrics of each camera
+    @type sources               [Pipeline_Metrics]
+
+    @param path                 The JSON file written. None disables the file
+    @type path                  str
+
+    @param port                 The loopback port on which GET /metrics is served. 0 picks a free port, None disables the
+                                endpoint
+    @type port                  int
+
+    @param interval             The time in seconds between writes of the file
+    @type interval              float
+
+    @param extra                Functions returning further metrics that are not per camera, keyed by the name they are
+                                exported under. Each returns a dict of numbers, with None for anything not yet measured
+    @type extra                 {str:function}
+    """
+
+    def __init__(self, sources, path = None, port = None, interval = DEFAULT_METRICS_INTERVAL, extra = None):
+        """
+        Metrics_Exporter Constructor.
+        """
+
+        self.sources = sources
+        self.extra = extra or {}
+        self.path = path
+        self.port = port
+        self.interval = interval
+
+        self.stopping = threading.Event()
+        self.writer = None
+        self.server = None
+        self.server_thread = None
+
+    def snapshot(self):
+        """
+        Get the current metrics of every camera.
+
+        @return metrics:            The time.time() time of the snapshot, each camera's metrics and the extra metrics
+        @rtype metrics:             dict
+        """
+
+        snapshot = {"time": time.time(), "cameras": [source.snapshot() for source in self.sources]}
+        for name, function in self.extra.items():
+            snapshot[name] = function()
+        return snapshot
+
+    def write(self):
+        """
+        Write the current metrics to the JSON file, replacing it in one step so that readers never see a partial file.
+        """
+
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as metrics_file:
+            json.dump(self.snapshot(), metrics_file, indent=2)
+        os.replace(temporary, self.path)
+
+    def prometheus_Text(self):
+        """
+        Get the current metrics in the Prometheus text exposition format.
+
+        @return text:               The metrics, one sample per camera per metric. Unmeasured samples are left out
+        @rtype text:                str
+        """
+
+        snapshot = self.snapshot()
+        cameras = snapshot["cameras"]
+        lines = []
+
+        for field, metric, metric_type, description in EXPORTED_METRICS:
+            lines.append("# HELP %s %s" %(metric, description))
+            lines.append("# TYPE %s %s" %(metric, metric_type))
+
+            for camera in cameras:
+                value = camera[field]
+                if value == None:
+                    continue
+                lines.append('%s{camera="%s"} %s' %(metric, camera["camera"], repr(float(value))))
+
+        #Extra metrics are exported as gauges named <name>_<field>
+        for name in self.extra:
+            for field, value in sorted(snapshot[name].items()):
+                if value == None:
+                    continue
+                lines.append("# TYPE %s_%s gauge" %(name, field))
+                lines.append("%s_%s %s" %(name, field, repr(float(value))))
+
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        """
+        Start writing the file and serving the endpoint.
+        """
+
+        self.stopping.clear()
+
+        if self.path != None:
+            self.writer = threading.Thread(target=self.run, name="metrics-writer", daemon=True)
+            self.writer.start()
+
+        if self.port != None:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+
+                    body = exporter.prometheus_Text().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer((METRICS_HOST, self.port), Handler)
+            self.port = self.server.server_address[1]
+            self.server_thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+            self.server_thread.start()
+
+    def run(self):
+        """
+        Write the file every interval until stopped, and once more on stopping. Runs on the writer thread.
+        """
+
+        while True:
+            stopping = self.stopping.wait(self.interval)
+            try:
+                self.write()
+            except OSError as error:
+                print("Warning: metrics could not be written to %s: %s" %(self.path, error))
+            if stopping == True:
+                return
+
+    def stop(self):
+        """
+        Stop writing the file and serving the endpoint.
+        """
+
+        self.stopping.set()
+
+        if self.writer != None:
+            self.writer.join()
+            self.writer = None
+
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server_thread.join()
+            self.server = None
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def test():
+    class Finished_Pipeline:
+        def __init__(self):
+            self.start_time = 100.0
+            self.stop_latency = 0.05
+
+        def add_Finish_Callback(self, callback):
+            self.callback = callback
+
+    pipeline = Finished_Pipeline()
+    written = [0]
+    metrics = Pipeline_Metrics("cam_0", written_bytes = lambda: written[0], window = 1.0)
+    metrics.start(pipeline, 10)
+
+    #Ten frames a second for a second, with the fifth frame missing and the eighth arriving late
+    for index in range(10):
+        if index == 5:
+            continue
+        arrival = 100.2 + index * 0.1 + (0.1 if index == 8 else 0.0)
+        metrics.on_Frame(5000, int(index * 1e8), arrival)
+
+    metrics.handle_Message("meter_cam_1", "handoff", {"size": 5000, "pts": None})
+    metrics.handle_Message("nvv4l2h264enc0", "qos", {"processed": 10, "dropped": 2})
+
+    written[0] = 1000
+    metrics.snapshot(now = 101.0)
+    written[0] = 3000
+    snapshot = metrics.snapshot(now = 101.2)
+
+    assert abs(snapshot["fps"] - 9.0) < 1e-6 and snapshot["frames"] == 9
+    assert abs(snapshot["bitrate"] - 9 * 5000 * 8) < 1e-6
+    assert snapshot["dropped_frames"] == 3 and snapshot["late_frames"] == 2
+    assert abs(snapshot["file_growth"] - 10000) < 1e-6
+    assert abs(snapshot["start_latency"] - 0.2) < 1e-6
+
+    pipeline.callback(pipeline)
+    assert metrics.snapshot()["stop_latency"] == 0.05 and metrics.running == False
+
+    exporter = Metrics_Exporter([metrics], port = 0, extra = {"standby": lambda: {"warm_time": 12.5, "warm_latency_max": None}})
+    exporter.start()
+    try:
+        text = urllib.request.urlopen("http://%s:%d/metrics" %(METRICS_HOST, exporter.port), timeout = 5).read().decode()
+    finally:
+        exporter.stop()
+
+    assert 'camera_dropped_frames_total{camera="cam_0"} 3.0' in text
+    assert 'camera_stop_latency_seconds{camera="cam_0"} 0.05' in text
+    assert "standby_warm_time 12.5" in text and "standby_warm_latency_max" not in text
+
+    print("Pipeline_Metrics tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
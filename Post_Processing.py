@@ -0,0 +1,843 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Post_Processing
+#   Version:    1.00
+#
+#   Description:
+#   The Post_Processing library derives files from the camera trap's recordings once they are kept: a thumbnail and a
+#   low-bitrate preview of each camera's clip, and a side-by-side merge of the clips two cameras took at the same trigger.
+#   The segments of a clip are read as one stream. Jobs are queued by priority and run on a small pool of worker processes
+#   at idle CPU and IO priority. None are started while any camera is recording and the running ones are paused until it
+#   stops, so post-processing never takes the encoder, the CPU or the card away from live capture. The queue is kept in an
+#   SQLite database, so jobs that had not finished when the trap stopped are run after it restarts.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in placing and removing derived files
+import ctypes           #Used in lowering the IO priority of the workers
+import heapq            #Used in ordering the queued jobs
+import json             #Used in storing the sources of each job
+import multiprocessing  #Used in starting the worker processes
+import platform         #Used in lowering the IO priority of the workers
+import shutil           #Used in removing test output
+import sqlite3          #Used in storing the queued jobs
+import tempfile         #Used in creating test output
+import threading        #Used in dispatching jobs in the background
+import concurrent.futures                           #Used in running jobs on the worker processes
+import time
+
+from Pipeline_Engine import get_Engine, Subprocess_Engine
+from Video_Container import recording_Format, CONTAINER_MATROSKA
+from Recording_Catalog import RECORDING_FILE_PATTERN
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Jobs
+JOB_THUMBNAIL = "thumbnail"
+JOB_PREVIEW = "preview"
+JOB_MERGE = "merge"
+
+#Order in which queued jobs are run, lowest first. Thumbnails are cheap and wanted first when browsing recordings
+JOB_PRIORITIES = {
+    JOB_THUMBNAIL:  0,
+    JOB_PREVIEW:    1,
+    JOB_MERGE:      2,
+}
+
+DEFAULT_POST_JOBS = (JOB_THUMBNAIL, JOB_PREVIEW)
+
+#Number of worker processes. A Nano has one encoder, so more workers only queue on it
+DEFAULT_POST_WORKERS = 1
+
+#Directory in the output directory that holds the derived files and the job queue
+DERIVED_DIR = "derived"
+
+#Name of the job queue database in the derived directory
+JOBS_NAME = "jobs.sqlite3"
+
+#Size of the thumbnails and of each camera's picture in previews and merges, as (width,height) of pixels
+THUMBNAIL_RESOLUTION = (320, 180)
+PREVIEW_RESOLUTION = (640, 360)
+
+#Bitrate in bits per second of previews, per camera for merges
+PREVIEW_BITRATE = 500000
+
+#Time in seconds between checks of whether the cameras are recording while jobs are queued or running, which bounds how
+#long a running job keeps the encoder after a recording starts
+PAUSE_POLL_INTERVAL = 0.1
+
+#Engine that runs the pipelines of this worker process, chosen as it starts. None uses the shared one
+worker_engine = None
+
+#Event shared with the dispatcher, set while the pipelines of this worker process must be paused. None never pauses them
+worker_hold = None
+
+#Niceness added to the worker processes, the lowest CPU priority
+WORKER_NICE = 19
+
+#Linux IO priority of the worker processes, the idle class which only gets the disk when no one else wants it
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+#Number of the ioprio_set system call, which has no wrapper in the standard library
+IOPRIO_SET_SYSCALLS = {
+    "x86_64":   251,
+    "aarch64":  30,
+}
+
+#Job states
+JOB_PENDING = "pending"
+JOB_FAILED = "failed"
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind        TEXT,
+    priority    INTEGER,
+    sources     TEXT,
+    output      TEXT,
+    state       TEXT,
+    error       TEXT,
+    created     REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority, id);
+"""
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Exceptions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Post_Processing_Error(Exception):
+    """
+    Exception raised when a job's pipeline fails.
+
+    @param path:                The path of the output
+    @type path:                 str
+
+    @param message:             Description of the error
+    @type message:              str
+    """
+
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+
+    def __str__(self):
+        return "%s: %s" %(self.path, self.message)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Post_Job:
+    """
+    Class representing a queued post-processing job.
+
+    @param kind                 The job, one of JOB_THUMBNAIL, JOB_PREVIEW or JOB_MERGE
+    @type kind                  str
+
+    @param sources              The recordings the job reads, the segments of each clip in order
+    @type sources               [str]
+
+    @param output               The path of the derived file
+    @type output                str
+
+    @param priority             The order in which the job is run among those queued, lowest first
+    @type priority              int
+
+    @param id                   The row of the job in the queue database
+    @type id                    int
+    """
+
+    def __init__(self, kind, sources, output, priority = None, id = None):
+        """
+        Post_Job Constructor.
+        """
+
+        if priority == None:
+            priority = JOB_PRIORITIES[kind]
+
+        self.kind = kind
+        self.sources = list(sources)
+        self.output = output
+        self.priority = priority
+        self.id = id
+
+    def __lt__(self, other):
+        return (self.priority, self.id) < (other.priority, other.id)
+
+
+
+class Post_Processor:
+    """
+    Class that runs post-processing jobs on a pool of worker processes. A dispatcher thread hands the queued jobs to the
+    workers in order of priority, no more at a time than there are workers. While busy() is True no jobs are started and
+    the pipelines of the running ones are paused, to resume where they stopped once it is False. The queue may be used from
+    any thread.
+
+    @param dir                  The directory the derived files are written to
+    @type dir                   str
+
+    @param workers              The number of worker processes
+    @type workers               int
+
+    @param completed            The number of jobs that succeeded
+    @type completed             int
+
+    @param failed               The number of jobs that failed, which are left in the database with their error
+    @type failed                int
+
+    @param skipped              The number of jobs dropped because their recordings had been deleted
+    @type skipped               int
+
+    @param paused               True while jobs are being held back and paused
+    @type paused                bool
+
+    @param hold                 Event set while the workers must pause their pipelines
+    @type hold                  multiprocessing.Event
+    """
+
+    def __init__(self, dir, workers = DEFAULT_POST_WORKERS, busy = None, engine_name = None):
+        """
+        Post_Processor Constructor. The jobs left pending in the directory's queue are run again.
+
+        @param dir:                 The directory the derived files and the job queue are kept in
+        @type dir:                  str
+
+        @param workers:             The number of worker processes
+        @type workers:              int
+
+        @param busy:                Function returning True while jobs must not run. None never holds them back
+        @type busy:                 function
+
+        @param engine_name:         The name of the engine the workers run pipelines on, Subprocess_Engine.name to force
+                                    gst-launch-1.0. None lets each worker pick the shared one
+        @type engine_name:          str
+        """
+
+        self.dir = dir
+        self.workers = workers
+        self.busy = busy
+
+        os.makedirs(dir, exist_ok=True)
+
+        self.connection = sqlite3.connect(os.path.join(dir, JOBS_NAME), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(JOBS_SCHEMA)
+        self.connection.commit()
+
+        self.condition = threading.Condition()
+        self.heap = []
+        self.running = 0
+        self.closed = False
+        self.paused = False
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+
+        rows = self.connection.execute("SELECT id, kind, priority, sources, output FROM jobs WHERE state = ?",
+                                       (JOB_PENDING,)).fetchall()
+        for id, kind, priority, sources, output in rows:
+            heapq.heappush(self.heap, Post_Job(kind, json.loads(sources), output, priority, id))
+
+        #The workers are started from a fork server rather than forked from this process, whose engine threads may hold
+        #locks at the time of the fork
+        context = multiprocessing.get_context("forkserver")
+        self.hold = context.Event()
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                               initializer=start_Worker,
+                                                               initargs=(engine_name, self.hold))
+
+        self.thread = threading.Thread(target=self.run, name="post-processor", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, sources, output, priority = None):
+        """
+        Queue a job.
+
+        @param kind:                The job, one of JOB_THUMBNAIL, JOB_PREVIEW or JOB_MERGE
+        @type kind:                 str
+
+        @param sources:             The recordings the job reads
+        @type sources:              [str]
+
+        @param output:              The path of the derived file
+        @type output:               str
+
+        @param priority:            The order in which the job is run, lowest first. Defaults to the job's usual priority
+        @type priority:             int
+
+        @return job:                The queued job
+        @rtype job:                 Post_Job
+        """
+
+        job = Post_Job(kind, sources, output, priority)
+
+        with self.condition:
+            cursor = self.connection.execute("INSERT INTO jobs (kind, priority, sources, output, state, created) "
+                                             "VALUES (?, ?, ?, ?, ?, ?)", (job.kind, job.priority, json.dumps(job.sources),
+                                                                           job.output, JOB_PENDING, time.time()))
+            self.connection.commit()
+            job.id = cursor.lastrowid
+
+            heapq.heappush(self.heap, job)
+            self.condition.notify_all()
+
+        return job
+
+    def submit_Recording(self, paths, jobs = DEFAULT_POST_JOBS):
+        """
+        Queue the jobs of a kept recording: a thumbnail of the first segment and a preview of the whole of each camera's
+        clip, and a merge of the clips of the first two cameras, in order of name.
+
+        @param paths:               The files of the recording
+        @type paths:                [str]
+
+        @param jobs:                The jobs to run
+        @type jobs:                 (str)
+
+        @return jobs:               The queued jobs
+        @rtype jobs:                [Post_Job]
+        """
+
+        queued = []
+        recordings = {}
+
+        for name, sources in group_Clips(paths):
+            if JOB_THUMBNAIL in jobs:
+                queued.append(self.submit(JOB_THUMBNAIL, sources[:1], self.thumbnail_Path(sources[0])))
+            if JOB_PREVIEW in jobs:
+                queued.append(self.submit(JOB_PREVIEW, sources, self.preview_Path(sources[0])))
+
+            match = RECORDING_FILE_PATTERN.match(os.path.basename(sources[0]))
+            if match != None:
+                recordings.setdefault(match.group(1), {})[match.group(2)] = sources
+
+        if JOB_MERGE in jobs:
+            for recording, cameras in sorted(recordings.items()):
+                if len(cameras) < 2:
+                    continue
+                sources = [source for name in sorted(cameras)[:2] for source in cameras[name]]
+                queued.append(self.submit(JOB_MERGE, sources, self.merge_Path(recording)))
+
+        return queued
+
+    def thumbnail_Path(self, path):
+        """
+        Get the path of the thumbnail of the clip a recorded file belongs to.
+        """
+
+        return os.path.join(self.dir, clip_Name(path) + ".jpg")
+
+    def preview_Path(self, path):
+        """
+        Get the path of the preview of the clip a recorded file belongs to.
+        """
+
+        return os.path.join(self.dir, clip_Name(path) + "_preview.mp4")
+
+    def merge_Path(self, recording):
+        """
+        Get the path of the merge of a recording.
+        """
+
+        return os.path.join(self.dir, "%s_merged.mp4" %(recording))
+
+    def remove_Derived(self, paths):
+        """
+        Delete the files derived from deleted recordings. Jobs still queued for them are dropped when they come to run.
+
+        @param paths:               The paths of the deleted recordings
+        @type paths:                [str]
+        """
+
+        for path in paths:
+            derived = [self.thumbnail_Path(path), self.preview_Path(path)]
+
+            match = RECORDING_FILE_PATTERN.match(os.path.basename(path))
+            if match != None:
+                derived.append(self.merge_Path(match.group(1)))
+
+            for location in derived:
+                try:
+                    os.remove(location)
+                except FileNotFoundError:
+                    pass
+
+    def run(self):
+        """
+        Hand queued jobs to the workers until the processor is closed. Runs on the dispatcher thread.
+        """
+
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed == True:
+                        return
+
+                    held = False
+                    if self.busy != None and len(self.heap) + self.running > 0:
+                        held = self.busy()
+                    self.hold_Workers(held)
+
+                    if len(self.heap) > 0 and self.running < self.workers and held == False:
+                        break
+
+                    #Running jobs are watched so that they are paused as soon as a recording starts
+                    if self.busy != None and len(self.heap) + self.running > 0:
+                        self.condition.wait(PAUSE_POLL_INTERVAL)
+                    else:
+                        self.condition.wait()
+
+                job = heapq.heappop(self.heap)
+                self.running += 1
+
+            try:
+                future = self.executor.submit(run_Job, job.kind, job.sources, job.output)
+            except RuntimeError:
+                #The executor has been shut down, the job stays pending for the next run
+                with self.condition:
+                    self.running -= 1
+                    self.condition.notify_all()
+                return
+
+            future.add_done_callback(lambda future, job=job: self.finish(job, future))
+
+    def hold_Workers(self, held):
+        """
+        Hold back the queued jobs and pause the running ones, or let them run again.
+
+        @param held:                True to hold the jobs
+        @type held:                 bool
+        """
+
+        self.paused = held
+        if held == True:
+            self.hold.set()
+        else:
+            self.hold.clear()
+
+    def finish(self, job, future):
+        """
+        Record the outcome of a job. Called when its worker returns.
+        """
+
+        with self.condition:
+            self.running -= 1
+
+            if future.cancelled() == True:
+                pass
+            elif future.exception() == None:
+                self.completed += 1
+                self.connection.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+            elif isinstance(future.exception(), FileNotFoundError) == True:
+                self.skipped += 1
+                self.connection.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+            else:
+                self.failed += 1
+                self.connection.execute("UPDATE jobs SET state = ?, error = ? WHERE id = ?",
+                                        (JOB_FAILED, str(future.exception()), job.id))
+
+            if self.closed == False:
+                self.connection.commit()
+            self.condition.notify_all()
+
+    def pending(self):
+        """
+        Get the number of jobs queued or running.
+        """
+
+        with self.condition:
+            return len(self.heap) + self.running
+
+    def summary(self):
+        """
+        Summarise the queue.
+
+        @return summary:            The number of jobs pending, completed, failed and skipped, and whether jobs are held back
+        @rtype summary:             {str:int}
+        """
+
+        return {
+            "pending": self.pending(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "paused": int(self.paused),
+        }
+
+    def flush(self, timeout = None):
+        """
+        Wait until every queued job has run.
+
+        @param timeout:             The time in seconds to wait. None waits for every job
+        @type timeout:              float
+
+        @return done:               True if every job has run
+        @rtype done:                bool
+        """
+
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.heap) + self.running == 0, timeout)
+
+    def close(self):
+        """
+        Wait for the running jobs and stop the workers. Queued jobs are kept for the next run.
+        """
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        #Paused jobs are resumed so that they can finish
+        self.thread.join()
+        self.hold_Workers(False)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+        with self.condition:
+            self.connection.commit()
+            self.connection.close()
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def lower_Priority():
+    """
+    Give the calling process, and the pipelines it starts, the lowest CPU priority and idle IO priority. Runs in each
+    worker process as it starts.
+    """
+
+    os.nice(WORKER_NICE)
+
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall != None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+
+def start_Worker(engine_name, hold = None):
+    """
+    Lower the priority of a worker process and choose the engine its pipelines run on. Runs in each worker process as it
+    starts.
+
+    @param engine_name:         The name of the engine, Subprocess_Engine.name to force gst-launch-1.0. None uses the
+                                shared one
+    @type engine_name:          str
+
+    @param hold:                Event set while the worker's pipelines must be paused
+    @type hold:                 multiprocessing.Event
+    """
+
+    global worker_engine, worker_hold
+
+    lower_Priority()
+    worker_hold = hold
+
+    if engine_name == Subprocess_Engine.name:
+        worker_engine = Subprocess_Engine()
+
+def clip_Name(path):
+    """
+    Get the name of the clip a recorded file belongs to, its recording and camera. Files not named as recordings are a
+    clip of their own.
+
+    @param path:                The path of the recorded file
+    @type path:                 str
+
+    @return name:               The name of the clip
+    @rtype name:                str
+    """
+
+    match = RECORDING_FILE_PATTERN.match(os.path.basename(path))
+    if match == None:
+        return os.path.splitext(os.path.basename(path))[0]
+
+    return "%s_%s" %(match.group(1), match.group(2))
+
+def group_Clips(paths):
+    """
+    Group recorded files into clips, the segments of each in order.
+
+    @param paths:               The paths of the recorded files
+    @type paths:                [str]
+
+    @return clips:              The name and segments of each clip, in the order the clips first appear
+    @rtype clips:               [(str,[str])]
+    """
+
+    clips = {}
+    for path in paths:
+        clips.setdefault(clip_Name(path), []).append(path)
+
+    #Files not named as recordings keep the order they were given in
+    for sources in clips.values():
+        matches = [RECORDING_FILE_PATTERN.match(os.path.basename(source)) for source in sources]
+        if None not in matches:
+            ordered = sorted(zip(matches, sources), key=lambda pair: int(pair[0].group(3)))
+            sources[:] = [source for match, source in ordered]
+
+    return list(clips.items())
+
+def decoder(sources, resolution, name = "concat"):
+    """
+    Get the GStreamer pipeline description that decodes the segments of a clip as one stream and scales it to a
+    resolution in NVMM memory. Several segments are joined by a concat element, whose inputs must be placed after the
+    rest of the pipeline.
+
+    @param sources:             The paths of the segments, in order
+    @type sources:              [str]
+
+    @param resolution:          The resolution as (width,height) of pixels
+    @type resolution:           (int,int)
+
+    @param name:                The name of the concat element, unique within the pipeline
+    @type name:                 str
+
+    @return pipeline:           The pipeline description, ending in the scaled raw video
+    @rtype pipeline:            str
+
+    @return inputs:             The description of the concat element's inputs, empty for a single segment
+    @rtype inputs:              str
+    """
+
+    readers = []
+    for source in sources:
+        demuxer = "qtdemux"
+        if recording_Format(source) == CONTAINER_MATROSKA:
+            demuxer = "matroskademux"
+        readers.append("filesrc location=%s ! %s ! h264parse" %(source, demuxer))
+
+    if len(readers) == 1:
+        pipeline = readers[0]
+        inputs = ""
+    else:
+        pipeline = "concat name=%s" %(name)
+        inputs = "".join(" %s ! %s." %(reader, name) for reader in readers)
+
+    pipeline += " ! nvv4l2decoder ! nvvidconv ! "
+    pipeline += "'video/x-raw(memory:NVMM),format=RGBA,width=%d,height=%d'" %(resolution[0], resolution[1])
+
+    return pipeline, inputs
+
+def thumbnail_Pipeline(source, output):
+    """
+    Get the GStreamer pipeline description that writes the first frame of a recording as a JPEG thumbnail.
+    """
+
+    pipeline, inputs = decoder([source], THUMBNAIL_RESOLUTION)
+    pipeline += " ! nvvidconv ! 'video/x-raw,format=I420' ! jpegenc snapshot=true ! filesink location=%s" %(output)
+
+    return pipeline + inputs
+
+def preview_Pipeline(sources, output):
+    """
+    Get the GStreamer pipeline description that transcodes the segments of a clip into one low-bitrate MP4 preview.
+    """
+
+    pipeline, inputs = decoder(sources, PREVIEW_RESOLUTION)
+    pipeline += " ! nvvidconv ! 'video/x-raw(memory:NVMM),format=NV12' ! nvv4l2h264enc bitrate=%d ! h264parse ! " \
+                %(PREVIEW_BITRATE)
+    pipeline += "mp4mux faststart=true ! filesink location=%s" %(output)
+
+    return pipeline + inputs
+
+def merge_Pipeline(sources, output):
+    """
+    Get the GStreamer pipeline description that places clips side by side in one MP4, in order from the left. The
+    segments of each clip are joined before they are placed.
+    """
+
+    width, height = PREVIEW_RESOLUTION
+    clips = group_Clips(sources)
+
+    pipeline = "nvcompositor name=merge"
+    for index in range(len(clips)):
+        pipeline += " sink_%d::xpos=%d sink_%d::ypos=0" %(index, index * width, index)
+    pipeline += " ! nvvidconv ! 'video/x-raw(memory:NVMM),format=NV12,width=%d,height=%d' ! " %(len(clips) * width,
+                                                                                               height)
+    pipeline += "nvv4l2h264enc bitrate=%d ! h264parse ! mp4mux faststart=true ! filesink location=%s" \
+                %(len(clips) * PREVIEW_BITRATE, output)
+
+    for index, (name, segments) in enumerate(clips):
+        clip, inputs = decoder(segments, PREVIEW_RESOLUTION, "concat_%d" %(index))
+        pipeline += " %s ! merge.sink_%d%s" %(clip, index, inputs)
+
+    return pipeline
+
+def run_Job(kind, sources, output, engine = None, hold = None):
+    """
+    Run a job, writing its output through a temporary file so that an interrupted job leaves no partial output, and
+    pausing its pipeline while the hold is set. Runs on a worker process.
+
+    @param kind:                The job, one of JOB_THUMBNAIL, JOB_PREVIEW or JOB_MERGE
+    @type kind:                 str
+
+    @param sources:             The recordings the job reads, the segments of each clip in order
+    @type sources:              [str]
+
+    @param output:              The path of the derived file
+    @type output:               str
+
+    @param engine:              The engine that runs the pipeline. Defaults to the one the worker was started with
+    @type engine:               Gst_Engine or Subprocess_Engine
+
+    @param hold:                Event set while the pipeline must be paused. Defaults to the one the worker was started
+                                with
+    @type hold:                 multiprocessing.Event
+
+    @return output:             The path of the derived file
+    @rtype output:              str
+    """
+
+    for source in sources:
+        if os.path.exists(source) == False:
+            raise FileNotFoundError(source)
+
+    if engine == None:
+        engine = worker_engine
+    if engine == None:
+        engine = get_Engine()
+    if hold == None:
+        hold = worker_hold
+
+    temporary = "%s.part" %(output)
+    if kind == JOB_THUMBNAIL:
+        description = thumbnail_Pipeline(sources[0], temporary)
+    elif kind == JOB_PREVIEW:
+        description = preview_Pipeline(sources, temporary)
+    else:
+        description = merge_Pipeline(sources, temporary)
+
+    pipeline = engine.launch(description, kind, quiet = True)
+
+    paused = False
+    while pipeline.wait(PAUSE_POLL_INTERVAL) == False:
+        if hold == None or hold.is_set() == paused:
+            continue
+
+        paused = not paused
+        if paused == True:
+            pipeline.pause()
+        else:
+            pipeline.resume()
+
+    if pipeline.error != None or os.path.exists(temporary) == False:
+        if os.path.exists(temporary) == True:
+            os.remove(temporary)
+        raise Post_Processing_Error(output, pipeline.error or "the %s pipeline wrote nothing" %(kind))
+
+    os.replace(temporary, output)
+    return output
+
+def test():
+    import Fake_GStreamer
+
+    path_variable = os.environ.get("PATH")
+    directory = tempfile.mkdtemp()
+    try:
+        bin_dir = os.path.join(directory, "bin")
+        os.makedirs(bin_dir)
+        Fake_GStreamer.install(bin_dir)
+
+        paths = []
+        for camera in ("cam_0", "cam_1"):
+            for segment in range(2):
+                path = os.path.join(directory, "20260101_120000_%s_%03d.mp4" %(camera, segment))
+                with open(path, "wb") as recording:
+                    recording.write(b"\x00\x00\x00\x18ftypisom" + bytes(64))
+                paths.append(path)
+
+        merge = merge_Pipeline(paths, "merged.mp4")
+        assert merge.startswith("nvcompositor name=merge sink_0::xpos=0 sink_0::ypos=0 sink_1::xpos=640")
+        assert "qtdemux" in merge and "width=1280,height=360" in merge
+        assert " concat name=concat_0 ! nvv4l2decoder" in merge
+        assert "_cam_1_001.mp4 ! qtdemux ! h264parse ! concat_1." in merge
+        assert preview_Pipeline(paths[:1], "preview.mp4").startswith("filesrc location=%s ! qtdemux" %(paths[0]))
+
+        derived = os.path.join(directory, DERIVED_DIR)
+
+        #Nothing starts while the cameras are recording
+        recording = [True]
+        processor = Post_Processor(derived, busy = lambda: recording[0], engine_name = Subprocess_Engine.name)
+        jobs = processor.submit_Recording(list(reversed(paths)), (JOB_THUMBNAIL, JOB_PREVIEW, JOB_MERGE))
+        assert [job.kind for job in jobs] == [JOB_THUMBNAIL, JOB_PREVIEW, JOB_THUMBNAIL, JOB_PREVIEW, JOB_MERGE]
+        assert jobs[0].sources == [paths[2]] and jobs[1].sources == paths[2:] and jobs[4].sources == paths
+        missing = os.path.join(directory, "20260101_130000_cam_0_000.mp4")
+        processor.submit(JOB_PREVIEW, [missing], processor.preview_Path(missing))
+        time.sleep(2 * PAUSE_POLL_INTERVAL)
+        assert processor.paused == True and processor.pending() == 6 and processor.completed == 0
+
+        #Queued jobs survive a restart
+        processor.close()
+        processor = Post_Processor(derived, workers = 2, busy = lambda: recording[0],
+                                   engine_name = Subprocess_Engine.name)
+        assert processor.pending() == 6
+
+        #Jobs run by priority once recording stops, one of each per clip. A deleted recording's jobs are dropped
+        recording[0] = False
+        assert processor.flush(30) == True
+        assert processor.completed == 5 and processor.skipped == 1 and processor.failed == 0
+
+        outputs = sorted(os.listdir(derived))
+        assert "20260101_120000_cam_0.jpg" in outputs and "20260101_120000_cam_1_preview.mp4" in outputs
+        assert "20260101_120000_merged.mp4" in outputs and "20260101_130000_cam_0_preview.mp4" not in outputs
+        assert len([name for name in outputs if name.endswith(".part")]) == 0
+
+        processor.remove_Derived([paths[1]])
+        assert "20260101_120000_cam_0.jpg" not in os.listdir(derived)
+        assert "20260101_120000_merged.mp4" not in os.listdir(derived)
+        assert "20260101_120000_cam_1.jpg" in os.listdir(derived)
+
+        #A job started before a recording makes no progress until it stops. The stand-in transcodes a line per frame
+        source = os.path.join(directory, "20260101_140000_cam_0_000.mp4")
+        with open(source, "w") as recording_file:
+            for index in range(90):
+                recording_file.write("%d 0\n" %(index))
+        job = processor.submit(JOB_PREVIEW, [source], processor.preview_Path(source))
+        partial = job.output + ".part"
+
+        deadline = time.monotonic() + 30
+        while (os.path.exists(partial) == False or os.path.getsize(partial) == 0) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        recording[0] = True
+        time.sleep(5 * PAUSE_POLL_INTERVAL)
+        progress = os.path.getsize(partial)
+        time.sleep(1)
+        assert os.path.getsize(partial) == progress and processor.paused == True and processor.completed == 5
+
+        recording[0] = False
+        assert processor.flush(30) == True and processor.completed == 6
+        with open(job.output) as preview:
+            assert len(preview.readlines()) == 90
+
+        processor.close()
+
+        processor = Post_Processor(derived, engine_name = Subprocess_Engine.name)
+        assert processor.pending() == 0
+        processor.close()
+
+    finally:
+        if path_variable == None:
+            os.environ.pop("PATH", None)
+        else:
+            os.environ["PATH"] = path_variable
+        shutil.rmtree(directory)
+
+    print("Post_Processing tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
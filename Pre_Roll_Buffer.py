@@ -0,0 +1,356 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Pre_Roll_Buffer
+#   Version:    1.00
+#
+#   Description:
+#   The Pre_Roll_Buffer library keeps a bounded, GOP-aligned history of encoded H.264 access units so that a recording started by
+#   a trigger can include the footage captured in the seconds before the trigger fired.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import collections      #Used in storing buffered GOPs
+import threading        #Used in sharing the buffer between the reader and trigger threads
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Annex-B start code prefix
+START_CODE = b"\x00\x00\x01"
+
+#H.264 NAL unit types
+NAL_SLICE = 1
+NAL_IDR_SLICE = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+#NAL unit types that may only appear at the start of an access unit
+AU_PREFIX_TYPES = (NAL_SEI, NAL_SPS, NAL_PPS, NAL_AUD, 14, 15, 16, 17, 18)
+
+#Default pre-roll limits
+DEFAULT_PRE_ROLL_DURATION = 3.0
+DEFAULT_PRE_ROLL_BYTES = 8 * 1024 * 1024
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Access_Unit:
+    """
+    Class representing a single encoded H.264 picture together with any parameter sets that precede it.
+
+    @param data                 The Annex-B encoded bytes of the access unit
+    @type data                  bytes
+
+    @param keyframe             True if the access unit contains an IDR slice
+    @type keyframe              bool
+    """
+
+    def __init__(self, data, keyframe):
+        """
+        Access_Unit Constructor.
+        """
+
+        self.data = data
+        self.keyframe = keyframe
+
+
+
+class H264_Parser:
+    """
+    Class that splits an Annex-B H.264 byte stream, delivered in arbitrary sized chunks, into access units.
+
+    @param buffer               Bytes received that do not yet form a complete NAL unit
+    @type buffer                bytearray
+    """
+
+    def __init__(self):
+        """
+        H264_Parser Constructor.
+        """
+
+        self.buffer = bytearray()
+        self.nals = []
+        self.has_vcl = False
+        self.keyframe = False
+
+    def push(self, data):
+        """
+        Add bytes from the stream and return the access units they complete.
+
+        @param data:                The next chunk of the byte stream
+        @type data:                 bytes
+
+        @return units:              The access units completed by this chunk
+        @rtype units:               [Access_Unit]
+        """
+
+        self.buffer += data
+        units = []
+
+        start = self.find_Start_Code(0)
+        if start == -1:
+            return units
+
+        while True:
+            end = self.find_Start_Code(start + 4)
+            if end == -1:
+                break
+
+            self.add_NAL(bytes(self.buffer[start:end]), units)
+            start = end
+
+        del self.buffer[:start]
+        return units
+
+    def find_Start_Code(self, position):
+        """
+        Find the next start code at or after position, including the leading zero of a four byte start code.
+        """
+
+        index = self.buffer.find(START_CODE, position)
+        if index > position and self.buffer[index - 1] == 0:
+            index -= 1
+        return index
+
+    def flush(self):
+        """
+        Return the final access unit once the stream has ended.
+
+        @return units:              The remaining access units
+        @rtype units:               [Access_Unit]
+        """
+
+        units = []
+        if self.find_Start_Code(0) == 0:
+            self.add_NAL(bytes(self.buffer), units)
+        self.buffer = bytearray()
+
+        if self.has_vcl == True:
+            units.append(self.end_Access_Unit())
+        return units
+
+    def add_NAL(self, nal, units):
+        """
+        Append a NAL unit to the current access unit, ending it first if the NAL starts a new picture.
+        """
+
+        #Skip the three or four byte start code
+        header = nal.find(START_CODE) + 3
+        if len(nal) <= header:
+            return
+
+        nal_type = nal[header] & 0x1F
+
+        if self.has_vcl == True:
+            if nal_type in AU_PREFIX_TYPES:
+                units.append(self.end_Access_Unit())
+
+            #first_mb_in_slice is 0 (the first bit of the slice header is set) for the first slice of a picture
+            elif nal_type in (NAL_SLICE, NAL_IDR_SLICE) and len(nal) > header + 1 and nal[header + 1] & 0x80:
+                units.append(self.end_Access_Unit())
+
+        if nal_type in (NAL_SLICE, NAL_IDR_SLICE):
+            self.has_vcl = True
+        if nal_type == NAL_IDR_SLICE:
+            self.keyframe = True
+
+        self.nals.append(nal)
+
+    def end_Access_Unit(self):
+        """
+        Close the current access unit and start a new one.
+        """
+
+        unit = Access_Unit(b"".join(self.nals), self.keyframe)
+
+        self.nals = []
+        self.has_vcl = False
+        self.keyframe = False
+
+        return unit
+
+
+
+class Pre_Roll_Buffer:
+    """
+    Class representing a bounded ring of encoded GOPs. The ring always begins on a keyframe so that its contents can be
+    written to a new file as-is.
+
+    @param duration             The length of video in seconds to keep
+    @type duration              float
+
+    @param max_bytes            The maximum number of bytes to keep. The most recent GOP is kept even if it exceeds this
+    @type max_bytes             int
+
+    @param framerate            The framerate of the buffered stream
+    @type framerate             int
+    """
+
+    def __init__(self, duration = DEFAULT_PRE_ROLL_DURATION, max_bytes = DEFAULT_PRE_ROLL_BYTES, framerate = 30):
+        """
+        Pre_Roll_Buffer Constructor.
+
+        @param duration             The length of video in seconds to keep
+        @type duration              float
+
+        @param max_bytes            The maximum number of bytes to keep
+        @type max_bytes             int
+
+        @param framerate            The framerate of the buffered stream
+        @type framerate             int
+        """
+
+        self.duration = duration
+        self.max_bytes = max_bytes
+        self.framerate = framerate
+
+        self.lock = threading.Lock()
+        self.gops = collections.deque()
+        self.frame_count = 0
+        self.byte_count = 0
+
+    def push(self, unit):
+        """
+        Add an access unit to the ring, evicting whole GOPs from the oldest end when a limit is exceeded.
+
+        @param unit:                The access unit to buffer
+        @type unit:                 Access_Unit
+        """
+
+        with self.lock:
+
+            if unit.keyframe == True:
+                self.gops.append([])
+            elif len(self.gops) == 0:
+                #Nothing can be decoded until the first keyframe
+                return
+
+            self.gops[-1].append(unit)
+            self.frame_count += 1
+            self.byte_count += len(unit.data)
+
+            self.trim()
+
+    def trim(self):
+        """
+        Drop the oldest GOPs while the remaining GOPs still cover the configured duration, or while the byte limit is
+        exceeded.
+        """
+
+        while len(self.gops) > 1:
+            oldest = self.gops[0]
+            oldest_bytes = sum(len(unit.data) for unit in oldest)
+
+            remaining_duration = (self.frame_count - len(oldest)) / float(self.framerate)
+            if remaining_duration < self.duration and self.byte_count <= self.max_bytes:
+                break
+
+            self.gops.popleft()
+            self.frame_count -= len(oldest)
+            self.byte_count -= oldest_bytes
+
+    def buffered_Duration(self):
+        """
+        Get the length of the video currently held.
+
+        @return duration:           Buffered length in seconds
+        @rtype duration:            float
+        """
+
+        with self.lock:
+            return self.frame_count / float(self.framerate)
+
+    def flush(self):
+        """
+        Remove and return the buffered access units, oldest first.
+
+        @return units:              The buffered access units, beginning with a keyframe
+        @rtype units:               [Access_Unit]
+        """
+
+        with self.lock:
+            units = [unit for gop in self.gops for unit in gop]
+
+            self.gops.clear()
+            self.frame_count = 0
+            self.byte_count = 0
+
+        return units
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def synthetic_Access_Unit(keyframe, size = 64):
+    """
+    Build a minimal Annex-B access unit for exercising the parser and buffer without an encoder.
+
+    @param keyframe:            Build an IDR access unit preceded by SPS and PPS
+    @type keyframe:             bool
+
+    @param size:                The number of payload bytes in the slice
+    @type size:                 int
+
+    @return data:               The encoded access unit
+    @rtype data:                bytes
+    """
+
+    data = b"\x00\x00\x00\x01\x09\xf0"
+    if keyframe == True:
+        data += b"\x00\x00\x00\x01\x67\x42\x00\x1f" + b"\x00\x00\x00\x01\x68\xce\x3c\x80"
+        data += b"\x00\x00\x01\x65\x88" + b"\x11" * size
+    else:
+        data += b"\x00\x00\x01\x41\x9a" + b"\x22" * size
+    return data
+
+def test():
+    framerate = 10
+    gop_length = 5
+
+    stream = b"".join(synthetic_Access_Unit(index % gop_length == 0) for index in range(100))
+
+    parser = H264_Parser()
+    ring = Pre_Roll_Buffer(duration = 1.0, max_bytes = 1024 * 1024, framerate = framerate)
+
+    #Feed the stream in awkward chunk sizes to cross NAL boundaries
+    units = []
+    for offset in range(0, len(stream), 37):
+        units += parser.push(stream[offset:offset + 37])
+    units += parser.flush()
+
+    assert len(units) == 100
+    assert b"".join(unit.data for unit in units) == stream
+
+    for unit in units:
+        ring.push(unit)
+
+    buffered = ring.flush()
+    assert buffered[0].keyframe == True
+    assert framerate * 1.0 <= len(buffered) < framerate * 1.0 + gop_length
+
+    ring = Pre_Roll_Buffer(duration = 10.0, max_bytes = 2000, framerate = framerate)
+    for unit in units:
+        ring.push(unit)
+
+    buffered = ring.flush()
+    assert buffered[0].keyframe == True
+    assert sum(len(unit.data) for unit in buffered) <= 2000
+
+    print("Pre_Roll_Buffer tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,376 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Process_Supervisor
+#   Version:    1.00
+#
+#   Description:
+#   The Process_Supervisor library owns the capture subprocesses started by the camera modules. Every child is started in its own
+#   process group and tracked by handle, so that it can be stopped with an EOS signal, escalated if it does not exit in time and
+#   reaped in the background without searching the process table.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in signalling process groups
+import sys
+import shlex            #Used in splitting command strings into arguments
+import signal           #Used in stopping processes
+import subprocess       #Used in starting processes
+import threading        #Used in reaping processes
+import time
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Time in seconds a process is given to finish after the EOS signal before it is escalated
+DEFAULT_EOS_TIMEOUT = 2.0
+
+#Time in seconds a process is given to exit after each escalation signal
+ESCALATION_TIMEOUT = 0.5
+
+#Signals sent after the EOS signal, in order, if the process is still running
+ESCALATION_SIGNALS = (signal.SIGTERM, signal.SIGKILL)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Supervised_Process:
+    """
+    Class representing a child process owned by a Process_Supervisor.
+
+    @param name                 The plaintext name given to the process
+    @type name                  str
+
+    @param popen                The underlying process
+    @type popen                 Popen
+
+    @param pgid                 The ID of the process group led by the process
+    @type pgid                  int
+
+    @param returncode           The exit status of the process, None while it is running
+    @type returncode            int
+
+    @param stop_latency         The time in seconds between the first stop signal and the process exiting
+    @type stop_latency          float
+    """
+
+    def __init__(self, name, popen):
+        """
+        Supervised_Process Constructor.
+        """
+
+        self.name = name
+        self.popen = popen
+        self.pid = popen.pid
+        self.pgid = popen.pid
+        self.stdin = popen.stdin
+        self.stdout = popen.stdout
+        self.stderr = popen.stderr
+        self.returncode = None
+
+        self.start_time = time.monotonic()
+        self.stop_time = None
+        self.exit_time = None
+        self.stop_latency = None
+
+        self.lock = threading.Lock()
+        self.exited = threading.Event()
+        self.callbacks = []
+
+    def poll(self):
+        """
+        Return the exit status of the process, or None if it is still running.
+        """
+
+        if self.exited.is_set() == False:
+            return None
+        return self.returncode
+
+    def is_Running(self):
+        """
+        Return True if the process has not exited.
+        """
+
+        return self.exited.is_set() == False
+
+    def wait(self, timeout = None):
+        """
+        Wait for the process to exit.
+
+        @param timeout:             The maximum time in seconds to wait. None waits indefinitely
+        @type timeout:              float
+
+        @return returncode:         The exit status of the process, or None if the timeout expired
+        @rtype returncode:          int
+        """
+
+        if self.exited.wait(timeout) == False:
+            return None
+        return self.returncode
+
+    def send_Signal(self, sig):
+        """
+        Send a signal to the process group. Does nothing if the process has already been reaped, which only happens
+        with the lock held. Any signal other than SIGSTOP and SIGCONT is taken as the start of stopping the process.
+
+        @param sig:                 The signal to send
+        @type sig:                  int
+        """
+
+        with self.lock:
+            if self.returncode != None:
+                return
+
+            if self.stop_time == None and sig not in (signal.SIGSTOP, signal.SIGCONT):
+                self.stop_time = time.monotonic()
+
+            try:
+                os.killpg(self.pgid, sig)
+            except ProcessLookupError:
+                pass
+
+    def add_Exit_Callback(self, callback):
+        """
+        Call a function with this handle once the process has exited. Called immediately if it already has. Callbacks
+        finish before wait() returns.
+
+        @param callback:            The function to call
+        @type callback:             function
+        """
+
+        with self.lock:
+            if self.returncode == None:
+                self.callbacks.append(callback)
+                return
+
+        callback(self)
+
+    def reap(self):
+        """
+        Wait for the process to exit and run its exit callbacks. Runs on the reaper thread.
+        """
+
+        #Wait for the exit without reaping, then reap under the lock, so that send_Signal never signals a process group
+        #whose ID has been freed for reuse
+        try:
+            os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            pass
+
+        with self.lock:
+            self.exit_time = time.monotonic()
+            self.returncode = self.popen.wait()
+            if self.stop_time != None:
+                self.stop_latency = self.exit_time - self.stop_time
+
+            callbacks = self.callbacks
+            self.callbacks = []
+
+        for callback in callbacks:
+            callback(self)
+
+        self.exited.set()
+
+
+
+class Process_Supervisor:
+    """
+    Class that starts, tracks and stops capture subprocesses.
+
+    @param processes            The processes started by the supervisor that have not yet exited
+    @type processes             [Supervised_Process]
+    """
+
+    def __init__(self):
+        """
+        Process_Supervisor Constructor.
+        """
+
+        self.lock = threading.Lock()
+        self.processes = []
+
+    def spawn(self, command, name, **kwargs):
+        """
+        Start a process in a new process group.
+
+        @param command:             The command to run, either as an argument list or a string split with shell rules. No
+                                    shell is started
+        @type command:              [str] or str
+
+        @param name:                The plaintext name given to the process
+        @type name:                 str
+
+        @param kwargs:              Further arguments passed to Popen, e.g. stdin or stdout
+        @type kwargs:               dict
+
+        @return process:            The handle of the started process
+        @rtype process:             Supervised_Process
+        """
+
+        if isinstance(command, str):
+            command = shlex.split(command)
+
+        popen = subprocess.Popen(command, start_new_session=True, **kwargs)
+        process = Supervised_Process(name, popen)
+
+        with self.lock:
+            self.processes.append(process)
+        process.add_Exit_Callback(self.remove)
+
+        reaper = threading.Thread(target=process.reap, name="reap-%s" %(name), daemon=True)
+        reaper.start()
+
+        return process
+
+    def remove(self, process):
+        """
+        Stop tracking a process that has exited.
+        """
+
+        with self.lock:
+            if process in self.processes:
+                self.processes.remove(process)
+
+    def stop(self, process, timeout = DEFAULT_EOS_TIMEOUT, eos_signal = signal.SIGINT):
+        """
+        Stop a process, escalating to SIGTERM and then SIGKILL if it does not exit in time.
+
+        @param process:             The process to stop
+        @type process:              Supervised_Process
+
+        @param timeout:             The time in seconds given for the process to finish after the EOS signal
+        @type timeout:              float
+
+        @param eos_signal:          The signal that asks the process to finish. None if the caller has already asked it to
+                                    finish, e.g. by closing its input
+        @type eos_signal:           int
+
+        @return returncode:         The exit status of the process
+        @rtype returncode:          int
+        """
+
+        if eos_signal != None:
+            process.send_Signal(eos_signal)
+        elif process.stop_time == None:
+            process.stop_time = time.monotonic()
+
+        if process.wait(timeout) != None:
+            return process.returncode
+
+        for sig in ESCALATION_SIGNALS:
+            process.send_Signal(sig)
+            if process.wait(ESCALATION_TIMEOUT) != None:
+                return process.returncode
+
+        return process.wait()
+
+    def stop_Async(self, process, timeout = DEFAULT_EOS_TIMEOUT, eos_signal = signal.SIGINT):
+        """
+        Stop a process on a background thread.
+
+        @return thread:             The thread performing the stop
+        @rtype thread:              Thread
+        """
+
+        thread = threading.Thread(target=self.stop, args=(process, timeout, eos_signal), daemon=True)
+        thread.start()
+        return thread
+
+    def stop_All(self, processes = None, timeout = DEFAULT_EOS_TIMEOUT, eos_signal = signal.SIGINT):
+        """
+        Stop several processes in parallel. Every process is signalled before any of them is waited on.
+
+        @param processes:           The processes to stop. None stops every process owned by the supervisor
+        @type processes:            [Supervised_Process]
+
+        @return returncodes:        The exit status of each process, in the given order
+        @rtype returncodes:         [int]
+        """
+
+        if processes == None:
+            with self.lock:
+                processes = list(self.processes)
+
+        for process in processes:
+            process.send_Signal(eos_signal)
+
+        threads = [self.stop_Async(process, timeout, None) for process in processes]
+        for thread in threads:
+            thread.join()
+
+        return [process.returncode for process in processes]
+
+
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Supervisor shared by every camera module
+supervisor = Process_Supervisor()
+
+def get_Supervisor():
+    """
+    Get the supervisor shared by every camera module.
+
+    @return supervisor:         The shared supervisor
+    @rtype supervisor:          Process_Supervisor
+    """
+
+    return supervisor
+
+def test():
+    test_supervisor = Process_Supervisor()
+
+    #Stand-in for gst-launch-1.0 -e: finishes shortly after SIGINT
+    eos_child = [sys.executable, "-c",
+                 "import signal, time\n"
+                 "signal.signal(signal.SIGINT, lambda *args: exit(0))\n"
+                 "time.sleep(60)\n"]
+
+    #Stand-in for a pipeline that never finishes its EOS
+    stuck_child = [sys.executable, "-c",
+                   "import signal, time\n"
+                   "signal.signal(signal.SIGINT, signal.SIG_IGN)\n"
+                   "time.sleep(60)\n"]
+
+    latencies = []
+    for index in range(10):
+        cam_0 = test_supervisor.spawn(eos_child, "cam_0")
+        cam_1 = test_supervisor.spawn(eos_child, "cam_1")
+        time.sleep(0.2)
+
+        start = time.monotonic()
+        test_supervisor.stop_All([cam_0, cam_1])
+        latencies.append(time.monotonic() - start)
+
+    assert len(test_supervisor.processes) == 0
+    assert max(latencies) < 0.1
+
+    stuck = test_supervisor.spawn(stuck_child, "stuck")
+    time.sleep(0.2)
+    test_supervisor.stop(stuck, timeout = 0.2)
+    assert stuck.returncode == -signal.SIGTERM
+
+    #A reaped process is not signalled, as its process group ID may have been reused
+    done = test_supervisor.spawn([sys.executable, "-c", "pass"], "done")
+    assert done.wait(5) == 0
+    done.send_Signal(signal.SIGTERM)
+    assert done.stop_time == None and done.returncode == 0
+
+    print("Dual stop latency: min %.1f ms, max %.1f ms" %(min(latencies) * 1e3, max(latencies) * 1e3))
+    print("Process_Supervisor tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,512 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Recording_Catalog
+#   Version:    1.00
+#
+#   Description:
+#   The Recording_Catalog library keeps an SQLite index of the camera trap's recordings so that footage can be found without
+#   scanning or probing the output directory. A row is added for each kept file as its recording is committed, holding its
+#   camera, start and end times, trigger, size and activity score, and the recording it belongs to, which pairs the clips
+#   of every camera taken at the same trigger. Rows are removed as retention deletes files, and the whole catalog can be
+#   rebuilt from the files on disk.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in scanning the output directory
+import sys              #Used in running catalog commands
+import re               #Used in parsing recording file names
+import argparse         #Used in running catalog commands
+import shutil           #Used in removing test output
+import sqlite3          #Used in storing the catalog
+import tempfile         #Used in creating test output
+import threading        #Used in sharing the catalog between threads
+import time
+
+from Video_Container import VIDEO_EXTENSIONS
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Name of the catalog file in the output directory
+CATALOG_NAME = "catalog.sqlite3"
+
+#Trigger sources
+TRIGGER_PIS = "pis"
+
+#Format of the timestamp at the start of each recording's file names
+RECORDING_TIME_FORMAT = "%Y%m%d_%H%M%S"
+
+#Matches a recording file name, capturing its recording, camera and segment index. Files moved out of a spool after an
+#interrupted run carry a recovered_ prefix, and clips rotated on their maximum duration a -<rollover> suffix
+RECORDING_FILE_PATTERN = re.compile(r'^(?:recovered_)?(\d{8}_\d{6})_(.+?)(?:-\d+)?_(\d{3})\.\w+$')
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    path        TEXT PRIMARY KEY,
+    recording   TEXT,
+    camera      TEXT,
+    segment     INTEGER,
+    start_time  REAL,
+    end_time    REAL,
+    duration    REAL,
+    size        INTEGER,
+    trigger     TEXT,
+    score       REAL
+);
+CREATE INDEX IF NOT EXISTS clips_time ON clips (start_time);
+CREATE INDEX IF NOT EXISTS clips_camera_time ON clips (camera, start_time);
+CREATE INDEX IF NOT EXISTS clips_recording ON clips (recording);
+"""
+
+CATALOG_COLUMNS = ("path", "recording", "camera", "segment", "start_time", "end_time", "duration", "size", "trigger", "score")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Catalog_Entry:
+    """
+    Class representing a recorded file in the catalog.
+
+    @param path                 The path of the file
+    @type path                  str
+
+    @param recording            The name of the recording the file belongs to, shared by the clips of every camera taken
+                                at the same trigger. None if unknown
+    @type recording             str
+
+    @param camera               The name of the camera that recorded the file. None if unknown
+    @type camera                str
+
+    @param segment              The position of the file within its camera's clip
+    @type segment               int
+
+    @param start_time           The time.time() time at which the file's video begins
+    @type start_time            float
+
+    @param end_time             The time.time() time at which the file's video ends
+    @type end_time              float
+
+    @param size                 The size of the file in bytes. None is measured when the entry is added
+    @type size                  int
+
+    @param trigger              The source of the trigger, e.g. TRIGGER_PIS. None if unknown
+    @type trigger               str
+
+    @param score                The activity score of the camera over the recording. None if the cameras were not scored
+    @type score                 float
+    """
+
+    def __init__(self, path, recording = None, camera = None, segment = 0, start_time = None, end_time = None, size = None,
+                 trigger = None, score = None):
+        """
+        Catalog_Entry Constructor.
+        """
+
+        self.path = path
+        self.recording = recording
+        self.camera = camera
+        self.segment = segment
+        self.start_time = start_time
+        self.end_time = end_time
+        self.size = size
+        self.trigger = trigger
+        self.score = score
+
+    def duration(self):
+        """
+        Get the length of the file's video.
+
+        @return duration:           Length in seconds, None if either time is unknown
+        @rtype duration:            float
+        """
+
+        if self.start_time == None or self.end_time == None:
+            return None
+        return self.end_time - self.start_time
+
+    def row(self):
+        """
+        Get the entry as a catalog row, in the order of CATALOG_COLUMNS.
+        """
+
+        return (self.path, self.recording, self.camera, self.segment, self.start_time, self.end_time, self.duration(),
+                self.size, self.trigger, self.score)
+
+    @staticmethod
+    def from_Row(row):
+        """
+        Get the entry of a catalog row.
+        """
+
+        path, recording, camera, segment, start_time, end_time, duration, size, trigger, score = row
+        return Catalog_Entry(path, recording, camera, segment, start_time, end_time, size, trigger, score)
+
+
+
+class Recording_Catalog:
+    """
+    Class that stores the catalog of recordings in an SQLite database. Every query is answered from the indexes on time,
+    camera and recording, so it takes milliseconds however many files have been recorded. The catalog may be used from
+    any thread.
+
+    @param path                 The path of the database
+    @type path                  str
+    """
+
+    def __init__(self, path):
+        """
+        Recording_Catalog Constructor. The database is created if it does not exist.
+
+        @param path:                The path of the database
+        @type path:                 str
+        """
+
+        self.path = path
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        #The write-ahead log turns each commit into one sequential append, which suits SD cards
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(CATALOG_SCHEMA)
+        self.connection.commit()
+
+    def add(self, entries):
+        """
+        Add files to the catalog in a single transaction, replacing any entry for the same path.
+
+        @param entries:             The entries of the files
+        @type entries:              [Catalog_Entry]
+        """
+
+        for entry in entries:
+            if entry.size == None:
+                try:
+                    entry.size = os.path.getsize(entry.path)
+                except OSError:
+                    entry.size = 0
+
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO clips VALUES (%s)" %(", ".join("?" * len(CATALOG_COLUMNS))),
+                                        [entry.row() for entry in entries])
+            self.connection.commit()
+
+    def remove(self, paths):
+        """
+        Remove deleted files from the catalog.
+
+        @param paths:               The paths of the files
+        @type paths:                [str]
+        """
+
+        with self.lock:
+            self.connection.executemany("DELETE FROM clips WHERE path = ?", [(path,) for path in paths])
+            self.connection.commit()
+
+    def query(self, start = None, end = None, camera = None, recording = None, limit = None):
+        """
+        Find the files that begin within a time range.
+
+        @param start:               The earliest time.time() start time. None for no limit
+        @type start:                float
+
+        @param end:                 The time.time() time before which the files must begin. None for no limit
+        @type end:                  float
+
+        @param camera:              The name of the camera. None for every camera
+        @type camera:               str
+
+        @param recording:           The name of the recording. None for every recording
+        @type recording:            str
+
+        @param limit:               The largest number of files returned. None returns every file
+        @type limit:                int
+
+        @return entries:            The entries of the files in order of start time
+        @rtype entries:             [Catalog_Entry]
+        """
+
+        conditions = []
+        values = []
+        for condition, value in (("start_time >= ?", start), ("start_time < ?", end), ("camera = ?", camera),
+                                 ("recording = ?", recording)):
+            if value != None:
+                conditions.append(condition)
+                values.append(value)
+
+        statement = "SELECT %s FROM clips" %(", ".join(CATALOG_COLUMNS))
+        if len(conditions) > 0:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " ORDER BY start_time, camera, segment"
+        if limit != None:
+            statement += " LIMIT ?"
+            values.append(limit)
+
+        with self.lock:
+            rows = self.connection.execute(statement, values).fetchall()
+
+        return [Catalog_Entry.from_Row(row) for row in rows]
+
+    def paired(self, path):
+        """
+        Find the files recorded by the other cameras at the same trigger as a file.
+
+        @return entries:            The entries of the other cameras' files, empty if the file is not in the catalog
+        @rtype entries:             [Catalog_Entry]
+        """
+
+        with self.lock:
+            row = self.connection.execute("SELECT camera, recording FROM clips WHERE path = ?", (path,)).fetchone()
+
+        if row == None or row[1] == None:
+            return []
+
+        return [entry for entry in self.query(recording = row[1]) if entry.camera != row[0]]
+
+    def recordings(self):
+        """
+        Get the files of the catalog grouped by recording, e.g. to index the kept recordings at start-up. A file of no known
+        recording is a recording of its own.
+
+        @return recordings:         (paths, end time, score) of each recording, in order of start time. The end time is the
+                                    latest of its files and the score the highest, None if none of its files is known
+        @rtype recordings:          [([str],float,float)]
+        """
+
+        with self.lock:
+            rows = self.connection.execute("SELECT path, recording, end_time, score FROM clips "
+                                           "ORDER BY start_time, camera, segment").fetchall()
+
+        recordings = {}
+        for path, recording, end_time, score in rows:
+            key = (recording,) if recording != None else path
+            paths, latest, highest = recordings.get(key, ([], None, None))
+
+            paths.append(path)
+            if end_time != None:
+                latest = max(latest, end_time) if latest != None else end_time
+            if score != None:
+                highest = max(highest, score) if highest != None else score
+            recordings[key] = (paths, latest, highest)
+
+        return list(recordings.values())
+
+    def count(self):
+        """
+        Get the number of files in the catalog.
+        """
+
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM clips").fetchone()[0]
+
+    def rebuild(self, dir):
+        """
+        Replace the catalog with the recordings found in a directory. Camera, recording and start time are taken from
+        each file's name and its end time from its modification time. Trigger and score cannot be recovered.
+
+        @param dir:                 The output directory
+        @type dir:                  str
+
+        @return count:              The number of files catalogued
+        @rtype count:               int
+        """
+
+        entries = scan_Directory(dir)
+
+        with self.lock:
+            self.connection.execute("DELETE FROM clips")
+            self.connection.commit()
+
+        self.add(entries)
+        return len(entries)
+
+    def close(self):
+        """
+        Close the database.
+        """
+
+        with self.lock:
+            self.connection.close()
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def entry_From_File(path, start_time = None):
+    """
+    Get the catalog entry of a recorded file from its name and modification time.
+
+    @param path:                The path of the file
+    @type path:                 str
+
+    @param start_time:          The time.time() time at which the file's video begins. Defaults to the time in its name,
+                                or its modification time if the name has none
+    @type start_time:           float
+
+    @return entry:              The entry of the file
+    @rtype entry:               Catalog_Entry
+    """
+
+    stat = os.stat(path)
+    entry = Catalog_Entry(path, start_time = start_time, end_time = stat.st_mtime, size = stat.st_size)
+
+    match = RECORDING_FILE_PATTERN.match(os.path.basename(path))
+    if match != None:
+        entry.recording = match.group(1)
+        entry.camera = match.group(2)
+        entry.segment = int(match.group(3))
+        if entry.start_time == None:
+            entry.start_time = time.mktime(time.strptime(match.group(1), RECORDING_TIME_FORMAT))
+
+    if entry.start_time == None or entry.start_time > entry.end_time:
+        entry.start_time = entry.end_time
+
+    return entry
+
+def scan_Directory(dir):
+    """
+    Get the catalog entries of the recordings in a directory. Each segment after the first of a clip is taken to begin
+    when the previous segment was last written.
+
+    @return entries:            The entries of the files in order of name
+    @rtype entries:             [Catalog_Entry]
+    """
+
+    entries = []
+    previous = None
+
+    for entry in sorted(os.scandir(dir), key=lambda entry: entry.name):
+        if entry.is_file() == False or entry.name.endswith(VIDEO_EXTENSIONS) == False:
+            continue
+
+        catalog_entry = entry_From_File(entry.path)
+        if previous != None and catalog_entry.segment > 0 and (previous.recording, previous.camera) == \
+           (catalog_entry.recording, catalog_entry.camera):
+            catalog_entry.start_time = min(previous.end_time, catalog_entry.end_time)
+
+        entries.append(catalog_entry)
+        previous = catalog_entry
+
+    return entries
+
+def parse_Time(text):
+    """
+    Get the time.time() time of a local time given as YYYYmmdd_HHMMSS.
+    """
+
+    return time.mktime(time.strptime(text, RECORDING_TIME_FORMAT))
+
+def main(arguments):
+    """
+    Rebuild or query a catalog from the command line.
+
+    @return status:             0 on success
+    @rtype status:              int
+    """
+
+    parser = argparse.ArgumentParser(description="Rebuild or query the catalog of a camera trap's recordings")
+    parser.add_argument("command", choices=("rebuild", "query"))
+    parser.add_argument("dir", help="output directory of the camera trap")
+    parser.add_argument("--catalog", help="path of the catalog, defaults to %s in the output directory" %(CATALOG_NAME))
+    parser.add_argument("--camera", help="only list files from this camera")
+    parser.add_argument("--since", type=parse_Time, help="only list files beginning at or after YYYYmmdd_HHMMSS")
+    parser.add_argument("--until", type=parse_Time, help="only list files beginning before YYYYmmdd_HHMMSS")
+    parser.add_argument("--limit", type=int, help="largest number of files listed")
+    options = parser.parse_args(arguments)
+
+    catalog = Recording_Catalog(options.catalog or os.path.join(options.dir, CATALOG_NAME))
+
+    if options.command == "rebuild":
+        start = time.monotonic()
+        count = catalog.rebuild(options.dir)
+        print("Catalogued %d files from %s in %.2f s" %(count, options.dir, time.monotonic() - start))
+    else:
+        for entry in catalog.query(options.since, options.until, options.camera, limit = options.limit):
+            print("%s  %-8s %8.1f s %10d B  %s" %(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.start_time)),
+                                                  entry.camera, entry.duration() or 0.0, entry.size, entry.path))
+
+    catalog.close()
+    return 0
+
+def test():
+    directory = tempfile.mkdtemp()
+    try:
+        catalog = Recording_Catalog(os.path.join(directory, CATALOG_NAME))
+
+        #A trigger recorded by two cameras, the first in two segments
+        paths = {}
+        for name in ("20240101_120000_cam_0_000.mp4", "20240101_120000_cam_0_001.mp4", "20240101_120000_cam_1_000.mp4",
+                     "recovered_20240101_110000_cam_1_000.mkv", "notes.txt"):
+            paths[name] = os.path.join(directory, name)
+            with open(paths[name], "wb") as recording_file:
+                recording_file.write(b"\x00" * 100)
+
+        start = parse_Time("20240101_120000")
+        os.utime(paths["20240101_120000_cam_0_000.mp4"], (start + 60, start + 60))
+        os.utime(paths["20240101_120000_cam_0_001.mp4"], (start + 90, start + 90))
+
+        catalog.add([Catalog_Entry(paths["20240101_120000_cam_0_000.mp4"], "20240101_120000", "cam_0", 0, start, start + 60,
+                                   trigger = TRIGGER_PIS, score = 0.4),
+                     Catalog_Entry(paths["20240101_120000_cam_1_000.mp4"], "20240101_120000", "cam_1", 0, start, start + 60,
+                                   trigger = TRIGGER_PIS, score = 0.1)])
+        assert catalog.count() == 2
+
+        entries = catalog.query(camera = "cam_0")
+        assert len(entries) == 1 and entries[0].duration() == 60 and entries[0].size == 100 and entries[0].score == 0.4
+        assert [entry.camera for entry in catalog.paired(paths["20240101_120000_cam_0_000.mp4"])] == ["cam_1"]
+
+        #The cameras' files of a trigger are one recording, scored by its highest scoring camera
+        assert catalog.recordings() == [([paths["20240101_120000_cam_0_000.mp4"], paths["20240101_120000_cam_1_000.mp4"]],
+                                         start + 60, 0.4)]
+
+        catalog.remove([paths["20240101_120000_cam_1_000.mp4"]])
+        assert catalog.paired(paths["20240101_120000_cam_0_000.mp4"]) == []
+
+        #Rebuilding takes camera, recording and times from the files themselves
+        assert catalog.rebuild(directory) == 4
+        second = catalog.query(camera = "cam_0")[1]
+        assert second.segment == 1 and second.start_time == start + 60 and second.duration() == 30
+        recovered = catalog.query(end = start)
+        assert len(recovered) == 1 and recovered[0].camera == "cam_1" and recovered[0].recording == "20240101_110000"
+
+        #Queries over a large catalog are answered from the indexes
+        entries = [Catalog_Entry("/recordings/%d_cam_%d.mp4" %(index, index % 2), str(index), "cam_%d" %(index % 2), 0,
+                                 start + index * 10, start + index * 10 + 8, 1000, TRIGGER_PIS, 0.5)
+                   for index in range(100000)]
+        catalog.add(entries)
+        assert catalog.count() == 100004
+
+        query_start = time.monotonic()
+        entries = catalog.query(start + 500000, start + 500600, camera = "cam_1")
+        elapsed = time.monotonic() - query_start
+        assert len(entries) == 30 and elapsed < 0.05
+        print("Queried %d clips in %.2f ms" %(catalog.count(), elapsed * 1e3))
+
+        catalog.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print("Recording_Catalog tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv[1:]))
+
+    test()
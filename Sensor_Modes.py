@@ -0,0 +1,627 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Sensor_Modes
+#   Version:    1.00
+#
+#   Description:
+#   The Sensor_Modes library matches capture requests to the native modes of each CSI sensor. A resolution or framerate that
+#   is not a native mode makes argus pick a larger mode and scale it in the ISP, or a slower one, costing bandwidth and
+#   frames. The sensor modes that argus lists when a session starts are probed once per camera and cached on disk, and each
+#   request is resolved to the smallest native mode that covers it, followed by an explicit nvvidconv scaling step when the
+#   request is not native. Requests that no mode can satisfy are rejected before any pipeline is launched.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in storing the cache
+import sys              #Used in running probe commands
+import re               #Used in parsing the sensor mode listing
+import argparse         #Used in running probe commands
+import json             #Used in storing the cache
+import shutil           #Used in removing test output
+import subprocess       #Used in probing the sensors
+import tempfile         #Used in creating test output
+import threading        #Used in sharing the cache between cameras
+import time             #Used in backing off failed probes
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#File in which the probed sensor modes are cached
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "nano_camera_trap", "sensor_modes.json")
+
+#Time in seconds given to a probe to start an argus session and list the sensor modes
+PROBE_TIMEOUT = 10.0
+
+#Time in seconds before a sensor that could not be probed is probed again, doubling after each failure up to the maximum
+PROBE_RETRY_INTERVAL = 60.0
+PROBE_MAX_RETRY_INTERVAL = 3600.0
+
+#Matches a sensor mode in the listing argus prints as a session starts
+SENSOR_MODE_PATTERN = re.compile(r'GST_ARGUS: (\d+) x (\d+) FR = ([\d.]+) fps')
+
+#Margin in frames per second within which a mode's maximum framerate counts as reaching the requested framerate
+FRAMERATE_TOLERANCE = 0.5
+
+#Relative difference in aspect ratio within which a mode can be scaled to a request without stretching the image
+ASPECT_TOLERANCE = 0.01
+
+#Listing printed by the IMX219 camera module (Raspberry Pi camera v2), recorded from gst-launch-1.0 on a Jetson Nano
+IMX219_PROBE_OUTPUT = """Setting pipeline to PAUSED ...
+Pipeline is live and does not need PREROLL ...
+Setting pipeline to PLAYING ...
+New clock: GstSystemClock
+GST_ARGUS: Creating output stream
+CONSUMER: Waiting until producer is connected...
+GST_ARGUS: Available Sensor modes :
+GST_ARGUS: 3264 x 2464 FR = 21.000000 fps Duration = 47619048 ; Analog Gain range min 1.000000, max 10.625000; Exposure Range min 13000, max 683709000;
+
+GST_ARGUS: 3264 x 1848 FR = 28.000001 fps Duration = 35714284 ; Analog Gain range min 1.000000, max 10.625000; Exposure Range min 13000, max 683709000;
+
+GST_ARGUS: 1920 x 1080 FR = 29.999999 fps Duration = 33333334 ; Analog Gain range min 1.000000, max 10.625000; Exposure Range min 13000, max 683709000;
+
+GST_ARGUS: 1640 x 1232 FR = 29.999999 fps Duration = 33333334 ; Analog Gain range min 1.000000, max 10.625000; Exposure Range min 13000, max 683709000;
+
+GST_ARGUS: 1280 x 720 FR = 59.999999 fps Duration = 16666667 ; Analog Gain range min 1.000000, max 10.625000; Exposure Range min 13000, max 683709000;
+
+GST_ARGUS: 1280 x 720 FR = 120.000005 fps Duration = 8333333 ; Analog Gain range min 1.000000, max 10.625000; Exposure Range min 13000, max 683709000;
+
+GST_ARGUS: Running with following settings:
+   Camera index = 0
+   Camera mode  = 4
+   Output Stream W = 1280 H = 720
+   seconds to Run    = 0
+   Frame Rate = 59.999999
+GST_ARGUS: Setup Complete, Starting captures for 0 seconds
+GST_ARGUS: Starting repeat capture requests.
+CONSUMER: Producer has connected; continuing.
+Got EOS from element "pipeline0".
+Execution ended after 0:00:00.412345678
+Setting pipeline to NULL ...
+GST_ARGUS: Cleaning up
+CONSUMER: Done Success
+GST_ARGUS: Done Success
+Freeing pipeline ...
+"""
+
+#Listing printed by the IMX477 camera module (Raspberry Pi HQ camera), recorded from gst-launch-1.0 on a Jetson Nano
+IMX477_PROBE_OUTPUT = """Setting pipeline to PAUSED ...
+Pipeline is live and does not need PREROLL ...
+Setting pipeline to PLAYING ...
+New clock: GstSystemClock
+GST_ARGUS: Creating output stream
+CONSUMER: Waiting until producer is connected...
+GST_ARGUS: Available Sensor modes :
+GST_ARGUS: 4032 x 3040 FR = 29.999999 fps Duration = 33333334 ; Analog Gain range min 1.000000, max 22.250000; Exposure Range min 13000, max 683709000;
+
+GST_ARGUS: 1920 x 1080 FR = 59.999999 fps Duration = 16666667 ; Analog Gain range min 1.000000, max 22.250000; Exposure Range min 13000, max 683709000;
+
+GST_ARGUS: Running with following settings:
+   Camera index = 1
+   Camera mode  = 1
+   Output Stream W = 1920 H = 1080
+   seconds to Run    = 0
+   Frame Rate = 59.999999
+GST_ARGUS: Setup Complete, Starting captures for 0 seconds
+GST_ARGUS: Starting repeat capture requests.
+CONSUMER: Producer has connected; continuing.
+Got EOS from element "pipeline0".
+Setting pipeline to NULL ...
+GST_ARGUS: Cleaning up
+CONSUMER: Done Success
+GST_ARGUS: Done Success
+Freeing pipeline ...
+"""
+
+class Sensor_Mode_Error(Exception):
+    """
+    Exception raised when a capture request cannot be satisfied by a sensor.
+
+    @param sensor_id:           The sensor ID of the camera
+    @type sensor_id:            int
+
+    @param message:             Description of the error
+    @type message:              str
+    """
+
+    def __init__(self, sensor_id, message):
+        self.sensor_id = sensor_id
+        self.message = message
+
+    def __str__(self):
+        return "sensor %s: %s" %(self.sensor_id, self.message)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Sensor_Mode:
+    """
+    Class representing a native mode of a sensor.
+
+    @param index                The index of the mode, as given to nvarguscamerasrc sensor-mode
+    @type index                 int
+
+    @param width                The width of the mode in pixels
+    @type width                 int
+
+    @param height               The height of the mode in pixels
+    @type height                int
+
+    @param framerate            The highest framerate of the mode
+    @type framerate             float
+    """
+
+    def __init__(self, index, width, height, framerate):
+        """
+        Sensor_Mode Constructor.
+        """
+
+        self.index = index
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+
+    def __repr__(self):
+        return "%dx%d@%.0f" %(self.width, self.height, self.framerate)
+
+    def covers(self, width, height, framerate):
+        """
+        Return True if the mode can be captured at framerate and scaled down to width x height.
+        """
+
+        return self.width >= width and self.height >= height and self.framerate + FRAMERATE_TOLERANCE >= framerate
+
+    def aspect_Matches(self, width, height):
+        """
+        Return True if the mode can be scaled to width x height without stretching the image.
+        """
+
+        return abs(self.width * height / float(self.height * width) - 1) <= ASPECT_TOLERANCE
+
+
+
+class Capture_Mode:
+    """
+    Class representing a capture request resolved against a sensor's modes.
+
+    @param sensor_id            The sensor ID of the camera
+    @type sensor_id             int
+
+    @param mode                 The native mode the sensor captures in. None if the sensor's modes are unknown, in which
+                                case the requested caps are passed to argus as they are
+    @type mode                  Sensor_Mode
+
+    @param width                The requested width in pixels
+    @type width                 int
+
+    @param height               The requested height in pixels
+    @type height                int
+
+    @param framerate            The requested framerate
+    @type framerate             int
+    """
+
+    def __init__(self, sensor_id, mode, width, height, framerate):
+        """
+        Capture_Mode Constructor.
+        """
+
+        self.sensor_id = sensor_id
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+
+    def is_Scaled(self):
+        """
+        Return True if the native mode is scaled to the requested resolution.
+        """
+
+        return self.mode != None and (self.mode.width, self.mode.height) != (self.width, self.height)
+
+    def elements(self):
+        """
+        Get the GStreamer elements of the camera source, capturing in the native mode and scaling it to the requested
+        resolution in the hardware scaler.
+
+        @return elements:           The source element and the caps and scaler that follow it, in order
+        @rtype elements:            [str]
+        """
+
+        if self.mode == None:
+            return ["nvarguscamerasrc sensor-id=%d" %(self.sensor_id),
+                    "'video/x-raw(memory:NVMM),width=%d,height=%d,framerate=%d/1,format=NV12'" %(self.width, self.height,
+                                                                                                self.framerate)]
+
+        elements = ["nvarguscamerasrc sensor-id=%d sensor-mode=%d" %(self.sensor_id, self.mode.index),
+                    "'video/x-raw(memory:NVMM),width=%d,height=%d,framerate=%d/1,format=NV12'" %(self.mode.width,
+                                                                                                self.mode.height,
+                                                                                                self.framerate)]
+
+        if self.is_Scaled() == True:
+            elements += ["nvvidconv", "'video/x-raw(memory:NVMM),width=%d,height=%d,format=NV12'" %(self.width, self.height)]
+
+        return elements
+
+    def description(self):
+        """
+        Get the GStreamer pipeline description of the camera source.
+
+        @return pipeline:           The pipeline description, ending in a link to the next element
+        @rtype pipeline:            str
+        """
+
+        return " ! ".join(self.elements()) + " ! "
+
+
+
+class Sensor_Mode_Cache:
+    """
+    Class that probes the sensor modes of each camera once and keeps them in a JSON file, so that later runs start
+    without opening an extra argus session. A sensor that cannot be probed, e.g. one that is busy or not fitted, is not
+    written to the file. It is probed again after PROBE_RETRY_INTERVAL, backing off after each failure, so that capture
+    starts do not wait on it meanwhile. Each sensor is probed outside the lock, so a slow probe only holds up its own
+    camera.
+
+    @param path                 The path of the cache file
+    @type path                  str
+
+    @param probe                Function called with a sensor ID to probe its modes, returning None on failure
+    @type probe                 function
+    """
+
+    def __init__(self, path = DEFAULT_CACHE_PATH, probe = None):
+        """
+        Sensor_Mode_Cache Constructor.
+        """
+
+        if probe == None:
+            probe = probe_Sensor_Modes
+
+        self.path = path
+        self.probe = probe
+        self.lock = threading.Lock()
+        self.modes = self.load()
+
+        #(time.monotonic() time of the next probe, retry interval) of each sensor whose last probe failed, and the event
+        #set when each running probe ends
+        self.failures = {}
+        self.probing = {}
+
+    def load(self):
+        """
+        Read the cache file.
+
+        @return modes:              The cached modes, keyed by sensor ID. Empty if there is no readable cache
+        @rtype modes:               {int:[Sensor_Mode]}
+        """
+
+        try:
+            with open(self.path) as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+        modes = {}
+        for sensor_id, listed in cached.items():
+            modes[int(sensor_id)] = [Sensor_Mode(index, width, height, framerate)
+                                     for index, (width, height, framerate) in enumerate(listed)]
+        return modes
+
+    def save(self):
+        """
+        Write the cache file. Must be called with the lock held.
+        """
+
+        cached = {str(sensor_id): [(mode.width, mode.height, mode.framerate) for mode in modes]
+                  for sensor_id, modes in self.modes.items()}
+
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        temporary = "%s.tmp" %(self.path)
+        with open(temporary, "w") as cache_file:
+            json.dump(cached, cache_file, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+
+    def get(self, sensor_id, refresh = False):
+        """
+        Get the modes of a sensor, probing it if they are not cached.
+
+        @param sensor_id:           The sensor ID of the camera
+        @type sensor_id:            int
+
+        @param refresh:             Probe the sensor even if its modes are cached, e.g. after a camera has been replaced
+        @type refresh:              bool
+
+        @return modes:              The sensor's modes in index order. None if they are unknown
+        @rtype modes:               [Sensor_Mode]
+        """
+
+        #A probe of the same sensor that is already running is waited on rather than repeated
+        while True:
+            with self.lock:
+                if refresh == False and sensor_id in self.modes:
+                    return self.modes[sensor_id]
+                if refresh == False and sensor_id in self.failures and time.monotonic() < self.failures[sensor_id][0]:
+                    return None
+
+                probing = self.probing.get(sensor_id)
+                if probing == None:
+                    probing = threading.Event()
+                    self.probing[sensor_id] = probing
+                    break
+
+            probing.wait()
+            refresh = False
+
+        modes = None
+        try:
+            modes = self.probe(sensor_id)
+        finally:
+            with self.lock:
+                del self.probing[sensor_id]
+
+                if modes == None:
+                    interval = PROBE_RETRY_INTERVAL
+                    if sensor_id in self.failures:
+                        interval = min(self.failures[sensor_id][1] * 2, PROBE_MAX_RETRY_INTERVAL)
+                    self.failures[sensor_id] = (time.monotonic() + interval, interval)
+                else:
+                    self.failures.pop(sensor_id, None)
+                    self.modes[sensor_id] = modes
+                    try:
+                        self.save()
+                    except OSError as error:
+                        print("Warning: the sensor modes could not be cached in %s: %s" %(self.path, error))
+
+            probing.set()
+
+        return modes
+
+    def resolve(self, sensor_id, resolution, framerate):
+        """
+        Resolve a capture request against a sensor's modes. See resolve_Capture.
+        """
+
+        return resolve_Capture(sensor_id, self.get(sensor_id), resolution, framerate)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def parse_Sensor_Modes(output):
+    """
+    Get the sensor modes from the output of a gst-launch-1.0 pipeline with an nvarguscamerasrc.
+
+    @param output:              The output of the pipeline
+    @type output:               str
+
+    @return modes:              The modes in index order, empty if the output lists none
+    @rtype modes:               [Sensor_Mode]
+    """
+
+    modes = []
+    for match in SENSOR_MODE_PATTERN.finditer(output):
+        modes.append(Sensor_Mode(len(modes), int(match.group(1)), int(match.group(2)), float(match.group(3))))
+    return modes
+
+def probe_Sensor_Modes(sensor_id, timeout = PROBE_TIMEOUT):
+    """
+    List a sensor's modes by starting a one frame argus session. The sensor must not be in use.
+
+    @param sensor_id:           The sensor ID of the camera
+    @type sensor_id:            int
+
+    @return modes:              The modes in index order. None if the sensor could not be probed
+    @rtype modes:               [Sensor_Mode]
+    """
+
+    command = ["gst-launch-1.0", "nvarguscamerasrc", "sensor-id=%d" %(sensor_id), "num-buffers=1", "!", "fakesink"]
+
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                                timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    modes = parse_Sensor_Modes(result.stdout)
+    if len(modes) == 0:
+        return None
+    return modes
+
+def resolve_Capture(sensor_id, modes, resolution, framerate):
+    """
+    Resolve a capture request to the cheapest native mode of a sensor that covers it: the mode with the fewest pixels
+    among those reaching the framerate and resolution, preferring modes of the same aspect ratio.
+
+    @param sensor_id:           The sensor ID of the camera
+    @type sensor_id:            int
+
+    @param modes:               The sensor's modes. None if they are unknown, in which case only the request itself is
+                                checked
+    @type modes:                [Sensor_Mode]
+
+    @param resolution:          The requested resolution as (width,height) of pixels
+    @type resolution:           (int,int)
+
+    @param framerate:           The requested framerate
+    @type framerate:            int
+
+    @return capture:            The resolved capture
+    @rtype capture:             Capture_Mode
+
+    @raise Sensor_Mode_Error:   If the request is invalid or no mode covers it
+    """
+
+    width, height = resolution
+
+    if width <= 0 or height <= 0 or framerate <= 0:
+        raise Sensor_Mode_Error(sensor_id, "invalid capture %dx%d at %d fps" %(width, height, framerate))
+
+    #NV12 holds chroma at half resolution in both directions
+    if width % 2 != 0 or height % 2 != 0:
+        raise Sensor_Mode_Error(sensor_id, "NV12 capture needs an even resolution, not %dx%d" %(width, height))
+
+    if modes == None:
+        return Capture_Mode(sensor_id, None, width, height, framerate)
+
+    candidates = [mode for mode in modes if mode.covers(width, height, framerate) == True]
+    if len(candidates) == 0:
+        raise Sensor_Mode_Error(sensor_id, "no sensor mode covers %dx%d at %d fps, the modes are %s"
+                                %(width, height, framerate, ", ".join(repr(mode) for mode in modes)))
+
+    mode = min(candidates, key=lambda mode: (mode.aspect_Matches(width, height) == False, mode.width * mode.height,
+                                             mode.framerate))
+    return Capture_Mode(sensor_id, mode, width, height, framerate)
+
+#Cache shared by every camera module, created on first use
+cache = None
+cache_lock = threading.Lock()
+
+def get_Sensor_Mode_Cache():
+    """
+    Get the sensor mode cache shared by every camera module.
+
+    @return cache:              The shared cache
+    @rtype cache:               Sensor_Mode_Cache
+    """
+
+    global cache
+
+    with cache_lock:
+        if cache == None:
+            cache = Sensor_Mode_Cache()
+        return cache
+
+def main(arguments):
+    """
+    Probe and list the sensor modes of cameras from the command line.
+
+    @return status:             0 if every sensor was probed, 1 otherwise
+    @rtype status:              int
+    """
+
+    parser = argparse.ArgumentParser(description="List the native modes of the CSI sensors")
+    parser.add_argument("sensor_ids", type=int, nargs="+", help="sensor IDs to list")
+    parser.add_argument("--refresh", action="store_true", help="probe the sensors even if their modes are cached")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="path of the cache file")
+    options = parser.parse_args(arguments)
+
+    mode_cache = Sensor_Mode_Cache(options.cache)
+    status = 0
+
+    for sensor_id in options.sensor_ids:
+        modes = mode_cache.get(sensor_id, options.refresh)
+        if modes == None:
+            print("sensor %d: could not be probed" %(sensor_id))
+            status = 1
+            continue
+
+        for mode in modes:
+            print("sensor %d mode %d: %d x %d at up to %.2f fps" %(sensor_id, mode.index, mode.width, mode.height,
+                                                                   mode.framerate))
+
+    return status
+
+def test():
+    modes = parse_Sensor_Modes(IMX219_PROBE_OUTPUT)
+    assert [(mode.index, mode.width, mode.height) for mode in modes] == \
+        [(0, 3264, 2464), (1, 3264, 1848), (2, 1920, 1080), (3, 1640, 1232), (4, 1280, 720), (5, 1280, 720)]
+    assert parse_Sensor_Modes("Setting pipeline to PAUSED ...\n") == []
+
+    #Native requests need no scaling
+    capture = resolve_Capture(0, modes, (1280, 720), 60)
+    assert capture.mode.index == 4 and capture.is_Scaled() == False
+    assert capture.description() == "nvarguscamerasrc sensor-id=0 sensor-mode=4 ! " \
+        "'video/x-raw(memory:NVMM),width=1280,height=720,framerate=60/1,format=NV12' ! "
+
+    #Other requests are scaled from the smallest covering mode of the same shape
+    capture = resolve_Capture(0, modes, (960, 540), 30)
+    assert capture.mode.index == 4 and "nvvidconv ! 'video/x-raw(memory:NVMM),width=960,height=540" in capture.description()
+    assert resolve_Capture(0, modes, (1600, 1200), 30).mode.index == 3
+    assert resolve_Capture(0, modes, (640, 480), 30).mode.index == 3
+    assert resolve_Capture(0, modes, (1280, 720), 90).mode.index == 5
+    assert resolve_Capture(0, modes, (1920, 1080), 25).mode.index == 2
+
+    for resolution, framerate in (((3840, 2160), 30), ((1920, 1080), 60), ((1281, 720), 30), ((0, 720), 30)):
+        try:
+            resolve_Capture(0, modes, resolution, framerate)
+            assert False
+        except Sensor_Mode_Error:
+            pass
+
+    #Without known modes the request is passed through
+    capture = resolve_Capture(1, None, (1280, 720), 30)
+    assert capture.mode == None and "sensor-mode" not in capture.description()
+
+    directory = tempfile.mkdtemp()
+    try:
+        probes = []
+        outputs = {0: IMX219_PROBE_OUTPUT, 1: IMX477_PROBE_OUTPUT}
+
+        def probe(sensor_id):
+            probes.append(sensor_id)
+            return parse_Sensor_Modes(outputs.get(sensor_id, "")) or None
+
+        path = os.path.join(directory, "cache", "sensor_modes.json")
+        mode_cache = Sensor_Mode_Cache(path, probe)
+        assert len(mode_cache.get(0)) == 6 and mode_cache.resolve(1, (1920, 1080), 50).mode.index == 1
+
+        #A failed probe is not repeated until its retry interval has passed, which doubles after each failure
+        assert mode_cache.get(2) == None and mode_cache.get(2) == None
+        mode_cache.get(0)
+        assert probes == [0, 1, 2] and mode_cache.failures[2][1] == PROBE_RETRY_INTERVAL
+        mode_cache.failures[2] = (time.monotonic(), PROBE_RETRY_INTERVAL)
+        assert mode_cache.get(2) == None and probes == [0, 1, 2, 2]
+        assert mode_cache.failures[2][1] == 2 * PROBE_RETRY_INTERVAL
+
+        #A slow probe holds up neither the other sensors nor a second start of the same sensor beyond its own end
+        release = threading.Event()
+        def slow_Probe(sensor_id):
+            if sensor_id == 0:
+                release.wait(5.0)
+            return probe(sensor_id)
+
+        probes.clear()
+        slow_cache = Sensor_Mode_Cache(os.path.join(directory, "slow.json"), slow_Probe)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(slow_cache.get(0))) for index in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        start = time.monotonic()
+        assert len(slow_cache.get(1)) == 2 and time.monotonic() - start < 1.0
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 2 and all(len(modes) == 6 for modes in results) and probes == [1, 0]
+
+        #A new cache reads the probed modes back without probing
+        probes.clear()
+        mode_cache = Sensor_Mode_Cache(path, probe)
+        assert repr(mode_cache.get(1)) == "[4032x3040@30, 1920x1080@60]" and probes == []
+        mode_cache.get(1, refresh = True)
+        assert probes == [1]
+    finally:
+        shutil.rmtree(directory)
+
+    print("Sensor_Modes tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv[1:]))
+
+    test()
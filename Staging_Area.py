@@ -0,0 +1,403 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Staging_Area
+#   Version:    1.00
+#
+#   Description:
+#   The Staging_Area library holds recordings in a RAM-backed directory until the camera trap has decided whether to keep them.
+#   Kept recordings are promoted to persistent storage with one sequential copy per file, and discarded recordings are deleted
+#   from RAM without ever reaching the SD card. Once the RAM cap is reached, new files are staged in a spill directory on the
+#   persistent filesystem instead, from which promotion is a rename. Crash-safe recordings are staged in the spill directory
+#   from the start, as a power loss would take the RAM copy with it.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in moving and removing staged files
+import shutil           #Used in copying staged files to persistent storage
+import tempfile         #Used in finding a fallback staging directory
+import threading        #Used in sharing the staging accounts between camera threads
+
+from Video_Container import Container_Error, VIDEO_EXTENSIONS, recover
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#RAM-backed directory in which recordings are staged
+DEFAULT_STAGING_DIR = "/dev/shm/nano_camera_trap"
+
+#Maximum number of bytes held in RAM
+DEFAULT_STAGING_BYTES = 256 * 1024 * 1024
+
+#Name of the spill directory created inside the persistent directory
+SPILL_DIR_NAME = ".staging"
+
+#Name of the directory in the RAM and spill directories that holds the cameras' in-progress segments
+SPOOL_DIR_NAME = "spool"
+
+#Size of the buffer used when copying a staged file to persistent storage
+COPY_BUFFER_SIZE = 1024 * 1024
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Staged_File:
+    """
+    Class representing a file held in the staging area.
+
+    @param path                 The path of the staged file
+    @type path                  str
+
+    @param destination          The persistent path the file is promoted to
+    @type destination           str
+
+    @param in_ram               True if the file is staged in RAM, False if it was spilled to persistent storage
+    @type in_ram                bool
+
+    @param size                 The number of bytes accounted to the file
+    @type size                  int
+    """
+
+    def __init__(self, path, destination, in_ram, size):
+        """
+        Staged_File Constructor.
+        """
+
+        self.path = path
+        self.destination = destination
+        self.in_ram = in_ram
+        self.size = size
+
+
+
+class Staging_Area:
+    """
+    Class that stages recordings in RAM until they are promoted to persistent storage or dropped.
+
+    @param ram_dir              The RAM-backed directory in which files are staged
+    @type ram_dir               str
+
+    @param spill_dir            The directory on persistent storage in which files are staged once RAM is full
+    @type spill_dir             str
+
+    @param max_bytes            The maximum number of bytes staged in RAM
+    @type max_bytes             int
+
+    @param ram_bytes            The number of bytes currently staged in RAM
+    @type ram_bytes             int
+
+    @param spilled              The number of files staged in the spill directory
+    @type spilled               int
+
+    @param promoted_bytes       The number of bytes promoted to persistent storage
+    @type promoted_bytes        int
+
+    @param dropped_bytes        The number of bytes dropped without being written to persistent storage
+    @type dropped_bytes         int
+    """
+
+    def __init__(self, persistent_dir, ram_dir = None, max_bytes = DEFAULT_STAGING_BYTES, spill_dir = None):
+        """
+        Staging_Area Constructor.
+
+        @param persistent_dir       The directory on persistent storage that holds the kept recordings
+        @type persistent_dir        str
+
+        @param ram_dir              The RAM-backed staging directory. Defaults to a directory in /dev/shm, or in the
+                                    temporary directory where /dev/shm does not exist
+        @type ram_dir               str
+
+        @param max_bytes            The maximum number of bytes staged in RAM
+        @type max_bytes             int
+
+        @param spill_dir            The spill directory. Defaults to a hidden directory inside persistent_dir, so that
+                                    spilled files are promoted with a rename
+        @type spill_dir             str
+        """
+
+        if ram_dir == None:
+            ram_dir = DEFAULT_STAGING_DIR
+            if os.path.isdir(os.path.dirname(ram_dir)) == False:
+                ram_dir = os.path.join(tempfile.gettempdir(), os.path.basename(ram_dir))
+        if spill_dir == None:
+            spill_dir = os.path.join(persistent_dir, SPILL_DIR_NAME)
+
+        self.ram_dir = ram_dir
+        self.spill_dir = spill_dir
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.files = {}
+        self.ram_bytes = 0
+        self.spilled = 0
+        self.promoted_bytes = 0
+        self.dropped_bytes = 0
+
+    def spool_Dir(self, name, persistent = False):
+        """
+        Get a directory for a camera's in-progress segments.
+
+        @param name:                The name of the camera
+        @type name:                 str
+
+        @param persistent:          True for a directory on persistent storage, so that the segments of crash-safe
+                                    recordings can be recovered after a power loss. False for a RAM-backed directory
+        @type persistent:           bool
+        """
+
+        if persistent == True:
+            return os.path.join(self.spill_dir, SPOOL_DIR_NAME, name)
+        return os.path.join(self.ram_dir, SPOOL_DIR_NAME, name)
+
+    def location(self, destination, expected_bytes = 0, persistent = False):
+        """
+        Reserve a staging path for a file that is about to be written.
+
+        @param destination:         The persistent path the file will be promoted to
+        @type destination:          str
+
+        @param expected_bytes:      The number of bytes the file is expected to grow to
+        @type expected_bytes:       int
+
+        @param persistent:          True to stage the file in the spill directory whatever the space left in RAM, e.g. for
+                                    a crash-safe recording
+        @type persistent:           bool
+
+        @return path:               The path to write the file to
+        @rtype path:                str
+        """
+
+        with self.lock:
+            in_ram = persistent == False and self.ram_bytes + expected_bytes <= self.max_bytes
+            directory = self.ram_dir if in_ram == True else self.spill_dir
+
+            path = os.path.join(directory, os.path.basename(destination))
+            os.makedirs(directory, exist_ok=True)
+
+            self.files[path] = Staged_File(path, destination, in_ram, expected_bytes)
+            if in_ram == True:
+                self.ram_bytes += expected_bytes
+            else:
+                self.spilled += 1
+
+        return path
+
+    def stage(self, source, destination, persistent = False):
+        """
+        Move a finished file into the staging area.
+
+        @param source:              The path of the finished file
+        @type source:               str
+
+        @param destination:         The persistent path the file will be promoted to
+        @type destination:          str
+
+        @param persistent:          True to stage the file in the spill directory, e.g. a crash-safe segment spooled on
+                                    persistent storage, which is then staged with a rename
+        @type persistent:           bool
+
+        @return path:               The staged path of the file
+        @rtype path:                str
+        """
+
+        path = self.location(destination, os.path.getsize(source), persistent)
+        shutil.move(source, path)
+        return path
+
+    def update(self, path):
+        """
+        Account a staged file at its actual size once it has been written.
+        """
+
+        with self.lock:
+            staged = self.files.get(path)
+            if staged == None:
+                return
+
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if staged.in_ram == True:
+                self.ram_bytes += size - staged.size
+            staged.size = size
+
+    def release(self, staged):
+        """
+        Stop accounting a staged file. Must be called with the lock held.
+        """
+
+        del self.files[staged.path]
+        if staged.in_ram == True:
+            self.ram_bytes -= staged.size
+
+    def promote(self, paths):
+        """
+        Move staged files to persistent storage, in order. Files spilled onto the persistent filesystem are renamed,
+        files in RAM are copied sequentially. Paths that are not staged are returned unchanged.
+
+        @param paths:               The staged paths
+        @type paths:                [str]
+
+        @return destinations:       The persistent paths of the files
+        @rtype destinations:        [str]
+        """
+
+        destinations = []
+
+        for path in paths:
+            with self.lock:
+                staged = self.files.get(path)
+
+            if staged == None:
+                destinations.append(path)
+                continue
+
+            directory = os.path.dirname(staged.destination)
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+
+            try:
+                os.rename(staged.path, staged.destination)
+            except OSError:
+                #Different filesystems, so copy in one sequential pass and free the RAM
+                with open(staged.path, "rb") as source, open(staged.destination, "wb") as destination:
+                    shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+                os.remove(staged.path)
+
+            with self.lock:
+                self.promoted_bytes += staged.size
+                self.release(staged)
+
+            destinations.append(staged.destination)
+
+        return destinations
+
+    def drop(self, paths):
+        """
+        Delete staged files without writing them to persistent storage.
+
+        @param paths:               The staged paths
+        @type paths:                [str]
+        """
+
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            with self.lock:
+                staged = self.files.get(path)
+                if staged != None:
+                    self.dropped_bytes += staged.size
+                    self.release(staged)
+
+    def recover_Staged(self, dir):
+        """
+        Move the files an interrupted run left in the RAM and spill directories into dir as recovered_<name>, each
+        truncated back to its last complete fragment, so that they are kept rather than orphaned. The RAM directory only
+        survives a crash of the trap, not a power loss. Files that cannot be recovered are moved as they are. The cameras'
+        spool directories are left to the cameras. Must be called before anything is staged.
+
+        @param dir:                 The directory into which the files are moved
+        @type dir:                  str
+
+        @return paths:              The moved files
+        @rtype paths:               [str]
+        """
+
+        paths = []
+
+        for directory in (self.ram_dir, self.spill_dir):
+            if os.path.isdir(directory) == False:
+                continue
+
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if os.path.isfile(path) == False:
+                    continue
+                if name.endswith(VIDEO_EXTENSIONS) == False:
+                    os.remove(path)
+                    continue
+
+                try:
+                    recover(path)
+                except Container_Error as error:
+                    print("Warning: %s" %(error))
+                except OSError as error:
+                    print("Warning: %s could not be recovered: %s" %(path, error))
+
+                destination = os.path.join(dir, "recovered_%s" %(name))
+                os.makedirs(dir, exist_ok=True)
+                shutil.move(path, destination)
+                paths.append(destination)
+
+        return paths
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def test():
+    directory = tempfile.mkdtemp()
+    try:
+        persistent_dir = os.path.join(directory, "sd")
+        staging = Staging_Area(persistent_dir, os.path.join(directory, "ram"), max_bytes = 3000)
+
+        def segment(name, size):
+            path = os.path.join(directory, name)
+            with open(path, "wb") as segment_file:
+                segment_file.write(b"\x00" * size)
+            return path
+
+        kept = [staging.stage(segment("kept_%d.mp4" %(index), 1000), os.path.join(persistent_dir, "kept_%d.mp4" %(index)))
+                for index in range(2)]
+        dropped = [staging.stage(segment("dropped.mp4", 1000), os.path.join(persistent_dir, "dropped.mp4"))]
+
+        #RAM is full, so the next file spills
+        spilled = staging.stage(segment("spilled.mp4", 1000), os.path.join(persistent_dir, "spilled.mp4"))
+        assert os.path.dirname(spilled) == staging.spill_dir and staging.ram_bytes == 3000
+
+        staging.drop(dropped)
+        assert staging.ram_bytes == 2000 and staging.dropped_bytes == 1000
+
+        destinations = staging.promote(kept + [spilled])
+        assert sorted(os.listdir(persistent_dir)) == [SPILL_DIR_NAME, "kept_0.mp4", "kept_1.mp4", "spilled.mp4"]
+        assert destinations[-1] == os.path.join(persistent_dir, "spilled.mp4")
+        assert staging.ram_bytes == 0 and len(staging.files) == 0
+
+        #A file written in place is accounted at its reserved size until it is updated
+        path = staging.location(os.path.join(persistent_dir, "written.mp4"), 2500)
+        with open(path, "wb") as written:
+            written.write(b"\x00" * 500)
+        staging.update(path)
+        assert staging.ram_bytes == 500
+
+        #Crash-safe files are staged on persistent storage whatever the space left in RAM
+        assert os.path.dirname(staging.location(os.path.join(persistent_dir, "safe.mkv"), 0, True)) == staging.spill_dir
+        assert staging.spool_Dir("cam_0", True) == os.path.join(staging.spill_dir, SPOOL_DIR_NAME, "cam_0")
+
+        #The files an interrupted run left staged are recovered into the persistent directory, the spool is left alone
+        os.makedirs(staging.spool_Dir("cam_0"))
+        with open(os.path.join(staging.spill_dir, "safe.mkv"), "wb") as safe:
+            safe.write(b"\x00" * 100)
+        restarted = Staging_Area(persistent_dir, os.path.join(directory, "ram"), max_bytes = 3000)
+        recovered = restarted.recover_Staged(persistent_dir)
+        assert sorted(os.path.basename(path) for path in recovered) == ["recovered_safe.mkv", "recovered_written.mp4"]
+        assert os.listdir(restarted.ram_dir) == [SPOOL_DIR_NAME] and os.listdir(restarted.spill_dir) == []
+    finally:
+        shutil.rmtree(directory)
+
+    print("Staging_Area tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,602 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Still_Capture
+#   Version:    1.00
+#
+#   Description:
+#   The Still_Capture library takes still images from a CSI camera on a long-lived pipeline that encodes every frame to JPEG.
+#   The camera session is opened once, so a photo costs one frame interval instead of a full nvgstcapture-1.0 start-up, and
+#   bursts of photos are handed to a bounded background writer so that the disk does not stall the camera.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in writing image files
+import queue            #Used in passing images to the writer thread
+import shutil           #Used in removing test output
+import tempfile         #Used in creating test output
+import threading        #Used in waiting for frames and writing images
+import time
+
+from Pipeline_Engine import get_Engine, Pipeline_Error
+from Sensor_Modes import get_Sensor_Mode_Cache
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#JPEG markers
+SOI = b"\xff\xd8"
+MARKER_SOS = 0xDA
+MARKER_EOI = 0xD9
+MARKER_RST = range(0xD0, 0xD8)
+
+#Default rate in frames per second at which the still pipeline encodes frames
+DEFAULT_STILL_FRAMERATE = 15
+
+#Default JPEG encoder quality
+DEFAULT_JPEG_QUALITY = 90
+
+#Default number of images the writer may hold before a capture waits for the disk
+DEFAULT_WRITER_QUEUE = 16
+
+#Time in seconds to wait for a frame before the still pipeline is considered stalled
+DEFAULT_FRAME_TIMEOUT = 2.0
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class JPEG_Parser:
+    """
+    Class that splits a stream of concatenated JPEG images, delivered in arbitrary sized chunks, into whole images. Marker
+    segments are skipped by their length, so an EOI inside embedded metadata does not end the image early.
+
+    @param buffer               Bytes received that do not yet form a complete image
+    @type buffer                bytearray
+    """
+
+    def __init__(self):
+        """
+        JPEG_Parser Constructor.
+        """
+
+        self.buffer = bytearray()
+        self.reset()
+
+    def reset(self):
+        """
+        Start scanning a new image at the beginning of the buffer.
+        """
+
+        self.position = len(SOI)
+        self.in_header = True
+
+    def push(self, data):
+        """
+        Add bytes from the stream and return the images they complete.
+
+        @param data:                The next chunk of the stream
+        @type data:                 bytes
+
+        @return images:             The encoded images completed by this chunk
+        @rtype images:              [bytes]
+        """
+
+        self.buffer += data
+        images = []
+
+        while True:
+            end = self.find_End()
+            if end == -1:
+                break
+
+            images.append(bytes(self.buffer[:end]))
+            del self.buffer[:end]
+            self.reset()
+
+        return images
+
+    def find_End(self):
+        """
+        Find the end of the image at the start of the buffer.
+
+        @return end:                The offset just past the EOI marker, or -1 if the image is not yet complete
+        @rtype end:                 int
+        """
+
+        start = self.buffer.find(SOI)
+        if start == -1:
+            #Keep a trailing 0xFF in case it begins the next SOI
+            del self.buffer[:max(0, len(self.buffer) - 1)]
+            return -1
+        if start > 0:
+            del self.buffer[:start]
+            self.reset()
+
+        buffer = self.buffer
+        position = self.position
+
+        while True:
+
+            if self.in_header == True:
+                if len(buffer) < position + 4:
+                    break
+
+                if buffer[position] != 0xFF:
+                    #Not a JPEG after all, resynchronise on the next SOI
+                    del buffer[:len(SOI)]
+                    self.reset()
+                    return self.find_End()
+
+                marker = buffer[position + 1]
+                if marker == 0xFF:
+                    position += 1
+                    continue
+                if marker == MARKER_EOI:
+                    return position + 2
+
+                position += 2 + ((buffer[position + 2] << 8) | buffer[position + 3])
+                if marker == MARKER_SOS:
+                    self.in_header = False
+
+            else:
+                #Entropy coded data, in which 0xFF is always followed by a stuffed zero or a restart marker
+                index = buffer.find(b"\xff", position)
+                if index == -1 or index + 1 >= len(buffer):
+                    position = len(buffer) - 1 if index != -1 else len(buffer)
+                    break
+
+                marker = buffer[index + 1]
+                if marker == 0x00 or marker in MARKER_RST:
+                    position = index + 2
+                elif marker == 0xFF:
+                    position = index + 1
+                elif marker == MARKER_EOI:
+                    return index + 2
+                else:
+                    #Another marker segment, e.g. the tables between the scans of a progressive JPEG
+                    position = index
+                    self.in_header = True
+
+        self.position = position
+        return -1
+
+
+
+class Image_Writer:
+    """
+    Class that writes images to disk on a background thread. The queue is bounded, so a capture that outpaces the disk waits
+    for space instead of holding an unbounded number of frames in memory.
+
+    @param max_pending          The number of images that may wait to be written
+    @type max_pending           int
+
+    @param written              The number of images written
+    @type written               int
+
+    @param errors               The (path, error) pairs of images that could not be written
+    @type errors                [(str,OSError)]
+    """
+
+    def __init__(self, max_pending = DEFAULT_WRITER_QUEUE):
+        """
+        Image_Writer Constructor.
+        """
+
+        self.queue = queue.Queue(max_pending)
+        self.written = 0
+        self.errors = []
+
+        self.thread = threading.Thread(target=self.run, name="image-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, path, data):
+        """
+        Queue an image to be written, waiting if the queue is full.
+
+        @param path:                The path of the output file
+        @type path:                 str
+
+        @param data:                The encoded image
+        @type data:                 bytes
+        """
+
+        self.queue.put((path, data))
+
+    def run(self):
+        """
+        Write queued images until the writer is closed. Runs on the writer thread.
+        """
+
+        while True:
+            item = self.queue.get()
+            if item == None:
+                self.queue.task_done()
+                return
+
+            path, data = item
+            try:
+                with open(path, "wb") as image_file:
+                    image_file.write(data)
+                self.written += 1
+            except OSError as error:
+                self.errors.append((path, error))
+
+            self.queue.task_done()
+
+    def flush(self):
+        """
+        Wait until every queued image has been written.
+        """
+
+        self.queue.join()
+
+    def close(self):
+        """
+        Write the remaining images and stop the writer thread.
+        """
+
+        self.queue.put(None)
+        self.thread.join()
+
+
+
+class Burst_Result:
+    """
+    Class representing the images taken by a burst.
+
+    @param paths                The paths of the images, in capture order
+    @type paths                 [str]
+
+    @param duration             The time in seconds between the first and last capture
+    @type duration              float
+    """
+
+    def __init__(self, paths, duration):
+        """
+        Burst_Result Constructor.
+        """
+
+        self.paths = paths
+        self.duration = duration
+
+    def rate(self):
+        """
+        Get the capture throughput of the burst.
+
+        @return rate:               Images captured per second
+        @rtype rate:                float
+        """
+
+        if len(self.paths) < 2 or self.duration <= 0:
+            return 0.0
+        return (len(self.paths) - 1) / self.duration
+
+
+
+class Still_Capture:
+    """
+    Class representing a long-lived JPEG pipeline on a CSI camera. The most recent frame is kept, and each capture hands out
+    the first frame encoded after it was requested.
+
+    @param sensor_id            CSI Port ID of the camera device
+    @type sensor_id             int
+
+    @param width                The resolution width of the images
+    @type width                 int
+
+    @param height               The resolution height of the images
+    @type height                int
+
+    @param framerate            The rate at which frames are encoded, and so the highest burst rate
+    @type framerate             int
+
+    @param quality              The JPEG encoder quality
+    @type quality               int
+
+    @param pipeline             The running still pipeline, None if it is not running
+    @type pipeline              Pipeline
+
+    @param writer               The writer used for captures saved to file
+    @type writer                Image_Writer
+
+    @param mode_cache           The probed sensor modes that the pipeline is resolved against
+    @type mode_cache            Sensor_Mode_Cache
+    """
+
+    def __init__(self, sensor_id, width, height, framerate = DEFAULT_STILL_FRAMERATE, quality = DEFAULT_JPEG_QUALITY,
+                 engine = None, writer = None, mode_cache = None):
+        """
+        Still_Capture Constructor.
+        """
+
+        self.sensor_id = sensor_id
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.quality = quality
+        self.name = "still_%d" %(sensor_id)
+
+        if engine == None:
+            engine = get_Engine()
+        self.engine = engine
+
+        if writer == None:
+            writer = Image_Writer()
+        self.writer = writer
+
+        if mode_cache == None:
+            mode_cache = get_Sensor_Mode_Cache()
+        self.mode_cache = mode_cache
+
+        self.pipeline = None
+        self.parser = None
+
+        self.condition = threading.Condition()
+        self.requests = []
+        self.frame = None
+        self.frame_index = 0
+        self.frame_time = None
+
+    def still_Pipeline(self):
+        """
+        Get the description of the still pipeline, using the hardware JPEG encoder where it is installed.
+        """
+
+        description = self.mode_cache.resolve(self.sensor_id, (self.width, self.height), self.framerate).description()
+
+        if self.engine.has_Element("nvjpegenc") == True:
+            description += "nvjpegenc quality=%d ! " %(self.quality)
+        else:
+            description += "nvvidconv ! 'video/x-raw,format=I420' ! jpegenc quality=%d ! " %(self.quality)
+
+        description += self.engine.data_Sink()
+        return description
+
+    def is_Running(self):
+        """
+        Return True if the still pipeline is running.
+        """
+
+        return self.pipeline != None and self.pipeline.is_Running()
+
+    def start(self):
+        """
+        Start the still pipeline. Does nothing if it is already running.
+        """
+
+        if self.is_Running() == True:
+            return
+
+        self.parser = JPEG_Parser()
+        self.pipeline = self.engine.launch(self.still_Pipeline(), self.name, data_callback=self.read_Data)
+
+        #Wake captures waiting on a pipeline that has failed
+        self.pipeline.add_Finish_Callback(lambda pipeline: self.notify())
+
+    def stop(self):
+        """
+        Stop the still pipeline and write any queued images.
+        """
+
+        if self.pipeline != None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+        self.writer.flush()
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+            requests = self.requests
+            self.requests = []
+
+        #The pipeline has finished, so no frame will come for the waiting requests
+        for callback in requests:
+            callback(None)
+
+    def read_Data(self, data):
+        """
+        Keep the newest complete frame from the pipeline output. Runs on the pipeline's data thread.
+        """
+
+        images = self.parser.push(data)
+        if len(images) == 0:
+            return
+
+        with self.condition:
+            self.frame = images[-1]
+            self.frame_index += len(images)
+            self.frame_time = time.monotonic()
+            self.condition.notify_all()
+            requests = self.requests
+            self.requests = []
+
+        for callback in requests:
+            callback(self.frame)
+
+    def request_Frame(self, callback):
+        """
+        Take a photo without waiting for it. The function is called on the pipeline's data thread with the JPEG encoded
+        image, or with None if the pipeline stops first.
+
+        @param callback:            Function called with the image
+        @type callback:             function
+        """
+
+        with self.condition:
+            if self.is_Running() == True:
+                self.requests.append(callback)
+                return
+
+        callback(None)
+
+    def capture(self, timeout = DEFAULT_FRAME_TIMEOUT):
+        """
+        Take a photo.
+
+        @param timeout:             The time in seconds to wait for a frame
+        @type timeout:              float
+
+        @return data:               The JPEG encoded image
+        @rtype data:                bytes
+        """
+
+        with self.condition:
+            index = self.frame_index
+
+            if self.condition.wait_for(lambda: self.frame_index > index or self.is_Running() == False, timeout) == False:
+                raise Pipeline_Error(self.name, "no frame within %.1f s" %(timeout))
+            if self.frame_index == index:
+                raise Pipeline_Error(self.name, "the still pipeline has stopped")
+
+            return self.frame
+
+    def capture_To_File(self, filename, timeout = DEFAULT_FRAME_TIMEOUT):
+        """
+        Take a photo and queue it to be written as a JPEG file.
+
+        @param filename:            The name of the output JPEG file, without extension
+        @type filename:             str
+
+        @return path:               The path of the output file
+        @rtype path:                str
+        """
+
+        path = "%s.jpg" %(filename)
+        self.writer.write(path, self.capture(timeout))
+        return path
+
+    def burst(self, filename, count, interval = 0.0, timeout = DEFAULT_FRAME_TIMEOUT):
+        """
+        Take a number of photos at a set interval and queue them to be written as numbered JPEG files.
+
+        @param filename:            The name of the output JPEG files, without index and extension
+        @type filename:             str
+
+        @param count:               The number of photos to take
+        @type count:                int
+
+        @param interval:            The time in seconds between photos. 0 takes consecutive frames
+        @type interval:             float
+
+        @return result:             The paths of the images and the achieved rate
+        @rtype result:              Burst_Result
+        """
+
+        paths = []
+        start = time.monotonic()
+        first = None
+
+        for index in range(count):
+
+            #Schedule from the start of the burst so that delays do not accumulate
+            delay = start + index * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            data = self.capture(timeout)
+            if first == None:
+                first = time.monotonic()
+
+            path = "%s_%03d.jpg" %(filename, index)
+            self.writer.write(path, data)
+            paths.append(path)
+
+        return Burst_Result(paths, time.monotonic() - first)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def synthetic_JPEG(index, size = 256):
+    """
+    Build a minimal JPEG shaped image for exercising the parser without an encoder. The APP segment holds a stray EOI and
+    the scan holds stuffed bytes and a restart marker.
+
+    @param index:               A value stored in the image to tell images apart
+    @type index:                int
+
+    @param size:                The number of scan bytes
+    @type size:                 int
+
+    @return data:               The encoded image
+    @rtype data:                bytes
+    """
+
+    app = b"EXIF" + b"\xff\xd9" + bytes([index & 0xFF])
+    scan = bytes([index & 0xFF]) * (size // 2) + b"\xff\x00" + b"\xff\xd0" + b"\x5a" * (size // 2)
+
+    data = SOI
+    data += b"\xff\xe1" + (len(app) + 2).to_bytes(2, "big") + app
+    data += b"\xff\xda" + (8).to_bytes(2, "big") + b"\x01\x01\x00\x00\x3f\x00"
+    data += scan + b"\xff\xd9"
+    return data
+
+def test():
+    images = [synthetic_JPEG(index) for index in range(50)]
+    stream = b"garbage" + b"".join(images)
+
+    #Feed the stream in awkward chunk sizes to cross marker boundaries
+    parser = JPEG_Parser()
+    parsed = []
+    for offset in range(0, len(stream), 33):
+        parsed += parser.push(stream[offset:offset + 33])
+    assert parsed == images
+
+    directory = tempfile.mkdtemp()
+    try:
+        #Stand-in for the camera: feeds frames into a capture that was never started
+        framerate = 100
+        camera = Still_Capture(0, 1280, 720, framerate, writer = Image_Writer(4))
+        camera.parser = JPEG_Parser()
+        camera.is_Running = lambda: True
+
+        stopped = threading.Event()
+        def feed():
+            index = 0
+            while stopped.wait(1.0 / framerate) == False:
+                camera.read_Data(synthetic_JPEG(index, 64 * 1024))
+                index += 1
+        threading.Thread(target=feed, daemon=True).start()
+
+        start = time.monotonic()
+        single = camera.capture_To_File(os.path.join(directory, "single"))
+        latency = time.monotonic() - start
+
+        result = camera.burst(os.path.join(directory, "burst"), 30)
+        interval_result = camera.burst(os.path.join(directory, "interval"), 5, interval = 0.05)
+
+        #A requested frame arrives on the feeding thread without the caller waiting for it
+        requested = []
+        delivered = threading.Event()
+        camera.request_Frame(lambda data: (requested.append(data), delivered.set()))
+        assert delivered.wait(1.0) == True and requested[0].startswith(SOI) == True
+
+        stopped.set()
+        camera.writer.close()
+
+        assert os.path.exists(single)
+        assert camera.writer.written == 36 and len(camera.writer.errors) == 0
+        assert len(set(open(path, "rb").read() for path in result.paths)) == 30
+        assert result.rate() > framerate * 0.5
+        assert 0.15 < interval_result.duration < 0.4
+
+        print("Single capture latency %.1f ms, burst %.1f frames per second" %(latency * 1e3, result.rate()))
+    finally:
+        shutil.rmtree(directory)
+
+    print("Still_Capture tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,472 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Storage_Manager
+#   Version:    1.00
+#
+#   Description:
+#   The Storage_Manager library keeps the camera trap's output directory from filling its storage. It keeps an index of the
+#   kept recordings that is updated as recordings are added and deleted instead of by rescanning the directory, estimates the
+#   recording time left from the free space and the measured write rate, and deletes old or low scoring recordings on a
+#   background thread so that the recording path never waits on the disk.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in measuring free space and deleting recordings
+import heapq            #Used in ordering recordings for deletion
+import itertools        #Used in ordering recordings for deletion
+import shutil           #Used in removing test output
+import tempfile         #Used in creating test output
+import threading        #Used in deleting recordings in the background
+import time
+
+from Video_Container import VIDEO_EXTENSIONS
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Retention policies
+OLDEST_FIRST = "oldest"
+LOWEST_SCORE_FIRST = "lowest_score"
+
+#Storage levels
+STORAGE_OK = "ok"
+STORAGE_LOW = "low"
+STORAGE_CRITICAL = "critical"
+STORAGE_FULL = "full"
+
+#Free space in bytes below which old recordings are deleted
+DEFAULT_LOW_BYTES = 1024 * 1024 * 1024
+
+#Free space in bytes below which capture is downgraded
+DEFAULT_CRITICAL_BYTES = 256 * 1024 * 1024
+
+#Free space in bytes that is never recorded into, left for the system
+DEFAULT_RESERVE_BYTES = 64 * 1024 * 1024
+
+#Score of a recording whose value is not known
+DEFAULT_SCORE = 0.0
+
+#Weight of each new recording in the measured write rate
+RATE_SMOOTHING = 0.3
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Stored_Recording:
+    """
+    Class representing a kept recording in the output directory.
+
+    @param paths                The files of the recording
+    @type paths                 [str]
+
+    @param size                 The total size of the files in bytes
+    @type size                  int
+
+    @param created              The time.time() time at which the recording was kept
+    @type created               float
+
+    @param score                The value of the recording, lower scores are deleted first by LOWEST_SCORE_FIRST
+    @type score                 float
+    """
+
+    def __init__(self, paths, size, created, score):
+        """
+        Stored_Recording Constructor.
+        """
+
+        self.paths = paths
+        self.size = size
+        self.created = created
+        self.score = score
+        self.deleted = False
+
+
+
+class Storage_Manager:
+    """
+    Class that tracks and enforces the storage use of the output directory.
+
+    @param dir                  The output directory
+    @type dir                   str
+
+    @param retention            The order in which recordings are deleted, OLDEST_FIRST or LOWEST_SCORE_FIRST
+    @type retention             str
+
+    @param record_rate          The estimated number of bytes written per second of recording
+    @type record_rate           float
+
+    @param used_bytes           The total size of the indexed recordings
+    @type used_bytes            int
+
+    @param deleted_bytes        The number of bytes deleted by retention
+    @type deleted_bytes         int
+
+    @param delete_callback      Function called on the retention thread with the files of each deleted recording
+    @type delete_callback       function
+
+    @param default_score        The score of a recording whose value is not known
+    @type default_score         float
+    """
+
+    def __init__(self, dir, record_rate, retention = OLDEST_FIRST, low_bytes = DEFAULT_LOW_BYTES,
+                 critical_bytes = DEFAULT_CRITICAL_BYTES, reserve_bytes = DEFAULT_RESERVE_BYTES, capacity_bytes = None,
+                 delete_callback = None, existing = None, default_score = DEFAULT_SCORE):
+        """
+        Storage_Manager Constructor.
+
+        @param dir:                 The output directory
+        @type dir:                  str
+
+        @param record_rate:         The initial estimate of bytes written per second of recording, e.g. from the bitrate
+                                    of each camera at the configured resolution and framerate
+        @type record_rate:          float
+
+        @param retention:           The order in which recordings are deleted, OLDEST_FIRST or LOWEST_SCORE_FIRST
+        @type retention:            str
+
+        @param low_bytes:           The free space below which recordings are deleted before a recording starts
+        @type low_bytes:            int
+
+        @param critical_bytes:      The free space below which capture is downgraded
+        @type critical_bytes:       int
+
+        @param reserve_bytes:       The free space that is never recorded into
+        @type reserve_bytes:        int
+
+        @param capacity_bytes:      A quota on the size of the output directory. None uses the free space of its filesystem
+        @type capacity_bytes:       int
+
+        @param delete_callback:     Function called on the retention thread with the files of each deleted recording
+        @type delete_callback:      function
+
+        @param existing:            The recordings already in the output directory as (paths, time.time() time kept,
+                                    score) of each, e.g. from Recording_Catalog.recordings(). A time or score of None is
+                                    taken from the files' modification time or default_score. Any other video file in the
+                                    directory is indexed on its own
+        @type existing:             [([str],float,float)]
+
+        @param default_score:       The score of a recording whose value is not known
+        @type default_score:        float
+        """
+
+        self.dir = dir
+        self.record_rate = float(record_rate)
+        self.retention = retention
+        self.low_bytes = low_bytes
+        self.critical_bytes = critical_bytes
+        self.reserve_bytes = reserve_bytes
+        self.capacity_bytes = capacity_bytes
+        self.delete_callback = delete_callback
+        self.default_score = default_score
+
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.heap = []
+        self.order = itertools.count()
+        self.used_bytes = 0
+        self.deleted_bytes = 0
+        self.target_bytes = None
+        self.running = False
+        self.thread = None
+
+        os.makedirs(dir, exist_ok=True)
+        self.index_Existing(existing or [])
+
+    def index_Existing(self, existing):
+        """
+        Index the recordings already in the output directory, once, at start-up. The files of each known recording are
+        kept and deleted together at its score, and any other file is indexed on its own at its modification time and
+        default_score.
+
+        @param existing:            (paths, time.time() time kept, score) of each known recording
+        @type existing:             [([str],float,float)]
+        """
+
+        indexed = set()
+
+        for paths, created, score in existing:
+            size = 0
+            modified = None
+            found = []
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                size += stat.st_size
+                modified = max(modified or stat.st_mtime, stat.st_mtime)
+                found.append(path)
+                indexed.add(os.path.abspath(path))
+
+            if len(found) == 0:
+                continue
+            if created == None:
+                created = modified
+            if score == None:
+                score = self.default_score
+            self.push(Stored_Recording(found, size, created, score))
+
+        for entry in os.scandir(self.dir):
+            if entry.is_file() == True and entry.name.endswith(VIDEO_EXTENSIONS) == True and \
+               os.path.abspath(entry.path) not in indexed:
+                stat = entry.stat()
+                self.push(Stored_Recording([entry.path], stat.st_size, stat.st_mtime, self.default_score))
+
+    def push(self, recording):
+        """
+        Add a recording to the index. Must be called with the lock held, or before the manager is started.
+        """
+
+        if self.retention == LOWEST_SCORE_FIRST:
+            key = (recording.score, recording.created)
+        else:
+            key = (recording.created,)
+
+        heapq.heappush(self.heap, (key, next(self.order), recording))
+        self.used_bytes += recording.size
+
+    def start(self):
+        """
+        Start the background deletion thread.
+        """
+
+        with self.lock:
+            if self.running == True:
+                return
+            self.running = True
+
+        self.thread = threading.Thread(target=self.run, name="storage-retention", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the background deletion thread, leaving any pending deletions undone.
+        """
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+
+    def free_Bytes(self):
+        """
+        Get the free space available to recordings.
+
+        @return free:               The free space in bytes
+        @rtype free:                int
+        """
+
+        if self.capacity_bytes != None:
+            return self.capacity_bytes - self.used_bytes
+
+        stat = os.statvfs(self.dir)
+        return stat.f_bavail * stat.f_frsize
+
+    def remaining_Time(self):
+        """
+        Estimate the recording time left before the storage is full, at the measured write rate.
+
+        @return remaining:          Remaining recording time in seconds
+        @rtype remaining:           float
+        """
+
+        return max(0, self.free_Bytes() - self.reserve_bytes) / self.record_rate
+
+    def level(self, free):
+        """
+        Get the storage level for an amount of free space.
+        """
+
+        if free <= self.reserve_bytes:
+            return STORAGE_FULL
+        if free <= self.critical_bytes:
+            return STORAGE_CRITICAL
+        if free <= self.low_bytes:
+            return STORAGE_LOW
+        return STORAGE_OK
+
+    def prepare_Recording(self, duration):
+        """
+        Check the storage before a recording starts, asking the background thread to delete recordings if the recording
+        would take the free space below low_bytes. Returns immediately.
+
+        @param duration:            The longest the recording may run in seconds
+        @type duration:             float
+
+        @return level:              The storage level after the recording, before any deletion has completed
+        @rtype level:               str
+        """
+
+        expected = duration * self.record_rate
+        free = self.free_Bytes() - expected
+
+        if free <= self.low_bytes:
+            with self.condition:
+                self.target_bytes = max(self.target_bytes or 0, self.low_bytes - free)
+                self.condition.notify_all()
+
+        return self.level(free)
+
+    def add_Recording(self, paths, duration, score = None):
+        """
+        Index a kept recording and update the measured write rate.
+
+        @param paths:               The files of the recording
+        @type paths:                [str]
+
+        @param duration:            The length of the recording in seconds
+        @type duration:             float
+
+        @param score:               The value of the recording, used by LOWEST_SCORE_FIRST. None uses default_score
+        @type score:                float
+        """
+
+        if score == None:
+            score = self.default_score
+
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+
+        with self.lock:
+            self.push(Stored_Recording(list(paths), size, time.time(), score))
+
+            if duration > 0:
+                self.record_rate += RATE_SMOOTHING * (size / duration - self.record_rate)
+
+    def run(self):
+        """
+        Delete recordings until the requested space has been freed. Runs on the retention thread.
+        """
+
+        while True:
+            with self.condition:
+                while self.running == True and self.target_bytes == None:
+                    self.condition.wait()
+
+                if self.running == False:
+                    return
+
+                if self.target_bytes <= 0 or len(self.heap) == 0:
+                    self.target_bytes = None
+                    self.condition.notify_all()
+                    continue
+
+                key, order, recording = heapq.heappop(self.heap)
+
+            for path in recording.paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            recording.deleted = True
+
+            if self.delete_callback != None:
+                self.delete_callback(recording.paths)
+
+            with self.condition:
+                self.used_bytes -= recording.size
+                self.deleted_bytes += recording.size
+                if self.target_bytes != None:
+                    self.target_bytes -= recording.size
+
+    def wait_Idle(self, timeout = None):
+        """
+        Wait until no deletion is pending.
+
+        @return idle:               True if no deletion is pending
+        @rtype idle:                bool
+        """
+
+        with self.condition:
+            return self.condition.wait_for(lambda: self.target_bytes == None, timeout)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def downgrade_Caps(resolution, framerate):
+    """
+    Get the reduced capture settings used while storage is critical: half the resolution and framerate.
+
+    @return caps:               ((width,height), framerate) of the downgraded capture
+    @rtype caps:                ((int,int),int)
+    """
+
+    width = max(2, resolution[0] // 4 * 2)
+    height = max(2, resolution[1] // 4 * 2)
+    return (width, height), max(1, framerate // 2)
+
+def test():
+    directory = tempfile.mkdtemp()
+    try:
+        def recording(name, size):
+            path = os.path.join(directory, name)
+            with open(path, "wb") as recording_file:
+                recording_file.write(b"\x00" * size)
+            return [path]
+
+        #A recording of two files kept by an earlier run, and a file of no known recording
+        existing = recording("existing_0.mp4", 400) + recording("existing_1.mp4", 400)
+        recording("stray.mp4", 200)
+
+        deleted = []
+        storage = Storage_Manager(directory, record_rate = 100, retention = LOWEST_SCORE_FIRST, low_bytes = 3000,
+                                  critical_bytes = 1500, reserve_bytes = 500, capacity_bytes = 10000,
+                                  delete_callback = deleted.extend, existing = [(existing, time.time() - 60, 3.0)],
+                                  default_score = 2.0)
+        storage.start()
+
+        assert storage.used_bytes == 1000 and len(storage.heap) == 2
+        assert storage.prepare_Recording(10) == STORAGE_OK
+
+        storage.add_Recording(recording("high.mp4", 3000), 10, score = 5.0)
+        storage.add_Recording(recording("low.mp4", 3000), 10, score = 1.0)
+        assert 100 < storage.record_rate < 300
+        assert abs(storage.remaining_Time() - 2500 / storage.record_rate) < 1e-6
+
+        #Free space would fall to 3000 - 2000: the new low scoring recording is deleted ahead of the earlier run's
+        start = time.monotonic()
+        assert storage.prepare_Recording(2000 / storage.record_rate) == STORAGE_CRITICAL
+        assert time.monotonic() - start < 0.01
+
+        assert storage.wait_Idle(5) == True
+        assert sorted(os.listdir(directory)) == ["existing_0.mp4", "existing_1.mp4", "high.mp4", "stray.mp4"]
+        assert [os.path.basename(path) for path in deleted] == ["low.mp4"]
+
+        #Free space would fall to 6000 - 3500: the stray file goes at the default score, then the earlier run's
+        #recording as a whole
+        assert storage.prepare_Recording(3500 / storage.record_rate) == STORAGE_LOW
+        assert storage.wait_Idle(5) == True
+        assert sorted(os.listdir(directory)) == ["high.mp4"]
+        assert [os.path.basename(path) for path in deleted] == ["low.mp4", "stray.mp4", "existing_0.mp4", "existing_1.mp4"]
+        assert storage.deleted_bytes == 4000 and storage.free_Bytes() == 7000
+
+        storage.stop()
+
+        assert downgrade_Caps((1920, 1080), 30) == ((960, 540), 15)
+    finally:
+        shutil.rmtree(directory)
+
+    print("Storage_Manager tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
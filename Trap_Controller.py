@@ -0,0 +1,701 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Trap_Controller
+#   Version:    1.00
+#
+#   Description:
+#   The Trap_Controller library implements the recording policy of the camera trap as an event driven state machine
+#   (armed -> recording -> validating -> cooldown) and runs it on an asyncio event loop. Time is read from an injectable clock,
+#   so the same controller runs on the real monotonic clock in the field and on a virtual clock in simulation.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import asyncio          #Used in running the controller
+import heapq            #Used in ordering virtual timers
+import itertools        #Used in ordering virtual timers
+import threading        #Used in posting events from other threads
+import time
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Policy states
+ARMED = "armed"
+RECORDING = "recording"
+VALIDATING = "validating"
+COOLDOWN = "cooldown"
+
+#Policy actions
+START = "start"
+STOP = "stop"
+COMMIT = "commit"
+DISCARD = "discard"
+
+#Controller event kinds
+MOTION = "motion"
+CONFIRMATION = "confirmation"
+STARTED = "started"
+STOPPED = "stopped"
+SHUTDOWN = "shutdown"
+
+#Tolerance in seconds used when comparing accumulated activity with the threshold
+TIME_TOLERANCE = 1e-6
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Recording_Policy:
+    """
+    The recording policy of the camera trap. The policy has no notion of real time: every input carries its own
+    timestamp and the owner is expected to call on_Timer at next_Deadline().
+
+    A recording starts when activity begins while armed. It is extended while activity continues and stopped once
+    activity has ended and rec_min_duration has passed, or when rec_max_duration is reached. Activity must be present for
+    the whole of the first active_threshold seconds, otherwise the recording is stopped and discarded. After the pipeline
+    has stopped, a valid recording is committed and the trap sleeps for sleep_duration. A recording the cameras failed to
+    start is stopped and discarded, and the trap sleeps for sleep_duration before trying again.
+
+    Activity may also be confirmed by the cameras. While the cameras report no motion, activity does not count towards
+    active_threshold; until they report at all, it counts unconfirmed.
+
+    @param state                The current state: ARMED, RECORDING, VALIDATING or COOLDOWN
+    @type state                 str
+
+    @param active               True while activity is reported
+    @type active                bool
+
+    @param confirmed            True while the cameras see motion, False while they do not, None if they are not reporting
+    @type confirmed             bool
+    """
+
+    def __init__(self, rec_min_duration, rec_max_duration, active_threshold, sleep_duration):
+        """
+        Recording_Policy Constructor.
+
+        @param rec_min_duration:    The enforced minimum duration of a recording session in seconds
+        @type rec_min_duration:     float
+
+        @param rec_max_duration:    The enforced maximum duration of a recording session in seconds
+        @type rec_max_duration:     float
+
+        @param active_threshold:    The duration in seconds during the start of recording for which activity must be detected
+        @type active_threshold:     float
+
+        @param sleep_duration:      The enforced period of inactivity after a successful recording session in seconds
+        @type sleep_duration:       float
+        """
+
+        self.rec_min_duration = rec_min_duration
+        self.rec_max_duration = rec_max_duration
+        self.active_threshold = active_threshold
+        self.sleep_duration = sleep_duration
+
+        self.state = ARMED
+        self.now = None
+        self.active = False
+        self.active_since = None
+        self.confirmed = None
+
+        #Current recording
+        self.start_time = None
+        self.stop_time = None
+        self.window_active = 0.0
+        self.valid = None
+        self.start_failed = False
+        self.cooldown_until = None
+
+        #Counters
+        self.recordings = 0
+        self.committed = 0
+        self.discarded = 0
+        self.failed_starts = 0
+        self.missed_triggers = 0
+
+    def on_Activity(self, t, active):
+        """
+        Report a change in activity.
+
+        @param t:                   The time of the change
+        @type t:                    float
+
+        @param active:              True if activity has started, False if it has ended
+        @type active:               bool
+
+        @return actions:            The actions the owner must perform
+        @rtype actions:             [str]
+        """
+
+        self.now = t
+        self.accumulate(t)
+
+        if active == self.active:
+            return self.update(t)
+
+        self.active = active
+        self.active_since = t if self.is_Counting() == True else None
+
+        if active == True:
+            if self.state == ARMED:
+                return self.start(t)
+            if self.state == COOLDOWN:
+                self.missed_triggers += 1
+
+        return self.update(t)
+
+    def on_Confirmation(self, t, confirmed):
+        """
+        Report a change in whether the cameras see motion.
+
+        @param t:                   The time of the change
+        @type t:                    float
+
+        @param confirmed:           True if the cameras see motion, False if they do not, None if they are not reporting
+        @type confirmed:            bool
+
+        @return actions:            The actions the owner must perform
+        @rtype actions:             [str]
+        """
+
+        self.now = t
+        self.accumulate(t)
+
+        counting = self.is_Counting()
+        self.confirmed = confirmed
+        self.active_since = t if self.is_Counting() == True else None
+
+        #Activity the cameras had vetoed is now seen
+        if self.state == ARMED and counting == False and self.is_Counting() == True:
+            return self.start(t)
+
+        return self.update(t)
+
+    def is_Counting(self):
+        """
+        Return True if the current activity counts towards active_threshold.
+        """
+
+        return self.active == True and self.confirmed != False
+
+    def on_Started(self, t, started):
+        """
+        Report whether the cameras started the current recording.
+
+        @param started:             True if any camera is recording
+        @type started:              bool
+
+        @return actions:            The actions the owner must perform
+        @rtype actions:             [str]
+        """
+
+        self.now = t
+        self.accumulate(t)
+
+        if started == True or self.state != RECORDING:
+            return self.update(t)
+
+        self.start_failed = True
+        self.valid = False
+        return self.stop(t)
+
+    def on_Stopped(self, t):
+        """
+        Report that the recording pipeline has stopped and its output is complete.
+
+        @return actions:            The actions the owner must perform
+        @rtype actions:             [str]
+        """
+
+        self.now = t
+        if self.state != VALIDATING:
+            return []
+
+        #Retrying straight away would fail again while the sensor stays active
+        if self.start_failed == True:
+            self.failed_starts += 1
+            self.state = COOLDOWN
+            self.cooldown_until = t + self.sleep_duration
+            return [DISCARD] + self.update(t)
+
+        if self.valid == True:
+            self.committed += 1
+            self.state = COOLDOWN
+            self.cooldown_until = t + self.sleep_duration
+            return [COMMIT] + self.update(t)
+
+        self.discarded += 1
+        self.state = ARMED
+        actions = [DISCARD]
+        if self.is_Counting() == True:
+            actions += self.start(t)
+        return actions
+
+    def on_Timer(self, t):
+        """
+        Report that next_Deadline() has been reached.
+
+        @return actions:            The actions the owner must perform
+        @rtype actions:             [str]
+        """
+
+        self.now = t
+        self.accumulate(t)
+        return self.update(t)
+
+    def next_Deadline(self):
+        """
+        Get the next time at which on_Timer must be called.
+
+        @return deadline:           The deadline, or None if the policy is waiting for an event
+        @rtype deadline:            float
+        """
+
+        if self.state == RECORDING:
+            deadlines = [self.start_time + self.rec_max_duration]
+            if self.valid == None:
+                deadlines.append(self.start_time + self.active_threshold)
+            if self.active == False and self.now < self.start_time + self.rec_min_duration:
+                deadlines.append(self.start_time + self.rec_min_duration)
+            return min(deadlines)
+
+        if self.state == COOLDOWN:
+            return self.cooldown_until
+
+        return None
+
+    def start(self, t):
+        """
+        Start a recording.
+        """
+
+        self.state = RECORDING
+        self.start_time = t
+        self.stop_time = None
+        self.window_active = 0.0
+        self.valid = None if self.active_threshold > 0 else True
+        self.start_failed = False
+        self.recordings += 1
+
+        if self.is_Counting() == True:
+            self.active_since = t
+
+        return [START] + self.update(t)
+
+    def stop(self, t):
+        """
+        Stop the current recording.
+        """
+
+        self.state = VALIDATING
+        self.stop_time = t
+        return [STOP]
+
+    def accumulate(self, t):
+        """
+        Add the activity up to t that falls inside the validation window of the current recording.
+        """
+
+        if self.state != RECORDING or self.valid != None or self.is_Counting() == False:
+            return
+
+        end = min(t, self.start_time + self.active_threshold)
+        if end > self.active_since:
+            self.window_active += end - self.active_since
+        self.active_since = max(self.active_since, end)
+
+    def update(self, t):
+        """
+        Apply any transition that is due at t.
+        """
+
+        if self.state == RECORDING:
+
+            if self.valid == None and t >= self.start_time + self.active_threshold - TIME_TOLERANCE:
+                self.valid = self.window_active >= self.active_threshold - TIME_TOLERANCE
+
+            elapsed = t - self.start_time
+
+            if self.valid == False:
+                return self.stop(t)
+            if elapsed >= self.rec_max_duration - TIME_TOLERANCE:
+                return self.stop(t)
+            if self.valid == True and self.active == False and elapsed >= self.rec_min_duration - TIME_TOLERANCE:
+                return self.stop(t)
+
+        elif self.state == COOLDOWN and t >= self.cooldown_until - TIME_TOLERANCE:
+            self.state = ARMED
+            self.cooldown_until = None
+            if self.active == True:
+                return self.start(t)
+
+        return []
+
+
+
+class Trap_Event:
+    """
+    Class representing an input of the controller.
+
+    @param kind                 MOTION, CONFIRMATION, STOPPED or SHUTDOWN
+    @type kind                  str
+
+    @param timestamp            The clock time of the event
+    @type timestamp             float
+
+    @param value                The payload of the event, e.g. the activity level of a MOTION event
+    @type value                 object
+    """
+
+    def __init__(self, kind, timestamp, value = None):
+        """
+        Trap_Event Constructor.
+        """
+
+        self.kind = kind
+        self.timestamp = timestamp
+        self.value = value
+
+
+
+class Monotonic_Clock:
+    """
+    Clock that follows time.monotonic() and waits on the event loop.
+    """
+
+    def time(self):
+        return time.monotonic()
+
+    def call_At(self, when, callback, *args):
+        """
+        Call a function on the event loop at the given clock time.
+        """
+
+        loop = asyncio.get_running_loop()
+        loop.call_later(max(0.0, when - self.time()), callback, *args)
+
+    async def wait(self, queue, deadline):
+        """
+        Wait for the next event, or until the deadline.
+
+        @return event:              The next event, or None if the deadline was reached first
+        @rtype event:               Trap_Event
+        """
+
+        timeout = None
+        if deadline != None:
+            timeout = max(0.0, deadline - self.time())
+
+        try:
+            return await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+
+class Virtual_Clock:
+    """
+    Clock that jumps straight to the next timer or deadline whenever the controller is idle, so hours of trap activity
+    run in milliseconds. Scheduled timers stand in for everything that happens outside the controller, such as sensor
+    edges and pipeline stops.
+
+    @param now                  The current virtual time in seconds
+    @type now                   float
+    """
+
+    def __init__(self, start = 0.0):
+        """
+        Virtual_Clock Constructor.
+        """
+
+        self.now = start
+        self.timers = []
+        self.sequence = itertools.count()
+
+    def time(self):
+        return self.now
+
+    def call_At(self, when, callback, *args):
+        """
+        Call a function once the virtual time reaches when.
+        """
+
+        heapq.heappush(self.timers, (when, next(self.sequence), callback, args))
+
+    async def wait(self, queue, deadline):
+        """
+        Wait for the next event, advancing virtual time through the timers until one produces an event or the deadline
+        is reached.
+
+        @return event:              The next event, None if the deadline was reached first, or a SHUTDOWN event if
+                                    nothing further can happen
+        @rtype event:               Trap_Event
+        """
+
+        while True:
+            #Let any other task on the loop run first
+            await asyncio.sleep(0)
+
+            if queue.empty() == False:
+                return queue.get_nowait()
+
+            if len(self.timers) > 0 and (deadline == None or self.timers[0][0] <= deadline):
+                when, sequence, callback, args = heapq.heappop(self.timers)
+                self.now = max(self.now, when)
+                callback(*args)
+                continue
+
+            if deadline == None:
+                return Trap_Event(SHUTDOWN, self.now)
+
+            self.now = max(self.now, deadline)
+            return None
+
+
+
+class Trap_Controller:
+    """
+    Class that runs a Recording_Policy on an asyncio event loop and carries out its actions through an actuator.
+
+    The actuator provides start_Recording(t), stop_Recording(t, done), commit_Recording(t) and discard_Recording(t).
+    Both start_Recording and stop_Recording must return immediately. stop_Recording calls done() from any thread once the
+    recording has stopped. An actuator that starts its cameras in the background posts STARTED with whether they started.
+
+    @param policy               The recording policy
+    @type policy                Recording_Policy
+
+    @param actuator             The object that controls the cameras
+    @type actuator              object
+
+    @param clock                The clock the controller runs on
+    @type clock                 Monotonic_Clock or Virtual_Clock
+
+    @param log                  The (time, action) pairs performed so far
+    @type log                   [(float,str)]
+    """
+
+    def __init__(self, policy, actuator, clock = None):
+        """
+        Trap_Controller Constructor.
+        """
+
+        if clock == None:
+            clock = Monotonic_Clock()
+
+        self.policy = policy
+        self.actuator = actuator
+        self.clock = clock
+        self.log = []
+
+        self.loop = None
+        self.loop_thread = None
+        self.queue = None
+
+    def post(self, kind, value = None, timestamp = None):
+        """
+        Deliver an event to the controller. May be called from any thread once the controller is running.
+
+        @param kind:                MOTION, CONFIRMATION, STARTED, STOPPED or SHUTDOWN
+        @type kind:                 str
+
+        @param value:               The payload of the event
+        @type value:                object
+
+        @param timestamp:           The clock time of the event. Defaults to the time it is handled
+        @type timestamp:            float
+        """
+
+        event = Trap_Event(kind, timestamp, value)
+
+        if threading.get_ident() == self.loop_thread:
+            self.queue.put_nowait(event)
+        else:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    def shutdown(self):
+        """
+        Ask the controller to stop once its current event has been handled.
+        """
+
+        self.post(SHUTDOWN)
+
+    async def run(self, sources = ()):
+        """
+        Run the controller until it is shut down.
+
+        @param sources:             Coroutines that feed events to the controller, run alongside it
+        @type sources:              [coroutine]
+        """
+
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.queue = asyncio.Queue()
+
+        tasks = [asyncio.ensure_future(source) for source in sources]
+
+        try:
+            while True:
+                event = await self.clock.wait(self.queue, self.policy.next_Deadline())
+
+                if event == None:
+                    actions = self.policy.on_Timer(self.clock.time())
+                    self.execute(actions)
+                    continue
+
+                if event.kind == SHUTDOWN:
+                    break
+
+                t = event.timestamp
+                if t == None:
+                    t = self.clock.time()
+
+                if event.kind == MOTION:
+                    actions = self.policy.on_Activity(t, event.value)
+                elif event.kind == CONFIRMATION:
+                    actions = self.policy.on_Confirmation(t, event.value)
+                elif event.kind == STARTED:
+                    actions = self.policy.on_Started(t, event.value)
+                elif event.kind == STOPPED:
+                    actions = self.policy.on_Stopped(t)
+                else:
+                    actions = []
+
+                self.execute(actions)
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def execute(self, actions):
+        """
+        Carry out the actions of the policy.
+        """
+
+        t = self.clock.time()
+
+        for action in actions:
+            self.log.append((t, action))
+
+            if action == START:
+                self.actuator.start_Recording(t)
+            elif action == STOP:
+                self.actuator.stop_Recording(t, lambda: self.post(STOPPED))
+            elif action == COMMIT:
+                self.actuator.commit_Recording(t)
+            elif action == DISCARD:
+                self.actuator.discard_Recording(t)
+
+
+
+class Simulated_Actuator:
+    """
+    Actuator that stands in for the cameras on a Virtual_Clock, stopping each recording after a fixed latency.
+
+    @param stop_latency         The time in seconds between a stop request and the recording being complete
+    @type stop_latency          float
+    """
+
+    def __init__(self, clock, stop_latency = 0.0):
+        """
+        Simulated_Actuator Constructor.
+        """
+
+        self.clock = clock
+        self.stop_latency = stop_latency
+        self.recording_time = 0.0
+        self.start_time = None
+
+    def start_Recording(self, t):
+        self.start_time = t
+
+    def stop_Recording(self, t, done):
+        self.clock.call_At(t + self.stop_latency, done)
+        self.recording_time += t + self.stop_latency - self.start_time
+
+    def commit_Recording(self, t):
+        pass
+
+    def discard_Recording(self, t):
+        pass
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def schedule_Trace(controller, trace):
+    """
+    Schedule a trace of activity changes on the controller's virtual clock.
+
+    @param trace:               (time, active) pairs
+    @type trace:                [(float,bool)]
+    """
+
+    for t, active in trace:
+        controller.clock.call_At(t, controller.post, MOTION, active, t)
+
+def test():
+    clock = Virtual_Clock()
+    policy = Recording_Policy(rec_min_duration = 5.0, rec_max_duration = 20.0, active_threshold = 1.0, sleep_duration = 10.0)
+    actuator = Simulated_Actuator(clock, stop_latency = 0.5)
+    controller = Trap_Controller(policy, actuator, clock)
+
+    trace = [
+        (100.0, True), (103.0, False),          #Valid: stopped at the minimum duration
+        (106.0, True), (107.0, False),          #During cooldown: missed
+        (200.0, True), (200.4, False),          #Too short: discarded at the threshold
+        (300.0, True), (330.0, False),          #Long: stopped at the maximum duration
+    ]
+
+    #A day of one second motion bursts every ten minutes
+    trace += [(1000.0 + 600.0 * index + offset, active) for index in range(144) for offset, active in ((0.0, True), (1.5, False))]
+
+    schedule_Trace(controller, trace)
+
+    start = time.monotonic()
+    asyncio.run(controller.run())
+    elapsed = time.monotonic() - start
+
+    assert controller.log[:2] == [(100.0, START), (105.0, STOP)]
+    assert (200.0, START) in controller.log and (201.0, STOP) in controller.log
+    assert (320.0, STOP) in controller.log
+    assert policy.missed_triggers == 1
+    assert policy.committed == 2 + 144
+    assert policy.discarded == 1
+
+    #The sensor fires on a warm gust the cameras do not see
+    veto_clock = Virtual_Clock()
+    veto_policy = Recording_Policy(rec_min_duration = 5.0, rec_max_duration = 20.0, active_threshold = 1.0, sleep_duration = 10.0)
+    veto_controller = Trap_Controller(veto_policy, Simulated_Actuator(veto_clock), veto_clock)
+
+    schedule_Trace(veto_controller, [(10.0, True), (13.0, False), (50.0, True), (53.0, False)])
+    for t, confirmed in ((10.2, False), (49.9, True)):
+        veto_clock.call_At(t, veto_controller.post, CONFIRMATION, confirmed, t)
+
+    asyncio.run(veto_controller.run())
+    assert veto_controller.log[:3] == [(10.0, START), (11.0, STOP), (11.0, DISCARD)]
+    assert veto_policy.committed == 1 and veto_policy.discarded == 1
+
+    #The cameras fail to start while the sensor stays active: the trap sleeps instead of retrying at once
+    failed_policy = Recording_Policy(rec_min_duration = 5.0, rec_max_duration = 20.0, active_threshold = 1.0, sleep_duration = 10.0)
+    assert failed_policy.on_Activity(10.0, True) == [START]
+    assert failed_policy.on_Started(10.1, False) == [STOP]
+    assert failed_policy.on_Stopped(10.2) == [DISCARD] and failed_policy.state == COOLDOWN
+    assert failed_policy.on_Timer(20.2) == [START] and failed_policy.failed_starts == 1
+    assert failed_policy.on_Started(20.3, True) == [] and failed_policy.state == RECORDING
+    assert failed_policy.on_Timer(21.2) == [] and failed_policy.valid == True
+
+    print("Simulated %.0f s of trap time in %.1f ms" %(clock.time(), elapsed * 1e3))
+    print("Trap_Controller tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,739 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Trap_Simulator
+#   Version:    1.00
+#
+#   Description:
+#   The Trap_Simulator library replays traces of sensor activity through the camera trap's recording policy on a virtual
+#   clock, to see what a choice of rec_min_duration, rec_max_duration, active_threshold and sleep_duration would have
+#   recorded. The cameras are modelled by the time they take to start and to stop, and by their pre-roll. Each run reports
+#   the animal events captured, those missed while the trap slept, the bytes written and the time the cameras were on.
+#   Traces are read from the trap's own sensor log or from CSV, or synthesised, and grids of settings are swept across every
+#   core.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in finding the number of cores
+import sys              #Used in running simulator commands
+import re               #Used in parsing sensor logs
+import argparse         #Used in running simulator commands
+import asyncio          #Used in running the controller
+import itertools        #Used in building parameter grids
+import random           #Used in synthesising traces
+import shutil           #Used in removing test output
+import tempfile         #Used in creating test output
+import concurrent.futures                           #Used in sweeping parameter grids in parallel
+import time
+
+from Trap_Controller import Trap_Controller, Recording_Policy, Virtual_Clock, Simulated_Actuator, MOTION, CONFIRMATION, \
+                            COMMIT
+from Pipeline_Builder import DEFAULT_VIDEO_BITRATE
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Settings of the recording policy that a simulation varies
+POLICY_PARAMETERS = ("rec_min_duration", "rec_max_duration", "active_threshold", "sleep_duration")
+
+#Time in seconds from a cold trigger to the first recorded frame, roughly an argus session start-up and auto-exposure
+DEFAULT_START_LATENCY = 1.0
+
+#Time in seconds from a stop request to the recording being complete, the EOS of an MP4 recording
+DEFAULT_STOP_LATENCY = 0.5
+
+#Number of cameras recording at each trigger
+DEFAULT_CAMERAS = 2
+
+#Event kind of the ground-truth animal events in trace files
+EVENT = "event"
+
+#Matches a sensor edge in the trap's log, capturing its time and level
+PIS_LOG_PATTERN = re.compile(r'PIS_Event\(([\d.]+), (RISING|FALLING)\)')
+
+#Synthetic traces: animal visits per hour, mean length of a visit in seconds, false triggers per hour such as warm gusts,
+#and the mean lengths in seconds of the bursts and pauses of the sensor during a visit
+DEFAULT_EVENT_RATE = 6.0
+DEFAULT_EVENT_DURATION = 8.0
+DEFAULT_FALSE_RATE = 12.0
+DEFAULT_BURST_DURATION = 3.0
+DEFAULT_PAUSE_DURATION = 1.0
+
+#Longest false trigger in seconds
+MAX_FALSE_DURATION = 1.0
+
+#Trace passed once to each worker process of a sweep
+worker_trace = None
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Trap_Trace:
+    """
+    Class representing a trace of the trap's inputs, with the animal events it should capture.
+
+    @param edges                The inputs as (time, kind, value) triples in time order, kind being MOTION with the
+                                activity or CONFIRMATION with the cameras' confirmation as value
+    @type edges                 [(float,str,object)]
+
+    @param events               The animal events as (start, end) times
+    @type events                [(float,float)]
+
+    @param duration             The time in seconds the trace covers
+    @type duration              float
+    """
+
+    def __init__(self, edges, events = None, duration = None):
+        """
+        Trap_Trace Constructor.
+
+        @param edges:               The inputs as (time, kind, value) triples
+        @type edges:                [(float,str,object)]
+
+        @param events:              The animal events as (start, end) times. Defaults to each period of activity
+        @type events:               [(float,float)]
+
+        @param duration:            The time in seconds the trace covers. Defaults to the time of its last input
+        @type duration:             float
+        """
+
+        self.edges = sorted(edges, key=lambda edge: edge[0])
+
+        if events == None:
+            events = activity_Periods(self.edges)
+        self.events = sorted(events)
+
+        if duration == None:
+            duration = max([edge[0] for edge in self.edges] + [end for start, end in self.events] + [0.0])
+        self.duration = duration
+
+
+
+class Simulated_Recording:
+    """
+    Class representing a recording made in a simulation.
+
+    @param start                The time the recording was triggered
+    @type start                 float
+
+    @param stop                 The time the recording was stopped
+    @type stop                  float
+
+    @param stopped              The time the recording was complete
+    @type stopped               float
+
+    @param video_start          The time of the first recorded frame, before start with pre-roll
+    @type video_start           float
+
+    @param committed            True if the recording was kept, False if it was discarded, None until it is complete
+    @type committed             bool
+    """
+
+    def __init__(self, start, video_start):
+        """
+        Simulated_Recording Constructor.
+        """
+
+        self.start = start
+        self.video_start = video_start
+        self.stop = None
+        self.stopped = None
+        self.committed = None
+
+    def video_Duration(self):
+        """
+        Get the length in seconds of the recorded video.
+        """
+
+        return max(0.0, self.stop - self.video_start)
+
+    def covers(self, start, end):
+        """
+        Return True if the recorded video overlaps a period.
+        """
+
+        return self.video_Duration() > 0 and self.video_start < end and self.stop > start
+
+
+
+class Latency_Actuator(Simulated_Actuator):
+    """
+    Actuator that stands in for the cameras on a Virtual_Clock, recording when each recording's video begins and ends.
+
+    @param start_latency        The time in seconds from a trigger to the first recorded frame of a cold camera
+    @type start_latency         float
+
+    @param pre_roll_duration    The video in seconds from before each trigger that is kept. The cameras are then on
+                                throughout and record from the trigger without start-up latency
+    @type pre_roll_duration     float
+
+    @param recordings           The recordings made so far
+    @type recordings            [Simulated_Recording]
+    """
+
+    def __init__(self, clock, start_latency = DEFAULT_START_LATENCY, stop_latency = DEFAULT_STOP_LATENCY,
+                 pre_roll_duration = 0.0):
+        """
+        Latency_Actuator Constructor.
+        """
+
+        Simulated_Actuator.__init__(self, clock, stop_latency)
+
+        self.start_latency = start_latency
+        self.pre_roll_duration = pre_roll_duration
+        self.recordings = []
+
+    def start_Recording(self, t):
+        Simulated_Actuator.start_Recording(self, t)
+
+        video_start = t + self.start_latency
+        if self.pre_roll_duration > 0:
+            video_start = t - self.pre_roll_duration
+        self.recordings.append(Simulated_Recording(t, video_start))
+
+    def stop_Recording(self, t, done):
+        Simulated_Actuator.stop_Recording(self, t, done)
+        self.recordings[-1].stop = t
+        self.recordings[-1].stopped = t + self.stop_latency
+
+    def commit_Recording(self, t):
+        self.recordings[-1].committed = True
+
+    def discard_Recording(self, t):
+        self.recordings[-1].committed = False
+
+
+
+class Simulation_Result:
+    """
+    Class representing the outcome of replaying a trace with one choice of settings.
+
+    @param parameters           The settings of the recording policy, keyed by name
+    @type parameters            {str:float}
+
+    @param events               The number of animal events in the trace
+    @type events                int
+
+    @param captured             The number of events overlapped by a kept recording
+    @type captured              int
+
+    @param missed_cooldown      The number of events not captured that began while the trap slept after a recording
+    @type missed_cooldown       int
+
+    @param missed_other         The number of other events not captured, e.g. too short to pass active_threshold
+    @type missed_other          int
+
+    @param committed            The number of recordings kept
+    @type committed             int
+
+    @param discarded            The number of recordings discarded
+    @type discarded             int
+
+    @param bytes_written        The bytes written by every camera, kept or not
+    @type bytes_written         int
+
+    @param bytes_kept           The bytes of the kept recordings
+    @type bytes_kept            int
+
+    @param camera_on_time       The time in seconds the cameras were on
+    @type camera_on_time        float
+
+    @param duration             The time in seconds the trace covers
+    @type duration              float
+    """
+
+    def __init__(self, parameters, events, captured, missed_cooldown, missed_other, committed, discarded, bytes_written,
+                 bytes_kept, camera_on_time, duration):
+        """
+        Simulation_Result Constructor.
+        """
+
+        self.parameters = parameters
+        self.events = events
+        self.captured = captured
+        self.missed_cooldown = missed_cooldown
+        self.missed_other = missed_other
+        self.committed = committed
+        self.discarded = discarded
+        self.bytes_written = bytes_written
+        self.bytes_kept = bytes_kept
+        self.camera_on_time = camera_on_time
+        self.duration = duration
+
+    def capture_Rate(self):
+        """
+        Get the fraction of the events that were captured, None if the trace has no events.
+        """
+
+        if self.events == 0:
+            return None
+        return self.captured / self.events
+
+    def bytes_Per_Capture(self):
+        """
+        Get the bytes kept for each captured event, None if no event was captured.
+        """
+
+        if self.captured == 0:
+            return None
+        return self.bytes_kept / self.captured
+
+    def summary(self):
+        """
+        Summarise the result.
+
+        @return summary:            The settings followed by the outcome, keyed by name
+        @rtype summary:             {str:float}
+        """
+
+        summary = dict(self.parameters)
+        summary.update({
+            "events": self.events,
+            "captured": self.captured,
+            "missed_cooldown": self.missed_cooldown,
+            "missed_other": self.missed_other,
+            "committed": self.committed,
+            "discarded": self.discarded,
+            "bytes_written": self.bytes_written,
+            "bytes_kept": self.bytes_kept,
+            "camera_on_time": self.camera_on_time,
+            "capture_rate": self.capture_Rate(),
+        })
+
+        return summary
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def activity_Periods(edges):
+    """
+    Get the periods of activity of a trace.
+
+    @param edges:               The inputs as (time, kind, value) triples in time order
+    @type edges:                [(float,str,object)]
+
+    @return periods:            The (start, end) times of each period. A period still open at the end of the trace ends
+                                at its last input
+    @rtype periods:             [(float,float)]
+    """
+
+    periods = []
+    since = None
+
+    for t, kind, value in edges:
+        if kind != MOTION:
+            continue
+        if value == True and since == None:
+            since = t
+        elif value == False and since != None:
+            periods.append((since, t))
+            since = None
+
+    if since != None:
+        periods.append((since, edges[-1][0]))
+
+    return periods
+
+def simulate(trace, rec_min_duration, rec_max_duration, active_threshold, sleep_duration,
+             start_latency = DEFAULT_START_LATENCY, stop_latency = DEFAULT_STOP_LATENCY, pre_roll_duration = 0.0,
+             cameras = DEFAULT_CAMERAS, bitrate = DEFAULT_VIDEO_BITRATE):
+    """
+    Replay a trace through the recording policy.
+
+    @param trace:               The trace
+    @type trace:                Trap_Trace
+
+    @param start_latency:       The time in seconds from a trigger to the first recorded frame of a cold camera
+    @type start_latency:        float
+
+    @param stop_latency:        The time in seconds from a stop request to the recording being complete
+    @type stop_latency:         float
+
+    @param pre_roll_duration:   The video in seconds from before each trigger that is kept. The cameras are then on
+                                throughout
+    @type pre_roll_duration:    float
+
+    @param cameras:             The number of cameras recording at each trigger
+    @type cameras:              int
+
+    @param bitrate:             The bitrate in bits per second of each camera's video
+    @type bitrate:              int
+
+    @return result:             The outcome
+    @rtype result:              Simulation_Result
+    """
+
+    clock = Virtual_Clock()
+    policy = Recording_Policy(rec_min_duration, rec_max_duration, active_threshold, sleep_duration)
+    actuator = Latency_Actuator(clock, start_latency, stop_latency, pre_roll_duration)
+    controller = Trap_Controller(policy, actuator, clock)
+
+    for t, kind, value in trace.edges:
+        clock.call_At(t, controller.post, kind, value, t)
+
+    asyncio.run(controller.run())
+
+    recordings = [recording for recording in actuator.recordings if recording.stop != None]
+    kept = [recording for recording in recordings if recording.committed == True]
+    cooldowns = [(t, t + sleep_duration) for t, action in controller.log if action == COMMIT]
+
+    captured = 0
+    missed_cooldown = 0
+    for start, end in trace.events:
+        if any(recording.covers(start, end) for recording in kept) == True:
+            captured += 1
+        elif any(since <= start < until for since, until in cooldowns) == True:
+            missed_cooldown += 1
+
+    bytes_per_second = cameras * bitrate / 8
+
+    if pre_roll_duration > 0:
+        camera_on_time = max([trace.duration] + [recording.stopped for recording in recordings])
+    else:
+        camera_on_time = sum(recording.stopped - recording.start for recording in recordings)
+
+    parameters = {
+        "rec_min_duration": rec_min_duration,
+        "rec_max_duration": rec_max_duration,
+        "active_threshold": active_threshold,
+        "sleep_duration": sleep_duration,
+    }
+
+    return Simulation_Result(parameters, len(trace.events), captured, missed_cooldown,
+                             len(trace.events) - captured - missed_cooldown, len(kept), len(recordings) - len(kept),
+                             int(sum(recording.video_Duration() for recording in recordings) * bytes_per_second),
+                             int(sum(recording.video_Duration() for recording in kept) * bytes_per_second),
+                             camera_on_time, trace.duration)
+
+def parameter_Grid(grid):
+    """
+    Get every combination of a grid of settings.
+
+    @param grid:                The values of each setting, keyed by name
+    @type grid:                 {str:[float]}
+
+    @return combinations:       The settings of each combination, keyed by name, varying the last setting fastest
+    @rtype combinations:        [{str:float}]
+    """
+
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+def set_Worker_Trace(trace):
+    """
+    Keep the trace of a sweep in a worker process, so that it is passed once rather than with every combination.
+    """
+
+    global worker_trace
+    worker_trace = trace
+
+def simulate_Worker(parameters, options):
+    """
+    Replay the worker's trace with a combination of settings. Runs on a worker process.
+    """
+
+    return simulate(worker_trace, **parameters, **options)
+
+def sweep(trace, grid, workers = None, **options):
+    """
+    Replay a trace with every combination of a grid of settings, in parallel.
+
+    @param trace:               The trace
+    @type trace:                Trap_Trace
+
+    @param grid:                The values of each setting of the recording policy, keyed by name. Every setting in
+                                POLICY_PARAMETERS must be given
+    @type grid:                 {str:[float]}
+
+    @param workers:             The number of worker processes. Defaults to one per core
+    @type workers:              int
+
+    @param options:             The remaining arguments of simulate, e.g. start_latency
+    @type options:              {str:object}
+
+    @return results:            The outcome of each combination, in the order of parameter_Grid
+    @rtype results:             [Simulation_Result]
+    """
+
+    combinations = parameter_Grid(grid)
+
+    if workers == None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(combinations)))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=set_Worker_Trace,
+                                                initargs=(trace,)) as executor:
+        return list(executor.map(simulate_Worker, combinations, itertools.repeat(options),
+                                 chunksize=max(1, len(combinations) // (4 * workers))))
+
+def synthetic_Trace(duration, event_rate = DEFAULT_EVENT_RATE, event_duration = DEFAULT_EVENT_DURATION,
+                    false_rate = DEFAULT_FALSE_RATE, seed = None):
+    """
+    Synthesise a trace of animal visits and false triggers arriving at random. During a visit the sensor fires in bursts
+    separated by pauses, as an animal moves and stops. A false trigger is a single short burst.
+
+    @param duration:            The time in seconds the trace covers
+    @type duration:             float
+
+    @param event_rate:          The mean number of visits per hour
+    @type event_rate:           float
+
+    @param event_duration:      The mean length of a visit in seconds
+    @type event_duration:       float
+
+    @param false_rate:          The mean number of false triggers per hour
+    @type false_rate:           float
+
+    @param seed:                The seed of the random numbers, None for a different trace each time
+    @type seed:                 int
+
+    @return trace:              The trace
+    @rtype trace:               Trap_Trace
+    """
+
+    generator = random.Random(seed)
+
+    events = []
+    bursts = []
+
+    t = generator.expovariate(event_rate / 3600.0)
+    while event_rate > 0 and t < duration:
+        end = min(duration, t + generator.expovariate(1.0 / event_duration))
+        events.append((t, end))
+
+        burst = t
+        while burst < end:
+            burst_end = min(end, burst + generator.expovariate(1.0 / DEFAULT_BURST_DURATION))
+            bursts.append((burst, burst_end))
+            burst = burst_end + generator.expovariate(1.0 / DEFAULT_PAUSE_DURATION)
+
+        t = end + generator.expovariate(event_rate / 3600.0)
+
+    t = generator.expovariate(false_rate / 3600.0) if false_rate > 0 else duration
+    while t < duration:
+        bursts.append((t, min(duration, t + generator.uniform(0.1, MAX_FALSE_DURATION))))
+        t += generator.expovariate(false_rate / 3600.0)
+
+    #Overlapping bursts are one period of activity to the sensor
+    edges = []
+    for start, end in sorted(bursts):
+        if len(edges) > 0 and start <= edges[-1][0]:
+            edges[-1] = (max(edges[-1][0], end), MOTION, False)
+            continue
+        edges += [(start, MOTION, True), (end, MOTION, False)]
+
+    return Trap_Trace(edges, events, duration)
+
+def load_Trace(path):
+    """
+    Read a trace from a file. Each line is either a sensor edge from the trap's log, such as
+    "pis: PIS_Event(3577.933275, RISING)", or CSV as "time,motion,1", "time,confirmation,0" or "time,event,end time" for a
+    labelled animal event. Other lines are ignored. Times are taken relative to the first line.
+
+    @param path:                The path of the file
+    @type path:                 str
+
+    @return trace:              The trace. Without labelled events, each period of activity is taken as an event
+    @rtype trace:               Trap_Trace
+    """
+
+    edges = []
+    events = []
+
+    with open(path) as trace_file:
+        for line in trace_file:
+            match = PIS_LOG_PATTERN.search(line)
+            if match != None:
+                edges.append((float(match.group(1)), MOTION, match.group(2) == "RISING"))
+                continue
+
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) != 3:
+                continue
+
+            try:
+                t = float(fields[0])
+                if fields[1] == MOTION:
+                    edges.append((t, MOTION, fields[2] == "1"))
+                elif fields[1] == CONFIRMATION:
+                    edges.append((t, CONFIRMATION, None if fields[2] == "" else fields[2] == "1"))
+                elif fields[1] == EVENT:
+                    events.append((t, float(fields[2])))
+            except ValueError:
+                continue
+
+    times = [edge[0] for edge in edges] + [start for start, end in events]
+    origin = min(times) if len(times) > 0 else 0.0
+    edges = [(t - origin, kind, value) for t, kind, value in edges]
+    events = [(start - origin, end - origin) for start, end in events]
+
+    return Trap_Trace(edges, events if len(events) > 0 else None)
+
+def save_Trace(trace, path):
+    """
+    Write a trace to a CSV file that load_Trace reads, with its animal events labelled.
+    """
+
+    lines = []
+    for t, kind, value in trace.edges:
+        lines.append((t, "%.6f,%s,%s" %(t, kind, "" if value == None else int(value))))
+    for start, end in trace.events:
+        lines.append((start, "%.6f,%s,%.6f" %(start, EVENT, end)))
+
+    with open(path, "w") as trace_file:
+        for t, line in sorted(lines, key=lambda line: line[0]):
+            trace_file.write(line + "\n")
+
+def parse_Values(text):
+    """
+    Parse a comma separated list of settings, e.g. "5,10,20".
+    """
+
+    return [float(value) for value in text.split(",")]
+
+def main(arguments):
+    """
+    Synthesise a trace, or replay a trace with a grid of settings, from the command line.
+
+    @return status:             0 on success
+    @rtype status:              int
+    """
+
+    parser = argparse.ArgumentParser(description="Replay sensor traces through the camera trap's recording policy")
+    parser.add_argument("command", choices=("synthesize", "simulate"))
+    parser.add_argument("trace", help="trace file, the trap's log or CSV. Written by synthesize")
+    parser.add_argument("--duration", type=float, default=86400.0, help="seconds of synthetic trace")
+    parser.add_argument("--event-rate", type=float, default=DEFAULT_EVENT_RATE, help="animal visits per hour")
+    parser.add_argument("--event-duration", type=float, default=DEFAULT_EVENT_DURATION, help="mean seconds per visit")
+    parser.add_argument("--false-rate", type=float, default=DEFAULT_FALSE_RATE, help="false triggers per hour")
+    parser.add_argument("--seed", type=int, help="seed of the synthetic trace")
+    parser.add_argument("--rec-min-duration", type=parse_Values, default=[5.0], help="values to try, e.g. 5,10,20")
+    parser.add_argument("--rec-max-duration", type=parse_Values, default=[30.0], help="values to try")
+    parser.add_argument("--active-threshold", type=parse_Values, default=[1.0], help="values to try")
+    parser.add_argument("--sleep-duration", type=parse_Values, default=[10.0], help="values to try")
+    parser.add_argument("--start-latency", type=float, default=DEFAULT_START_LATENCY, help="seconds to the first frame")
+    parser.add_argument("--stop-latency", type=float, default=DEFAULT_STOP_LATENCY, help="seconds to complete a stop")
+    parser.add_argument("--pre-roll-duration", type=float, default=0.0, help="seconds of video kept before a trigger")
+    parser.add_argument("--cameras", type=int, default=DEFAULT_CAMERAS, help="cameras recording at each trigger")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to one per core")
+    options = parser.parse_args(arguments)
+
+    if options.command == "synthesize":
+        trace = synthetic_Trace(options.duration, options.event_rate, options.event_duration, options.false_rate,
+                                options.seed)
+        save_Trace(trace, options.trace)
+        print("Wrote %d edges and %d events over %.0f s to %s" %(len(trace.edges), len(trace.events), trace.duration,
+                                                                 options.trace))
+        return 0
+
+    trace = load_Trace(options.trace)
+    grid = {name: getattr(options, name) for name in POLICY_PARAMETERS}
+
+    start = time.monotonic()
+    results = sweep(trace, grid, options.workers, start_latency = options.start_latency,
+                    stop_latency = options.stop_latency, pre_roll_duration = options.pre_roll_duration,
+                    cameras = options.cameras)
+    elapsed = time.monotonic() - start
+
+    print("%6s %6s %6s %6s  %8s %8s %8s  %10s %10s" %("min", "max", "thresh", "sleep", "captured", "cooldown", "other",
+                                                      "kept MB", "on s"))
+    for result in sorted(results, key=lambda result: (-result.captured, result.bytes_kept)):
+        print("%6.1f %6.1f %6.1f %6.1f  %8d %8d %8d  %10.1f %10.0f" %(result.parameters["rec_min_duration"],
+              result.parameters["rec_max_duration"], result.parameters["active_threshold"],
+              result.parameters["sleep_duration"], result.captured, result.missed_cooldown, result.missed_other,
+              result.bytes_kept / 1e6, result.camera_on_time))
+
+    print("Replayed %d events over %.0f s with %d settings in %.2f s" %(len(trace.events), trace.duration, len(results),
+                                                                        elapsed))
+    return 0
+
+def test():
+    #One valid visit, a visit during the following cooldown, and a gust too short to pass the threshold
+    trace = Trap_Trace([
+        (100.0, MOTION, True), (103.0, MOTION, False),
+        (108.0, MOTION, True), (110.0, MOTION, False),
+        (200.0, MOTION, True), (200.4, MOTION, False),
+    ], events = [(100.0, 103.0), (108.0, 110.0)])
+
+    result = simulate(trace, rec_min_duration = 5.0, rec_max_duration = 20.0, active_threshold = 1.0, sleep_duration = 10.0,
+                      start_latency = 1.0, stop_latency = 0.5, cameras = 2, bitrate = 8000000)
+    assert result.captured == 1 and result.missed_cooldown == 1 and result.missed_other == 0
+    assert result.committed == 1 and result.discarded == 1
+
+    #The kept recording runs from the first frame at 101 s to 105 s, the discarded one is stopped before its first frame
+    assert result.bytes_kept == 4 * 2 * 1000000 and result.bytes_written == result.bytes_kept
+    assert abs(result.camera_on_time - (5.5 + 1.5)) < 1e-6
+
+    #A short sleep catches the second visit
+    assert simulate(trace, 5.0, 20.0, 1.0, 2.0).captured == 2
+
+    #A visit shorter than the start-up latency is only captured with pre-roll
+    short = Trap_Trace([(10.0, MOTION, True), (10.5, MOTION, False)])
+    assert simulate(short, 1.0, 10.0, 0.0, 10.0).captured == 0
+    result = simulate(short, 1.0, 10.0, 0.0, 10.0, pre_roll_duration = 2.0)
+    assert result.captured == 1 and result.camera_on_time == 11.5
+
+    #A day of synthetic activity is the same for the same seed
+    day = synthetic_Trace(86400.0, seed = 1)
+    assert len(day.events) > 50 and day.edges == synthetic_Trace(86400.0, seed = 1).edges
+    assert all(earlier[0] <= later[0] for earlier, later in zip(day.edges, day.edges[1:]))
+
+    grid = {
+        "rec_min_duration": [2.0, 10.0],
+        "rec_max_duration": [30.0],
+        "active_threshold": [0.5, 2.0],
+        "sleep_duration": [5.0, 60.0],
+    }
+    assert parameter_Grid(grid)[1] == {"rec_min_duration": 2.0, "rec_max_duration": 30.0, "active_threshold": 0.5,
+                                       "sleep_duration": 60.0}
+
+    start = time.monotonic()
+    results = sweep(day, grid, workers = 2)
+    elapsed = time.monotonic() - start
+
+    assert [result.parameters for result in results] == parameter_Grid(grid)
+    for result in results:
+        assert result.captured + result.missed_cooldown + result.missed_other == len(day.events)
+        assert result.bytes_written >= result.bytes_kept
+
+    #A longer sleep misses more visits, a higher threshold keeps fewer false triggers
+    assert results[0].missed_cooldown < results[1].missed_cooldown
+    assert results[0].committed > results[2].committed
+    assert results[0].summary() == simulate(day, 2.0, 30.0, 0.5, 5.0).summary()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "trace.csv")
+        save_Trace(day, path)
+        loaded = load_Trace(path)
+        assert len(loaded.edges) == len(day.edges) and len(loaded.events) == len(day.events)
+
+        log = os.path.join(directory, "trap.log")
+        with open(log, "w") as log_file:
+            log_file.write("pis: PIS_Event(3577.933275, RISING)\nGot EOS from element \"pipeline0\".\n"
+                           "pis: PIS_Event(3579.433275, FALLING)\n")
+        logged = load_Trace(log)
+        assert logged.edges == [(0.0, MOTION, True), (1.5, MOTION, False)] and len(logged.events) == 1
+    finally:
+        shutil.rmtree(directory)
+
+    print("Swept %d settings over a day of %d visits in %.2f s" %(len(results), len(day.events), elapsed))
+    print("Trap_Simulator tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv[1:]))
+
+    test()
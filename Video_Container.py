@@ -0,0 +1,668 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Video_Container
+#   Version:    1.00
+#
+#   Description:
+#   The Video_Container library chooses the container the cameras record into. A standard MP4 is only readable once EOS has
+#   made mp4mux write its index, so stopping waits on EOS and an interrupted recording is lost. Fragmented MP4 and Matroska
+#   write a playable fragment every fragment duration instead, so recordings stop without waiting and an interrupted file
+#   only loses its last fragment. The library truncates interrupted files back to their last complete fragment and remuxes
+#   finished recordings into standard faststart MP4 files in the background.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import os               #Used in truncating and replacing recordings
+import queue            #Used in queueing recordings to remux
+import shutil           #Used in removing test output
+import struct           #Used in reading container headers
+import tempfile         #Used in creating test output
+import threading        #Used in remuxing in the background
+
+from Process_Supervisor import DEFAULT_EOS_TIMEOUT
+from Pipeline_Engine import get_Engine
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Containers
+CONTAINER_MP4 = "mp4"
+CONTAINER_FRAGMENTED_MP4 = "fmp4"
+CONTAINER_MATROSKA = "mkv"
+
+DEFAULT_CONTAINER = CONTAINER_MP4
+
+#Length in seconds of each fragment of a fragmented container, and so the most video an interrupted recording loses
+DEFAULT_FRAGMENT_DURATION = 1.0
+
+#Time in seconds a fragmented recording is given to finish after EOS. Killing it only loses the open fragment
+FRAGMENTED_EOS_TIMEOUT = 0.5
+
+#Extension of the files written in each container
+EXTENSIONS = {
+    CONTAINER_MP4:              ".mp4",
+    CONTAINER_FRAGMENTED_MP4:   ".mp4",
+    CONTAINER_MATROSKA:         ".mkv",
+}
+
+#Extensions of every recording the cameras may write
+VIDEO_EXTENSIONS = (".mp4", ".mkv")
+
+#Magic numbers at the start of each container
+MP4_MAGIC = b"ftyp"
+MATROSKA_MAGIC = b"\x1a\x45\xdf\xa3"
+
+#Matroska element IDs
+EBML_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+TRACKS_ID = 0x1654AE6B
+CLUSTER_ID = 0x1F43B675
+
+#Matroska elements found directly in the segment, which end a cluster of unknown size
+MATROSKA_TOP_LEVEL_IDS = (0x114D9B74, 0x1549A966, TRACKS_ID, CLUSTER_ID, 0x1C53BB6B, 0x1043A770, 0x1254C367, 0x1941A469)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Error Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Container_Error(Exception):
+    """
+    Exception raised when a recording cannot be recovered or remuxed.
+
+    @param path:                The path of the recording
+    @type path:                 str
+
+    @param message:             Description of the error
+    @type message:              str
+    """
+
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+
+    def __str__(self):
+        return "%s: %s" %(self.path, self.message)
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Remuxer:
+    """
+    Class that remuxes finished recordings into standard faststart MP4 files on a background thread, one at a time so that
+    remuxing never competes with the cameras for more than one core.
+
+    @param remuxed              The number of files remuxed
+    @type remuxed               int
+
+    @param errors               The (path, error) pairs of files that could not be remuxed, which are left as they were
+    @type errors                [(str,Exception)]
+    """
+
+    def __init__(self, engine = None):
+        """
+        Remuxer Constructor.
+
+        @param engine:              The engine that runs the remux pipelines. Defaults to the shared one
+        @type engine:               Gst_Engine or Subprocess_Engine
+        """
+
+        if engine == None:
+            engine = get_Engine()
+        self.engine = engine
+
+        self.queue = queue.Queue()
+        self.remuxed = 0
+        self.errors = []
+
+        self.thread = threading.Thread(target=self.run, name="remuxer", daemon=True)
+        self.thread.start()
+
+    def submit(self, paths, callback = None):
+        """
+        Queue the files of a recording to be remuxed.
+
+        @param paths:               The files of the recording
+        @type paths:                [str]
+
+        @param callback:            Function called on the remux thread with the path of each file once they have all
+                                    been remuxed, the original path where remuxing failed
+        @type callback:             function
+        """
+
+        self.queue.put((list(paths), callback))
+
+    def run(self):
+        """
+        Remux queued recordings until the remuxer is closed. Runs on the remux thread.
+        """
+
+        while True:
+            item = self.queue.get()
+            if item == None:
+                self.queue.task_done()
+                return
+
+            paths, callback = item
+            outputs = []
+            for path in paths:
+                try:
+                    outputs.append(remux(path, self.engine))
+                    self.remuxed += 1
+                except (Container_Error, OSError) as error:
+                    self.errors.append((path, error))
+                    outputs.append(path)
+
+            if callback != None:
+                callback(outputs)
+
+            self.queue.task_done()
+
+    def flush(self):
+        """
+        Wait until every queued recording has been remuxed.
+        """
+
+        self.queue.join()
+
+    def close(self):
+        """
+        Remux the remaining recordings and stop the remux thread.
+        """
+
+        self.queue.put(None)
+        self.thread.join()
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def is_Fragmented(container):
+    """
+    Return True if recordings in the container stay playable while they are written.
+    """
+
+    return container != CONTAINER_MP4
+
+def extension(container):
+    """
+    Get the extension of the files written in a container, e.g. .mp4.
+    """
+
+    return EXTENSIONS[container]
+
+def stop_Timeout(container):
+    """
+    Get the time in seconds a recording in the container is given to finish after EOS before it is killed.
+    """
+
+    if is_Fragmented(container) == True:
+        return FRAGMENTED_EOS_TIMEOUT
+    return DEFAULT_EOS_TIMEOUT
+
+def muxer(container, fragment_duration = DEFAULT_FRAGMENT_DURATION):
+    """
+    Get the GStreamer pipeline description of the muxer of a container.
+
+    @param container:           The container
+    @type container:            str
+
+    @param fragment_duration:   The length in seconds of each fragment of a fragmented container
+    @type fragment_duration:    float
+
+    @return muxer:              The muxer element and its properties
+    @rtype muxer:               str
+    """
+
+    if container == CONTAINER_FRAGMENTED_MP4:
+        return "mp4mux fragment-duration=%d streamable=true" %(int(fragment_duration * 1e3))
+    if container == CONTAINER_MATROSKA:
+        return "matroskamux streamable=true max-cluster-duration=%d" %(int(fragment_duration * 1e9))
+    return "mp4mux"
+
+def splitmux_Muxer(container, fragment_duration = DEFAULT_FRAGMENT_DURATION):
+    """
+    Get the splitmuxsink properties that select the muxer of a container.
+
+    @return properties:         The muxer-factory and muxer-properties properties
+    @rtype properties:          str
+    """
+
+    if container == CONTAINER_FRAGMENTED_MP4:
+        return "muxer-factory=mp4mux muxer-properties='properties,fragment-duration=(uint)%d,streamable=(boolean)true'" \
+            %(int(fragment_duration * 1e3))
+    if container == CONTAINER_MATROSKA:
+        return "muxer-factory=matroskamux muxer-properties='properties,streamable=(boolean)true," \
+            "max-cluster-duration=(gint64)%d'" %(int(fragment_duration * 1e9))
+    return "muxer-factory=mp4mux"
+
+def read_Box(recording, offset, file_size):
+    """
+    Read the header of an MP4 box.
+
+    @return box:                (type, offset of the box's end) of the box, None if its header runs past the end of the file
+    @rtype box:                 (bytes,int)
+    """
+
+    recording.seek(offset)
+    header = recording.read(16)
+    if len(header) < 8:
+        return None
+
+    size, box_type = struct.unpack(">I4s", header[:8])
+    header_size = 8
+
+    #A 64 bit size follows the type
+    if size == 1:
+        if len(header) < 16:
+            return None
+        size = struct.unpack(">Q", header[8:16])[0]
+        header_size = 16
+
+    #A box running to the end of the file was never given its size, so its end is unknown
+    elif size == 0:
+        return box_type, file_size + 1
+
+    if size < header_size:
+        return box_type, file_size + 1
+
+    return box_type, offset + size
+
+def scan_MP4(path):
+    """
+    Find the end of the last complete fragment of an MP4 file. A standard MP4 is complete once its moov box has been
+    written, a fragmented MP4 at the end of each moof and mdat pair.
+
+    @return scan:               (offset of the end of the playable part, number of complete fragments, True if the file
+                                has a moov box) of the file
+    @rtype scan:                (int,int,bool)
+    """
+
+    file_size = os.path.getsize(path)
+    valid_end = 0
+    fragments = 0
+    has_moov = False
+    in_fragment = False
+
+    with open(path, "rb") as recording:
+        offset = 0
+        while offset < file_size:
+            box = read_Box(recording, offset, file_size)
+            if box == None or box[1] > file_size:
+                break
+
+            box_type, end = box
+
+            if box_type == b"moov":
+                has_moov = True
+                valid_end = end
+            elif box_type == b"moof":
+                in_fragment = True
+            elif box_type == b"mdat":
+                if in_fragment == True:
+                    in_fragment = False
+                    fragments += 1
+                    valid_end = end
+            elif in_fragment == False and (has_moov == True or box_type == b"ftyp"):
+                valid_end = end
+
+            offset = end
+
+    return valid_end, fragments, has_moov
+
+def read_Variable_Integer(recording, keep_marker):
+    """
+    Read an EBML variable length integer.
+
+    @param keep_marker:         True for an element ID, which keeps its length marker
+    @type keep_marker:          bool
+
+    @return integer:            (value, length in bytes) of the integer, with a value of None for an unknown size. None if
+                                it runs past the end of the file
+    @rtype integer:             (int,int)
+    """
+
+    first = recording.read(1)
+    if len(first) == 0 or first[0] == 0:
+        return None
+
+    length = 1
+    while first[0] & (0x80 >> (length - 1)) == 0:
+        length += 1
+
+    rest = recording.read(length - 1)
+    if len(rest) < length - 1:
+        return None
+
+    value = first[0]
+    if keep_marker == False:
+        value &= (0xFF >> length)
+    for byte in rest:
+        value = (value << 8) | byte
+
+    if keep_marker == False and value == (1 << (7 * length)) - 1:
+        return None, length
+
+    return value, length
+
+def read_Element(recording, offset):
+    """
+    Read the header of a Matroska element.
+
+    @return element:            (ID, offset of the size, length of the size, offset of the data, size of the data or None
+                                if unknown) of the element, None if its header runs past the end of the file
+    @rtype element:             (int,int,int,int,int)
+    """
+
+    recording.seek(offset)
+    element_id = read_Variable_Integer(recording, True)
+    if element_id == None:
+        return None
+
+    size_offset = offset + element_id[1]
+    size = read_Variable_Integer(recording, False)
+    if size == None:
+        return None
+
+    return element_id[0], size_offset, size[1], size_offset + size[1], size[0]
+
+def scan_Matroska(path):
+    """
+    Find the end of the last complete block of a Matroska file. Elements that run past the end of the file are listed so
+    that their size can be marked as unknown once the file is truncated.
+
+    @return scan:               (offset of the end of the playable part, number of clusters with a complete block,
+                                (offset, length) of each size to mark as unknown) of the file
+    @rtype scan:                (int,int,[(int,int)])
+    """
+
+    file_size = os.path.getsize(path)
+    valid_end = 0
+    clusters = 0
+    unknown_sizes = []
+    has_tracks = False
+
+    with open(path, "rb") as recording:
+        header = read_Element(recording, 0)
+        if header == None or header[0] != EBML_ID or header[4] == None:
+            return 0, 0, []
+
+        segment = read_Element(recording, header[3] + header[4])
+        if segment == None or segment[0] != SEGMENT_ID:
+            return 0, 0, []
+
+        segment_end = file_size
+        if segment[4] != None and segment[3] + segment[4] < file_size:
+            segment_end = segment[3] + segment[4]
+        elif segment[4] != None:
+            unknown_sizes.append((segment[1], segment[2]))
+
+        offset = segment[3]
+        while offset < segment_end:
+            element = read_Element(recording, offset)
+            if element == None:
+                break
+
+            element_id, size_offset, size_length, data_offset, size = element
+
+            if size != None and data_offset + size <= segment_end:
+                offset = data_offset + size
+                if element_id == TRACKS_ID:
+                    has_tracks = True
+                elif element_id == CLUSTER_ID:
+                    clusters += 1
+                if has_tracks == True:
+                    valid_end = offset
+                continue
+
+            #Only a cluster is kept in part, up to its last complete block
+            if element_id != CLUSTER_ID or has_tracks == False:
+                break
+            if size != None:
+                unknown_sizes.append((size_offset, size_length))
+
+            complete = False
+            truncated = True
+            child_offset = data_offset
+            while child_offset < segment_end:
+                child = read_Element(recording, child_offset)
+                if child != None and child[0] in MATROSKA_TOP_LEVEL_IDS:
+                    truncated = False
+                    break
+                if child == None or child[4] == None or child[3] + child[4] > segment_end:
+                    break
+
+                child_offset = child[3] + child[4]
+                valid_end = child_offset
+                complete = True
+
+            if complete == True:
+                clusters += 1
+            offset = child_offset
+
+            #A cluster cut short ends the file
+            if truncated == True:
+                break
+
+    if has_tracks == False:
+        return 0, 0, []
+
+    return valid_end, clusters, [entry for entry in unknown_sizes if entry[0] < valid_end]
+
+def recording_Format(path):
+    """
+    Get the container of a recording from its first bytes.
+
+    @return container:          CONTAINER_MP4 for any MP4, CONTAINER_MATROSKA, or None if it is neither
+    @rtype container:           str
+    """
+
+    with open(path, "rb") as recording:
+        header = recording.read(8)
+
+    if header[4:8] == MP4_MAGIC:
+        return CONTAINER_MP4
+    if header[:4] == MATROSKA_MAGIC:
+        return CONTAINER_MATROSKA
+    return None
+
+def recover(path):
+    """
+    Truncate an interrupted recording back to its last complete fragment, so that it can be played. A complete recording
+    is left as it is.
+
+    @param path:                The path of the recording
+    @type path:                 str
+
+    @return dropped:            The number of bytes cut from the end of the recording
+    @rtype dropped:             int
+    """
+
+    container = recording_Format(path)
+    unknown_sizes = []
+
+    if container == CONTAINER_MP4:
+        valid_end, fragments, has_moov = scan_MP4(path)
+        if has_moov == False:
+            raise Container_Error(path, "no moov box, the MP4 was interrupted before it was finalised")
+    elif container == CONTAINER_MATROSKA:
+        valid_end, clusters, unknown_sizes = scan_Matroska(path)
+        if valid_end == 0:
+            raise Container_Error(path, "no tracks, the recording was interrupted before its header was written")
+    else:
+        raise Container_Error(path, "not an MP4 or Matroska file")
+
+    file_size = os.path.getsize(path)
+    if valid_end == file_size:
+        return 0
+
+    with open(path, "r+b") as recording:
+        for offset, length in unknown_sizes:
+            recording.seek(offset)
+            recording.write(bytes([0xFF >> (length - 1)]) + b"\xff" * (length - 1))
+        recording.truncate(valid_end)
+
+    return file_size - valid_end
+
+def remux(path, engine = None, output = None):
+    """
+    Remux a recording into a standard MP4 file with its index at the start, replacing the recording.
+
+    @param path:                The path of the recording
+    @type path:                 str
+
+    @param engine:              The engine that runs the remux pipeline. Defaults to the shared one
+    @type engine:               Gst_Engine or Subprocess_Engine
+
+    @param output:              The path of the MP4 file. Defaults to the recording's path with a .mp4 extension
+    @type output:               str
+
+    @return output:             The path of the MP4 file
+    @rtype output:              str
+    """
+
+    if engine == None:
+        engine = get_Engine()
+
+    if output == None:
+        output = os.path.splitext(path)[0] + ".mp4"
+
+    demuxer = "qtdemux"
+    if recording_Format(path) == CONTAINER_MATROSKA:
+        demuxer = "matroskademux"
+
+    temporary = "%s.remux" %(output)
+    description = "filesrc location=%s ! %s ! h264parse ! mp4mux faststart=true ! filesink location=%s" %(path, demuxer,
+                                                                                                       temporary)
+
+    pipeline = engine.launch(description, "remux")
+    pipeline.wait()
+
+    if pipeline.error != None or os.path.exists(temporary) == False:
+        if os.path.exists(temporary) == True:
+            os.remove(temporary)
+        raise Container_Error(path, pipeline.error or "the remux pipeline wrote nothing")
+
+    os.replace(temporary, output)
+    if output != path:
+        os.remove(path)
+
+    return output
+
+def mp4_Box(box_type, payload):
+    """
+    Build an MP4 box.
+    """
+
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+def matroska_Element(element_id, payload, size_length = 8):
+    """
+    Build a Matroska element with a fixed length size, as matroskamux writes them.
+    """
+
+    id_length = (element_id.bit_length() + 7) // 8
+    size = (1 << (7 * size_length)) | len(payload)
+    return element_id.to_bytes(id_length, "big") + size.to_bytes(size_length, "big") + payload
+
+def synthetic_Recording(container, fragments, fragment_size = 1000):
+    """
+    Build the box or element structure of a recording without an encoder, for exercising recovery where no software
+    pipeline is installed.
+
+    @return data:               The recording
+    @rtype data:                bytes
+    """
+
+    if container == CONTAINER_MATROSKA:
+        data = matroska_Element(EBML_ID, b"\x42\x82\x88matroska")
+        body = matroska_Element(0x1549A966, b"\x00" * 16) + matroska_Element(TRACKS_ID, b"\x00" * 32)
+        for index in range(fragments):
+            blocks = b"".join(matroska_Element(0xA3, bytes([index]) * (fragment_size // 4), 4) for block in range(4))
+            body += matroska_Element(CLUSTER_ID, matroska_Element(0xE7, bytes([index]), 1) + blocks)
+        return data + matroska_Element(SEGMENT_ID, body)
+
+    data = mp4_Box(b"ftyp", b"isom\x00\x00\x02\x00") + mp4_Box(b"moov", b"\x00" * 64)
+    for index in range(fragments):
+        data += mp4_Box(b"moof", b"\x00" * 32) + mp4_Box(b"mdat", bytes([index]) * fragment_size)
+    return data
+
+def software_Pipeline(container, location, frames):
+    """
+    Get the description of a pipeline that records test video without a camera, for exercising recovery on real output.
+    """
+
+    description = "videotestsrc num-buffers=%d ! video/x-raw,width=320,height=240,framerate=30/1 ! " %(frames)
+    description += "x264enc key-int-max=15 ! h264parse ! %s ! filesink location=%s" %(muxer(container, 0.5), location)
+    return description
+
+def test():
+    directory = tempfile.mkdtemp()
+    try:
+        recordings = {}
+        for container in (CONTAINER_FRAGMENTED_MP4, CONTAINER_MATROSKA):
+            path = os.path.join(directory, "synthetic" + extension(container))
+            with open(path, "wb") as recording:
+                recording.write(synthetic_Recording(container, 5))
+            recordings[container] = path
+
+        #A software pipeline gives real muxer output where GStreamer is installed
+        try:
+            engine = get_Engine()
+        except Exception:
+            engine = None
+
+        if engine != None and engine.has_Element("x264enc") == True:
+            for container in (CONTAINER_FRAGMENTED_MP4, CONTAINER_MATROSKA):
+                path = os.path.join(directory, "software" + extension(container))
+                pipeline = engine.launch(software_Pipeline(container, path, 90), "software")
+                pipeline.wait()
+                recordings[container + "-software"] = path
+        else:
+            print("No software encoder is installed, recovering synthetic recordings only")
+
+        for name, path in recordings.items():
+            scan = scan_Matroska if recording_Format(path) == CONTAINER_MATROSKA else scan_MP4
+            complete_end, fragments = scan(path)[:2]
+            assert complete_end == os.path.getsize(path) and fragments >= 3 and recover(path) == 0
+
+            #Cutting into the last fragment loses only that fragment, or only its last block in Matroska
+            with open(path, "r+b") as recording:
+                recording.truncate(complete_end - 100)
+            dropped = recover(path)
+            recovered_end, recovered_fragments = scan(path)[:2]
+
+            assert 0 < dropped < complete_end / 2
+            assert recovered_end == os.path.getsize(path) == complete_end - 100 - dropped
+            assert fragments - 1 <= recovered_fragments <= fragments
+            assert recover(path) == 0
+
+        #A standard MP4 cut off before its moov box cannot be recovered
+        path = os.path.join(directory, "standard.mp4")
+        with open(path, "wb") as recording:
+            recording.write(mp4_Box(b"ftyp", b"isom") + mp4_Box(b"mdat", b"\x00" * 1000)[:500])
+        try:
+            recover(path)
+            assert False
+        except Container_Error:
+            pass
+
+        assert muxer(CONTAINER_MP4) == "mp4mux" and stop_Timeout(CONTAINER_MATROSKA) < stop_Timeout(CONTAINER_MP4)
+    finally:
+        shutil.rmtree(directory)
+
+    print("Video_Container tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()
@@ -0,0 +1,270 @@
+#------------------------------------------------------------------------------------------------------------------------------------
+#
+#   Author:     William Bourn
+#   File:       Warm_Standby
+#   Version:    1.00
+#
+#   Description:
+#   The Warm_Standby library decides how long the cameras stay open after a recording. Starting an argus session costs
+#   around a second of set-up and auto-exposure per trigger, while keeping the cameras open around the clock costs power.
+#   After each recording the cameras stay warm, encoding into the pre-roll ring with their output held back, for an idle
+#   window that grows with the recent density of triggers, and are turned off once the window passes without a trigger.
+#   The latency from trigger to recording and the time spent warm are measured, so the trade-off can be tuned per site.
+#
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Included Libraries
+#------------------------------------------------------------------------------------------------------------------------------------
+
+import collections      #Used in holding recent triggers
+import threading        #Used in sharing the statistics between threads
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Constants & Global Variables
+#------------------------------------------------------------------------------------------------------------------------------------
+
+#Shortest and longest time in seconds the cameras stay warm after a recording
+DEFAULT_MIN_IDLE_WINDOW = 30.0
+DEFAULT_MAX_IDLE_WINDOW = 600.0
+
+#Time in seconds over which past triggers are taken into account
+DEFAULT_TRIGGER_HISTORY = 3600.0
+
+#Multiple of the typical gap between triggers for which the cameras stay warm
+DEFAULT_WINDOW_FACTOR = 2.0
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Class Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+class Standby_Policy:
+    """
+    Class that chooses the idle window after each recording from the gaps between recent triggers. While triggers come
+    close together the cameras stay warm long enough to catch the next one. When the typical gap is longer than the
+    longest window, the next trigger would find the cameras off anyway, so they are only kept warm for the shortest one.
+
+    @param min_window           The shortest idle window in seconds
+    @type min_window            float
+
+    @param max_window           The longest idle window in seconds
+    @type max_window            float
+
+    @param history              The time in seconds over which past triggers are taken into account
+    @type history               float
+
+    @param factor               The multiple of the typical gap between triggers for which the cameras stay warm
+    @type factor                float
+    """
+
+    def __init__(self, min_window = DEFAULT_MIN_IDLE_WINDOW, max_window = DEFAULT_MAX_IDLE_WINDOW,
+                 history = DEFAULT_TRIGGER_HISTORY, factor = DEFAULT_WINDOW_FACTOR):
+        """
+        Standby_Policy Constructor.
+        """
+
+        self.min_window = min_window
+        self.max_window = max_window
+        self.history = history
+        self.factor = factor
+
+        self.triggers = collections.deque()
+
+    def record_Trigger(self, t):
+        """
+        Record a trigger at time t.
+        """
+
+        self.triggers.append(t)
+        self.trim(t)
+
+    def trim(self, t):
+        """
+        Forget the triggers older than the history.
+        """
+
+        while len(self.triggers) > 0 and self.triggers[0] < t - self.history:
+            self.triggers.popleft()
+
+    def idle_Window(self, t):
+        """
+        Get the time the cameras stay warm after a recording ending at time t.
+
+        @return window:             The idle window in seconds
+        @rtype window:              float
+        """
+
+        self.trim(t)
+
+        triggers = list(self.triggers)
+        gaps = sorted(later - earlier for earlier, later in zip(triggers, triggers[1:]))
+        if len(gaps) == 0:
+            return self.min_window
+
+        typical = gaps[len(gaps) // 2]
+        if typical > self.max_window:
+            return self.min_window
+
+        return min(self.max_window, max(self.min_window, typical * self.factor))
+
+
+
+class Standby_Stats:
+    """
+    Class that measures the warm standby of the cameras.
+
+    @param warm_triggers        The number of triggers that found the cameras warm
+    @type warm_triggers         int
+
+    @param cold_triggers        The number of triggers that had to start the cameras
+    @type cold_triggers         int
+
+    @param warm_latencies       The time in seconds from each warm trigger to its first recorded frame
+    @type warm_latencies        [float]
+
+    @param cold_latencies       The time in seconds from each cold trigger to its first recorded frame
+    @type cold_latencies        [float]
+
+    @param warm_time            The total time in seconds the cameras were open without recording
+    @type warm_time             float
+
+    @param power_offs           The number of times the cameras were turned off after an idle window
+    @type power_offs            int
+    """
+
+    def __init__(self):
+        """
+        Standby_Stats Constructor.
+        """
+
+        self.lock = threading.Lock()
+        self.warm_triggers = 0
+        self.cold_triggers = 0
+        self.warm_latencies = []
+        self.cold_latencies = []
+        self.warm_time = 0.0
+        self.power_offs = 0
+        self.idle_since = None
+
+    def triggered(self, t, warm):
+        """
+        Record a trigger at time t, ending the current idle period.
+        """
+
+        with self.lock:
+            if warm == True:
+                self.warm_triggers += 1
+            else:
+                self.cold_triggers += 1
+            self.end_Idle(t)
+
+    def recorded(self, latency, warm):
+        """
+        Record the time from a trigger to its first recorded frame.
+        """
+
+        with self.lock:
+            if warm == True:
+                self.warm_latencies.append(latency)
+            else:
+                self.cold_latencies.append(latency)
+
+    def idle(self, t):
+        """
+        Record the cameras staying warm after a recording ending at time t.
+        """
+
+        with self.lock:
+            self.idle_since = t
+
+    def powered_Off(self, t):
+        """
+        Record the cameras being turned off at time t.
+        """
+
+        with self.lock:
+            self.power_offs += 1
+            self.end_Idle(t)
+
+    def end_Idle(self, t):
+        """
+        Add the current idle period to the warm time. Must be called with the lock held.
+        """
+
+        if self.idle_since != None:
+            self.warm_time += max(0.0, t - self.idle_since)
+            self.idle_since = None
+
+    def summary(self):
+        """
+        Summarise the warm standby.
+
+        @return summary:            The trigger counts, the mean and worst latency of warm and cold triggers in seconds,
+                                    the time spent warm in seconds and the number of power-offs. Unmeasured values are None
+        @rtype summary:             {str:float}
+        """
+
+        with self.lock:
+            summary = {
+                "warm_triggers": self.warm_triggers,
+                "cold_triggers": self.cold_triggers,
+                "warm_time": self.warm_time,
+                "power_offs": self.power_offs,
+            }
+
+            for name, latencies in (("warm", self.warm_latencies), ("cold", self.cold_latencies)):
+                summary["%s_latency_mean" %(name)] = None
+                summary["%s_latency_max" %(name)] = None
+                if len(latencies) > 0:
+                    summary["%s_latency_mean" %(name)] = sum(latencies) / len(latencies)
+                    summary["%s_latency_max" %(name)] = max(latencies)
+
+        return summary
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Global Funtion Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+def test():
+    policy = Standby_Policy(min_window = 30, max_window = 600, history = 3600, factor = 2)
+
+    #A single trigger only keeps the cameras warm for the shortest window
+    policy.record_Trigger(0)
+    assert policy.idle_Window(10) == 30
+
+    #Triggers a minute apart keep them warm for two minutes
+    for t in (60, 120, 180):
+        policy.record_Trigger(t)
+    assert policy.idle_Window(190) == 120
+
+    #Sparse triggers are not worth staying warm for
+    sparse = Standby_Policy(min_window = 30, max_window = 600, history = 36000, factor = 2)
+    for t in (0, 3000, 6000):
+        sparse.record_Trigger(t)
+    assert sparse.idle_Window(6010) == 30
+
+    #Old triggers are forgotten
+    assert policy.idle_Window(10000) == 30
+
+    stats = Standby_Stats()
+    stats.triggered(0, False)
+    stats.recorded(1.2, False)
+    stats.idle(10)
+    stats.triggered(40, True)
+    stats.recorded(0.01, True)
+    stats.idle(50)
+    stats.powered_Off(170)
+
+    summary = stats.summary()
+    assert summary["warm_triggers"] == 1 and summary["cold_triggers"] == 1 and summary["power_offs"] == 1
+    assert summary["warm_time"] == 150 and summary["cold_latency_max"] == 1.2 and summary["warm_latency_mean"] == 0.01
+
+    print("Warm_Standby tests passed")
+
+#------------------------------------------------------------------------------------------------------------------------------------
+#   Main Function Definitions
+#------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    test()